@@ -1,17 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import Client
 import jwt
 from functools import wraps
 from datetime import datetime, timedelta
 import json
 import threading
+import time
 
 # Load environment variables
 load_dotenv()
 
+# Structured logging, formatted and written by a background thread (LOG_ASYNC)
+from structured_logging import configure_logging, get_logger
+configure_logging()
+logger = get_logger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -20,15 +26,136 @@ CORS(app)  # Enable CORS for all routes
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+# 'supabase' (hosted Postgres) or 'sqlite' (embedded database, see persistence.py)
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase").lower()
+
+if DATABASE_BACKEND == 'supabase' and (not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY):
     raise ValueError("Supabase URL and Service Role Key must be set in environment variables")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# The sqlite backend has no auth server: tokens can only be verified locally
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local" if DATABASE_BACKEND == 'sqlite' else "remote")
+if DATABASE_BACKEND == 'sqlite' and (AUTH_VERIFY_MODE != 'local' or not os.getenv("SUPABASE_JWT_SECRET")):
+    raise ValueError("The sqlite backend needs AUTH_VERIFY_MODE=local and SUPABASE_JWT_SECRET")
+AUTH_REVOCATION_CHECK_INTERVAL = 0.0 if DATABASE_BACKEND == 'sqlite' \
+    else float(os.getenv("AUTH_REVOCATION_CHECK_INTERVAL", "60"))
+
+# One client for the routes, the evaluator and the scheduler, on a shared connection pool
+from supabase_client import get_supabase_client, pool_stats
+supabase: Client = get_supabase_client()
 
 # Import Prop Firm service
 from prop_firm_service import get_prop_firm_evaluator
 # Import scheduler
 from scheduler import get_scheduler, start_background_scheduler
+# Import market data hub
+from market_data import get_market_data_hub
+# Import leaderboard rankings
+from leaderboard import get_leaderboard_service, PERIODS
+# Import event-driven challenge evaluation
+from evaluation_queue import get_evaluation_queue
+# Import token verification
+from auth_service import TokenVerifier, AuthenticationError, is_admin
+# Import Prometheus metrics
+import metrics
+# Import the Idempotency-Key response store
+from idempotency import (IdempotencyStore, StoredResponse, request_fingerprint, store_options_from_env,
+                         IDEMPOTENCY_HEADER, REPLAYED_HEADER, MAX_KEY_LENGTH, MISMATCH, IN_PROGRESS, REPLAY)
+# Import request tracing and profiling
+import tracing
+from profiling import PROFILE_HEADER, get_request_profiler
+
+# Token verification: 'remote' asks the auth server on every request,
+# 'local' checks the JWT signature in-process and caches verified claims
+token_verifier = TokenVerifier(
+    supabase,
+    SUPABASE_URL,
+    mode=AUTH_VERIFY_MODE,
+    jwt_secret=os.getenv("SUPABASE_JWT_SECRET"),
+    cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")),
+    cache_ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300")),
+    revocation_check_interval=AUTH_REVOCATION_CHECK_INTERVAL
+)
+
+# Upper bound on trades closed by one /evaluate-trades request
+MAX_BATCH_CLOSE_TRADES = int(os.getenv("MAX_BATCH_CLOSE_TRADES", "500"))
+
+# Leaderboard rankings follow the trades settled through this app
+leaderboard_service = get_leaderboard_service(get_prop_firm_evaluator(supabase))
+LEADERBOARD_MAX_LIMIT = int(os.getenv("LEADERBOARD_MAX_LIMIT", "100"))
+
+# Settlements and daily resets of this app enqueue their challenges for evaluation
+evaluation_queue = None
+if os.getenv("EVALUATION_QUEUE_ENABLED", "true").lower() == "true":
+    evaluation_queue = get_evaluation_queue(
+        get_prop_firm_evaluator(supabase),
+        window=float(os.getenv("EVALUATION_QUEUE_WINDOW", "0.25")),
+        batch_size=int(os.getenv("EVALUATION_QUEUE_BATCH_SIZE", "500"))
+    )
+
+# Responses of retried settlements and payment captures (Idempotency-Key header)
+idempotency_store = IdempotencyStore(**store_options_from_env())
+
+# Per-request span breakdown (Server-Timing header, log line for slow requests).
+# The header names tables and functions: by default only requests carrying
+# the X-Profile token get it
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "false").lower() == "true"
+TRACE_LOG_THRESHOLD_MS = float(os.getenv("TRACE_LOG_THRESHOLD_MS", "1000"))
+
+# Operator-enabled profiling of selected requests (see profiling.py)
+request_profiler = get_request_profiler()
+
+# Request latency per route template and in-flight requests, served by /metrics
+metrics.track_cache('challenge', get_prop_firm_evaluator(supabase).challenge_cache_stats)
+metrics.track_cache('auth_token', token_verifier.cache.stats)
+metrics.track_cache('idempotency', idempotency_store.responses.stats)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+    if TRACE_ENABLED:
+        g.trace_token = tracing.start_trace()
+    if request_profiler.should_profile(request.headers.get(PROFILE_HEADER)):
+        g.profile = request_profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.record_request(request.method, route, response.status_code, elapsed)
+
+        profile = g.pop('profile', None)
+        if profile is not None:
+            request_profiler.stop(profile, f'{request.method} {route}')
+
+        trace_token = g.pop('trace_token', None)
+        if trace_token is not None:
+            trace = tracing.finish_trace(trace_token)
+            if TRACE_SERVER_TIMING or request_profiler.has_token(request.headers.get(PROFILE_HEADER)):
+                response.headers['Server-Timing'] = trace.server_timing(elapsed)
+            if elapsed * 1000 >= TRACE_LOG_THRESHOLD_MS:
+                logger.warning('Slow request', method=request.method, route=route, status=response.status_code,
+                               ms=round(elapsed * 1000, 1), spans=trace.summary())
+    return response
+
+
+@app.teardown_request
+def finish_request(exc):
+    # After an unhandled error after_request did not run
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile, 'failed request')
+    trace_token = g.pop('trace_token', None)
+    if trace_token is not None:
+        tracing.finish_trace(trace_token)
+    if g.pop('request_started', None) is not None:
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+
 
 def authenticate_user(f):
     """Decorator to authenticate user from JWT token"""
@@ -42,35 +169,80 @@ def authenticate_user(f):
         try:
             token = auth_header.replace('Bearer ', '')
             
-            # Verify token using Supabase
-            user = supabase.auth.get_user(token)
-            request.current_user = user.user
+            with tracing.span('auth'):
+                request.current_user = token_verifier.verify(token)
             
-        except Exception as e:
-            print(f"Authentication error: {str(e)}")
+        except AuthenticationError as e:
+            logger.warning('Authentication error', error=e)
             return jsonify({'error': 'Unauthorized'}), 401
+        except Exception as e:
+            # The verifier reports bad tokens as AuthenticationError; anything else is our failure
+            logger.error('Token verification failed', error=e)
+            return jsonify({'error': 'Authentication unavailable'}), 500
             
         return f(*args, **kwargs)
     
     return decorated_function
 
+def require_admin(f):
+    """Decorator restricting an endpoint to admins; goes below authenticate_user"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin(request.current_user):
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+def idempotent(f):
+    """
+    Decorator replaying the stored response of a retried request (Idempotency-Key header)
+
+    Goes below authenticate_user: keys are scoped to the user and the path.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return f(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+
+        scope = (request.current_user.id, request.path, key)
+        fingerprint = request_fingerprint(request.get_data())
+        outcome, stored = idempotency_store.begin(scope, fingerprint)
+
+        if outcome == MISMATCH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+        if outcome == IN_PROGRESS:
+            return jsonify({'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'}), 409
+        if outcome == REPLAY:
+            response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except BaseException:
+            idempotency_store.abandon(scope)
+            raise
+        idempotency_store.complete(scope, StoredResponse(
+            response.status_code, response.get_data(), response.content_type, fingerprint))
+        return response
+
+    return decorated_function
+
 def check_challenge_status_internal(challenge_id):
     """Internal function to check challenge status"""
     try:
-        # Get the challenge
-        challenge_response = (
-            supabase.table('user_challenges')
-            .select('*')
-            .eq('id', challenge_id)
-            .single()
-        )
+        # Read fresh: a status change must not be decided on a cached row
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
+        challenge = prop_firm_evaluator.get_challenge(challenge_id, fresh=True)
         
-        if challenge_response.error or not challenge_response.data:
-            print(f'Challenge not found in check_challenge_status: {challenge_response.error}')
+        if not challenge:
+            logger.warning('Challenge not found in check_challenge_status', challenge_id=challenge_id)
             return {'error': 'Challenge not found', 'status': 'error'}
         
-        challenge = challenge_response.data
-        
         # Calculate percentages
         profit_percentage = ((challenge['current_balance'] - challenge['initial_capital']) / challenge['initial_capital']) * 100
         loss_percentage = ((challenge['initial_capital'] - challenge['current_balance']) / challenge['initial_capital']) * 100
@@ -89,18 +261,18 @@ def check_challenge_status_internal(challenge_id):
         
         # If status changed, update the challenge
         if new_status != challenge['status']:
-            update_response = (
-                supabase.table('user_challenges')
-                .update({
-                    'status': new_status,
-                    'ended_at': datetime.utcnow().isoformat() if new_status in ['success', 'failed'] else None
-                })
-                .eq('id', challenge_id)
-                .execute()
-            )
+            update_data = {
+                'status': new_status,
+                'ended_at': datetime.utcnow().isoformat() if new_status in ['success', 'failed'] else None
+            }
             
-            if update_response.error:
-                print(f'Failed to update challenge status: {update_response.error}')
+            try:
+                if not prop_firm_evaluator.write_status_update(challenge, update_data):
+                    # Changed by another process since the read; report its status
+                    current = prop_firm_evaluator.get_challenge(challenge_id)
+                    new_status = current['status'] if current else challenge['status']
+            except Exception as e:
+                logger.error('Failed to update challenge status', error=e)
         
         return {
             'status': new_status,
@@ -112,7 +284,7 @@ def check_challenge_status_internal(challenge_id):
         }
     
     except Exception as e:
-        print(f'Error in check_challenge_status_internal: {e}')
+        logger.error('Error in check_challenge_status_internal', error=e)
         return {'error': str(e), 'status': 'error'}
 
 
@@ -123,6 +295,7 @@ def health_check():
 
 @app.route('/evaluate-trade', methods=['POST'])
 @authenticate_user
+@idempotent
 def evaluate_trade():
     """Evaluate a trade and update PnL with Prop Firm rules"""
     """Evaluate a trade and update PnL"""
@@ -135,107 +308,57 @@ def evaluate_trade():
             return jsonify({'error': 'trade_id and exit_price are required'}), 400
         
         user = request.current_user
-        print(f'Evaluating trade {trade_id} with exit price {exit_price} for user {user.id}')
-        
-        # Get the trade
-        trade_response = (
-            supabase.table('trades')
-            .select('*')
-            .eq('id', trade_id)
-            .eq('user_id', user.id)
-            .eq('is_open', True)
-            .maybe_single()
-        )
-        
-        if trade_response.error or not trade_response.data:
-            print(f'Trade not found or already closed: {trade_response.error}')
-            return jsonify({'error': 'Trade not found or already closed'}), 404
-        
-        trade = trade_response.data
-        
-        # Calculate PnL
-        price_change = exit_price - trade['entry_price']
-        direction = 1 if trade['trade_type'] == 'buy' else -1
-        pnl = (price_change / trade['entry_price']) * trade['amount'] * trade['leverage'] * direction
+        logger.info('Evaluating trade', trade_id=trade_id, exit_price=exit_price, user_id=user.id)
         
-        print(f'Calculated PnL: {pnl} for trade type: {trade["trade_type"]}')
-        
-        # Update trade with exit price and PnL
-        update_trade_response = (
-            supabase.table('trades')
-            .update({
-                'exit_price': exit_price,
-                'pnl': pnl,
-                'is_open': False,
-                'closed_at': datetime.utcnow().isoformat(),
-            })
-            .eq('id', trade_id)
-            .execute()
-        )
-        
-        if update_trade_response.error:
-            print(f'Failed to update trade: {update_trade_response.error}')
-            return jsonify({'error': 'Failed to update trade'}), 500
+        # Close the trade, update balances and apply Prop Firm rules in one transaction
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
+        result = prop_firm_evaluator.settle_trade(trade_id, user.id, exit_price)
         
-        # Get the challenge
-        challenge_response = (
-            supabase.table('user_challenges')
-            .select('*')
-            .eq('id', trade['challenge_id'])
-            .single()
-        )
+        if 'error' in result:
+            logger.warning('Failed to settle trade', trade_id=trade_id, error=result['error'])
+            return jsonify({'error': result['error']}), result.get('status_code', 500)
         
-        if challenge_response.error or not challenge_response.data:
-            print(f'Challenge not found: {challenge_response.error}')
-            return jsonify({'error': 'Challenge not found'}), 404
+        logger.info('Challenge status check result', challenge=result['challenge'])
         
-        challenge = challenge_response.data
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error('Error in evaluate-trade function', error=e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/evaluate-trades', methods=['POST'])
+@authenticate_user
+def evaluate_trades():
+    """Close many open trades in one request (close all / stop-out)"""
+    try:
+        data = request.get_json()
+        closes = data.get('trades') if data else None
         
-        # Update challenge balances
-        new_balance = challenge['current_balance'] + pnl
-        new_total_pnl = challenge['total_pnl'] + pnl
-        new_daily_pnl = challenge['daily_pnl'] + pnl
+        if not isinstance(closes, list) or not closes:
+            return jsonify({'error': 'trades must be a non-empty list of {trade_id, exit_price}'}), 400
         
-        print(f'Updating challenge: balance {challenge["current_balance"]} -> {new_balance}, total PnL: {new_total_pnl}')
+        if len(closes) > MAX_BATCH_CLOSE_TRADES:
+            return jsonify({'error': f'At most {MAX_BATCH_CLOSE_TRADES} trades can be closed per request'}), 400
         
-        update_challenge_response = (
-            supabase.table('user_challenges')
-            .update({
-                'current_balance': new_balance,
-                'total_pnl': new_total_pnl,
-                'daily_pnl': new_daily_pnl,
-            })
-            .eq('id', trade['challenge_id'])
-            .execute()
-        )
+        for close in closes:
+            if not isinstance(close, dict) or not close.get('trade_id') or close.get('exit_price') is None:
+                return jsonify({'error': 'Each trade requires trade_id and exit_price'}), 400
         
-        if update_challenge_response.error:
-            print(f'Failed to update challenge: {update_challenge_response.error}')
-            return jsonify({'error': 'Failed to update challenge'}), 500
+        user = request.current_user
+        logger.info('Evaluating trades', trades=len(closes), user_id=user.id)
         
-        # Check challenge status using Prop Firm rules
+        # Group by challenge: one balance delta and one rule evaluation per challenge
         prop_firm_evaluator = get_prop_firm_evaluator(supabase)
-        check_response = prop_firm_evaluator.process_trade_completion(trade_id, user.id)
+        result = prop_firm_evaluator.settle_trades(user.id, closes)
         
-        print('Challenge status check result:', check_response)
+        if 'error' in result:
+            logger.warning('Failed to settle trades', error=result['error'])
+            return jsonify({'error': result['error']}), result.get('status_code', 500)
+        
+        return jsonify(result)
         
-        return jsonify({
-            'success': True,
-            'trade': {
-                'id': trade_id,
-                'pnl': pnl,
-                'exit_price': exit_price,
-            },
-            'challenge': {
-                'id': trade['challenge_id'],
-                'new_balance': new_balance,
-                'total_pnl': new_total_pnl,
-                'status': check_response.get('status', 'active'),
-            },
-        })
-
     except Exception as e:
-        print(f'Error in evaluate-trade function: {e}')
+        logger.error('Error in evaluate-trades function', error=e)
         return jsonify({'error': str(e)}), 500
 
 # PayPal Integration Functions
@@ -264,7 +387,7 @@ async def get_paypal_access_token(api_base_url):
             data = await response.json()
             
             if response.status != 200:
-                print(f"PayPal auth error: {response.status}, {data}")
+                logger.error('PayPal auth error', status=response.status, response=data)
                 raise Exception(f"PayPal auth failed ({api_base_url}): {data.get('error', response.status)}")
             
             return data['access_token']
@@ -275,7 +398,7 @@ async def get_paypal_access_token_auto():
         access_token = await get_paypal_access_token(PAYPAL_API_SANDBOX)
         return access_token, PAYPAL_API_SANDBOX
     except Exception as e:
-        print(f"Sandbox token failed, trying live... {str(e)}")
+        logger.warning('Sandbox token failed, trying live', error=e)
         
     access_token = await get_paypal_access_token(PAYPAL_API_LIVE)
     return access_token, PAYPAL_API_LIVE
@@ -286,7 +409,7 @@ def create_paypal_order():
     """Create a PayPal order for payment"""
     try:
         if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
-            print("Missing PayPal secrets")
+            logger.error('Missing PayPal secrets')
             return jsonify({'error': 'Missing PayPal secrets'}), 500
         
         user = request.current_user
@@ -296,7 +419,7 @@ def create_paypal_order():
         currency = data.get('currency', 'USD')
         initial_capital = data.get('initialCapital')
         
-        print(f"Creating PayPal order: {plan_name}, {amount}, {currency}, {user.id}, {initial_capital}")
+        logger.info('Creating PayPal order', plan_name=plan_name, amount=amount, currency=currency, user_id=user.id, initial_capital=initial_capital)
         
         if not plan_name or not amount:
             return jsonify({'error': 'Missing required fields: planName or amount'}), 400
@@ -308,9 +431,8 @@ def create_paypal_order():
         import uuid
         order_id = str(uuid.uuid4())
         
-        # Record pending payment
-        payment_response = (
-            supabase.table('payments')
+        # Record pending payment (a failed insert raises APIError)
+        supabase.table('payments') \
             .insert({
                 'user_id': user.id,
                 'amount': amount,
@@ -318,12 +440,8 @@ def create_paypal_order():
                 'payment_method': 'paypal',
                 'status': 'pending',
                 'transaction_id': order_id,
-            })
+            }) \
             .execute()
-        )
-        
-        if payment_response.error:
-            print(f"Error creating payment record: {payment_response.error}")
         
         # In a real implementation, we would get the approval URL from PayPal
         approval_url = f"https://sandbox.paypal.com/cgi-bin/webscr?cmd=_express-checkout&token={order_id}"
@@ -334,11 +452,12 @@ def create_paypal_order():
         })
         
     except Exception as e:
-        print(f'Error in create-paypal-order: {e}')
+        logger.error('Error in create-paypal-order', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/capture-paypal-order', methods=['POST'])
 @authenticate_user
+@idempotent
 def capture_paypal_order():
     """Capture PayPal order after payment completion"""
     try:
@@ -349,48 +468,36 @@ def capture_paypal_order():
         if not order_id:
             return jsonify({'error': 'orderId is required'}), 400
         
-        print(f'Capturing PayPal order {order_id} for user {user.id}')
+        logger.info('Capturing PayPal order', order_id=order_id, user_id=user.id)
         
-        # Get the pending payment record
-        payment_response = (
-            supabase.table('payments')
-            .select('*')
-            .eq('transaction_id', order_id)
-            .eq('user_id', user.id)
-            .single()
-        )
-        
-        if payment_response.error or not payment_response.data:
-            print(f'Payment not found: {payment_response.error}')
-            return jsonify({'error': 'Payment not found'}), 404
-        
-        payment = payment_response.data
-        
-        # Update payment status to completed
-        update_payment_response = (
+        # Only a payment of this user is moved to completed
+        update_response = (
             supabase.table('payments')
             .update({
                 'status': 'completed',
             })
             .eq('transaction_id', order_id)
+            .eq('user_id', user.id)
             .execute()
         )
         
-        if update_payment_response.error:
-            print(f'Failed to update payment: {update_payment_response.error}')
-            return jsonify({'error': 'Failed to update payment'}), 500
+        if not update_response.data:
+            logger.warning('Payment not found', order_id=order_id)
+            return jsonify({'error': 'Payment not found'}), 404
+        
+        payment = update_response.data[0]
         
         # For now, just return success
         return jsonify({
             'success': True,
             'payment': {
-                'id': payment['id'] if payment else None,
+                'id': payment['id'],
                 'status': 'completed',
             },
         })
         
     except Exception as e:
-        print(f'Error in capture-paypal-order: {e}')
+        logger.error('Error in capture-paypal-order', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/check-challenge-status', methods=['POST'])
@@ -405,7 +512,7 @@ def check_challenge_status():
         if not challenge_id:
             return jsonify({'error': 'challenge_id is required'}), 400
         
-        print(f'Checking challenge status for challenge {challenge_id} and user {user.id}')
+        logger.info('Checking challenge status', challenge_id=challenge_id, user_id=user.id)
         
         result = check_challenge_status_internal(challenge_id)
         
@@ -415,7 +522,7 @@ def check_challenge_status():
         return jsonify(result)
         
     except Exception as e:
-        print(f'Error in check-challenge-status: {e}')
+        logger.error('Error in check-challenge-status', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/reset-daily-pnl', methods=['POST'])
@@ -424,38 +531,20 @@ def reset_daily_pnl():
     """Reset daily PnL for active challenges"""
     try:
         user = request.current_user
-        print(f'Resetting daily PnL for user {user.id}')
+        logger.info('Resetting daily PnL', user_id=user.id)
         
-        # Get all active challenges for the user
-        challenges_response = (
-            supabase.table('user_challenges')
-            .select('*')
-            .eq('user_id', user.id)
-            .in_('status', ['active', 'pending'])
-            .execute()
+        # Reset all active/pending challenges of the user in one statement
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
+        reset_result = prop_firm_evaluator.reset_daily_metrics(
+            user_id=user.id,
+            statuses=['active', 'pending']
         )
         
-        if challenges_response.error:
-            print(f'Error fetching challenges: {challenges_response.error}')
-            return jsonify({'error': 'Failed to fetch challenges'}), 500
-        
-        updated_challenges = []
-        
-        for challenge in challenges_response.data:
-            # Reset daily PnL to 0
-            update_response = (
-                supabase.table('user_challenges')
-                .update({
-                    'daily_pnl': 0,
-                })
-                .eq('id', challenge['id'])
-                .execute()
-            )
-            
-            if update_response.error:
-                print(f'Error updating challenge {challenge["id"]}: {update_response.error}')
-            else:
-                updated_challenges.append(challenge['id'])
+        if 'error' in reset_result:
+            logger.error('Error resetting daily PnL', error=reset_result['error'])
+            return jsonify({'error': 'Failed to reset daily PnL'}), 500
+        
+        updated_challenges = reset_result['reset_ids']
         
         return jsonify({
             'success': True,
@@ -464,7 +553,7 @@ def reset_daily_pnl():
         })
         
     except Exception as e:
-        print(f'Error in reset-daily-pnl: {e}')
+        logger.error('Error in reset-daily-pnl', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prop-firm/create-challenge', methods=['POST'])
@@ -495,7 +584,7 @@ def create_prop_firm_challenge():
         })
         
     except Exception as e:
-        print(f'Error creating Prop Firm challenge: {e}')
+        logger.error('Error creating Prop Firm challenge', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prop-firm/challenge/<challenge_id>/status', methods=['GET'])
@@ -505,19 +594,13 @@ def get_prop_firm_challenge_status(challenge_id):
     try:
         user = request.current_user
         
-        # Verify user owns this challenge
-        challenge_check = supabase.table('user_challenges') \
-            .select('*') \
-            .eq('id', challenge_id) \
-            .eq('user_id', user.id) \
-            .single() \
-            .execute()
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
         
-        if challenge_check.error:
+        # Verify user owns this challenge (the row is cached for the summary below)
+        if not prop_firm_evaluator.get_challenge(challenge_id, user.id):
             return jsonify({'error': 'Challenge not found or unauthorized'}), 404
         
         # Get detailed summary
-        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
         summary = prop_firm_evaluator.get_challenge_summary(challenge_id)
         
         if 'error' in summary:
@@ -526,7 +609,7 @@ def get_prop_firm_challenge_status(challenge_id):
         return jsonify(summary)
         
     except Exception as e:
-        print(f'Error getting challenge status: {e}')
+        logger.error('Error getting challenge status', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prop-firm/challenge/<challenge_id>/evaluate', methods=['POST'])
@@ -536,19 +619,13 @@ def evaluate_prop_firm_challenge(challenge_id):
     try:
         user = request.current_user
         
-        # Verify user owns this challenge
-        challenge_check = supabase.table('user_challenges') \
-            .select('*') \
-            .eq('id', challenge_id) \
-            .eq('user_id', user.id) \
-            .single() \
-            .execute()
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
         
-        if challenge_check.error:
+        # Verify user owns this challenge
+        if not prop_firm_evaluator.get_challenge(challenge_id, user.id):
             return jsonify({'error': 'Challenge not found or unauthorized'}), 404
         
         # Evaluate challenge rules
-        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
         evaluation_result = prop_firm_evaluator.evaluate_challenge_rules(challenge_id)
         
         if 'error' in evaluation_result:
@@ -560,10 +637,12 @@ def evaluate_prop_firm_challenge(challenge_id):
         })
         
     except Exception as e:
-        print(f'Error evaluating challenge: {e}')
+        logger.error('Error evaluating challenge', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prop-firm/scheduler/start', methods=['POST'])
+@authenticate_user
+@require_admin
 def start_scheduler_endpoint():
     """Start the background scheduler (admin endpoint)"""
     try:
@@ -575,7 +654,7 @@ def start_scheduler_endpoint():
         return jsonify({'success': True, 'message': 'Scheduler started successfully'})
         
     except Exception as e:
-        print(f'Error starting scheduler: {e}')
+        logger.error('Error starting scheduler', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prop-firm/scheduler/status', methods=['GET'])
@@ -586,13 +665,87 @@ def get_scheduler_status():
         return jsonify({
             'running': getattr(scheduler, 'running', False),
             'thread_alive': getattr(scheduler, 'scheduler_thread', None) is not None and \
-                           scheduler.scheduler_thread.is_alive() if hasattr(scheduler, 'scheduler_thread') else False
+                           scheduler.scheduler_thread.is_alive() if hasattr(scheduler, 'scheduler_thread') else False,
+            'price_alerts': scheduler.price_alert_engine.stats() if scheduler.price_alert_engine else None,
+            'mark_to_market': scheduler.mark_to_market_engine.stats() if scheduler.mark_to_market_engine else None,
+            'leaderboard': leaderboard_service.stats(),
+            'evaluation_queue': evaluation_queue.stats() if evaluation_queue else None,
+            'jobs': scheduler.job_pool.stats(),
+            'coordination': scheduler.coordinator.stats() if scheduler.coordinator else None
+        })
+        
+    except Exception as e:
+        logger.error('Error getting scheduler status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/prop-firm/cache/status', methods=['GET'])
+def get_challenge_cache_status():
+    """Get challenge cache hit/miss counters"""
+    try:
+        prop_firm_evaluator = get_prop_firm_evaluator(supabase)
+        return jsonify(prop_firm_evaluator.challenge_cache_stats())
+        
+    except Exception as e:
+        logger.error('Error getting cache status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Top traders of a period from the in-memory rankings"""
+    try:
+        period = request.args.get('period', 'monthly')
+        limit = min(request.args.get('limit', 10, type=int), LEADERBOARD_MAX_LIMIT)
+        
+        if period not in PERIODS:
+            return jsonify({'error': f'period must be one of {", ".join(PERIODS)}'}), 400
+        
+        leaderboard_service.ensure_loaded()
+        return jsonify({
+            'success': True,
+            'period': period,
+            'leaders': leaderboard_service.top(period, limit)
         })
         
     except Exception as e:
-        print(f'Error getting scheduler status: {e}')
+        logger.error('Error getting leaderboard', error=e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/leaderboard/rank/<user_id>', methods=['GET'])
+def get_leaderboard_rank(user_id):
+    """Rank of a user's best challenge in a period"""
+    try:
+        period = request.args.get('period', 'monthly')
+        
+        if period not in PERIODS:
+            return jsonify({'error': f'period must be one of {", ".join(PERIODS)}'}), 400
+        
+        leaderboard_service.ensure_loaded()
+        entry = leaderboard_service.rank(period, user_id)
+        
+        if entry is None:
+            return jsonify({'error': 'User is not ranked in this period'}), 404
+        
+        return jsonify({'success': True, 'period': period, 'entry': entry})
+        
+    except Exception as e:
+        logger.error('Error getting leaderboard rank', error=e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/supabase/pool-status', methods=['GET'])
+def get_pool_status():
+    """Get Supabase connection pool utilization and wait time"""
+    try:
+        return jsonify(pool_stats())
+        
+    except Exception as e:
+        logger.error('Error getting pool status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics: request and database latencies, sweeps, caches"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/prop-firm/reset-daily-metrics', methods=['POST'])
 @authenticate_user
 def reset_daily_metrics():
@@ -613,59 +766,31 @@ def reset_daily_metrics():
         })
         
     except Exception as e:
-        print(f'Error resetting daily metrics: {e}')
+        logger.error('Error resetting daily metrics', error=e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/scrape-morocco-stocks', methods=['GET'])
 def scrape_morocco_stocks():
-    """Scrape Morocco stock prices"""
+    """Latest Morocco stock quotes from the in-memory market data hub"""
     try:
-        # This is a placeholder implementation
-        # In a real application, you would scrape actual market data
-        # from a financial data provider or exchange website
-        
-        # For demonstration purposes, return sample data
-        morocco_stocks_data = [
-            {
-                'symbol': 'MNG',
-                'name': 'Managem',
-                'price': 850.50,
-                'change': 2.5,
-                'changePercent': 0.30,
-                'volume': 125000,
-                'timestamp': datetime.utcnow().isoformat()
-            },
-            {
-                'symbol': 'IAM',
-                'name': 'Itissalat Al-Maghrib',
-                'price': 62.80,
-                'change': -0.20,
-                'changePercent': -0.32,
-                'volume': 340000,
-                'timestamp': datetime.utcnow().isoformat()
-            },
-            {
-                'symbol': 'CIH',
-                'name': 'Credit Immobilier et Hotelier',
-                'price': 285.25,
-                'change': 1.75,
-                'changePercent': 0.62,
-                'volume': 89000,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-        ]
+        stocks, etag, last_modified = get_market_data_hub().snapshot()
         
-        # Store the scraped data in the database (optional)
-        # For now, we'll just return the data
-        
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'stocks': morocco_stocks_data,
-            'lastUpdated': datetime.utcnow().isoformat()
+            'stocks': stocks,
+            'lastUpdated': datetime.utcfromtimestamp(last_modified).isoformat() if last_modified else None
         })
         
+        # Pollers revalidate with If-None-Match / If-Modified-Since and get a 304 until the next tick
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        
+        return response.make_conditional(request)
+        
     except Exception as e:
-        print(f'Error in scrape-morocco-stocks: {e}')
+        logger.error('Error in scrape-morocco-stocks', error=e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
@@ -678,7 +803,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
     
     if args.with_scheduler:
-        print("Starting Flask app with background scheduler...")
+        logger.info('Starting Flask app with background scheduler')
         # Start scheduler in background thread
         scheduler_thread = threading.Thread(
             target=start_background_scheduler,
@@ -686,6 +811,6 @@ if __name__ == '__main__':
             name="BackgroundScheduler"
         )
         scheduler_thread.start()
-        print("Background scheduler started")
+        logger.info('Background scheduler started')
     
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,751 @@
+"""
+ASGI serving mode for the TradeSense AI backend
+
+Quart application exposing the same routes as app.py, backed by the async
+Supabase client. Route handlers await every database call, so a single
+process keeps many requests in flight instead of blocking one worker per
+request on network I/O.
+
+Run with:
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from functools import wraps
+
+from dotenv import load_dotenv
+from quart import Quart, Response, request, jsonify, g
+from quart_cors import cors
+from supabase import AsyncClient
+
+from auth_service import TokenVerifier, AuthenticationError, is_admin
+from async_prop_firm_service import AsyncPropFirmChallengeEvaluator
+from scheduler import get_scheduler
+from supabase_client import create_async_supabase_client, get_supabase_client, pool_stats
+from market_data import get_market_data_hub
+from leaderboard import LeaderboardService, get_leaderboard_service, PERIODS
+from evaluation_queue import ChallengeEvaluationQueue, get_evaluation_queue
+from idempotency import (AsyncIdempotencyStore, StoredResponse, request_fingerprint, store_options_from_env,
+                         IDEMPOTENCY_HEADER, REPLAYED_HEADER, MAX_KEY_LENGTH, MISMATCH, IN_PROGRESS, REPLAY)
+import metrics
+import tracing
+from profiling import PROFILE_HEADER, get_request_profiler
+from structured_logging import configure_logging, get_logger
+
+# Load environment variables
+load_dotenv()
+
+# Structured logging, formatted and written by a background thread (LOG_ASYNC)
+configure_logging()
+logger = get_logger(__name__)
+
+# Initialize Quart app
+app = cors(Quart(__name__), allow_origin="*")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+# 'supabase' (hosted Postgres) or 'sqlite' (embedded database, see persistence.py)
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase").lower()
+
+if DATABASE_BACKEND == 'supabase' and (not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY):
+    raise ValueError("Supabase URL and Service Role Key must be set in environment variables")
+
+# The sqlite backend has no auth server: tokens can only be verified locally
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local" if DATABASE_BACKEND == 'sqlite' else "remote")
+if DATABASE_BACKEND == 'sqlite' and (AUTH_VERIFY_MODE != 'local' or not os.getenv("SUPABASE_JWT_SECRET")):
+    raise ValueError("The sqlite backend needs AUTH_VERIFY_MODE=local and SUPABASE_JWT_SECRET")
+AUTH_REVOCATION_CHECK_INTERVAL = 0.0 if DATABASE_BACKEND == 'sqlite' \
+    else float(os.getenv("AUTH_REVOCATION_CHECK_INTERVAL", "60"))
+
+MAX_BATCH_CLOSE_TRADES = int(os.getenv("MAX_BATCH_CLOSE_TRADES", "500"))
+LEADERBOARD_MAX_LIMIT = int(os.getenv("LEADERBOARD_MAX_LIMIT", "100"))
+EVALUATION_QUEUE_ENABLED = os.getenv("EVALUATION_QUEUE_ENABLED", "true").lower() == "true"
+
+# Responses of retried settlements and payment captures (Idempotency-Key header)
+idempotency_store = AsyncIdempotencyStore(**store_options_from_env())
+
+# Per-request span breakdown (Server-Timing header, log line for slow requests).
+# The header names tables and functions: by default only requests carrying
+# the X-Profile token get it
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "false").lower() == "true"
+TRACE_LOG_THRESHOLD_MS = float(os.getenv("TRACE_LOG_THRESHOLD_MS", "1000"))
+
+# Operator-enabled profiling of selected requests (see profiling.py)
+request_profiler = get_request_profiler()
+
+PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID", "")
+PAYPAL_CLIENT_SECRET = os.getenv("PAYPAL_CLIENT_SECRET", "")
+
+# Created on startup, inside the server's event loop
+supabase: AsyncClient = None
+prop_firm_evaluator: AsyncPropFirmChallengeEvaluator = None
+token_verifier: TokenVerifier = None
+leaderboard_service: LeaderboardService = None
+evaluation_queue: ChallengeEvaluationQueue = None
+
+
+@app.before_serving
+async def create_supabase_client():
+    """Create the async Supabase client and the services that use it"""
+    global supabase, prop_firm_evaluator, token_verifier, leaderboard_service, evaluation_queue
+
+    supabase = await create_async_supabase_client()
+    prop_firm_evaluator = AsyncPropFirmChallengeEvaluator(supabase)
+
+    # Rankings are updated in memory by settlements; loads and flushes use the sync client
+    leaderboard_service = get_leaderboard_service(prop_firm_evaluator, get_supabase_client())
+
+    # Settlements and resets enqueue their challenges; the queue's worker uses the sync client
+    if EVALUATION_QUEUE_ENABLED:
+        evaluation_queue = get_evaluation_queue(
+            prop_firm_evaluator,
+            window=float(os.getenv("EVALUATION_QUEUE_WINDOW", "0.25")),
+            batch_size=int(os.getenv("EVALUATION_QUEUE_BATCH_SIZE", "500"))
+        )
+
+    # The hub's first fetch is blocking; run it off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, get_market_data_hub)
+    token_verifier = TokenVerifier(
+        supabase,
+        SUPABASE_URL,
+        mode=AUTH_VERIFY_MODE,
+        jwt_secret=os.getenv("SUPABASE_JWT_SECRET"),
+        cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")),
+        cache_ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300")),
+        revocation_check_interval=AUTH_REVOCATION_CHECK_INTERVAL
+    )
+    metrics.track_cache('challenge', prop_firm_evaluator.challenge_cache_stats)
+    metrics.track_cache('auth_token', token_verifier.cache.stats)
+    metrics.track_cache('idempotency', idempotency_store.responses.stats)
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+    if TRACE_ENABLED:
+        g.trace_token = tracing.start_trace()
+    if request_profiler.should_profile(request.headers.get(PROFILE_HEADER)):
+        g.profile = request_profiler.start()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.record_request(request.method, route, response.status_code, elapsed)
+
+        profile = g.pop('profile', None)
+        if profile is not None:
+            request_profiler.stop(profile, f'{request.method} {route}')
+
+        trace_token = g.pop('trace_token', None)
+        if trace_token is not None:
+            trace = tracing.finish_trace(trace_token)
+            if TRACE_SERVER_TIMING or request_profiler.has_token(request.headers.get(PROFILE_HEADER)):
+                response.headers['Server-Timing'] = trace.server_timing(elapsed)
+            if elapsed * 1000 >= TRACE_LOG_THRESHOLD_MS:
+                logger.warning('Slow request', method=request.method, route=route, status=response.status_code,
+                               ms=round(elapsed * 1000, 1), spans=trace.summary())
+    return response
+
+
+@app.teardown_request
+async def finish_request(exc):
+    # After an unhandled error after_request did not run
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile, 'failed request')
+    trace_token = g.pop('trace_token', None)
+    if trace_token is not None:
+        tracing.finish_trace(trace_token)
+    if g.pop('request_started', None) is not None:
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+
+
+@app.after_serving
+async def close_supabase_client():
+    """Release the pooled connections"""
+    # The sqlite backend's connections belong to the shared sync client
+    if DATABASE_BACKEND == 'supabase' and supabase is not None and supabase.options.httpx_client is not None:
+        await supabase.options.httpx_client.aclose()
+
+
+def authenticate_user(f):
+    """Decorator to authenticate user from JWT token"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+
+        if not auth_header:
+            return jsonify({'error': 'No authorization header'}), 401
+
+        try:
+            token = auth_header.replace('Bearer ', '')
+            with tracing.span('auth'):
+                g.current_user = await token_verifier.averify(token)
+
+        except AuthenticationError as e:
+            logger.warning('Authentication error', error=e)
+            return jsonify({'error': 'Unauthorized'}), 401
+        except Exception as e:
+            # The verifier reports bad tokens as AuthenticationError; anything else is our failure
+            logger.error('Token verification failed', error=e)
+            return jsonify({'error': 'Authentication unavailable'}), 500
+
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+
+def require_admin(f):
+    """Decorator restricting an endpoint to admins; goes below authenticate_user"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if not is_admin(g.current_user):
+            return jsonify({'error': 'Forbidden'}), 403
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+
+def idempotent(f):
+    """
+    Decorator replaying the stored response of a retried request (Idempotency-Key header)
+
+    Goes below authenticate_user: keys are scoped to the user and the path.
+    """
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await f(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+
+        scope = (g.current_user.id, request.path, key)
+        fingerprint = request_fingerprint(await request.get_data())
+        outcome, stored = await idempotency_store.begin(scope, fingerprint)
+
+        if outcome == MISMATCH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+        if outcome == IN_PROGRESS:
+            return jsonify({'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'}), 409
+        if outcome == REPLAY:
+            response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        try:
+            response = await app.make_response(await f(*args, **kwargs))
+        except BaseException:
+            # Includes the cancellation of a disconnected client
+            idempotency_store.abandon(scope)
+            raise
+        idempotency_store.complete(scope, StoredResponse(
+            response.status_code, await response.get_data(), response.content_type, fingerprint))
+        return response
+
+    return decorated_function
+
+
+async def check_challenge_status_internal(challenge_id):
+    """Internal function to check challenge status"""
+    try:
+        # Read fresh: a status change must not be decided on a cached row
+        challenge = await prop_firm_evaluator.get_challenge(challenge_id, fresh=True)
+
+        if not challenge:
+            logger.warning('Challenge not found in check_challenge_status', challenge_id=challenge_id)
+            return {'error': 'Challenge not found', 'status': 'error'}
+
+        # Calculate percentages
+        profit_percentage = ((challenge['current_balance'] - challenge['initial_capital']) / challenge['initial_capital']) * 100
+        loss_percentage = ((challenge['initial_capital'] - challenge['current_balance']) / challenge['initial_capital']) * 100
+        daily_loss_percentage = abs(((challenge['initial_capital'] + challenge['daily_pnl']) - challenge['initial_capital']) / challenge['initial_capital']) * 100
+        total_loss_percentage = abs(loss_percentage)
+
+        # Determine status
+        new_status = 'active'
+
+        if profit_percentage >= challenge['profit_target_percent']:
+            new_status = 'success'
+        elif total_loss_percentage >= challenge['max_total_loss_percent']:
+            new_status = 'failed'
+        elif daily_loss_percentage >= challenge['max_daily_loss_percent']:
+            new_status = 'failed'
+
+        # If status changed, update the challenge
+        if new_status != challenge['status']:
+            update_data = {
+                'status': new_status,
+                'ended_at': datetime.utcnow().isoformat() if new_status in ['success', 'failed'] else None
+            }
+
+            if not await prop_firm_evaluator.write_status_update(challenge, update_data):
+                # Changed by another process since the read; report its status
+                current = await prop_firm_evaluator.get_challenge(challenge_id)
+                new_status = current['status'] if current else challenge['status']
+
+        return {
+            'status': new_status,
+            'profit_percentage': profit_percentage,
+            'loss_percentage': loss_percentage,
+            'daily_loss_percentage': daily_loss_percentage,
+            'total_loss_percentage': total_loss_percentage,
+            'challenge_data': challenge
+        }
+
+    except Exception as e:
+        logger.error('Error in check_challenge_status_internal', error=e)
+        return {'error': str(e), 'status': 'error'}
+
+
+@app.route('/')
+async def health_check():
+    """Health check endpoint"""
+    return jsonify({"status": "Backend is running", "timestamp": datetime.now().isoformat()})
+
+
+@app.route('/evaluate-trade', methods=['POST'])
+@authenticate_user
+@idempotent
+async def evaluate_trade():
+    """Evaluate a trade and update PnL with Prop Firm rules"""
+    try:
+        data = await request.get_json()
+        trade_id = data.get('trade_id')
+        exit_price = data.get('exit_price')
+
+        if not trade_id or exit_price is None:
+            return jsonify({'error': 'trade_id and exit_price are required'}), 400
+
+        user = g.current_user
+        result = await prop_firm_evaluator.settle_trade(trade_id, user.id, exit_price)
+
+        if 'error' in result:
+            logger.warning('Failed to settle trade', trade_id=trade_id, error=result['error'])
+            return jsonify({'error': result['error']}), result.get('status_code', 500)
+
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error('Error in evaluate-trade function', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/evaluate-trades', methods=['POST'])
+@authenticate_user
+async def evaluate_trades():
+    """Close many open trades in one request (close all / stop-out)"""
+    try:
+        data = await request.get_json()
+        closes = data.get('trades') if data else None
+
+        if not isinstance(closes, list) or not closes:
+            return jsonify({'error': 'trades must be a non-empty list of {trade_id, exit_price}'}), 400
+
+        if len(closes) > MAX_BATCH_CLOSE_TRADES:
+            return jsonify({'error': f'At most {MAX_BATCH_CLOSE_TRADES} trades can be closed per request'}), 400
+
+        for close in closes:
+            if not isinstance(close, dict) or not close.get('trade_id') or close.get('exit_price') is None:
+                return jsonify({'error': 'Each trade requires trade_id and exit_price'}), 400
+
+        user = g.current_user
+        result = await prop_firm_evaluator.settle_trades(user.id, closes)
+
+        if 'error' in result:
+            logger.warning('Failed to settle trades', error=result['error'])
+            return jsonify({'error': result['error']}), result.get('status_code', 500)
+
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error('Error in evaluate-trades function', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/create-paypal-order', methods=['POST'])
+@authenticate_user
+async def create_paypal_order():
+    """Create a PayPal order for payment"""
+    try:
+        if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
+            logger.error('Missing PayPal secrets')
+            return jsonify({'error': 'Missing PayPal secrets'}), 500
+
+        user = g.current_user
+        data = await request.get_json()
+        plan_name = data.get('planName')
+        amount = data.get('amount')
+        currency = data.get('currency', 'USD')
+
+        if not plan_name or not amount:
+            return jsonify({'error': 'Missing required fields: planName or amount'}), 400
+
+        # Simulated PayPal order creation, same as the WSGI app
+        order_id = str(uuid.uuid4())
+
+        # Record pending payment
+        await supabase.table('payments') \
+            .insert({
+                'user_id': user.id,
+                'amount': amount,
+                'currency': currency,
+                'payment_method': 'paypal',
+                'status': 'pending',
+                'transaction_id': order_id,
+            }) \
+            .execute()
+
+        approval_url = f"https://sandbox.paypal.com/cgi-bin/webscr?cmd=_express-checkout&token={order_id}"
+
+        return jsonify({
+            'orderId': order_id,
+            'approvalUrl': approval_url
+        })
+
+    except Exception as e:
+        logger.error('Error in create-paypal-order', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/capture-paypal-order', methods=['POST'])
+@authenticate_user
+@idempotent
+async def capture_paypal_order():
+    """Capture PayPal order after payment completion"""
+    try:
+        user = g.current_user
+        data = await request.get_json()
+        order_id = data.get('orderId')
+
+        if not order_id:
+            return jsonify({'error': 'orderId is required'}), 400
+
+        # Only a pending payment of this user is moved to completed
+        update_response = await supabase.table('payments') \
+            .update({'status': 'completed'}) \
+            .eq('transaction_id', order_id) \
+            .eq('user_id', user.id) \
+            .execute()
+
+        if not update_response.data:
+            logger.warning('Payment not found', order_id=order_id)
+            return jsonify({'error': 'Payment not found'}), 404
+
+        payment = update_response.data[0]
+
+        return jsonify({
+            'success': True,
+            'payment': {
+                'id': payment['id'],
+                'status': 'completed',
+            },
+        })
+
+    except Exception as e:
+        logger.error('Error in capture-paypal-order', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/check-challenge-status', methods=['POST'])
+@authenticate_user
+async def check_challenge_status():
+    """Check the status of a challenge"""
+    try:
+        data = await request.get_json()
+        challenge_id = data.get('challenge_id')
+
+        if not challenge_id:
+            return jsonify({'error': 'challenge_id is required'}), 400
+
+        result = await check_challenge_status_internal(challenge_id)
+
+        if 'error' in result:
+            return jsonify(result), 404
+
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error('Error in check-challenge-status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/reset-daily-pnl', methods=['POST'])
+@authenticate_user
+async def reset_daily_pnl():
+    """Reset daily PnL for active challenges"""
+    try:
+        user = g.current_user
+
+        reset_result = await prop_firm_evaluator.reset_daily_metrics(
+            user_id=user.id,
+            statuses=['active', 'pending']
+        )
+
+        if 'error' in reset_result:
+            logger.error('Error resetting daily PnL', error=reset_result['error'])
+            return jsonify({'error': 'Failed to reset daily PnL'}), 500
+
+        updated_challenges = reset_result['reset_ids']
+
+        return jsonify({
+            'success': True,
+            'message': f'Daily PnL reset for {len(updated_challenges)} challenges',
+            'updated_challenges': updated_challenges,
+        })
+
+    except Exception as e:
+        logger.error('Error in reset-daily-pnl', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/create-challenge', methods=['POST'])
+@authenticate_user
+async def create_prop_firm_challenge():
+    """Create a new Prop Firm challenge for the authenticated user"""
+    try:
+        user = g.current_user
+        data = await request.get_json()
+        initial_balance = data.get('initial_balance')
+
+        challenge_result = await prop_firm_evaluator.create_new_challenge(
+            user_id=user.id,
+            initial_balance=initial_balance
+        )
+
+        if 'error' in challenge_result:
+            return jsonify(challenge_result), 400
+
+        return jsonify({
+            'success': True,
+            'challenge': challenge_result,
+            'message': f'Prop Firm challenge created with ${challenge_result["initial_capital"]:,.2f} starting balance'
+        })
+
+    except Exception as e:
+        logger.error('Error creating Prop Firm challenge', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/challenge/<challenge_id>/status', methods=['GET'])
+@authenticate_user
+async def get_prop_firm_challenge_status(challenge_id):
+    """Get detailed status of a Prop Firm challenge"""
+    try:
+        user = g.current_user
+
+        # Verify user owns this challenge
+        if not await prop_firm_evaluator.get_challenge(challenge_id, user.id):
+            return jsonify({'error': 'Challenge not found or unauthorized'}), 404
+
+        summary = await prop_firm_evaluator.get_challenge_summary(challenge_id)
+
+        if 'error' in summary:
+            return jsonify(summary), 400
+
+        return jsonify(summary)
+
+    except Exception as e:
+        logger.error('Error getting challenge status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/challenge/<challenge_id>/evaluate', methods=['POST'])
+@authenticate_user
+async def evaluate_prop_firm_challenge(challenge_id):
+    """Force evaluation of Prop Firm challenge rules"""
+    try:
+        user = g.current_user
+
+        # Verify user owns this challenge
+        if not await prop_firm_evaluator.get_challenge(challenge_id, user.id):
+            return jsonify({'error': 'Challenge not found or unauthorized'}), 404
+
+        evaluation_result = await prop_firm_evaluator.evaluate_challenge_rules(challenge_id)
+
+        if 'error' in evaluation_result:
+            return jsonify(evaluation_result), 400
+
+        return jsonify({
+            'success': True,
+            'evaluation': evaluation_result
+        })
+
+    except Exception as e:
+        logger.error('Error evaluating challenge', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/scheduler/start', methods=['POST'])
+@authenticate_user
+@require_admin
+async def start_scheduler_endpoint():
+    """Start the background scheduler (admin endpoint)"""
+    try:
+        scheduler = get_scheduler()
+        if scheduler.running:
+            return jsonify({'message': 'Scheduler is already running'}), 200
+
+        scheduler.run_in_background()
+        return jsonify({'success': True, 'message': 'Scheduler started successfully'})
+
+    except Exception as e:
+        logger.error('Error starting scheduler', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/scheduler/status', methods=['GET'])
+async def get_scheduler_status():
+    """Get scheduler status"""
+    try:
+        scheduler = get_scheduler()
+        return jsonify({
+            'running': scheduler.running,
+            'thread_alive': scheduler.scheduler_thread is not None and scheduler.scheduler_thread.is_alive(),
+            'price_alerts': scheduler.price_alert_engine.stats() if scheduler.price_alert_engine else None,
+            'mark_to_market': scheduler.mark_to_market_engine.stats() if scheduler.mark_to_market_engine else None,
+            'leaderboard': leaderboard_service.stats(),
+            'evaluation_queue': evaluation_queue.stats() if evaluation_queue else None,
+            'jobs': scheduler.job_pool.stats(),
+            'coordination': scheduler.coordinator.stats() if scheduler.coordinator else None
+        })
+
+    except Exception as e:
+        logger.error('Error getting scheduler status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/prop-firm/cache/status', methods=['GET'])
+async def get_challenge_cache_status():
+    """Get challenge cache hit/miss counters"""
+    try:
+        return jsonify(prop_firm_evaluator.challenge_cache_stats())
+
+    except Exception as e:
+        logger.error('Error getting cache status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/leaderboard', methods=['GET'])
+async def get_leaderboard():
+    """Top traders of a period from the in-memory rankings"""
+    try:
+        period = request.args.get('period', 'monthly')
+        limit = min(request.args.get('limit', 10, type=int), LEADERBOARD_MAX_LIMIT)
+
+        if period not in PERIODS:
+            return jsonify({'error': f'period must be one of {", ".join(PERIODS)}'}), 400
+
+        if not leaderboard_service.loaded:
+            await asyncio.get_running_loop().run_in_executor(None, leaderboard_service.ensure_loaded)
+        else:
+            # Starts a background reload once the rankings are stale
+            leaderboard_service.ensure_loaded()
+        return jsonify({
+            'success': True,
+            'period': period,
+            'leaders': leaderboard_service.top(period, limit)
+        })
+
+    except Exception as e:
+        logger.error('Error getting leaderboard', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/leaderboard/rank/<user_id>', methods=['GET'])
+async def get_leaderboard_rank(user_id):
+    """Rank of a user's best challenge in a period"""
+    try:
+        period = request.args.get('period', 'monthly')
+
+        if period not in PERIODS:
+            return jsonify({'error': f'period must be one of {", ".join(PERIODS)}'}), 400
+
+        if not leaderboard_service.loaded:
+            await asyncio.get_running_loop().run_in_executor(None, leaderboard_service.ensure_loaded)
+        else:
+            # Starts a background reload once the rankings are stale
+            leaderboard_service.ensure_loaded()
+        entry = leaderboard_service.rank(period, user_id)
+
+        if entry is None:
+            return jsonify({'error': 'User is not ranked in this period'}), 404
+
+        return jsonify({'success': True, 'period': period, 'entry': entry})
+
+    except Exception as e:
+        logger.error('Error getting leaderboard rank', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/supabase/pool-status', methods=['GET'])
+async def get_pool_status():
+    """Get Supabase connection pool utilization and wait time"""
+    try:
+        return jsonify(pool_stats())
+
+    except Exception as e:
+        logger.error('Error getting pool status', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Prometheus metrics: request and database latencies, sweeps, caches"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/prop-firm/reset-daily-metrics', methods=['POST'])
+@authenticate_user
+async def reset_daily_metrics():
+    """Reset daily metrics for all active challenges (admin endpoint)"""
+    try:
+        reset_result = await prop_firm_evaluator.reset_daily_metrics()
+
+        if 'error' in reset_result:
+            return jsonify(reset_result), 400
+
+        return jsonify({
+            'success': True,
+            'result': reset_result
+        })
+
+    except Exception as e:
+        logger.error('Error resetting daily metrics', error=e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/scrape-morocco-stocks', methods=['GET'])
+async def scrape_morocco_stocks():
+    """Latest Morocco stock quotes from the in-memory market data hub"""
+    try:
+        stocks, etag, last_modified = get_market_data_hub().snapshot()
+
+        response = jsonify({
+            'success': True,
+            'stocks': stocks,
+            'lastUpdated': datetime.utcfromtimestamp(last_modified).isoformat() if last_modified else None
+        })
+
+        # Pollers revalidate with If-None-Match / If-Modified-Since and get a 304 until the next tick
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+
+        return await response.make_conditional(request)
+
+    except Exception as e:
+        logger.error('Error in scrape-morocco-stocks', error=e)
+        return jsonify({'error': str(e)}), 500
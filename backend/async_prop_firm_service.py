@@ -0,0 +1,226 @@
+"""
+Async Prop Firm Challenge Service
+
+Counterpart of prop_firm_service for the ASGI serving mode (asgi_app.py).
+All database access goes through the async Supabase client so one process
+can keep many requests in flight. The rule logic itself (evaluate_challenge_data,
+build_status_update, rule_parameters, ...) is inherited unchanged from
+PropFirmChallengeEvaluator; only the I/O methods are re-implemented.
+
+Settlement and daily resets rely on the `settle_trade`, `settle_trades` and
+`reset_daily_metrics` Postgres functions; the async mode has no sequential
+fallback for them.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from postgrest.exceptions import APIError
+from supabase import AsyncClient
+
+from prop_firm_service import PropFirmChallengeEvaluator, MISSING_FUNCTION_ERROR_CODES
+from trade_stats import has_trade_stats
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class AsyncPropFirmChallengeEvaluator(PropFirmChallengeEvaluator):
+    """Prop Firm evaluator backed by the async Supabase client"""
+
+    def __init__(self, supabase_client: AsyncClient):
+        super().__init__(supabase_client)
+
+    async def create_new_challenge(self, user_id: str, initial_balance: float = None) -> Dict:
+        """Create a new Prop Firm challenge for a user"""
+        balance = initial_balance or self.STARTING_BALANCE
+
+        challenge_data = {
+            'user_id': user_id,
+            'initial_capital': balance,
+            'current_balance': balance,
+            'total_pnl': 0.0,
+            'daily_pnl': 0.0,
+            'status': 'active',
+            'started_at': datetime.utcnow().isoformat(),
+            'max_daily_loss_percent': self.DAILY_LOSS_LIMIT_PERCENT,
+            'max_total_loss_percent': self.TOTAL_LOSS_LIMIT_PERCENT,
+            'profit_target_percent': self.PROFIT_TARGET_PERCENT,
+            'daily_reset_time': datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+        }
+
+        try:
+            response = await self.supabase.table('user_challenges').insert(challenge_data).execute()
+            
+            if not response.data:
+                return {'error': 'No data returned'}
+            
+            self.cache_challenge(response.data[0])
+            return response.data[0]
+
+        except Exception as e:
+            logger.error('Error creating challenge', user_id=user_id, error=e)
+            return {'error': str(e)}
+
+    async def get_challenge(self, challenge_id: str, user_id: str = None, fresh: bool = False) -> Optional[Dict]:
+        """Fetch a challenge row through the challenge cache (skipped when fresh), optionally checking ownership"""
+        challenge = None if fresh else self.challenge_cache.get(challenge_id)
+
+        if challenge is None:
+            response = await self.supabase.table('user_challenges') \
+                .select('*') \
+                .eq('id', challenge_id) \
+                .maybe_single() \
+                .execute()
+
+            if not response or not response.data:
+                return None
+
+            challenge = response.data
+            self.cache_challenge(challenge)
+
+        if user_id and challenge['user_id'] != user_id:
+            return None
+
+        return dict(challenge)
+
+    async def write_status_update(self, challenge: Dict, update_data: Dict) -> bool:
+        """Async variant of PropFirmChallengeEvaluator.write_status_update"""
+        response = await self.supabase.table('user_challenges') \
+            .update(update_data) \
+            .eq('id', challenge['id']) \
+            .eq('status', challenge['status']) \
+            .execute()
+        return self._status_written(challenge['id'], update_data, response)
+
+    async def evaluate_challenge_rules(self, challenge_id: str) -> Dict:
+        """Evaluate all Prop Firm rules for a challenge and persist status changes"""
+        try:
+            challenge = await self.get_challenge(challenge_id, fresh=True)
+
+            if not challenge:
+                logger.error('Challenge not found', challenge_id=challenge_id)
+                return {'error': 'Challenge not found'}
+
+            evaluation = self.evaluate_challenge_data(challenge)
+
+            # Skip if already completed
+            if 'message' in evaluation:
+                return evaluation
+
+            new_status = evaluation['status']
+
+            if new_status != challenge['status']:
+                update_data = self.build_status_update(new_status, evaluation['rule_triggered'])
+
+                if not await self.write_status_update(challenge, update_data):
+                    logger.info('Challenge status changed concurrently', challenge_id=challenge_id)
+                    challenge = await self.get_challenge(challenge_id)
+                    return self.evaluate_challenge_data(challenge) if challenge else {'error': 'Challenge not found'}
+
+                logger.info('Challenge status updated', challenge_id=challenge_id, status=new_status)
+
+            return evaluation
+
+        except Exception as e:
+            logger.error('Error evaluating challenge rules', challenge_id=challenge_id, error=e)
+            return {'error': str(e)}
+
+    async def settle_trade(self, trade_id: str, user_id: str, exit_price: float) -> Dict:
+        """Close a trade and apply the Prop Firm rules in one `settle_trade` call"""
+        try:
+            response = await self.supabase.rpc('settle_trade', {
+                'p_trade_id': trade_id,
+                'p_user_id': user_id,
+                'p_exit_price': exit_price,
+                'p_rules': self.rule_parameters()
+            }).execute()
+        except APIError as e:
+            logger.error('Error settling trade', trade_id=trade_id, error=e.message)
+            return {'error': e.message or str(e), 'status_code': self._rpc_error_status(e)}
+
+        result = response.data
+
+        if 'error' in result:
+            return {'error': result['error'], 'status_code': 404}
+
+        self.invalidate_challenge(result['challenge']['id'])
+        self.notify_settled(user_id, [{'challenge_id': result['challenge']['id'], 'pnl': result['trade']['pnl']}])
+        return result
+
+    async def settle_trades(self, user_id: str, closes: List[Dict]) -> Dict:
+        """Close many trades of one user in one `settle_trades` call"""
+        exit_prices = {close['trade_id']: close['exit_price'] for close in closes}
+
+        try:
+            response = await self.supabase.rpc('settle_trades', {
+                'p_user_id': user_id,
+                'p_closes': [{'trade_id': t, 'exit_price': p} for t, p in exit_prices.items()],
+                'p_rules': self.rule_parameters()
+            }).execute()
+        except APIError as e:
+            logger.error('Error settling trades', trades=len(exit_prices), error=e.message)
+            return {'error': e.message or str(e), 'status_code': self._rpc_error_status(e)}
+
+        result = response.data
+        for challenge in result['challenges']:
+            self.invalidate_challenge(challenge['id'])
+        self.notify_settled(user_id, result['trades'])
+
+        settled_ids = {trade['id'] for trade in result['trades']}
+        result['not_found'] = [trade_id for trade_id in exit_prices if trade_id not in settled_ids]
+        return result
+
+    async def reset_daily_metrics(self, challenge_id: str = None, user_id: str = None,
+                                  statuses: List[str] = None) -> Dict:
+        """Reset daily PnL for all matching challenges with one `reset_daily_metrics` call"""
+        try:
+            response = await self.supabase.rpc('reset_daily_metrics', {
+                'p_challenge_id': challenge_id,
+                'p_user_id': user_id,
+                'p_statuses': statuses or ['active']
+            }).execute()
+        except Exception as e:
+            logger.error('Error resetting daily metrics', error=e)
+            return {'error': str(e)}
+
+        reset_ids = [row['id'] for row in (response.data or [])]
+        for reset_id in reset_ids:
+            self.invalidate_challenge(reset_id)
+        self.notify_reset(reset_ids)
+
+        return {
+            'success': True,
+            'reset_count': len(reset_ids),
+            'reset_ids': reset_ids,
+            'failed_resets': [],
+            'total_processed': len(reset_ids)
+        }
+
+    async def get_challenge_summary(self, challenge_id: str) -> Dict:
+        """Get comprehensive challenge summary with all metrics"""
+        try:
+            challenge = await self.get_challenge(challenge_id)
+
+            if not challenge:
+                return {'error': 'Challenge not found'}
+
+            if has_trade_stats(challenge):
+                return self.build_challenge_summary(challenge)
+
+            trades_response = await self.supabase.table('trades') \
+                .select('pnl') \
+                .eq('challenge_id', challenge_id) \
+                .eq('is_open', False) \
+                .execute()
+            return self.build_challenge_summary(challenge, trades_response.data or [])
+
+        except Exception as e:
+            logger.error('Error getting challenge summary', challenge_id=challenge_id, error=e)
+            return {'error': str(e)}
+
+    @staticmethod
+    def _rpc_error_status(error: APIError) -> int:
+        if error.code in MISSING_FUNCTION_ERROR_CODES:
+            return 501
+        return 404 if error.code == 'P0002' else 500
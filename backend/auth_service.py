@@ -0,0 +1,291 @@
+"""
+Supabase JWT Verification Service
+
+Verifies the bearer tokens sent by the frontend. Two modes are supported:
+- remote: every token is checked with `supabase.auth.get_user` (one network round trip per request)
+- local: the signature and expiry are checked in-process with PyJWT and the
+  verified claims are cached; `get_user` is only used as a fallback and as a
+  periodic revocation check
+
+With SUPABASE_JWT_SECRET set, local mode verifies HS256 tokens only; tokens
+signed with an asymmetric key (RS256/ES256) go to `get_user` instead.
+
+Only a rejection by the auth server is an AuthenticationError; transport
+failures (connect errors, timeouts, 5xx) propagate so callers answer 500, and
+a cached token stays valid while its revocation check cannot reach the server.
+"""
+
+import hashlib
+import time
+from typing import Dict, Optional
+
+import jwt
+from supabase import Client
+from supabase_auth.errors import AuthApiError, AuthInvalidJwtError, AuthSessionMissingError
+
+from structured_logging import get_logger
+from ttl_cache import TTLCache
+
+logger = get_logger(__name__)
+
+
+class AuthenticationError(Exception):
+    """Raised when a token cannot be verified"""
+
+
+class AuthenticatedUser:
+    """Minimal user object built from verified JWT claims"""
+
+    __slots__ = ('id', 'email', 'role', 'aud', 'app_metadata', 'user_metadata')
+
+    def __init__(self, claims: Dict):
+        self.id = claims['sub']
+        self.email = claims.get('email')
+        self.role = claims.get('role')
+        self.aud = claims.get('aud')
+        self.app_metadata = claims.get('app_metadata', {})
+        self.user_metadata = claims.get('user_metadata', {})
+
+    def __repr__(self):
+        return f"AuthenticatedUser(id={self.id!r}, email={self.email!r})"
+
+
+def is_admin(user) -> bool:
+    """
+    Whether a verified user may call the admin endpoints
+
+    Admins carry role 'admin' in app_metadata, which only the service role can
+    write; service-role tokens are admins as well.
+    """
+    app_metadata = getattr(user, 'app_metadata', None) or {}
+    return app_metadata.get('role') == 'admin' or getattr(user, 'role', None) == 'service_role'
+
+
+class _CachedToken:
+    __slots__ = ('user', 'last_remote_check')
+
+    def __init__(self, user, last_remote_check: float):
+        self.user = user
+        self.last_remote_check = last_remote_check
+
+
+class TokenVerifier:
+    """Verify Supabase access tokens, locally or through the auth server"""
+
+    SYMMETRIC_ALGORITHMS = ['HS256']
+    ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256']
+
+    def __init__(self, supabase_client: Client, supabase_url: str, mode: str = 'remote',
+                 jwt_secret: Optional[str] = None, audience: str = 'authenticated',
+                 cache_size: int = 10000, cache_ttl: float = 300.0,
+                 revocation_check_interval: float = 60.0):
+        if mode not in ('remote', 'local'):
+            raise ValueError(f"Unknown token verification mode: {mode}")
+
+        self.supabase = supabase_client
+        self.mode = mode
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.cache_ttl = cache_ttl
+        self.revocation_check_interval = revocation_check_interval
+
+        self.cache = TTLCache(max_size=cache_size, default_ttl=cache_ttl)
+
+        # Asymmetric signing keys are published by the auth server; the JWK set is cached by PyJWT
+        self.jwks_client = None
+        if mode == 'local' and not jwt_secret and supabase_url:
+            self.jwks_client = jwt.PyJWKClient(
+                f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json",
+                cache_jwk_set=True,
+                lifespan=3600
+            )
+
+        self.local_verifications = 0
+        self.remote_verifications = 0
+
+    def verify(self, token: str):
+        """
+        Verify a bearer token and return the authenticated user
+
+        Raises:
+            AuthenticationError: if the token is invalid, expired or revoked
+        """
+        if not token:
+            raise AuthenticationError("Empty token")
+
+        if self.mode == 'remote':
+            return self._verify_remote(token)
+
+        key = self._cache_key(token)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            if self._revocation_check_due(cached):
+                try:
+                    cached.user = self._verify_remote(token)
+                except AuthenticationError:
+                    self.cache.invalidate(key)
+                    raise
+                except Exception as e:
+                    # Auth server unreachable: the token was verified, keep serving it
+                    logger.warning('Revocation check failed, serving cached token', error=e)
+                cached.last_remote_check = time.monotonic()
+            return cached.user
+
+        user, claims = self._verify_local(token)
+        if user is None:
+            user = self._verify_remote(token)
+
+        self._store(key, user, claims)
+        return user
+
+    async def averify(self, token: str):
+        """
+        Async variant of verify, for a TokenVerifier built on the async Supabase client
+
+        Raises:
+            AuthenticationError: if the token is invalid, expired or revoked
+        """
+        if not token:
+            raise AuthenticationError("Empty token")
+
+        if self.mode == 'remote':
+            return await self._averify_remote(token)
+
+        key = self._cache_key(token)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            if self._revocation_check_due(cached):
+                try:
+                    cached.user = await self._averify_remote(token)
+                except AuthenticationError:
+                    self.cache.invalidate(key)
+                    raise
+                except Exception as e:
+                    # Auth server unreachable: the token was verified, keep serving it
+                    logger.warning('Revocation check failed, serving cached token', error=e)
+                cached.last_remote_check = time.monotonic()
+            return cached.user
+
+        user, claims = self._verify_local(token)
+        if user is None:
+            user = await self._averify_remote(token)
+
+        self._store(key, user, claims)
+        return user
+
+    def invalidate(self, token: str) -> None:
+        """Drop a token from the cache (e.g. after sign-out)"""
+        self.cache.invalidate(self._cache_key(token))
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _verify_local(self, token: str):
+        """
+        Check signature and expiry in-process
+
+        Returns (user, claims), or (None, unverified claims) when no signing
+        key is available and the caller must fall back to the auth server.
+        """
+        try:
+            claims = self._decode_local(token)
+        except jwt.PyJWKClientError as e:
+            logger.warning('Local JWT verification unavailable, using remote check', error=e)
+            try:
+                return None, jwt.decode(token, options={'verify_signature': False})
+            except jwt.InvalidTokenError as decode_error:
+                raise AuthenticationError(str(decode_error)) from decode_error
+        except jwt.InvalidTokenError as e:
+            raise AuthenticationError(str(e)) from e
+
+        self.local_verifications += 1
+        return AuthenticatedUser(claims), claims
+
+    def _store(self, key: str, user, claims: Dict) -> None:
+        # Never keep a token cached past its own expiry
+        ttl = self.cache_ttl
+        if claims.get('exp'):
+            ttl = min(ttl, claims['exp'] - time.time())
+
+        self.cache.set(key, _CachedToken(user, time.monotonic()), ttl=ttl)
+
+    def _decode_local(self, token: str) -> Dict:
+        if self.jwt_secret:
+            # Projects migrated to asymmetric signing keys still accept their old
+            # HS256 tokens; the new ones can only be checked by the auth server
+            if self._algorithm(token) in self.ASYMMETRIC_ALGORITHMS:
+                raise jwt.PyJWKClientError("Asymmetric token with only a JWT secret configured")
+            key = self.jwt_secret
+            algorithms = self.SYMMETRIC_ALGORITHMS
+        elif self.jwks_client is not None:
+            key = self.jwks_client.get_signing_key_from_jwt(token).key
+            algorithms = self.ASYMMETRIC_ALGORITHMS
+        else:
+            raise jwt.PyJWKClientError("No JWT secret or JWKS endpoint configured")
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=self.audience,
+            options={'require': ['exp', 'sub']}
+        )
+
+    @staticmethod
+    def _algorithm(token: str) -> Optional[str]:
+        try:
+            return jwt.get_unverified_header(token).get('alg')
+        except jwt.InvalidTokenError as e:
+            raise AuthenticationError(str(e)) from e
+
+    def _verify_remote(self, token: str):
+        try:
+            response = self.supabase.auth.get_user(token)
+        except Exception as e:
+            if self._is_rejection(e):
+                raise AuthenticationError(str(e)) from e
+            raise
+
+        if not response or not response.user:
+            raise AuthenticationError("User not found for token")
+
+        self.remote_verifications += 1
+        return response.user
+
+    async def _averify_remote(self, token: str):
+        try:
+            response = await self.supabase.auth.get_user(token)
+        except Exception as e:
+            if self._is_rejection(e):
+                raise AuthenticationError(str(e)) from e
+            raise
+
+        if not response or not response.user:
+            raise AuthenticationError("User not found for token")
+
+        self.remote_verifications += 1
+        return response.user
+
+    @staticmethod
+    def _is_rejection(error: Exception) -> bool:
+        """Whether the auth server rejected the token, as opposed to not answering"""
+        if isinstance(error, (AuthInvalidJwtError, AuthSessionMissingError)):
+            return True
+        return isinstance(error, AuthApiError) and error.status < 500
+
+    def _revocation_check_due(self, cached: _CachedToken) -> bool:
+        if self.revocation_check_interval <= 0:
+            return False
+        return time.monotonic() - cached.last_remote_check >= self.revocation_check_interval
+
+    def stats(self) -> Dict:
+        """Return verification counters and cache statistics"""
+        return {
+            'mode': self.mode,
+            'local_verifications': self.local_verifications,
+            'remote_verifications': self.remote_verifications,
+            'cache': self.cache.stats()
+        }
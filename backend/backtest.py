@@ -0,0 +1,408 @@
+"""
+Historical Replay of the Prop Firm Rules
+
+Answers "what would have happened under other limits" before a rule change
+ships. Historical challenges and closed trades are replayed offline, with no
+Supabase access:
+- Settlements are applied per challenge in closed_at order, starting from
+  the challenge's initial capital
+- daily_pnl restarts at every daily reset boundary (midnight UTC by
+  default, like the scheduler's daily reset)
+- After each settlement the rules run through evaluate_rules_batch, the
+  kernel PropFirmChallengeEvaluator uses; the first rule that fires ends
+  the challenge, later trades are ignored
+- A rule set may add a trailing drawdown: failing once the balance falls a
+  given percent of the initial capital below its running peak
+
+The replay is columnar: balances, daily PnL and peaks are grouped cumulative
+sums over the sorted trades, so each rule set costs a few array passes.
+Challenges are split into contiguous chunks of about CHUNK_TRADES trades,
+small enough to stay in cache, which are sorted and replayed in parallel
+worker processes.
+
+History comes from CSV exports of the user_challenges and trades tables
+(column names as in database_dump.sql), e.g.
+
+    \\copy (SELECT id, initial_capital, status FROM user_challenges) TO 'challenges.csv' CSV HEADER
+    \\copy (SELECT challenge_id, pnl, closed_at FROM trades WHERE NOT is_open) TO 'trades.csv' CSV HEADER
+
+or from Parquet files with the same columns (needs the optional pyarrow).
+
+Trades only exist up to where a challenge actually ended, so a challenge
+that ends later under looser limits shows up as still active.
+
+Usage:
+    python backtest.py --challenges challenges.csv --trades trades.csv \\
+        --rule-set current --rule-set strict:daily=4,total=8 --rule-set trailing:trailing=6
+"""
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from rule_engine import (
+    evaluate_rules_batch, STATUS_ACTIVE, STATUS_FAILED, STATUS_NAMES,
+    RULE_NONE, RULE_DAILY_LOSS, RULE_TOTAL_LOSS, RULE_PROFIT_TARGET
+)
+
+# Replay-only rule, checked after the loss limits and before the profit target
+RULE_TRAILING_DRAWDOWN = 4
+RULE_NAMES = {
+    RULE_DAILY_LOSS: 'daily_loss',
+    RULE_TOTAL_LOSS: 'total_loss',
+    RULE_TRAILING_DRAWDOWN: 'trailing_drawdown',
+    RULE_PROFIT_TARGET: 'profit_target',
+}
+
+# Trades per replay chunk: small enough for the chunk's arrays to stay in cache
+CHUNK_TRADES = 65_536
+
+# Below this many trades the process pool costs more than it saves
+PARALLEL_MIN_TRADES = 200_000
+
+
+class RuleSet(NamedTuple):
+    """Limits of one replayed scenario, in percent of the initial capital"""
+    name: str
+    daily_loss_limit: float = 5.0
+    total_loss_limit: float = 10.0
+    profit_target: float = 10.0
+    trailing_drawdown: Optional[float] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> 'RuleSet':
+        """Parse 'name[:daily=4,total=8,profit=10,trailing=6]'; omitted limits keep the defaults"""
+        name, _, options = spec.partition(':')
+        keys = {'daily': 'daily_loss_limit', 'total': 'total_loss_limit',
+                'profit': 'profit_target', 'trailing': 'trailing_drawdown'}
+        values = {}
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            if key.strip() not in keys:
+                raise ValueError(f"Unknown rule '{key}' in rule set '{spec}'")
+            values[keys[key.strip()]] = float(value)
+        return cls(name, **values)
+
+
+class History(NamedTuple):
+    """Columnar challenges and closed trades to replay"""
+    challenge_ids: np.ndarray       # str
+    initial_capital: np.ndarray     # float64
+    recorded_status: np.ndarray     # str, status stored in user_challenges
+    trade_challenge: np.ndarray     # int64 position of each trade's challenge in challenge_ids
+    trade_pnl: np.ndarray           # float64
+    trade_closed_at: np.ndarray     # float64, epoch seconds
+    skipped_trades: int = 0         # open, unsettled or orphaned trades
+
+
+class ChallengeOutcomes(NamedTuple):
+    """Per-challenge replay result of one rule set, aligned with History.challenge_ids"""
+    status: np.ndarray    # int8 status codes
+    rule: np.ndarray      # int8 rule codes, RULE_NONE while active
+    ended_at: np.ndarray  # float64 epoch seconds, nan while active
+    trades: np.ndarray    # int64 trades replayed up to the end
+
+
+def _epoch_seconds(value) -> float:
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _is_true(value) -> bool:
+    return value is True or str(value).lower() in ('t', 'true', '1')
+
+
+def history_from_rows(challenges: Iterable[Dict], trades: Iterable[Dict]) -> History:
+    """
+    Build a History from user_challenges and trades rows
+
+    Trades that are still open, have no pnl or closed_at, or belong to an
+    unknown challenge are skipped.
+    """
+    challenge_rows = list(challenges)
+    challenge_ids = np.array([str(row['id']) for row in challenge_rows])
+    initial_capital = np.array([float(row['initial_capital']) for row in challenge_rows], dtype=np.float64)
+    recorded_status = np.array([str(row.get('status') or '') for row in challenge_rows])
+
+    positions = {challenge_id: position for position, challenge_id in enumerate(challenge_ids.tolist())}
+
+    trade_challenge, pnls, closed_at = [], [], []
+    skipped = 0
+    for trade in trades:
+        position = positions.get(str(trade['challenge_id']))
+        if position is None or _is_true(trade.get('is_open')) or \
+                trade.get('pnl') in (None, '') or trade.get('closed_at') in (None, ''):
+            skipped += 1
+            continue
+        trade_challenge.append(position)
+        pnls.append(float(trade['pnl']))
+        closed_at.append(_epoch_seconds(trade['closed_at']))
+
+    return History(
+        challenge_ids=challenge_ids,
+        initial_capital=initial_capital,
+        recorded_status=recorded_status,
+        trade_challenge=np.array(trade_challenge, dtype=np.int64),
+        trade_pnl=np.array(pnls, dtype=np.float64),
+        trade_closed_at=np.array(closed_at, dtype=np.float64),
+        skipped_trades=skipped
+    )
+
+
+def _read_rows(path: str) -> List[Dict]:
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading Parquet files needs the optional pyarrow package (pip install pyarrow)")
+        table = pq.read_table(path)
+        # Timestamps come back as datetimes; keep the columns the replay uses
+        return table.to_pylist()
+
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load_history(challenges_path: str, trades_path: str) -> History:
+    """Load a History from CSV or Parquet exports of user_challenges and trades"""
+    return history_from_rows(_read_rows(challenges_path), _read_rows(trades_path))
+
+
+def _grouped_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Cumulative sum restarting at every index where starts is True"""
+    totals = np.cumsum(values)
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(values)), 0))
+    return totals - totals[first] + values[first]
+
+
+def _replay_chunk(initial_capital: np.ndarray, trade_challenge: np.ndarray, pnl: np.ndarray,
+                  closed_at: np.ndarray, rule_sets: List[RuleSet], reset_hour: int) -> List[ChallengeOutcomes]:
+    """
+    Replay one contiguous chunk of challenges
+
+    trade_challenge holds challenge positions within the chunk.
+    """
+    # Group trades by challenge, each group in closed_at order
+    order = np.lexsort((closed_at, trade_challenge))
+    trade_challenge, pnl, closed_at = trade_challenge[order], pnl[order], closed_at[order]
+
+    count = len(initial_capital)
+    trade_count = len(pnl)
+    new_challenge = np.ones(trade_count, dtype=bool)
+    new_challenge[1:] = trade_challenge[1:] != trade_challenge[:-1]
+
+    day = np.floor((closed_at - reset_hour * 3600) / 86400)
+    new_day = new_challenge.copy()
+    new_day[1:] |= day[1:] != day[:-1]
+
+    trade_initial = initial_capital[trade_challenge]
+    balance = trade_initial + _grouped_cumsum(pnl, new_challenge)
+    daily_pnl = _grouped_cumsum(pnl, new_day)
+
+    peak = None
+    if any(rule_set.trailing_drawdown is not None for rule_set in rule_sets):
+        peak = np.empty(trade_count)
+        bounds = np.append(np.flatnonzero(new_challenge), trade_count)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            np.maximum.accumulate(balance[start:end], out=peak[start:end])
+        np.maximum(peak, trade_initial, out=peak)
+
+    position = np.arange(trade_count)
+    first_trade = np.maximum.accumulate(np.where(new_challenge, position, 0))
+
+    outcomes = []
+    for rule_set in rule_sets:
+        result = evaluate_rules_batch(
+            trade_initial, balance, daily_pnl,
+            rule_set.daily_loss_limit, rule_set.total_loss_limit, rule_set.profit_target
+        )
+        rule = result.rule
+        status = result.status
+        if peak is not None and rule_set.trailing_drawdown is not None:
+            drawdown = (peak - balance) / trade_initial * 100
+            trailing_hit = (drawdown >= rule_set.trailing_drawdown) & \
+                ((rule == RULE_NONE) | (rule == RULE_PROFIT_TARGET))
+            rule = np.where(trailing_hit, RULE_TRAILING_DRAWDOWN, rule).astype(np.int8)
+            status = np.where(trailing_hit, STATUS_FAILED, status).astype(np.int8)
+
+        # Trades are sorted by challenge, so the first decided trade of each challenge ends it
+        decided = np.flatnonzero(rule != RULE_NONE)
+        ended, first = np.unique(trade_challenge[decided], return_index=True)
+        end_trade = decided[first]
+
+        outcome = ChallengeOutcomes(
+            status=np.full(count, STATUS_ACTIVE, dtype=np.int8),
+            rule=np.full(count, RULE_NONE, dtype=np.int8),
+            ended_at=np.full(count, np.nan),
+            trades=np.bincount(trade_challenge, minlength=count).astype(np.int64)
+        )
+        outcome.status[ended] = status[end_trade]
+        outcome.rule[ended] = rule[end_trade]
+        outcome.ended_at[ended] = closed_at[end_trade]
+        outcome.trades[ended] = end_trade - first_trade[end_trade] + 1
+        outcomes.append(outcome)
+
+    return outcomes
+
+
+class ReplayResult:
+    """Outcomes of every rule set for the replayed challenges"""
+
+    def __init__(self, history: History, rule_sets: List[RuleSet],
+                 outcomes: Dict[str, ChallengeOutcomes], elapsed: float):
+        self.history = history
+        self.rule_sets = rule_sets
+        self.outcomes = outcomes
+        self.elapsed = elapsed
+
+    def changed(self, name: str, baseline: str = None) -> np.ndarray:
+        """Challenge ids whose final status differs between a rule set and the baseline (first) rule set"""
+        baseline = baseline or self.rule_sets[0].name
+        differs = self.outcomes[name].status != self.outcomes[baseline].status
+        return self.history.challenge_ids[differs]
+
+    def report(self) -> Dict:
+        """Outcome and triggered-rule counts per rule set, with changes against the baseline"""
+        baseline = self.outcomes[self.rule_sets[0].name]
+        rule_sets = {}
+        for rule_set in self.rule_sets:
+            outcome = self.outcomes[rule_set.name]
+            status_counts = np.bincount(outcome.status, minlength=len(STATUS_NAMES))
+            rule_counts = np.bincount(outcome.rule, minlength=RULE_TRAILING_DRAWDOWN + 1)
+
+            changed = outcome.status != baseline.status
+            transitions = {}
+            for before, after in zip(baseline.status[changed], outcome.status[changed]):
+                key = f"{STATUS_NAMES[before]}->{STATUS_NAMES[after]}"
+                transitions[key] = transitions.get(key, 0) + 1
+
+            rule_sets[rule_set.name] = {
+                'limits': rule_set._asdict(),
+                'outcomes': {name: int(status_counts[code]) for code, name in enumerate(STATUS_NAMES)},
+                'rules': {name: int(rule_counts[code]) for code, name in RULE_NAMES.items()},
+                'changed_vs_baseline': int(np.count_nonzero(changed)),
+                'transitions': transitions
+            }
+
+        return {
+            'challenges': len(self.history.challenge_ids),
+            'trades': len(self.history.trade_pnl),
+            'skipped_trades': self.history.skipped_trades,
+            'baseline': self.rule_sets[0].name,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rule_sets': rule_sets
+        }
+
+
+def replay(history: History, rule_sets: List[RuleSet], workers: int = None,
+           reset_hour: int = 0) -> ReplayResult:
+    """
+    Replay the history under each rule set
+
+    Args:
+        history: Challenges and closed trades
+        rule_sets: Scenarios to compare; the first one is the baseline
+        workers: Worker processes (default: CPU count); 1 replays in-process
+        reset_hour: UTC hour of the daily reset of daily_pnl
+
+    Returns:
+        ReplayResult with per-challenge outcomes per rule set
+    """
+    if not rule_sets:
+        raise ValueError("At least one rule set is required")
+    if len({rule_set.name for rule_set in rule_sets}) != len(rule_sets):
+        raise ValueError("Rule set names must be unique")
+
+    start_time = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    # Chunks of whole challenges with about CHUNK_TRADES trades each
+    initial_capital = history.initial_capital
+    count = len(initial_capital)
+    trades_before = np.concatenate(([0], np.cumsum(np.bincount(history.trade_challenge, minlength=count))))
+    targets = np.arange(CHUNK_TRADES, len(history.trade_pnl), CHUNK_TRADES)
+    challenge_bounds = np.unique(np.concatenate(([0], np.searchsorted(trades_before, targets), [count])))
+    trade_bounds = trades_before[challenge_bounds]
+
+    # Bucket trades by chunk; a stable sort of small integer keys is a linear radix sort.
+    # Each chunk orders its own trades by challenge and closed_at.
+    chunk = np.searchsorted(challenge_bounds[1:-1], history.trade_challenge, side='right')
+    chunk_order = np.argsort(chunk.astype(np.uint16 if len(challenge_bounds) <= 65536 else np.int64), kind='stable')
+    trade_challenge = history.trade_challenge[chunk_order]
+    pnl = history.trade_pnl[chunk_order]
+    closed_at = history.trade_closed_at[chunk_order]
+
+    jobs = [
+        (initial_capital[lo:hi], trade_challenge[tlo:thi] - lo, pnl[tlo:thi], closed_at[tlo:thi], rule_sets, reset_hour)
+        for lo, hi, tlo, thi in zip(challenge_bounds[:-1], challenge_bounds[1:], trade_bounds[:-1], trade_bounds[1:])
+    ]
+    if workers == 1 or len(pnl) < PARALLEL_MIN_TRADES:
+        chunk_results = [_replay_chunk(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(_replay_chunk, *zip(*jobs),
+                                              chunksize=max(1, len(jobs) // (workers * 4))))
+
+    outcomes = {}
+    for index, rule_set in enumerate(rule_sets):
+        parts = [chunk[index] for chunk in chunk_results]
+        if not parts:
+            # No challenges: no chunks to concatenate
+            outcomes[rule_set.name] = ChallengeOutcomes(
+                np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int8),
+                np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+            )
+            continue
+        outcomes[rule_set.name] = ChallengeOutcomes(
+            *(np.concatenate([getattr(part, field) for part in parts])
+              for field in ChallengeOutcomes._fields)
+        )
+
+    return ReplayResult(history, rule_sets, outcomes, time.perf_counter() - start_time)
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"{report['challenges']:,} challenges, {report['trades']:,} trades replayed "
+        f"({report['skipped_trades']:,} skipped) in {report['elapsed_seconds']:.2f}s",
+        f"Baseline: {report['baseline']}",
+    ]
+    for name, summary in report['rule_sets'].items():
+        outcomes = ", ".join(f"{status}={count:,}" for status, count in summary['outcomes'].items())
+        rules = ", ".join(f"{rule}={count:,}" for rule, count in summary['rules'].items() if count)
+        lines.append(f"{name}: {outcomes}" + (f" [{rules}]" if rules else ""))
+        if summary['changed_vs_baseline']:
+            transitions = ", ".join(f"{key}: {count:,}" for key, count in sorted(summary['transitions'].items()))
+            lines.append(f"  changed vs baseline: {summary['changed_vs_baseline']:,} ({transitions})")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay historical trades under alternative Prop Firm rules')
+    parser.add_argument('--challenges', required=True, help='user_challenges export (.csv or .parquet)')
+    parser.add_argument('--trades', required=True, help='trades export (.csv or .parquet)')
+    parser.add_argument('--rule-set', action='append', default=[],
+                        help="name[:daily=5,total=10,profit=10,trailing=6]; the first is the baseline")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--reset-hour', type=int, default=0)
+    args = parser.parse_args()
+
+    rule_sets = [RuleSet.parse(spec) for spec in args.rule_set] or [RuleSet('current')]
+    history = load_history(args.challenges, args.trades)
+    result = replay(history, rule_sets, workers=args.workers, reset_hour=args.reset_hour)
+    print(format_report(result.report()))
+
+
+if __name__ == '__main__':
+    main()
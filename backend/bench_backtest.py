@@ -0,0 +1,74 @@
+"""
+Benchmark for the historical replay of the Prop Firm rules
+
+Replays synthetic history (by default 2M closed trades over 100k challenges
+and 30 days) under three rule sets, once in-process and once on the worker
+process pool, and checks that both give the same outcomes.
+
+Usage:
+    python bench_backtest.py [--challenges 100000] [--trades 2000000] [--workers N]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from backtest import History, RuleSet, format_report, replay
+
+RULE_SETS = [
+    RuleSet('current'),
+    RuleSet('strict', daily_loss_limit=4.0, total_loss_limit=8.0),
+    RuleSet('trailing', trailing_drawdown=6.0),
+]
+
+
+def make_history(challenges, trades, seed=11):
+    rng = np.random.default_rng(seed)
+    challenge_ids = np.array([f"{i:08x}-0000-4000-8000-000000000000" for i in range(challenges)])
+    initial = rng.choice([5000.0, 15000.0, 30000.0], size=challenges)
+    owner = rng.integers(challenges, size=trades)
+    return History(
+        challenge_ids=challenge_ids,
+        initial_capital=initial,
+        recorded_status=np.full(challenges, 'active'),
+        trade_challenge=owner,
+        trade_pnl=initial[owner] * rng.normal(0.0004, 0.01, size=trades),
+        trade_closed_at=1.77e9 + rng.uniform(0, 30 * 86400, size=trades)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the historical replay')
+    parser.add_argument('--challenges', type=int, default=100_000)
+    parser.add_argument('--trades', type=int, default=2_000_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print("Historical Replay Benchmark")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    history = make_history(args.challenges, args.trades)
+    print(f"Generated {args.trades:,} trades over {args.challenges:,} challenges "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    single = replay(history, RULE_SETS, workers=1)
+    print(f"1 process:   {single.elapsed:.2f}s ({args.trades / single.elapsed / 1e6:.1f}M trades/s)")
+
+    parallel = replay(history, RULE_SETS, workers=args.workers)
+    print(f"{args.workers} processes: {parallel.elapsed:.2f}s "
+          f"({args.trades / parallel.elapsed / 1e6:.1f}M trades/s)")
+
+    agree = all(np.array_equal(single.outcomes[r.name].status, parallel.outcomes[r.name].status)
+                for r in RULE_SETS)
+    print(f"In-process and parallel outcomes agree: {agree}")
+
+    print("-" * 50)
+    print(format_report(parallel.report()))
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark for the mark-to-market engine
+
+Loads synthetic open positions on one symbol, spread over many challenges,
+and times on_price: re-marking every position, summing unrealized PnL per
+challenge and checking the equity loss rules. Prices stay within the loss
+limits so every tick evaluates all touched challenges.
+
+Usage:
+    python bench_mark_to_market.py [--positions 100000] [--challenges 20000] [--ticks 200]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from mark_to_market import MarkToMarketEngine
+from prop_firm_service import PropFirmChallengeEvaluator
+
+
+def build_engine(positions, challenges, seed=7):
+    rng = np.random.default_rng(seed)
+    engine = MarkToMarketEngine(PropFirmChallengeEvaluator(supabase_client=None))
+
+    for c in range(challenges):
+        engine.add_challenge({'id': f'c{c}', 'initial_capital': 5000.0,
+                              'current_balance': 5000.0, 'daily_pnl': 0.0})
+
+    owners = rng.integers(0, challenges, size=positions)
+    sides = rng.choice(['buy', 'sell'], size=positions)
+    entries = rng.uniform(110.0, 118.0, size=positions)
+    for t in range(positions):
+        engine.add_position({'id': f't{t}', 'challenge_id': f'c{owners[t]}', 'asset_symbol': 'IAM',
+                             'trade_type': sides[t], 'amount': 10.0,
+                             'entry_price': float(entries[t]), 'leverage': 1})
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mark-to-market engine')
+    parser.add_argument('--positions', type=int, default=100_000)
+    parser.add_argument('--challenges', type=int, default=20_000)
+    parser.add_argument('--ticks', type=int, default=200)
+    args = parser.parse_args()
+
+    print("Mark-to-Market Engine Benchmark")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    engine = build_engine(args.positions, args.challenges)
+    print(f"Loaded {args.positions:,} positions over {args.challenges:,} challenges "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(1)
+    prices = 114.0 + rng.uniform(-2.0, 2.0, size=args.ticks)
+    timings = []
+    failed = 0
+    for price in prices:
+        start = time.perf_counter()
+        failed += len(engine.on_price('IAM', float(price)))
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    print(f"Ticks:      {args.ticks}")
+    print(f"p50:        {np.percentile(timings, 50):.2f} ms")
+    print(f"p99:        {np.percentile(timings, 99):.2f} ms")
+    print(f"max:        {timings.max():.2f} ms")
+    print(f"Throughput: {args.positions / (np.median(timings) / 1000):,.0f} positions/s")
+    print(f"Failures:   {failed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for the columnar challenge records
+
+Builds N synthetic PostgREST rows of user_challenges (the sweep columns),
+then measures the memory held by each representation with tracemalloc and
+the time to decode the JSON payload into it:
+- list of row dicts (what the PostgREST client returns)
+- ChallengeBatch (struct-of-arrays)
+
+Usage:
+    python bench_records.py [--rows 100000]
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+
+from records import ChallengeBatch
+
+
+def challenge_json(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    initial = rng.choice([5000.0, 15000.0, 30000.0], size=rows)
+    balance = np.round(initial * rng.uniform(0.9, 1.1, size=rows), 2)
+    daily = np.round(initial * rng.uniform(-0.05, 0.05, size=rows), 2)
+    return json.dumps([
+        {'id': str(uuid.UUID(int=int(rng.integers(1 << 62)) << 64 | i)), 'user_id': str(uuid.uuid4()),
+         'status': 'active', 'initial_capital': i_, 'current_balance': b, 'daily_pnl': d,
+         'total_pnl': round(b - i_, 2)}
+        for i, (i_, b, d) in enumerate(zip(initial.tolist(), balance.tolist(), daily.tolist()))
+    ])
+
+
+def measure(build):
+    """(bytes still allocated by the result, seconds to build it)"""
+    gc.collect()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    del result
+
+    # Separate run: tracemalloc slows allocation down several times
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def report(label, rows, size, elapsed, baseline=None):
+    saving = f"  ({1 - size / baseline:.0%} less)" if baseline else ''
+    print(f"  {label:<22} {size / 1e6:7.1f} MB  {size / rows:6.0f} B/row  "
+          f"parse {elapsed * 1000:7.1f} ms{saving}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the challenge and trade record types')
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+    rows = args.rows
+
+    print("Challenge Records Benchmark")
+    print("=" * 70)
+
+    # Every representation is built from the JSON payload, so the strings it
+    # keeps (ids, statuses) are counted and the dropped row dicts are not
+    payload = challenge_json(rows)
+    print(f"user_challenges, {rows:,} rows of the sweep columns")
+    dict_size, elapsed = measure(lambda: json.loads(payload))
+    report('row dicts', rows, dict_size, elapsed)
+    size, elapsed = measure(lambda: ChallengeBatch.from_rows(json.loads(payload)))
+    report('ChallengeBatch', rows, size, elapsed, dict_size)
+
+    print("Parse times include json.loads of the PostgREST payload.")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for the vectorized Prop Firm rule engine
+
+Evaluates 1M synthetic challenges with evaluate_rules_batch and compares
+the throughput with the scalar path (evaluate_rules, one call per row) on a
+sample of the same data.
+
+Usage:
+    python bench_rule_engine.py [--rows 1000000] [--scalar-sample 20000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from rule_engine import evaluate_rules, evaluate_rules_batch, STATUS_NAMES
+
+DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET = 5.0, 10.0, 10.0
+
+
+def make_batch(rows, seed=7):
+    """Generate realistic challenge columns"""
+    rng = np.random.default_rng(seed)
+    initial = rng.choice([5000.0, 15000.0, 30000.0], size=rows)
+    balance = initial * rng.uniform(0.85, 1.15, size=rows)
+    daily = initial * rng.uniform(-0.07, 0.07, size=rows)
+    return initial, balance, daily
+
+
+def bench_batch(initial, balance, daily, repeats=5):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = evaluate_rules_batch(initial, balance, daily, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench_scalar(initial, balance, daily):
+    start = time.perf_counter()
+    statuses = [
+        evaluate_rules(i, b, d, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET).status
+        for i, b, d in zip(initial.tolist(), balance.tolist(), daily.tolist())
+    ]
+    return time.perf_counter() - start, np.array(statuses, dtype=np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Prop Firm rule engine')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--scalar-sample', type=int, default=20_000)
+    args = parser.parse_args()
+
+    print("Prop Firm Rule Engine Benchmark")
+    print("=" * 50)
+
+    initial, balance, daily = make_batch(args.rows)
+
+    batch_time, result = bench_batch(initial, balance, daily)
+    print(f"Vectorized: {args.rows:,} rows in {batch_time * 1000:.1f} ms "
+          f"({args.rows / batch_time / 1e6:.1f}M rows/s)")
+
+    sample = min(args.scalar_sample, args.rows)
+    scalar_time, scalar_status = bench_scalar(initial[:sample], balance[:sample], daily[:sample])
+    per_row = scalar_time / sample
+    print(f"Scalar:     {sample:,} rows in {scalar_time * 1000:.1f} ms "
+          f"({per_row * 1e6:.2f} us/row, ~{per_row * args.rows:.1f} s extrapolated to {args.rows:,})")
+    print(f"Speedup:    {per_row * args.rows / batch_time:,.0f}x")
+
+    agree = np.array_equal(scalar_status, result.status[:sample])
+    print(f"Scalar and vectorized results agree on sample: {agree}")
+
+    counts = np.bincount(result.status, minlength=len(STATUS_NAMES))
+    print("Outcomes: " + ", ".join(f"{name}={count:,}" for name, count in zip(STATUS_NAMES, counts)))
+
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
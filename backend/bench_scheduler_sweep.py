@@ -0,0 +1,148 @@
+"""
+Benchmark for the scheduler's bulk sweep on the evaluation worker pool
+
+Runs evaluate_active_challenges_bulk against an in-process stand-in for the
+PostgREST endpoints it uses (keyset-paged reads of user_challenges and the
+apply_challenge_transitions RPC), each request sleeping for the injected
+latency. The sweep is repeated with an increasing number of evaluation
+workers; with the latency dominating, wall-clock time should drop close to
+linearly until the rate limit (or, in production, the database) caps it.
+
+Usage:
+    python bench_scheduler_sweep.py [--challenges 20000] [--chunk-size 500] [--latency-ms 20]
+                                    [--workers 1 2 4 8 16] [--rate-limit 0]
+"""
+
+import argparse
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import prop_firm_service
+from scheduler import PropFirmBackgroundScheduler
+
+
+class StubQuery:
+    """Keyset page of the id-sorted rows; only the filters the sweep uses"""
+
+    def __init__(self, db):
+        self.db = db
+        self.lower = 0
+        self.upper = len(db.ids)
+        self.limit_count = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        # Every stub row is active
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def gt(self, column, value):
+        self.lower = max(self.lower, bisect.bisect_right(self.db.ids, value))
+        return self
+
+    def gte(self, column, value):
+        self.lower = max(self.lower, bisect.bisect_left(self.db.ids, value))
+        return self
+
+    def lt(self, column, value):
+        self.upper = min(self.upper, bisect.bisect_left(self.db.ids, value))
+        return self
+
+    def execute(self):
+        time.sleep(self.db.latency)
+        end = min(self.upper, self.lower + self.limit_count)
+        return SimpleNamespace(data=[dict(row) for row in self.db.rows[self.lower:end]])
+
+
+class StubSupabase:
+    """Rows sorted by id, like the primary key index; every request costs `latency` seconds"""
+
+    def __init__(self, rows, latency):
+        self.rows = sorted(rows, key=lambda row: row['id'])
+        self.ids = [row['id'] for row in self.rows]
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        with self._lock:
+            self.requests += 1
+        return StubQuery(self)
+
+    def rpc(self, name, params):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        ids = [{'id': transition['id']} for transition in params['transitions']]
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=ids))
+
+
+def build_rows(count, seed=5):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        # Mostly active challenges, a few past a limit so every page writes transitions
+        balance = 5000.0 * (1 + rng.uniform(-0.09, 0.09) if rng.random() > 0.02 else 0.8)
+        rows.append({'id': str(uuid.UUID(int=rng.getrandbits(128))), 'user_id': 'bench', 'status': 'active',
+                     'initial_capital': 5000.0, 'current_balance': balance, 'daily_pnl': 0.0,
+                     'total_pnl': balance - 5000.0})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scheduler bulk sweep')
+    parser.add_argument('--challenges', type=int, default=20_000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    args = parser.parse_args()
+
+    # Per-transition log lines would dominate the timings
+    logging.disable(logging.INFO)
+
+    print("Scheduler Sweep Benchmark")
+    print("=" * 50)
+    print(f"{args.challenges:,} active challenges, pages of {args.chunk_size}, "
+          f"{args.latency_ms:.0f} ms per request, rate limit {args.rate_limit or 'off'}")
+
+    rows = build_rows(args.challenges)
+    os.environ['SCHEDULER_SWEEP_CHUNK_SIZE'] = str(args.chunk_size)
+    os.environ['SCHEDULER_SUPABASE_RATE_LIMIT'] = str(args.rate_limit)
+    os.environ['SCHEDULER_COORDINATION'] = 'none'
+
+    baseline = None
+    for workers in args.workers:
+        os.environ['SCHEDULER_EVALUATION_WORKERS'] = str(workers)
+        # A fresh evaluator per run, bound to the stub
+        prop_firm_service.prop_firm_evaluator = None
+        db = StubSupabase([dict(row) for row in rows], args.latency_ms / 1000)
+        scheduler = PropFirmBackgroundScheduler(db)
+
+        start = time.perf_counter()
+        results = scheduler.evaluate_active_challenges_bulk()
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+
+        print(f"workers={workers:<3} {elapsed:7.2f}s  speedup {baseline / elapsed:5.2f}x  "
+              f"requests {db.requests:<5} evaluated {results['total_evaluated']:,}  "
+              f"failures {results['failures']}")
+        scheduler.evaluation_pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
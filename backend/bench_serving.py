@@ -0,0 +1,188 @@
+"""
+Throughput comparison: sync Flask workers vs the ASGI serving mode
+
+Starts a stub Supabase server (PostgREST RPC endpoint with injected
+latency, in its own process), then runs the same /evaluate-trade load against:
+- app.py under gunicorn with N sync workers
+- asgi_app.py under hypercorn with one worker
+
+Tokens are verified locally (AUTH_VERIFY_MODE=local), so the measured
+difference comes from how each server waits on Supabase I/O.
+
+Usage:
+    python bench_serving.py [--latency-ms 50] [--concurrency 200] [--duration 10] [--sync-workers 4]
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+JWT_SECRET = "bench-serving-secret-with-enough-length-for-hs256"
+STUB_PORT = 54321
+SYNC_PORT = 5001
+ASYNC_PORT = 5002
+
+
+def make_stub_app(latency):
+    """Minimal stand-in for the PostgREST endpoints /evaluate-trade uses"""
+    async def settle_trade(request):
+        params = await request.json()
+        await asyncio.sleep(latency)
+        return web.json_response({
+            'success': True,
+            'trade': {'id': params['p_trade_id'], 'pnl': 12.5, 'exit_price': params['p_exit_price']},
+            'challenge': {'id': 'bench-challenge', 'new_balance': 5012.5, 'total_pnl': 12.5, 'status': 'active'}
+        })
+
+    app = web.Application()
+    app.router.add_post('/rest/v1/rpc/settle_trade', settle_trade)
+    return app
+
+
+def start_server(command, env):
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait()
+
+
+def run_stub(port, latency):
+    web.run_app(make_stub_app(latency), host='127.0.0.1', port=port, print=None)
+
+
+async def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/"):
+                    return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+async def run_load(port, concurrency, duration, token):
+    """Closed-loop load: `concurrency` clients issuing requests back to back"""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def client(n):
+            nonlocal errors
+            i = 0
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    async with session.post(
+                        f"http://127.0.0.1:{port}/evaluate-trade",
+                        json={'trade_id': f'trade-{n}-{i}', 'exit_price': 101.0},
+                        headers={'Authorization': f'Bearer {token}'}
+                    ) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+                i += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': count / elapsed,
+        'p50_ms': latencies[count // 2] * 1000 if count else 0,
+        'p99_ms': latencies[int(count * 0.99)] * 1000 if count else 0
+    }
+
+
+async def main_async(args):
+    # The stub runs in its own process so it does not compete with the load generator
+    stub = start_server([sys.executable, __file__, '--stub', '--latency-ms', str(args.latency_ms)], os.environ)
+    await wait_until_ready(STUB_PORT)
+
+    token = jwt.encode(
+        {'sub': 'bench-user', 'aud': 'authenticated', 'exp': int(time.time()) + 3600},
+        JWT_SECRET,
+        algorithm='HS256'
+    )
+
+    env = dict(
+        os.environ,
+        SUPABASE_URL=f"http://127.0.0.1:{STUB_PORT}",
+        SUPABASE_SERVICE_ROLE_KEY="bench-service-role-key",
+        AUTH_VERIFY_MODE="local",
+        SUPABASE_JWT_SECRET=JWT_SECRET
+    )
+
+    servers = {
+        f"sync  (gunicorn, {args.sync_workers} workers)": (
+            [sys.executable, '-m', 'gunicorn', '-w', str(args.sync_workers),
+             '-b', f'127.0.0.1:{SYNC_PORT}', 'app:app'],
+            SYNC_PORT
+        ),
+        "async (hypercorn, 1 worker)": (
+            [sys.executable, '-m', 'hypercorn', '-w', '1', '-b', f'127.0.0.1:{ASYNC_PORT}', 'asgi_app:app'],
+            ASYNC_PORT
+        ),
+    }
+
+    print("Serving Mode Throughput Comparison")
+    print("=" * 70)
+    print(f"Supabase latency: {args.latency_ms} ms, concurrency: {args.concurrency}, duration: {args.duration}s")
+    print("-" * 70)
+
+    try:
+        for name, (command, port) in servers.items():
+            process = start_server(command, env)
+            try:
+                await wait_until_ready(port)
+                stats = await run_load(port, args.concurrency, args.duration, token)
+                print(f"{name:<32} {stats['throughput']:>8.0f} req/s   "
+                      f"p50 {stats['p50_ms']:>7.1f} ms   p99 {stats['p99_ms']:>7.1f} ms   "
+                      f"errors {stats['errors']}")
+            finally:
+                stop_server(process)
+    finally:
+        stop_server(stub)
+
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync and async serving throughput')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--sync-workers', type=int, default=4)
+    parser.add_argument('--stub', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub:
+        run_stub(STUB_PORT, args.latency_ms / 1000)
+    else:
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
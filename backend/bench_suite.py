@@ -0,0 +1,302 @@
+"""
+Benchmark Suite for the Service Hot Paths
+
+Runs the hot paths against the in-memory Supabase stand-in
+(fake_supabase.py), with optional injected latency per round trip:
+- evaluate_trade: POST /evaluate-trade end to end through the Flask app
+  (local JWT verification; settle_trade is not registered, so this is the
+  table fallback, one failed RPC plus the read/update chain)
+- evaluate_challenge_rules: one challenge, uncached
+- get_challenge_summary: at 10, 1k and 10k closed trades
+- scheduler_sweep: the bulk sweep at 1k and 100k active challenges, with
+  an in-memory apply_challenge_transitions
+
+Each benchmark reports latency percentiles and Supabase round trips per
+operation. Results are written as JSON (--output); --compare prints the
+change against an earlier results file, so regressions between versions
+show up as a diff.
+
+Usage:
+    python bench_suite.py [--latency-ms 0] [--iterations 200] [--quick]
+                          [--only evaluate_trade] [--output bench_results.json]
+                          [--compare previous.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import jwt
+import numpy as np
+
+from fake_supabase import FakeSupabase
+
+JWT_SECRET = "bench-suite-secret-with-enough-length-for-hs256"
+BENCH_USER = str(uuid.UUID(int=1))
+PERCENTILES = (50, 90, 95, 99)
+
+
+def challenge_row(user_id: str = BENCH_USER, balance: float = 5000.0) -> Dict:
+    return {
+        'id': str(uuid.uuid4()), 'user_id': user_id, 'plan_name': 'Starter', 'status': 'active',
+        'initial_capital': 5000.0, 'current_balance': balance, 'profit_target_percent': 10.0,
+        'max_daily_loss_percent': 5.0, 'max_total_loss_percent': 10.0,
+        'daily_pnl': balance - 5000.0, 'total_pnl': balance - 5000.0,
+        'started_at': '2026-01-05T09:00:00', 'ended_at': None
+    }
+
+
+def trade_row(challenge: Dict, is_open: bool, rng: np.random.Generator) -> Dict:
+    entry = float(rng.uniform(50, 150))
+    pnl = None if is_open else float(rng.normal(0, 20))
+    return {
+        'id': str(uuid.uuid4()), 'user_id': challenge['user_id'], 'challenge_id': challenge['id'],
+        'asset_symbol': 'IAM', 'trade_type': 'buy' if rng.random() < 0.5 else 'sell', 'amount': 1000.0,
+        'entry_price': entry, 'exit_price': None if is_open else entry, 'leverage': 1, 'pnl': pnl,
+        'is_open': is_open, 'opened_at': '2026-01-05T10:00:00', 'closed_at': None if is_open else '2026-01-05T11:00:00'
+    }
+
+
+def apply_challenge_transitions(db: FakeSupabase, params: Dict) -> List[Dict]:
+    """In-memory apply_challenge_transitions: update the rows still active, return their ids"""
+    table = db.tables['user_challenges']
+    updated = []
+    for transition in params['transitions']:
+        row = table.rows.get(transition['id'])
+        if row is not None and row['status'] == 'active':
+            table.update(row, {k: v for k, v in transition.items() if k != 'id'})
+            updated.append({'id': row['id']})
+    return updated
+
+
+def measure(name: str, params: Dict, db: FakeSupabase, func: Callable[[int], object], iterations: int,
+            setup: Optional[Callable[[int], None]] = None) -> Dict:
+    """Time func(i) per iteration; setup(i) runs untimed and must not issue queries"""
+    latencies = []
+    db.reset_stats()
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    round_trips = db.reset_stats()
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        'name': name,
+        'params': params,
+        'iterations': iterations,
+        'latency_ms': {
+            'mean': round(float(latencies_ms.mean()), 4),
+            'min': round(float(latencies_ms.min()), 4),
+            'max': round(float(latencies_ms.max()), 4),
+            **{f"p{p}": round(float(np.percentile(latencies_ms, p)), 4) for p in PERCENTILES}
+        },
+        'round_trips_per_op': round(sum(round_trips.values()) / iterations, 2),
+        'round_trips': {key: round(count / iterations, 2) for key, count in sorted(round_trips.items())}
+    }
+    return result
+
+
+def benchmark_key(result: Dict) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]" if params else result['name']
+
+
+def fresh_evaluator(db: FakeSupabase):
+    import prop_firm_service
+    prop_firm_service.prop_firm_evaluator = None
+    return prop_firm_service.get_prop_firm_evaluator(db)
+
+
+def load_app(db: FakeSupabase):
+    """Import app.py bound to the stand-in, with local token verification"""
+    os.environ.update({
+        'SUPABASE_URL': 'http://fake-supabase.invalid',
+        'SUPABASE_SERVICE_ROLE_KEY': 'bench-suite',
+        'AUTH_VERIFY_MODE': 'local',
+        'SUPABASE_JWT_SECRET': JWT_SECRET,
+        'AUTH_REVOCATION_CHECK_INTERVAL': '86400',
+    })
+    import supabase_client
+    supabase_client._client = db
+    fresh_evaluator(db)
+
+    import app
+    return app.app
+
+
+def bench_evaluate_trade(db: FakeSupabase, iterations: int, rng) -> List[Dict]:
+    challenges = [challenge_row() for _ in range(10)]
+    trades = [trade_row(challenges[i % len(challenges)], True, rng) for i in range(iterations)]
+    db.load('user_challenges', challenges)
+    db.load('trades', trades)
+
+    client = load_app(db).test_client()
+    token = jwt.encode({'sub': BENCH_USER, 'aud': 'authenticated', 'exp': int(time.time()) + 3600},
+                       JWT_SECRET, algorithm='HS256')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def run(i):
+        response = client.post('/evaluate-trade', headers=headers,
+                               json={'trade_id': trades[i]['id'], 'exit_price': trades[i]['entry_price'] * 1.001})
+        if response.status_code != 200:
+            raise RuntimeError(f"/evaluate-trade returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    # The route prints every request; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post('/evaluate-trade', headers=headers, json={})  # warm up auth and routing
+        return [measure('evaluate_trade', {}, db, run, iterations)]
+
+
+def bench_evaluate_challenge_rules(db: FakeSupabase, iterations: int, rng) -> List[Dict]:
+    challenges = [challenge_row(balance=float(rng.uniform(4800, 5200))) for _ in range(100)]
+    db.load('user_challenges', challenges)
+    evaluator = fresh_evaluator(db)
+
+    def setup(i):
+        evaluator.invalidate_challenge(challenges[i % len(challenges)]['id'])
+
+    return [measure('evaluate_challenge_rules', {}, db,
+                    lambda i: evaluator.evaluate_challenge_rules(challenges[i % len(challenges)]['id']),
+                    iterations, setup)]
+
+
+def bench_challenge_summary(db: FakeSupabase, iterations: int, rng, sizes=(10, 1_000, 10_000)) -> List[Dict]:
+    results = []
+    for size in sizes:
+        challenge = challenge_row()
+        db.load('user_challenges', [challenge])
+        db.load('trades', (trade_row(challenge, False, rng) for _ in range(size)))
+        evaluator = fresh_evaluator(db)
+
+        results.append(measure('get_challenge_summary', {'trades': size}, db,
+                               lambda i: evaluator.get_challenge_summary(challenge['id']),
+                               max(5, iterations * 10 // size) if size > 100 else iterations,
+                               lambda i: evaluator.invalidate_challenge(challenge['id'])))
+    return results
+
+
+def bench_scheduler_sweep(db: FakeSupabase, iterations: int, rng, sizes=(1_000, 100_000)) -> List[Dict]:
+    os.environ.update({'SCHEDULER_COORDINATION': 'none', 'SCHEDULER_SUPABASE_RATE_LIMIT': '0'})
+    from scheduler import PropFirmBackgroundScheduler
+
+    results = []
+    for size in sizes:
+        # About 2% of the challenges breach a limit, so every sweep also writes transitions
+        rows = [challenge_row(user_id=str(uuid.uuid4()),
+                              balance=5000.0 * (0.85 if rng.random() < 0.02 else float(rng.uniform(0.95, 1.05))))
+                for _ in range(size)]
+        fresh_evaluator(db)
+        scheduler = PropFirmBackgroundScheduler(db)
+
+        def setup(i):
+            db.tables.pop('user_challenges', None)
+            db.load('user_challenges', rows)
+
+        results.append(measure('scheduler_sweep', {'challenges': size}, db,
+                               lambda i: scheduler.evaluate_active_challenges_bulk(),
+                               max(3, iterations // 40) if size <= 10_000 else 3, setup))
+        scheduler.evaluation_pool.shutdown()
+    return results
+
+
+BENCHMARKS = {
+    'evaluate_trade': bench_evaluate_trade,
+    'evaluate_challenge_rules': bench_evaluate_challenge_rules,
+    'get_challenge_summary': bench_challenge_summary,
+    'scheduler_sweep': bench_scheduler_sweep,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline_path: str) -> None:
+    """Print the p50/p99 and round trip changes against an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = {benchmark_key(r): r for r in json.load(f)['benchmarks']}
+
+    print("-" * 50)
+    print(f"Compared with {baseline_path} (commit {baseline.get('commit', '?')})")
+    for result in results['benchmarks']:
+        key = benchmark_key(result)
+        before = baseline.get(key)
+        if before is None:
+            print(f"{key:<40} new")
+            continue
+        changes = []
+        for stat in ('p50', 'p99'):
+            old, new = before['latency_ms'][stat], result['latency_ms'][stat]
+            changes.append(f"{stat} {old:.3f} -> {new:.3f} ms ({(new - old) / old * 100 if old else 0:+.1f}%)")
+        changes.append(f"round trips {before['round_trips_per_op']} -> {result['round_trips_per_op']}")
+        print(f"{key:<40} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the service hot paths against an in-memory Supabase')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='injected latency per round trip')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--quick', action='store_true', help='smaller sizes (sweep at 1k and 10k)')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='earlier results file to diff against')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    # Per-challenge log lines and the expected RPC fallback warnings would dominate the output
+    logging.disable(logging.WARNING)
+
+    print("Service Benchmark Suite")
+    print("=" * 50)
+    print(f"Injected latency {args.latency_ms} ms (+{args.jitter_ms} ms jitter) per round trip")
+
+    rng = np.random.default_rng(args.seed)
+    benchmarks = []
+    for name in args.only or BENCHMARKS:
+        db = FakeSupabase(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                          rpc_handlers={'apply_challenge_transitions': apply_challenge_transitions})
+        kwargs = {}
+        if args.quick and name == 'scheduler_sweep':
+            kwargs['sizes'] = (1_000, 10_000)
+        for result in BENCHMARKS[name](db, args.iterations, rng, **kwargs):
+            print(f"{benchmark_key(result):<40} p50 {result['latency_ms']['p50']:9.3f} ms  "
+                  f"p99 {result['latency_ms']['p99']:9.3f} ms  round trips/op {result['round_trips_per_op']}")
+            benchmarks.append(result)
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'benchmarks': benchmarks
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Shared pytest fixtures
+"""
+
+import importlib
+
+import pytest
+
+import supabase_client
+
+
+@pytest.fixture
+def sqlite_app(monkeypatch):
+    """app.py on an in-memory SQLite database (imported once per test session)"""
+    monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', ':memory:')
+    monkeypatch.setenv('SUPABASE_JWT_SECRET', 'secret')
+    monkeypatch.setenv('EVALUATION_QUEUE_ENABLED', 'false')
+    monkeypatch.setattr(supabase_client, 'DATABASE_BACKEND', 'sqlite')
+    monkeypatch.setattr(supabase_client, '_client', None)
+    return importlib.import_module('app')
@@ -0,0 +1,273 @@
+"""
+Coordination of Scheduler Instances
+
+Every web worker started with the scheduler (gunicorn workers, several
+hosts) runs its own PropFirmBackgroundScheduler. SchedulerCoordinator keeps
+them from repeating each other's work:
+- Membership: each instance heartbeats with a TTL; the live instances,
+  sorted by id, define the shard count and each instance's shard index
+- Sharding: instance i of n sweeps the challenges whose UUID falls in the
+  i-th of n equal slices of the key space (random v4 ids make this a hash
+  partition), see shard_of and scheduler.id_partitions
+- Leadership: singleton jobs (the daily reset, the leaderboard flush) and
+  the tick listeners (price alerts, mark-to-market) run only on the holder
+  of a time-limited lease, renewed by every heartbeat
+
+Two backends share one interface:
+- FileCoordinationBackend: a JSON state file guarded by an flock'ed lock
+  file, for several processes on one machine (and for tests)
+- SupabaseCoordinationBackend: the scheduler_* Postgres functions, which
+  serialize on transaction-level advisory locks, for several hosts
+
+When the membership changes between two sweeps, a slice can be swept twice
+or skipped once; the evaluation queue and the next sweep cover it.
+"""
+
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from supabase import Client
+
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+LEADER_LEASE = 'scheduler_leader'
+
+
+def shard_of(challenge_id: str, shards: int) -> int:
+    """Shard owning a challenge id: its slice of the UUID key space"""
+    if shards <= 1:
+        return 0
+    try:
+        return (uuid.UUID(challenge_id).int * shards) >> 128
+    except ValueError:
+        return (zlib.crc32(challenge_id.encode('utf-8')) * shards) >> 32
+
+
+class FileCoordinationBackend:
+    """Membership and leases in a JSON file, updated under an exclusive flock"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, 'scheduler_state.json')
+        self.lock_path = os.path.join(directory, 'scheduler_state.lock')
+
+    @contextmanager
+    def _state(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_path) as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {}
+                state.setdefault('members', {})
+                state.setdefault('leases', {})
+
+                yield state
+
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def heartbeat(self, instance_id: str, ttl: float) -> List[str]:
+        """Register or refresh an instance; returns the live instance ids, sorted"""
+        now = time.time()
+        with self._state() as state:
+            members = state['members']
+            for member, expires_at in list(members.items()):
+                if expires_at < now:
+                    del members[member]
+            members[instance_id] = now + ttl
+            return sorted(members)
+
+    def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew a lease; False if another holder's lease has not expired"""
+        now = time.time()
+        with self._state() as state:
+            lease = state['leases'].get(name)
+            if lease and lease['holder'] != holder and lease['expires_at'] >= now:
+                return False
+            state['leases'][name] = {'holder': holder, 'expires_at': now + ttl}
+            return True
+
+    def release(self, name: str, holder: str) -> None:
+        with self._state() as state:
+            lease = state['leases'].get(name)
+            if lease and lease['holder'] == holder:
+                del state['leases'][name]
+
+    def leave(self, instance_id: str) -> None:
+        """Drop an instance and the leases it holds"""
+        with self._state() as state:
+            state['members'].pop(instance_id, None)
+            for name, lease in list(state['leases'].items()):
+                if lease['holder'] == instance_id:
+                    del state['leases'][name]
+
+
+class SupabaseCoordinationBackend:
+    """Membership and leases in Postgres, through the scheduler_* functions"""
+
+    def __init__(self, supabase_client: Client):
+        self.supabase = supabase_client
+
+    def heartbeat(self, instance_id: str, ttl: float) -> List[str]:
+        response = self.supabase.rpc('scheduler_heartbeat', {
+            'p_instance_id': instance_id,
+            'p_ttl_seconds': ttl
+        }).execute()
+        return sorted(row['member_id'] for row in (response.data or []))
+
+    def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        response = self.supabase.rpc('acquire_scheduler_lease', {
+            'p_name': name,
+            'p_holder': holder,
+            'p_ttl_seconds': ttl
+        }).execute()
+        return bool(response.data)
+
+    def release(self, name: str, holder: str) -> None:
+        self.supabase.rpc('release_scheduler_lease', {'p_name': name, 'p_holder': holder}).execute()
+
+    def leave(self, instance_id: str) -> None:
+        self.supabase.rpc('leave_scheduler', {'p_instance_id': instance_id}).execute()
+
+
+class SchedulerCoordinator:
+    """One scheduler instance's view of its peers: its shard and whether it leads"""
+
+    def __init__(self, backend, instance_id: str = None, lease_ttl: float = 30.0):
+        self.backend = backend
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = lease_ttl
+
+        self._lock = threading.Lock()
+        self._members: List[str] = [self.instance_id]
+        self._leader = False
+        self.last_heartbeat: Optional[float] = None
+
+    def heartbeat(self) -> List[str]:
+        """
+        Refresh membership and renew (or try to take) the leader lease
+
+        On backend errors the last known membership is kept and leadership
+        is dropped, so singleton jobs never run on an unconfirmed lease.
+
+        Returns:
+            Live instance ids, sorted
+        """
+        try:
+            members = self.backend.heartbeat(self.instance_id, self.lease_ttl)
+            leader = self.backend.acquire(LEADER_LEASE, self.instance_id, self.lease_ttl)
+        except Exception as e:
+            logger.error('Scheduler coordination heartbeat failed', error=e)
+            with self._lock:
+                self._leader = False
+                return list(self._members)
+
+        with self._lock:
+            if leader != self._leader:
+                logger.info('Scheduler leadership changed', instance_id=self.instance_id, leader=leader)
+            if members != self._members:
+                logger.info('Scheduler instances changed', live=len(members))
+            self._members = members
+            self._leader = leader
+            self.last_heartbeat = time.time()
+            return list(members)
+
+    def is_leader(self) -> bool:
+        """Confirm the leader lease right before a singleton job runs"""
+        try:
+            leader = self.backend.acquire(LEADER_LEASE, self.instance_id, self.lease_ttl)
+        except Exception as e:
+            logger.error('Could not confirm scheduler leadership', error=e)
+            leader = False
+
+        with self._lock:
+            self._leader = leader
+        return leader
+
+    def leads(self) -> bool:
+        """Leadership as of the last heartbeat, without a round trip (for per-tick checks)"""
+        with self._lock:
+            return self._leader
+
+    def shard(self) -> Tuple[int, int]:
+        """(index, count) of this instance among the live instances"""
+        with self._lock:
+            members = list(self._members)
+
+        if self.instance_id not in members:
+            members = self.heartbeat()
+        if self.instance_id not in members:
+            # Not registered (backend unreachable): sweep everything rather than nothing
+            return 0, 1
+        return members.index(self.instance_id), len(members)
+
+    def owns(self, challenge_id: str) -> bool:
+        """Whether this instance's sweeps cover challenge_id"""
+        index, count = self.shard()
+        return shard_of(challenge_id, count) == index
+
+    def leave(self) -> None:
+        """Deregister on shutdown so peers take over this shard right away"""
+        try:
+            self.backend.leave(self.instance_id)
+        except Exception as e:
+            logger.error('Failed to leave scheduler coordination', error=e)
+        with self._lock:
+            self._members = [self.instance_id]
+            self._leader = False
+
+    def stats(self) -> Dict:
+        """Return this instance's id, shard and leadership"""
+        index, count = self.shard()
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'instance_id': self.instance_id,
+                'shard': index,
+                'shards': count,
+                'leader': self._leader,
+                'last_heartbeat': self.last_heartbeat
+            }
+
+
+def create_coordinator_from_env(supabase_client: Client) -> Optional[SchedulerCoordinator]:
+    """
+    Build the coordinator selected by SCHEDULER_COORDINATION
+
+    'file' (default) coordinates the processes of one machine through
+    SCHEDULER_COORDINATION_DIR, 'postgres' coordinates across hosts, 'none'
+    makes every instance sweep everything and run every job.
+    """
+    kind = os.getenv("SCHEDULER_COORDINATION", "file").lower()
+    lease_ttl = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
+
+    if kind == 'none':
+        return None
+    if kind == 'file':
+        directory = os.getenv("SCHEDULER_COORDINATION_DIR",
+                              os.path.join(tempfile.gettempdir(), 'tradesense-scheduler'))
+        backend = FileCoordinationBackend(directory)
+    elif kind == 'postgres':
+        backend = SupabaseCoordinationBackend(supabase_client)
+    else:
+        raise ValueError(f"Unknown scheduler coordination backend: {kind}")
+
+    return SchedulerCoordinator(backend, lease_ttl=lease_ttl)
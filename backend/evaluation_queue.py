@@ -0,0 +1,309 @@
+"""
+Event-Driven Challenge Evaluation Queue
+
+Challenges are evaluated when something that can change their status
+happens, instead of on a fixed timer:
+- a trade is settled            (evaluator settlement listeners)
+- the daily PnL is reset        (evaluator reset listeners)
+- a price move breaches equity  (mark-to-market engine, see attach_mark_to_market)
+
+Each event enqueues a challenge_id with a due time of now + window. Events
+for a challenge that is already pending are coalesced into that pending
+evaluation, so a burst of settlements or ticks costs one evaluation. A
+worker thread takes the due challenges in batches, reads their rows with one
+`in (ids)` query, runs the vectorized rules and writes the transitions through
+apply_status_transitions in one call.
+
+Because the window is the same for every event, due times are increasing in
+enqueue order and the pending set is a FIFO (an OrderedDict).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from prop_firm_service import PropFirmChallengeEvaluator, get_prop_firm_evaluator
+from records import CHALLENGE_COLUMNS as RECORD_COLUMNS, ChallengeBatch, select_list
+from rule_engine import STATUS_FAILED, STATUS_NAMES, evaluate_rules_batch
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+REASON_SETTLEMENT = 'settlement'
+REASON_DAILY_RESET = 'daily_reset'
+REASON_PRICE = 'price'
+
+
+class ChallengeEvaluationQueue:
+    """Coalescing queue of challenge ids, evaluated in batches on a worker thread"""
+
+    CHALLENGE_COLUMNS = select_list(RECORD_COLUMNS)
+
+    def __init__(self, evaluator: PropFirmChallengeEvaluator, window: float = 0.25, batch_size: int = 500):
+        self.evaluator = evaluator
+        self.supabase = evaluator.supabase
+        self.window = window
+        self.batch_size = batch_size
+
+        # Set by attach_mark_to_market: equity checks and position book refreshes
+        self.mark_to_market = None
+
+        self._pending: "OrderedDict[str, float]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.enqueued_total = 0
+        self.coalesced_total = 0
+        self.evaluated_total = 0
+        self.transitions_total = 0
+        self.errors_total = 0
+        self.events_by_reason: Dict[str, int] = {}
+        self.last_batch_ms = 0.0
+
+    def enqueue(self, challenge_ids: Iterable[str], reason: str = 'event') -> int:
+        """
+        Schedule challenges for evaluation after the coalescing window
+
+        Returns:
+            Number of challenges that were not already pending
+        """
+        added = 0
+        due = time.monotonic() + self.window
+
+        with self._cond:
+            for challenge_id in challenge_ids:
+                self.events_by_reason[reason] = self.events_by_reason.get(reason, 0) + 1
+                if challenge_id in self._pending:
+                    self.coalesced_total += 1
+                    continue
+                self._pending[challenge_id] = due
+                added += 1
+
+            self.enqueued_total += added
+            if added:
+                self._cond.notify()
+        return added
+
+    def on_settled(self, user_id: str, trades: List[Dict]) -> None:
+        """Settlement listener: re-evaluate the challenges of the settled trades"""
+        if self.mark_to_market is not None:
+            # current_balance now holds the realized PnL; the closed positions
+            # must stop adding their unrealized PnL on top of it
+            self.mark_to_market.on_settled(user_id, trades)
+        self.enqueue({trade['challenge_id'] for trade in trades}, REASON_SETTLEMENT)
+
+    def on_reset(self, challenge_ids: List[str]) -> None:
+        """Daily reset listener: re-evaluate the reset challenges"""
+        self.enqueue(challenge_ids, REASON_DAILY_RESET)
+
+    def attach_mark_to_market(self, engine) -> None:
+        """
+        Route the mark-to-market engine's equity breaches through the queue
+
+        The engine enqueues challenges its in-memory check flags instead of
+        failing them directly. The queue confirms the breach against the
+        fresh challenge row plus the engine's unrealized PnL, and refreshes
+        the engine's copy of every row it reads.
+        """
+        self.mark_to_market = engine
+        engine.evaluation_queue = self
+
+    def pop_due(self, now: float = None) -> List[str]:
+        """Remove and return the challenges whose window has elapsed"""
+        now = time.monotonic() if now is None else now
+        due = []
+
+        with self._cond:
+            while self._pending:
+                challenge_id, due_at = next(iter(self._pending.items()))
+                if due_at > now:
+                    break
+                self._pending.popitem(last=False)
+                due.append(challenge_id)
+        return due
+
+    def process_due(self, now: float = None) -> int:
+        """Evaluate every due challenge in batches; returns the number of challenges evaluated"""
+        due = self.pop_due(now)
+
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            try:
+                self.evaluate(batch)
+            except Exception as e:
+                # The periodic safety sweep picks these challenges up again
+                self.errors_total += len(batch)
+                logger.error('Error evaluating queued challenges', challenges=len(batch), error=e)
+        return len(due)
+
+    def evaluate(self, challenge_ids: List[str]) -> Dict:
+        """
+        Read and evaluate a batch of challenges, writing their transitions in one call
+
+        Returns:
+            Dictionary with the number of active challenges evaluated and the updated ids
+        """
+        start = time.perf_counter()
+
+        response = self.supabase.table('user_challenges') \
+            .select(self.CHALLENGE_COLUMNS) \
+            .in_('id', list(challenge_ids)) \
+            .eq('status', 'active') \
+            .execute()
+        rows = response.data or []
+
+        transitions = self._transitions(rows) if rows else []
+        write_result = self.evaluator.apply_status_transitions(transitions)
+        updated_ids = write_result.get('updated_ids', [])
+
+        if write_result.get('failed_ids'):
+            self.errors_total += len(write_result['failed_ids'])
+
+        if self.mark_to_market is not None:
+            self._sync_mark_to_market(challenge_ids, rows, updated_ids)
+
+        for transition in transitions:
+            if transition['id'] in updated_ids:
+                logger.info('Challenge status changed', challenge_id=transition['id'], status=transition['status'])
+
+        self.evaluated_total += len(rows)
+        self.transitions_total += len(updated_ids)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        return {'evaluated': len(rows), 'updated_ids': updated_ids}
+
+    def _transitions(self, rows: List[Dict]) -> List[Dict]:
+        evaluator = self.evaluator
+        batch = ChallengeBatch.from_rows(rows)
+        result = evaluator.evaluate_challenges_batch(batch)
+        status = result.status.copy()
+        rule = result.rule.copy()
+
+        if self.mark_to_market is not None:
+            # Loss limits also apply to equity; a breach there wins over the realized status.
+            # Positions closed since the engine last loaded them are already in current_balance
+            self.mark_to_market.refresh_positions(batch.ids)
+            unrealized_by_id = self.mark_to_market.unrealized_pnl(batch.ids)
+            unrealized = np.fromiter((unrealized_by_id.get(challenge_id, 0.0) for challenge_id in batch.ids),
+                                     dtype=np.float64, count=len(batch))
+
+            equity = evaluate_rules_batch(
+                batch.initial_capital, batch.current_balance + unrealized, batch.daily_pnl + unrealized,
+                evaluator.DAILY_LOSS_LIMIT_PERCENT, evaluator.TOTAL_LOSS_LIMIT_PERCENT, np.inf
+            )
+            breached = (equity.status == STATUS_FAILED) & (status != STATUS_FAILED)
+            status[breached] = STATUS_FAILED
+            rule[breached] = equity.rule[breached]
+
+        ended_at = datetime.utcnow().isoformat()
+        transitions = []
+        for challenge_id, old_status, status_code, rule_code in zip(batch.ids, batch.statuses,
+                                                                     status.tolist(), rule.tolist()):
+            new_status = STATUS_NAMES[status_code]
+            if new_status != old_status:
+                transitions.append({
+                    'id': challenge_id,
+                    **evaluator.build_status_update(new_status, evaluator.rule_triggered_name(rule_code), ended_at)
+                })
+        return transitions
+
+    def _sync_mark_to_market(self, challenge_ids: List[str], rows: List[Dict], updated_ids: List[str]) -> None:
+        """Refresh the engine's balances from the rows just read; drop challenges no longer active"""
+        engine = self.mark_to_market
+        active = {row['id']: row for row in rows}
+        completed = set(updated_ids)
+
+        for challenge_id in challenge_ids:
+            row = active.get(challenge_id)
+            if row is None or challenge_id in completed:
+                engine.remove_challenge(challenge_id)
+            else:
+                engine.add_challenge(row)
+
+    def start(self) -> None:
+        """Start the worker thread"""
+        if self._thread and self._thread.is_alive():
+            logger.warning("Challenge evaluation queue is already running")
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ChallengeEvaluationQueue")
+        self._thread.start()
+        logger.info('Challenge evaluation queue started', window_s=self.window)
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+
+    def _next_due_in(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return next(iter(self._pending.values())) - time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                wait = self._next_due_in()
+                while not self._stop.is_set() and (wait is None or wait > 0):
+                    self._cond.wait(wait)
+                    wait = self._next_due_in()
+
+            if not self._stop.is_set():
+                self.process_due()
+
+    def stats(self) -> Dict:
+        """Return queue depth and counters"""
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'window_seconds': self.window,
+                'enqueued_total': self.enqueued_total,
+                'coalesced_total': self.coalesced_total,
+                'evaluated_total': self.evaluated_total,
+                'transitions_total': self.transitions_total,
+                'errors_total': self.errors_total,
+                'events_by_reason': dict(self.events_by_reason),
+                'last_batch_ms': round(self.last_batch_ms, 3),
+                'running': self._thread is not None and self._thread.is_alive()
+            }
+
+
+# Global queue instance
+evaluation_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_evaluation_queue(evaluator: PropFirmChallengeEvaluator = None, window: float = None,
+                         batch_size: int = None) -> ChallengeEvaluationQueue:
+    """
+    Get the singleton evaluation queue, starting its worker on first use
+
+    The queue reads and writes through the shared synchronous evaluator. It
+    is registered as a settlement and reset listener on every evaluator
+    passed in (e.g. the async one of the ASGI app), so their events feed the
+    same queue.
+    """
+    global evaluation_queue
+    with _queue_lock:
+        if evaluation_queue is None:
+            evaluation_queue = ChallengeEvaluationQueue(
+                get_prop_firm_evaluator(),
+                window=0.25 if window is None else window,
+                batch_size=batch_size or 500
+            )
+            evaluation_queue.start()
+
+        for target in (evaluation_queue.evaluator, evaluator):
+            if target is None:
+                continue
+            if evaluation_queue.on_settled not in target.settlement_listeners:
+                target.add_settlement_listener(evaluation_queue.on_settled)
+            if evaluation_queue.on_reset not in target.reset_listeners:
+                target.add_reset_listener(evaluation_queue.on_reset)
+            target.evaluation_queue = evaluation_queue
+    return evaluation_queue
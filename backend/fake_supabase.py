@@ -0,0 +1,280 @@
+"""
+In-Memory Supabase Stand-In
+
+Implements the client interface of the services (see persistence.py), so hot
+paths can be benchmarked (bench_suite.py) without a database:
+- table(name) query builders: select / insert / upsert (on_conflict
+  columns included) / update / delete,
+  filters eq / neq / in_ / gt / gte / lt / lte / is_, order, limit,
+  single and maybe_single, then execute()
+- rpc(name, params): dispatched to registered Python handlers; unknown
+  functions raise the PostgREST "function not found" APIError, so the
+  services take their client-side fallbacks
+
+Every execute() is one round trip: it sleeps for the injected latency and
+is counted per table and operation. Rows live in dicts keyed by id, with a
+sorted id list for keyset paging and hash indexes on selected columns, so
+sweeps over 100k rows stay cheap. Returned rows are copies, like decoded
+JSON from PostgREST.
+"""
+
+import bisect
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, Iterable, List
+
+from postgrest.exceptions import APIError
+
+from persistence import QueryBuilder, QueryResponse, missing_function_error
+
+# Columns with hash indexes for equality and in_ filters
+DEFAULT_INDEXES = {
+    'user_challenges': ('user_id',),
+    'trades': ('challenge_id', 'user_id'),
+}
+
+
+class FakeTable:
+    """Rows of one table with a primary key order and hash indexes"""
+
+    def __init__(self, indexed_columns: Iterable[str] = ()):
+        self.rows: Dict[str, Dict] = {}
+        self._ids: List[str] = []
+        self._ids_sorted = True
+        self.indexes: Dict[str, Dict] = {column: {} for column in indexed_columns}
+
+    def sorted_ids(self) -> List[str]:
+        if not self._ids_sorted:
+            self._ids.sort()
+            self._ids_sorted = True
+        return self._ids
+
+    def _index(self, row: Dict) -> None:
+        for column, index in self.indexes.items():
+            index.setdefault(row.get(column), set()).add(row['id'])
+
+    def _unindex(self, row: Dict) -> None:
+        for column, index in self.indexes.items():
+            ids = index.get(row.get(column))
+            if ids is not None:
+                ids.discard(row['id'])
+
+    def put(self, row: Dict) -> Dict:
+        existing = self.rows.get(row['id'])
+        if existing is not None:
+            self._unindex(existing)
+            existing.update(row)
+            row = existing
+        else:
+            self.rows[row['id']] = row
+            if self._ids and row['id'] < self._ids[-1]:
+                self._ids_sorted = False
+            self._ids.append(row['id'])
+        self._index(row)
+        return row
+
+    def update(self, row: Dict, values: Dict) -> None:
+        self._unindex(row)
+        row.update(values)
+        self._index(row)
+
+    def remove(self, row: Dict) -> None:
+        self._unindex(row)
+        del self.rows[row['id']]
+        self._ids = [row_id for row_id in self._ids if row_id != row['id']]
+
+
+_FILTERS = {
+    'eq': lambda value, arg: value == arg,
+    'neq': lambda value, arg: value != arg,
+    'in': lambda value, arg: value in arg,
+    'gt': lambda value, arg: value is not None and value > arg,
+    'gte': lambda value, arg: value is not None and value >= arg,
+    'lt': lambda value, arg: value is not None and value < arg,
+    'lte': lambda value, arg: value is not None and value <= arg,
+    'is': lambda value, arg: value is arg,
+}
+
+
+class FakeQuery(QueryBuilder):
+    """Query builder for one request; execute() runs it against the tables"""
+
+    def __init__(self, client: 'FakeSupabase', table: str):
+        super().__init__(table)
+        self.client = client
+
+    def in_(self, column, values):
+        return self._filter('in', column, set(values))
+
+    def _candidates(self, table: FakeTable) -> Iterable[Dict]:
+        """Rows that may match, narrowed through the primary key or a hash index"""
+        for op, column, value in self.filters:
+            if column == 'id' and op == 'eq':
+                row = table.rows.get(value)
+                return [row] if row is not None else []
+            if column == 'id' and op == 'in':
+                return [table.rows[row_id] for row_id in sorted(value) if row_id in table.rows]
+
+        # Keyset pages walk the primary key; other equality filters may use a hash index
+        keyset = self.order_by == 'id' or any(column == 'id' for _, column, _ in self.filters)
+        for op, column, value in self.filters:
+            if not keyset and column in table.indexes and op in ('eq', 'in'):
+                values = [value] if op == 'eq' else value
+                ids = set().union(*(table.indexes[column].get(v, ()) for v in values))
+                return [table.rows[row_id] for row_id in sorted(ids)]
+
+        # Primary key order; keyset bounds on id become a bisected slice
+        ids = table.sorted_ids()
+        lower, upper = 0, len(ids)
+        for op, column, value in self.filters:
+            if column != 'id':
+                continue
+            if op == 'gt':
+                lower = max(lower, bisect.bisect_right(ids, value))
+            elif op == 'gte':
+                lower = max(lower, bisect.bisect_left(ids, value))
+            elif op == 'lt':
+                upper = min(upper, bisect.bisect_left(ids, value))
+            elif op == 'lte':
+                upper = min(upper, bisect.bisect_right(ids, value))
+        return (table.rows[ids[position]] for position in range(lower, upper))
+
+    def _matching(self, table: FakeTable) -> List[Dict]:
+        matches = []
+        # Rows come in id order, so an id-ordered limited read can stop early
+        stop_early = self.limit_count is not None and self.order_by in (None, 'id') and not self.descending
+        for row in self._candidates(table):
+            if all(_FILTERS[op](row.get(column), value) for op, column, value in self.filters):
+                matches.append(row)
+                if stop_early and len(matches) >= self.limit_count:
+                    break
+
+        if self.order_by is not None and self.order_by != 'id' or self.descending:
+            matches.sort(key=lambda row: (row.get(self.order_by) is None, row.get(self.order_by)),
+                         reverse=self.descending)
+        if self.limit_count is not None:
+            matches = matches[:self.limit_count]
+        return matches
+
+    def _project(self, row: Dict) -> Dict:
+        if self.columns is None:
+            return dict(row)
+        return {column: row.get(column) for column in self.columns}
+
+    def _conflicting_ids(self, table: FakeTable, rows: List[Dict]) -> List[Dict]:
+        """Upsert rows with the id of the existing row sharing their on_conflict columns"""
+        columns = [column.strip() for column in self.on_conflict.split(',')]
+        existing = {tuple(row.get(column) for column in columns): row_id for row_id, row in table.rows.items()}
+        resolved = []
+        for row in rows:
+            row_id = existing.get(tuple(row.get(column) for column in columns))
+            resolved.append({**row, 'id': row_id} if row_id is not None else row)
+        return resolved
+
+    def execute(self):
+        self.client._round_trip(self.table_name, self.operation)
+
+        with self.client.lock:
+            table = self.client.tables.setdefault(self.table_name, FakeTable(DEFAULT_INDEXES.get(self.table_name, ())))
+
+            if self.operation in ('insert', 'upsert'):
+                rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                if self.operation == 'insert':
+                    for row in rows:
+                        if row.get('id') in table.rows:
+                            raise APIError({'code': '23505', 'message': 'duplicate key value violates unique constraint'})
+                elif self.on_conflict != 'id':
+                    rows = self._conflicting_ids(table, rows)
+                data = [dict(table.put({'id': str(uuid.uuid4()), **row})) for row in rows]
+            elif self.operation == 'update':
+                data = []
+                for row in self._matching(table):
+                    table.update(row, dict(self.payload))
+                    data.append(dict(row))
+            elif self.operation == 'delete':
+                data = [dict(row) for row in self._matching(table)]
+                for row in data:
+                    table.remove(table.rows[row['id']])
+            else:
+                data = [self._project(row) for row in self._matching(table)]
+
+        return self._response(data)
+
+
+class _RpcCall:
+    def __init__(self, client: 'FakeSupabase', name: str, params: Dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.client._round_trip('rpc', self.name)
+        handler = self.client.rpc_handlers.get(self.name)
+        if handler is None:
+            raise missing_function_error(self.name)
+        with self.client.lock:
+            return QueryResponse(handler(self.client, self.params))
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the supabase Client
+
+    Args:
+        latency: Seconds slept by every round trip
+        jitter: Extra uniformly random seconds per round trip
+        rpc_handlers: {name: handler(client, params) -> data} for rpc()
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 rpc_handlers: Dict[str, Callable[['FakeSupabase', Dict], object]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpc_handlers = dict(rpc_handlers or {})
+        self.tables: Dict[str, FakeTable] = {}
+        self.lock = threading.RLock()
+
+        self._stats_lock = threading.Lock()
+        self.round_trips: Counter = Counter()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Dict = None) -> _RpcCall:
+        return _RpcCall(self, name, params or {})
+
+    def load(self, table: str, rows: Iterable[Dict]) -> None:
+        """Seed a table without counting round trips"""
+        with self.lock:
+            target = self.tables.setdefault(table, FakeTable(DEFAULT_INDEXES.get(table, ())))
+            for row in rows:
+                target.put(dict(row))
+
+    def rows(self, table: str) -> List[Dict]:
+        """Copies of a table's rows in primary key order"""
+        with self.lock:
+            target = self.tables.get(table)
+            if target is None:
+                return []
+            return [dict(target.rows[row_id]) for row_id in target.sorted_ids()]
+
+    def _round_trip(self, table: str, operation: str) -> None:
+        with self._stats_lock:
+            self.round_trips[f"{table}.{operation}"] += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def total_round_trips(self) -> int:
+        with self._stats_lock:
+            return sum(self.round_trips.values())
+
+    def reset_stats(self) -> Dict[str, int]:
+        """Return the round trip counters by 'table.operation' and zero them"""
+        with self._stats_lock:
+            counts = dict(self.round_trips)
+            self.round_trips.clear()
+        return counts
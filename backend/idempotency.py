@@ -0,0 +1,172 @@
+"""
+Idempotency-Key Response Store
+
+Lets clients retry /evaluate-trade and /capture-paypal-order safely: a
+request sent with an `Idempotency-Key` header has its response stored under
+(user, path, key) for IDEMPOTENCY_TTL seconds, and a retry with the same key
+gets the stored response back without running the endpoint again.
+
+- A duplicate arriving while the first request is still running waits for
+  it (up to IDEMPOTENCY_WAIT_TIMEOUT seconds, then 409) and replays its
+  response instead of settling the trade a second time
+- Reusing a key with a different request body is rejected with 422
+- Only responses below 500 are stored; after a server error the next retry
+  runs the endpoint again
+
+IdempotencyStore serves the threaded Flask app, AsyncIdempotencyStore the
+single event loop of asgi_app.py. Stores are per process: with several
+worker processes a retry routed to another worker runs again (the settlement
+functions still refuse to close a trade twice).
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
+
+from ttl_cache import TTLCache
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Longest accepted key; UUIDs and ULIDs fit comfortably
+MAX_KEY_LENGTH = 255
+
+# Outcomes of begin()
+OWNER = 'owner'        # no stored response: run the endpoint, then complete() or abandon()
+REPLAY = 'replay'      # stored response for the same request
+MISMATCH = 'mismatch'  # key already used for a different request body
+IN_PROGRESS = 'in_progress'  # the original request did not finish within the wait timeout
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    body: bytes
+    content_type: Optional[str]
+    fingerprint: str
+
+
+def request_fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def is_storable(status: int) -> bool:
+    return status < 500
+
+
+class _BaseIdempotencyStore:
+    def __init__(self, max_size: int = 10000, ttl: float = 86400.0, wait_timeout: float = 30.0):
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.responses = TTLCache(max_size=max_size, default_ttl=ttl)
+        self.replays = 0
+        self.waits = 0
+
+    def _lookup(self, key: Hashable, fingerprint: str) -> Optional[Tuple[str, Optional[StoredResponse]]]:
+        stored = self.responses.get(key)
+        if stored is None:
+            return None
+        if stored.fingerprint != fingerprint:
+            return MISMATCH, stored
+        self.replays += 1
+        return REPLAY, stored
+
+    def _store(self, key: Hashable, response: StoredResponse) -> None:
+        if is_storable(response.status):
+            self.responses.set(key, response)
+
+    def stats(self) -> Dict:
+        return {**self.responses.stats(), 'replays': self.replays, 'waits': self.waits,
+                'in_flight': len(self._in_flight)}
+
+
+class IdempotencyStore(_BaseIdempotencyStore):
+    """Store for threaded servers; duplicates wait on a threading.Event"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400.0, wait_timeout: float = 30.0):
+        super().__init__(max_size, ttl, wait_timeout)
+        self._in_flight: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: Hashable, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        """Claim key for this request, or return the response to replay"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                found = self._lookup(key, fingerprint)
+                if found is not None:
+                    return found
+                running = self._in_flight.get(key)
+                if running is None:
+                    self._in_flight[key] = threading.Event()
+                    return OWNER, None
+
+            # The original request either stores its response or abandons
+            # the key, in which case the next waiter becomes the owner
+            self.waits += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not running.wait(remaining):
+                return IN_PROGRESS, None
+
+    def complete(self, key: Hashable, response: StoredResponse) -> None:
+        """Store the owner's response and release the waiting duplicates"""
+        with self._lock:
+            self._store(key, response)
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def abandon(self, key: Hashable) -> None:
+        """Release key without a response (the endpoint raised)"""
+        with self._lock:
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+class AsyncIdempotencyStore(_BaseIdempotencyStore):
+    """Store for one asyncio event loop; duplicates await an asyncio.Event"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400.0, wait_timeout: float = 30.0):
+        super().__init__(max_size, ttl, wait_timeout)
+        self._in_flight: Dict[Hashable, asyncio.Event] = {}
+
+    async def begin(self, key: Hashable, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        """Claim key for this request, or return the response to replay"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            found = self._lookup(key, fingerprint)
+            if found is not None:
+                return found
+            running = self._in_flight.get(key)
+            if running is None:
+                self._in_flight[key] = asyncio.Event()
+                return OWNER, None
+
+            self.waits += 1
+            remaining = deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(running.wait(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                return IN_PROGRESS, None
+
+    def complete(self, key: Hashable, response: StoredResponse) -> None:
+        self._store(key, response)
+        event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def abandon(self, key: Hashable) -> None:
+        event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+def store_options_from_env() -> Dict:
+    return {
+        'max_size': int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+        'ttl': float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+        'wait_timeout': float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30")),
+    }
@@ -0,0 +1,435 @@
+"""
+Incrementally Ranked Leaderboard
+
+Keeps one order-statistics structure per leaderboard period ('monthly' for
+trades closed in the current calendar month, 'all_time' for whole challenge
+histories). Entries are per challenge, like the `leaderboard` table, and are
+ordered by profit_percent (realized PnL of the period over initial capital,
+the `monthly_leaderboard` formula).
+
+Settled trades update the entries through the evaluator's settlement
+listeners, so ranks are current without re-aggregating trades:
+- top(period, k) reads the first k entries            O(log n + k)
+- rank(period, user_id) bisects the user's best score  O(log n)
+
+Ranks use competition ranking (equal profit shares a rank). They are written
+to the `leaderboard` table by flush(), which upserts only the rows whose rank
+or values changed since the previous flush, in chunks.
+
+Settlement listeners only see the trades settled by their own process, so
+every process serving the leaderboard routes rebuilds its rankings from the
+database once they are older than max_age (in the background, readers keep
+the current rankings meanwhile). That bounds how far the web workers and the
+scheduler drift apart, and picks up new challenges.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sortedcontainers import SortedList
+from supabase import Client
+
+from prop_firm_service import PropFirmChallengeEvaluator
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+PERIOD_MONTHLY = 'monthly'
+PERIOD_ALL_TIME = 'all_time'
+PERIODS = (PERIOD_MONTHLY, PERIOD_ALL_TIME)
+
+
+def month_start(now: datetime = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class LeaderboardEntry:
+    """Running totals of one challenge in one period"""
+
+    __slots__ = ('user_id', 'challenge_id', 'initial_capital', 'pnl', 'trades', 'wins')
+
+    def __init__(self, user_id: str, challenge_id: str, initial_capital: float):
+        self.user_id = user_id
+        self.challenge_id = challenge_id
+        self.initial_capital = initial_capital
+        self.pnl = 0.0
+        self.trades = 0
+        self.wins = 0
+
+    @property
+    def profit_percent(self) -> float:
+        if not self.initial_capital:
+            return 0.0
+        return round(self.pnl / self.initial_capital * 100, 2)
+
+    @property
+    def win_rate(self) -> float:
+        return round(self.wins / self.trades * 100, 2) if self.trades else 0.0
+
+    def key(self) -> tuple:
+        # Highest profit first; challenge id breaks ties so keys are unique
+        return (-self.profit_percent, self.challenge_id)
+
+
+class PeriodRanking:
+    """Entries of one period in a sorted list keyed by (-profit_percent, challenge_id)"""
+
+    def __init__(self):
+        self.order = SortedList()
+        self.entries: Dict[str, LeaderboardEntry] = {}
+        self.by_user: Dict[str, set] = {}
+
+    def add_pnls(self, user_id: str, challenge_id: str, initial_capital: float, pnls: List[float],
+                 trades: int = None, wins: int = None) -> LeaderboardEntry:
+        """Add settled PnLs to an entry and move it to its new position"""
+        entry = self.entries.get(challenge_id)
+        if entry is None:
+            entry = self.entries[challenge_id] = LeaderboardEntry(user_id, challenge_id, initial_capital)
+            self.by_user.setdefault(user_id, set()).add(challenge_id)
+        else:
+            self.order.remove(entry.key())
+
+        entry.pnl += sum(pnls)
+        entry.trades += len(pnls) if trades is None else trades
+        entry.wins += sum(1 for pnl in pnls if pnl > 0) if wins is None else wins
+        self.order.add(entry.key())
+        return entry
+
+    def rank_of_score(self, profit_percent: float) -> int:
+        """Competition rank of a score: 1 + number of entries with strictly higher profit"""
+        return self.order.bisect_left((-profit_percent,)) + 1
+
+    def rank(self, user_id: str) -> Optional[Dict]:
+        """Rank of a user's best challenge in this period"""
+        challenge_ids = self.by_user.get(user_id)
+        if not challenge_ids:
+            return None
+        best = min((self.entries[c] for c in challenge_ids), key=LeaderboardEntry.key)
+        return self._row(best, self.rank_of_score(best.profit_percent))
+
+    def top(self, k: int) -> List[Dict]:
+        """First k entries with their competition ranks"""
+        rows = []
+        for position, (score, challenge_id) in enumerate(self.order.islice(0, k), start=1):
+            if rows and -score == rows[-1]['profit_percent']:
+                rank = rows[-1]['rank_position']
+            else:
+                rank = position
+            rows.append(self._row(self.entries[challenge_id], rank))
+        return rows
+
+    def ranked_rows(self):
+        """Every entry in rank order, as leaderboard rows (O(n), used by flush)"""
+        rank, previous = 0, None
+        for position, (score, challenge_id) in enumerate(self.order, start=1):
+            if score != previous:
+                rank, previous = position, score
+            yield self._row(self.entries[challenge_id], rank)
+
+    @staticmethod
+    def _row(entry: LeaderboardEntry, rank: int) -> Dict:
+        return {
+            'user_id': entry.user_id,
+            'challenge_id': entry.challenge_id,
+            'profit_percent': entry.profit_percent,
+            'total_trades': entry.trades,
+            'win_rate': entry.win_rate,
+            'rank_position': rank
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LeaderboardService:
+    """Per-period rankings fed by trade settlements and flushed to the leaderboard table"""
+
+    CHALLENGE_COLUMNS = 'id, user_id, initial_capital, total_pnl, trade_count, winning_trades'
+
+    def __init__(self, supabase_client: Client, page_size: int = 1000, write_chunk_size: int = 500,
+                 max_age: Optional[float] = None, max_unresolved: int = 10000):
+        self.supabase = supabase_client
+        self.page_size = page_size
+        self.write_chunk_size = write_chunk_size
+        self.max_age = max_age
+        self.max_unresolved = max_unresolved
+
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._rankings: Dict[str, PeriodRanking] = {period: PeriodRanking() for period in PERIODS}
+        self._capitals: Dict[str, float] = {}
+        self._unresolved: Dict[str, tuple] = {}
+        self._flushed: Dict[tuple, tuple] = {}
+        self._month_start = month_start()
+        self._month_rolled = False
+        self._loaded_at = None
+        self.unresolved_dropped = 0
+        self.loaded = False
+
+    def record_trades(self, user_id: str, trades: List[Dict]) -> None:
+        """
+        Settlement listener: add settled trades ({'challenge_id', 'pnl'}) to every period
+
+        Trades of challenges whose initial capital is not known yet are kept
+        aside and applied once the capital is fetched (on the next flush), or
+        dropped by the next load, which reads them from the database. At most
+        max_unresolved challenges are kept aside; the oldest are dropped first.
+        """
+        pnls_by_challenge: Dict[str, List[float]] = {}
+        for trade in trades:
+            pnls_by_challenge.setdefault(trade['challenge_id'], []).append(float(trade['pnl'] or 0.0))
+
+        with self._lock:
+            self._roll_month()
+            for challenge_id, pnls in pnls_by_challenge.items():
+                capital = self._capitals.get(challenge_id)
+                if capital is None:
+                    if challenge_id not in self._unresolved and len(self._unresolved) >= self.max_unresolved:
+                        self._unresolved.pop(next(iter(self._unresolved)))
+                        self.unresolved_dropped += 1
+                    pending = self._unresolved.setdefault(challenge_id, (user_id, []))
+                    pending[1].extend(pnls)
+                    continue
+                for ranking in self._rankings.values():
+                    ranking.add_pnls(user_id, challenge_id, capital, pnls)
+
+    def _roll_month(self) -> None:
+        current = month_start()
+        if current != self._month_start:
+            logger.info('Leaderboard period rolled over', period=PERIOD_MONTHLY, month=current.strftime('%Y-%m'))
+            self._month_start = current
+            self._rankings[PERIOD_MONTHLY] = PeriodRanking()
+            self._month_rolled = True
+
+    def top(self, period: str, k: int = 10) -> List[Dict]:
+        """Top k entries of a period"""
+        with self._lock:
+            self._roll_month()
+            return self._rankings[period].top(k)
+
+    def rank(self, period: str, user_id: str) -> Optional[Dict]:
+        """Rank and values of a user's best challenge in a period, or None"""
+        with self._lock:
+            self._roll_month()
+            return self._rankings[period].rank(user_id)
+
+    def ensure_loaded(self) -> None:
+        """
+        Load on first use, then reload in the background once older than max_age
+
+        Only the first call blocks; later readers keep the current rankings
+        while a single background thread rebuilds them.
+        """
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    self.load()
+            return
+
+        if self.max_age is None or time.monotonic() - self._loaded_at < self.max_age:
+            return
+        if self._load_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload, daemon=True, name="LeaderboardReload").start()
+
+    def _reload(self) -> None:
+        """Background reload started by ensure_loaded, which holds _load_lock"""
+        try:
+            self.load()
+        except Exception as e:
+            # Retried by the next reader after max_age
+            self._loaded_at = time.monotonic()
+            logger.error('Leaderboard reload failed', error=e)
+        finally:
+            self._load_lock.release()
+
+    def _fetch_pages(self, query_builder) -> List[Dict]:
+        rows = []
+        last_id = None
+
+        while True:
+            query = query_builder().order('id').limit(self.page_size)
+            if last_id:
+                query = query.gt('id', last_id)
+
+            page = query.execute().data or []
+            rows.extend(page)
+
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1]['id']
+
+        return rows
+
+    def load(self) -> int:
+        """
+        Rebuild both periods from the database
+
+        all_time uses the running trade statistics on user_challenges;
+        monthly aggregates the trades closed since the start of the month.
+
+        Returns:
+            Number of ranked challenges (all time)
+        """
+        start = month_start()
+        challenges = self._fetch_pages(
+            lambda: self.supabase.table('user_challenges').select(self.CHALLENGE_COLUMNS)
+        )
+        trades = self._fetch_pages(
+            lambda: self.supabase.table('trades')
+            .select('id, user_id, challenge_id, pnl')
+            .eq('is_open', False)
+            .gte('closed_at', start.isoformat())
+        )
+
+        rankings = {period: PeriodRanking() for period in PERIODS}
+        capitals = {}
+        for challenge in challenges:
+            capitals[challenge['id']] = float(challenge['initial_capital'])
+            trade_count = challenge.get('trade_count') or 0
+            if trade_count:
+                rankings[PERIOD_ALL_TIME].add_pnls(
+                    challenge['user_id'], challenge['id'], capitals[challenge['id']],
+                    [float(challenge['total_pnl'] or 0.0)],
+                    trades=trade_count, wins=challenge.get('winning_trades') or 0
+                )
+
+        monthly: Dict[str, tuple] = {}
+        for trade in trades:
+            if trade['challenge_id'] in capitals:
+                monthly.setdefault(trade['challenge_id'], (trade['user_id'], []))[1].append(float(trade['pnl'] or 0.0))
+        for challenge_id, (user_id, pnls) in monthly.items():
+            rankings[PERIOD_MONTHLY].add_pnls(user_id, challenge_id, capitals[challenge_id], pnls)
+
+        with self._lock:
+            if start != self._month_start:
+                self._month_rolled = True
+            self._month_start = start
+            self._rankings = rankings
+            self._capitals = capitals
+            self._unresolved.clear()
+            self._loaded_at = time.monotonic()
+            self.loaded = True
+
+        logger.info('Leaderboard loaded', all_time=len(rankings[PERIOD_ALL_TIME]),
+                    monthly=len(rankings[PERIOD_MONTHLY]))
+        return len(rankings[PERIOD_ALL_TIME])
+
+    def _resolve_capitals(self) -> None:
+        """Fetch the initial capital of challenges first seen in a settlement and apply their trades"""
+        with self._lock:
+            challenge_ids = list(self._unresolved)
+        if not challenge_ids:
+            return
+
+        response = self.supabase.table('user_challenges') \
+            .select('id, initial_capital') \
+            .in_('id', challenge_ids) \
+            .execute()
+
+        with self._lock:
+            for row in response.data or []:
+                self._capitals[row['id']] = float(row['initial_capital'])
+                pending = self._unresolved.pop(row['id'], None)
+                if pending:
+                    self.record_trades(pending[0], [{'challenge_id': row['id'], 'pnl': pnl} for pnl in pending[1]])
+
+    def flush(self) -> int:
+        """
+        Upsert changed ranks and values into the leaderboard table
+
+        Rows are compared with what the previous flush wrote, so a settlement
+        that moves one challenge costs the rows whose rank actually shifted.
+        Chunks that fail are retried on the next flush.
+
+        Returns:
+            Number of rows written
+        """
+        try:
+            self._resolve_capitals()
+        except Exception as e:
+            logger.error('Failed to resolve leaderboard challenge capitals', error=e)
+
+        with self._lock:
+            self._roll_month()
+            month_rolled, self._month_rolled = self._month_rolled, False
+            changed = []
+            for period, ranking in self._rankings.items():
+                for row in ranking.ranked_rows():
+                    values = (row['profit_percent'], row['total_trades'], row['win_rate'], row['rank_position'])
+                    if self._flushed.get((period, row['challenge_id'])) != values:
+                        changed.append({**row, 'period': period})
+
+        if month_rolled:
+            # Last month's rows would otherwise keep their ranks in the monthly period
+            try:
+                self.supabase.table('leaderboard').delete().eq('period', PERIOD_MONTHLY).execute()
+                self._flushed = {key: values for key, values in self._flushed.items() if key[0] != PERIOD_MONTHLY}
+            except Exception as e:
+                logger.error('Failed to clear the previous monthly leaderboard', error=e)
+                with self._lock:
+                    self._month_rolled = True
+
+        updated_at = datetime.utcnow().isoformat()
+        written = 0
+
+        for start in range(0, len(changed), self.write_chunk_size):
+            chunk = changed[start:start + self.write_chunk_size]
+            try:
+                self.supabase.table('leaderboard') \
+                    .upsert([{**row, 'updated_at': updated_at} for row in chunk],
+                            on_conflict='user_id,challenge_id,period') \
+                    .execute()
+                for row in chunk:
+                    self._flushed[(row['period'], row['challenge_id'])] = (
+                        row['profit_percent'], row['total_trades'], row['win_rate'], row['rank_position']
+                    )
+                written += len(chunk)
+            except Exception as e:
+                logger.error('Failed to upsert leaderboard rows', rows=len(chunk), error=e)
+
+        if written:
+            logger.info('Leaderboard flush', rows=written)
+        return written
+
+    def stats(self) -> Dict:
+        """Return entry counts per period and pending work"""
+        with self._lock:
+            return {
+                'entries': {period: len(ranking) for period, ranking in self._rankings.items()},
+                'unresolved_challenges': len(self._unresolved),
+                'unresolved_dropped': self.unresolved_dropped,
+                'loaded': self.loaded
+            }
+
+
+# Global service instance
+leaderboard_service = None
+_service_lock = threading.Lock()
+
+
+def get_leaderboard_service(evaluator: PropFirmChallengeEvaluator = None,
+                            supabase_client: Client = None) -> LeaderboardService:
+    """
+    Get the singleton leaderboard service
+
+    The service is registered as a settlement listener on every evaluator
+    passed in, so the rankings follow the trades settled by this process.
+    supabase_client overrides evaluator.supabase for the (synchronous) loads
+    and flushes, e.g. when evaluator is the async one. Readers reload the
+    rankings every LEADERBOARD_RELOAD_INTERVAL minutes (see ensure_loaded).
+    """
+    global leaderboard_service
+    with _service_lock:
+        if leaderboard_service is None:
+            leaderboard_service = LeaderboardService(
+                supabase_client or evaluator.supabase,
+                max_age=float(os.getenv("LEADERBOARD_RELOAD_INTERVAL", "5")) * 60,
+                max_unresolved=int(os.getenv("LEADERBOARD_MAX_UNRESOLVED", "10000"))
+            )
+        if evaluator is not None and leaderboard_service.record_trades not in evaluator.settlement_listeners:
+            evaluator.add_settlement_listener(leaderboard_service.record_trades)
+    return leaderboard_service
@@ -0,0 +1,494 @@
+"""
+Mark-to-Market Engine for Open Positions
+
+Keeps every open `trades` row (is_open = true) of the active challenges in
+memory, grouped by asset_symbol into struct-of-arrays position books. On a
+tick the unrealized PnL of every position in that symbol is recomputed in one
+vectorized expression, the changes are summed per challenge with
+np.bincount, and the touched challenges are checked against the loss rules
+on equity instead of realized balance:
+
+    equity          = current_balance + unrealized PnL
+    daily equity    = daily_pnl + unrealized PnL  (equity vs. start-of-day balance)
+
+Only the daily and total loss rules apply to equity; the profit target is
+still reached on realized balance by the regular evaluation. Challenges that
+breach a loss limit are re-checked on their current row and open trades, then
+failed through apply_status_transitions in one batched write per tick batch,
+and their positions leave the books. With an evaluation
+queue attached, the breaches are enqueued instead and confirmed against the
+current challenge row (see evaluation_queue.py). Simulated quotes are never
+marked: the scheduler only starts the engine on a real market data source.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from market_data import Tick, real_ticks
+from prop_firm_service import PropFirmChallengeEvaluator, trade_pnl_coef
+from rule_engine import STATUS_FAILED, evaluate_rules_batch
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class PositionBook:
+    """
+    Open positions of one symbol as parallel arrays
+
+    Unrealized PnL is (price - entry_price) * coef, where coef is the
+    trade_pnl_coef of the trade: amount * leverage * direction / entry_price.
+    Removal swaps the last position into the freed slot, so arrays stay dense.
+    """
+
+    __slots__ = ('ids', 'index', 'entry', 'coef', 'challenge', 'pnl', 'size')
+
+    def __init__(self, capacity: int = 64):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.entry = np.empty(capacity, dtype=np.float64)
+        self.coef = np.empty(capacity, dtype=np.float64)
+        self.challenge = np.empty(capacity, dtype=np.intp)
+        self.pnl = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    @classmethod
+    def from_columns(cls, ids: List[str], entry, coef, challenge) -> 'PositionBook':
+        book = cls(capacity=max(len(ids), 64))
+        n = len(ids)
+        book.ids = list(ids)
+        book.index = {trade_id: i for i, trade_id in enumerate(ids)}
+        book.entry[:n] = entry
+        book.coef[:n] = coef
+        book.challenge[:n] = challenge
+        book.pnl[:n] = 0.0
+        book.size = n
+        return book
+
+    def _grow(self) -> None:
+        capacity = len(self.entry) * 2
+        for name in ('entry', 'coef', 'challenge', 'pnl'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, trade_id: str, entry: float, coef: float, challenge: int, pnl: float) -> None:
+        if self.size == len(self.entry):
+            self._grow()
+        i = self.size
+        self.ids.append(trade_id)
+        self.index[trade_id] = i
+        self.entry[i] = entry
+        self.coef[i] = coef
+        self.challenge[i] = challenge
+        self.pnl[i] = pnl
+        self.size += 1
+
+    def remove(self, trade_id: str):
+        """Drop a position; returns (challenge index, last marked pnl) or None"""
+        i = self.index.pop(trade_id, None)
+        if i is None:
+            return None
+
+        removed = (int(self.challenge[i]), float(self.pnl[i]))
+        last = self.size - 1
+        if i != last:
+            moved = self.ids[last]
+            self.ids[i] = moved
+            self.index[moved] = i
+            for array in (self.entry, self.coef, self.challenge, self.pnl):
+                array[i] = array[last]
+        self.ids.pop()
+        self.size = last
+        return removed
+
+    def mark(self, price: float):
+        """Re-mark every position at price; returns (pnl change, challenge index) arrays"""
+        n = self.size
+        pnl = (price - self.entry[:n]) * self.coef[:n]
+        delta = pnl - self.pnl[:n]
+        self.pnl[:n] = pnl
+        return delta, self.challenge[:n]
+
+    def __len__(self):
+        return self.size
+
+
+class MarkToMarketEngine:
+    """Marks open positions on every tick and fails challenges whose equity breaches a loss limit"""
+
+    CHALLENGE_COLUMNS = 'id, initial_capital, current_balance, daily_pnl'
+    TRADE_COLUMNS = 'id, challenge_id, asset_symbol, trade_type, amount, entry_price, leverage'
+
+    def __init__(self, evaluator: PropFirmChallengeEvaluator, page_size: int = 1000):
+        self.evaluator = evaluator
+        self.supabase = evaluator.supabase
+        self.page_size = page_size
+
+        self._lock = threading.RLock()
+        self._last_price: Dict[str, float] = {}
+        self.failed_total = 0
+        self.last_tick_ms = 0.0
+        self._reset_state()
+
+        # Set by ChallengeEvaluationQueue.attach_mark_to_market: equity breaches
+        # are enqueued for confirmation against the fresh challenge row
+        self.evaluation_queue = None
+
+    def _reset_state(self, capacity: int = 64) -> None:
+        self._books: Dict[str, PositionBook] = {}
+        self._trade_symbol: Dict[str, str] = {}
+        self._challenge_ids: List[Optional[str]] = []
+        self._challenge_index: Dict[str, int] = {}
+        self._challenge_trades: Dict[int, set] = {}
+        self._free: List[int] = []
+
+        self._initial = np.zeros(capacity, dtype=np.float64)
+        self._balance = np.zeros(capacity, dtype=np.float64)
+        self._daily = np.zeros(capacity, dtype=np.float64)
+        self._unrealized = np.zeros(capacity, dtype=np.float64)
+        self._active = np.zeros(capacity, dtype=bool)
+
+    def _grow_challenges(self) -> None:
+        capacity = len(self._initial) * 2
+        for name in ('_initial', '_balance', '_daily', '_unrealized', '_active'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_challenge(self, challenge: Dict) -> None:
+        """Insert or refresh an active challenge's realized balance and daily PnL"""
+        with self._lock:
+            i = self._challenge_index.get(challenge['id'])
+            if i is None:
+                if self._free:
+                    i = self._free.pop()
+                    self._challenge_ids[i] = challenge['id']
+                else:
+                    i = len(self._challenge_ids)
+                    if i == len(self._initial):
+                        self._grow_challenges()
+                    self._challenge_ids.append(challenge['id'])
+                self._challenge_index[challenge['id']] = i
+                self._unrealized[i] = 0.0
+
+            self._initial[i] = float(challenge['initial_capital'])
+            self._balance[i] = float(challenge['current_balance'])
+            self._daily[i] = float(challenge.get('daily_pnl') or 0.0)
+            self._active[i] = True
+
+    def remove_challenge(self, challenge_id: str) -> bool:
+        """Drop a challenge (no longer active) together with its positions"""
+        with self._lock:
+            i = self._challenge_index.pop(challenge_id, None)
+            if i is None:
+                return False
+
+            for trade_id in list(self._challenge_trades.pop(i, ())):
+                self._books[self._trade_symbol.pop(trade_id)].remove(trade_id)
+
+            self._challenge_ids[i] = None
+            self._active[i] = False
+            self._unrealized[i] = 0.0
+            self._free.append(i)
+            return True
+
+    def add_position(self, trade: Dict) -> bool:
+        """
+        Track an open trade; it is marked at the symbol's last price right away
+
+        Returns:
+            False if the trade's challenge is not tracked
+        """
+        with self._lock:
+            i = self._challenge_index.get(trade['challenge_id'])
+            if i is None:
+                return False
+
+            self.remove_position(trade['id'])
+            symbol = trade['asset_symbol']
+            entry = float(trade['entry_price'])
+            coef = trade_pnl_coef(trade)
+            last_price = self._last_price.get(symbol)
+            pnl = (last_price - entry) * coef if last_price is not None else 0.0
+
+            book = self._books.get(symbol)
+            if book is None:
+                book = self._books[symbol] = PositionBook()
+            book.append(trade['id'], entry, coef, i, pnl)
+
+            self._trade_symbol[trade['id']] = symbol
+            self._challenge_trades.setdefault(i, set()).add(trade['id'])
+            self._unrealized[i] += pnl
+            return True
+
+    def remove_position(self, trade_id: str) -> bool:
+        """Stop tracking a trade (closed); its unrealized PnL leaves the challenge's equity"""
+        with self._lock:
+            symbol = self._trade_symbol.pop(trade_id, None)
+            if symbol is None:
+                return False
+
+            i, pnl = self._books[symbol].remove(trade_id)
+            self._unrealized[i] -= pnl
+            self._challenge_trades[i].discard(trade_id)
+            return True
+
+    def on_settled(self, user_id: str, trades: List[Dict]) -> None:
+        """Settlement listener: closed trades leave the books, their PnL is now in current_balance"""
+        with self._lock:
+            for trade in trades:
+                if 'id' in trade:
+                    self.remove_position(trade['id'])
+
+    def refresh_positions(self, challenge_ids: List[str]) -> None:
+        """
+        Re-read the open trades of tracked challenges and sync their positions
+
+        Trades settled since the last load (possibly by another process) leave
+        the books and newly opened ones join them, so unrealized PnL never
+        repeats a loss that current_balance already holds.
+        """
+        with self._lock:
+            tracked = [challenge_id for challenge_id in challenge_ids if challenge_id in self._challenge_index]
+        if not tracked:
+            return
+
+        trades = self._fetch_all(self.TRADE_COLUMNS, lambda query: query.in_('challenge_id', tracked).eq('is_open', True))
+
+        with self._lock:
+            open_ids = {trade['id'] for trade in trades}
+            for challenge_id in tracked:
+                i = self._challenge_index.get(challenge_id)
+                if i is None:
+                    continue
+                for trade_id in list(self._challenge_trades.get(i, ())):
+                    if trade_id not in open_ids:
+                        self.remove_position(trade_id)
+            for trade in trades:
+                if trade['id'] not in self._trade_symbol:
+                    self.add_position(trade)
+
+    def on_price(self, symbol: str, price: float) -> List[Dict]:
+        """
+        Re-mark all positions in symbol and check the challenges holding them
+
+        Returns:
+            Failure transitions (build_status_update payloads with 'id') for
+            challenges whose equity breached a loss limit on this tick
+        """
+        with self._lock:
+            self._last_price[symbol] = price
+            book = self._books.get(symbol)
+            if not book:
+                return []
+
+            start = time.perf_counter()
+            delta, challenge = book.mark(price)
+            n = len(self._challenge_ids)
+            self._unrealized[:n] += np.bincount(challenge, weights=delta, minlength=n)
+
+            touched = np.zeros(n, dtype=bool)
+            touched[challenge] = True
+            rows = np.flatnonzero(touched & self._active[:n])
+
+            transitions = self._check_equity(rows)
+            self.last_tick_ms = (time.perf_counter() - start) * 1000
+            return transitions
+
+    def _check_equity(self, rows: np.ndarray) -> List[Dict]:
+        unrealized = self._unrealized[rows]
+        result = evaluate_rules_batch(
+            self._initial[rows],
+            self._balance[rows] + unrealized,
+            self._daily[rows] + unrealized,
+            self.evaluator.DAILY_LOSS_LIMIT_PERCENT,
+            self.evaluator.TOTAL_LOSS_LIMIT_PERCENT,
+            np.inf
+        )
+
+        failed = np.flatnonzero(result.status == STATUS_FAILED)
+        if not len(failed):
+            return []
+
+        ended_at = datetime.utcnow().isoformat()
+        transitions = []
+        for k in failed.tolist():
+            i = int(rows[k])
+            update = self.evaluator.build_status_update(
+                'failed', self.evaluator.rule_triggered_name(int(result.rule[k])), ended_at
+            )
+            update['id'] = self._challenge_ids[i]
+            transitions.append(update)
+            # A failed challenge is checked once; its positions go with it in on_ticks
+            self._active[i] = False
+        return transitions
+
+    def on_ticks(self, ticks) -> List[Dict]:
+        """Market data hub listener: mark a batch of ticks, then persist the failures once"""
+        transitions = []
+        for tick in real_ticks(ticks):
+            transitions.extend(self.on_price(tick.symbol, tick.price))
+
+        if transitions and self.evaluation_queue is not None:
+            # The queue re-checks on the current balance and removes or re-activates them
+            self.evaluation_queue.enqueue([t['id'] for t in transitions], 'price')
+            return transitions
+
+        if transitions:
+            transitions = self._confirm_failures([t['id'] for t in transitions])
+
+        if transitions:
+            logger.info('Challenges failed on equity', challenges=len(transitions))
+            result = self.evaluator.apply_status_transitions(transitions)
+            if not result.get('success', True):
+                logger.error('Failed to persist equity failures', error=result.get('error'))
+
+            for transition in transitions:
+                self.remove_challenge(transition['id'])
+            self.failed_total += len(transitions)
+        return transitions
+
+    def _confirm_failures(self, challenge_ids: List[str]) -> List[Dict]:
+        """
+        Re-check equity breaches on the current challenge rows and open trades
+
+        The tracked balance and positions may predate settlements since the
+        last load, which would count a realized loss twice. Challenges that
+        already ended elsewhere leave the books; the others are re-marked on
+        the fresh balance and fail only if they still breach.
+        """
+        rows = self._fetch_all(self.CHALLENGE_COLUMNS + ', status',
+                               lambda query: query.in_('id', challenge_ids), table='user_challenges')
+        active = []
+        with self._lock:
+            for row in rows:
+                if row['status'] == 'active':
+                    self.add_challenge(row)
+                    active.append(row['id'])
+            for challenge_id in set(challenge_ids) - set(active):
+                self.remove_challenge(challenge_id)
+
+        self.refresh_positions(active)
+
+        with self._lock:
+            indexes = [self._challenge_index[c] for c in active if c in self._challenge_index]
+            return self._check_equity(np.array(indexes, dtype=np.intp))
+
+    def unrealized_pnl(self, challenge_ids: List[str]) -> Dict[str, float]:
+        """Unrealized PnL of the tracked challenges among challenge_ids"""
+        with self._lock:
+            return {
+                challenge_id: float(self._unrealized[self._challenge_index[challenge_id]])
+                for challenge_id in challenge_ids
+                if challenge_id in self._challenge_index
+            }
+
+    def equity(self, challenge_id: str) -> Optional[Dict]:
+        """Realized balance, unrealized PnL and equity of a tracked challenge"""
+        with self._lock:
+            i = self._challenge_index.get(challenge_id)
+            if i is None:
+                return None
+            balance = float(self._balance[i])
+            unrealized = float(self._unrealized[i])
+            return {
+                'current_balance': balance,
+                'unrealized_pnl': unrealized,
+                'equity': balance + unrealized,
+                'open_positions': len(self._challenge_trades.get(i, ()))
+            }
+
+    def _fetch_all(self, columns: str, where, table: str = 'trades') -> List[Dict]:
+        """Keyset-paged read of table; where(query) applies the filters"""
+        rows = []
+        last_id = None
+
+        while True:
+            query = where(self.supabase.table(table).select(columns)) \
+                .order('id') \
+                .limit(self.page_size)
+
+            if last_id:
+                query = query.gt('id', last_id)
+
+            page = query.execute().data or []
+            rows.extend(page)
+
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1]['id']
+
+        return rows
+
+    def load(self) -> int:
+        """
+        Rebuild the books from the active challenges and their open trades
+
+        Positions are built column-wise per symbol and re-marked at the last
+        known prices, so equity is current as soon as the reload completes.
+
+        Returns:
+            Number of open positions tracked
+        """
+        challenges = self._fetch_all(self.CHALLENGE_COLUMNS, lambda query: query.eq('status', 'active'),
+                                     table='user_challenges')
+        trades = self._fetch_all(self.TRADE_COLUMNS, lambda query: query.eq('is_open', True))
+
+        with self._lock:
+            self._reset_state(capacity=max(len(challenges), 64))
+            for challenge in challenges:
+                self.add_challenge(challenge)
+
+            columns: Dict[str, tuple] = {}
+            for trade in trades:
+                i = self._challenge_index.get(trade['challenge_id'])
+                if i is None:
+                    continue
+                ids, entry, coef, challenge = columns.setdefault(trade['asset_symbol'], ([], [], [], []))
+                ids.append(trade['id'])
+                entry.append(float(trade['entry_price']))
+                coef.append(trade_pnl_coef(trade))
+                challenge.append(i)
+                self._trade_symbol[trade['id']] = trade['asset_symbol']
+                self._challenge_trades.setdefault(i, set()).add(trade['id'])
+
+            for symbol, (ids, entry, coef, challenge) in columns.items():
+                self._books[symbol] = PositionBook.from_columns(ids, entry, coef, challenge)
+
+            positions = len(self._trade_symbol)
+
+        # Failures found while re-marking are persisted like any other tick
+        self.on_ticks([Tick(symbol, price) for symbol, price in self._last_price.items()])
+
+        logger.info('Loaded open positions', positions=positions, challenges=len(challenges))
+        return positions
+
+    def stats(self) -> Dict:
+        """Return book sizes and counters"""
+        with self._lock:
+            return {
+                'challenges': len(self._challenge_index),
+                'open_positions': len(self._trade_symbol),
+                'symbols': sum(1 for book in self._books.values() if book),
+                'failed_total': self.failed_total,
+                'last_tick_ms': round(self.last_tick_ms, 3)
+            }
+
+
+# Global engine instance
+mark_to_market_engine = None
+
+
+def get_mark_to_market_engine(evaluator: PropFirmChallengeEvaluator) -> MarkToMarketEngine:
+    """Get singleton instance of the mark-to-market engine"""
+    global mark_to_market_engine
+    if mark_to_market_engine is None:
+        mark_to_market_engine = MarkToMarketEngine(evaluator)
+    return mark_to_market_engine
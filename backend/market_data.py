@@ -0,0 +1,444 @@
+"""
+In-Memory Market Data Hub
+
+Keeps a ring buffer of recent ticks per symbol, fed by a pluggable source
+polled on a background thread. Routes read the latest snapshot from memory,
+so clients polling for quotes never trigger upstream work.
+
+Sources (MARKET_DATA_SOURCE):
+- simulated: random quotes around reference prices (default); for display only,
+  their ticks (source 'simulated') are ignored by price alerts and mark-to-market
+- replay: replays ticks from a CSV or JSON-lines file (MARKET_DATA_FILE)
+- http: polls a JSON endpoint returning quotes (MARKET_DATA_URL), e.g. a local stub server
+- scraper: scrapes TradingView pages through Firecrawl (FIRECRAWL_API_KEY), like the
+  scrape-morocco-stocks edge function
+"""
+
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Moroccan stocks tracked by default, with the TradingView pages used by the scraper
+MOROCCO_STOCKS = [
+    {'symbol': 'IAM', 'name': 'Maroc Telecom', 'base_price': 114, 'price_range': (80, 200),
+     'url': 'https://fr.tradingview.com/symbols/CSEMA-IAM/'},
+    {'symbol': 'ATW', 'name': 'Attijariwafa Bank', 'base_price': 752, 'price_range': (500, 900),
+     'url': 'https://fr.tradingview.com/symbols/CSEMA-ATW/'},
+    {'symbol': 'BCP', 'name': 'Banque Centrale Populaire', 'base_price': 285, 'price_range': (200, 400),
+     'url': 'https://fr.tradingview.com/symbols/CSEMA-BCP/'},
+    {'symbol': 'CIH', 'name': 'CIH Bank', 'base_price': 420, 'price_range': (300, 550),
+     'url': 'https://fr.tradingview.com/symbols/CSEMA-CIH/'},
+    {'symbol': 'MNG', 'name': 'Managem', 'base_price': 1850, 'price_range': (1000, 2500),
+     'url': 'https://fr.tradingview.com/symbols/CSEMA-MNG/'},
+]
+
+
+# Tick.source of random quotes, including the scraper's fallback for unparsed pages
+SIMULATED = 'simulated'
+
+
+class Tick:
+    """One price observation for a symbol"""
+
+    __slots__ = ('symbol', 'price', 'name', 'change', 'change_percent', 'volume', 'timestamp', 'source')
+
+    def __init__(self, symbol: str, price: float, name: str = None, change: float = 0.0,
+                 change_percent: float = 0.0, volume: float = None, timestamp: float = None,
+                 source: str = None):
+        self.symbol = symbol
+        self.price = price
+        self.name = name
+        self.change = change
+        self.change_percent = change_percent
+        self.volume = volume
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.source = source
+
+    def to_dict(self) -> Dict:
+        """Quote in the /scrape-morocco-stocks response format"""
+        return {
+            'symbol': self.symbol,
+            'name': self.name,
+            'price': self.price,
+            'change': self.change,
+            'changePercent': self.change_percent,
+            'volume': self.volume,
+            'timestamp': datetime.fromtimestamp(self.timestamp, timezone.utc).isoformat(),
+            'source': self.source
+        }
+
+    def __repr__(self):
+        return f"Tick({self.symbol!r}, {self.price!r})"
+
+
+def real_ticks(ticks: List[Tick]) -> List[Tick]:
+    """Ticks from a real price feed; simulated quotes must never trigger user-facing state changes"""
+    return [tick for tick in ticks if tick.source != SIMULATED]
+
+
+class MarketDataHub:
+    """Per-symbol ring buffers of recent ticks, with a cached latest snapshot"""
+
+    def __init__(self, buffer_size: int = 256):
+        self.buffer_size = buffer_size
+
+        self._buffers: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[Tick]], None]] = []
+
+        self._version = 0
+        self._last_modified: Optional[float] = None
+        self._snapshot = None
+
+        self._source = None
+        self._poll_interval = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def publish(self, ticks: List[Tick]) -> None:
+        """Append ticks to their symbols' buffers and notify listeners"""
+        if not ticks:
+            return
+
+        with self._lock:
+            for tick in ticks:
+                buffer = self._buffers.get(tick.symbol)
+                if buffer is None:
+                    buffer = self._buffers[tick.symbol] = deque(maxlen=self.buffer_size)
+                buffer.append(tick)
+
+            self._version += 1
+            self._last_modified = time.time()
+            self._snapshot = None
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(ticks)
+            except Exception as e:
+                logger.error('Market data listener failed', error=e)
+
+    def subscribe(self, listener: Callable[[List[Tick]], None]) -> None:
+        """Call listener(ticks) after every published batch"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def latest(self, symbol: str) -> Optional[Tick]:
+        """Most recent tick of a symbol, or None"""
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            return buffer[-1] if buffer else None
+
+    def history(self, symbol: str, limit: int = None) -> List[Tick]:
+        """Buffered ticks of a symbol, oldest first"""
+        with self._lock:
+            ticks = list(self._buffers.get(symbol, ()))
+        return ticks[-limit:] if limit else ticks
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._buffers)
+
+    def snapshot(self) -> Tuple[List[Dict], str, Optional[float]]:
+        """
+        Latest quote of every symbol, rebuilt at most once per published batch
+
+        Returns:
+            (quotes, etag, last_modified epoch seconds or None if nothing was published)
+        """
+        with self._lock:
+            if self._snapshot is None:
+                quotes = [buffer[-1].to_dict() for buffer in self._buffers.values() if buffer]
+                body = json.dumps(quotes, sort_keys=True).encode('utf-8')
+                etag = hashlib.sha1(body).hexdigest()
+                self._snapshot = (quotes, etag, self._last_modified)
+            return self._snapshot
+
+    def start(self, source, poll_interval: float = 15.0) -> None:
+        """Fetch once synchronously, then keep polling source on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            logger.warning("Market data hub is already running")
+            return
+
+        self._source = source
+        self._poll_interval = poll_interval
+        self._stop.clear()
+        self.poll_once()
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name="MarketDataHub")
+        self._thread.start()
+        logger.info('Market data hub started', source=type(source).__name__, poll_interval_s=poll_interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def has_real_source(self) -> bool:
+        """False while quotes come from SimulatedSource (MARKET_DATA_SOURCE=simulated)"""
+        return self._source is not None and not isinstance(self._source, SimulatedSource)
+
+    def poll_once(self) -> int:
+        """Fetch one batch from the source and publish it; returns the number of ticks"""
+        try:
+            ticks = self._source.fetch()
+        except Exception as e:
+            logger.error('Market data source failed', source=type(self._source).__name__, error=e)
+            return 0
+
+        self.publish(ticks)
+        return len(ticks)
+
+    def _run(self):
+        while not self._stop.wait(self._poll_interval):
+            self.poll_once()
+
+
+class SimulatedSource:
+    """Random quotes within ±volatility of reference prices (the edge function's fallback data)"""
+
+    def __init__(self, stocks: List[Dict] = None, volatility: float = 0.02, seed: int = None):
+        self.stocks = stocks or MOROCCO_STOCKS
+        self.volatility = volatility
+        self.random = random.Random(seed)
+
+    def fetch(self) -> List[Tick]:
+        return [simulated_tick(stock, self.volatility, self.random) for stock in self.stocks]
+
+
+def simulated_tick(stock: Dict, volatility: float = 0.02, rng=random) -> Tick:
+    variation = (rng.random() - 0.5) * stock['base_price'] * volatility * 2
+    return Tick(
+        symbol=stock['symbol'],
+        name=stock['name'],
+        price=round(stock['base_price'] + variation, 2),
+        change=round(variation, 2),
+        change_percent=round(variation / stock['base_price'] * 100, 2),
+        source=SIMULATED
+    )
+
+
+class FileReplaySource:
+    """
+    Replays ticks from a file, batch_size rows per fetch
+
+    Accepts CSV with a header or JSON lines, with fields symbol, price and
+    optionally name, change, changePercent, volume and timestamp (epoch seconds).
+    Restarts from the top when the file is exhausted if loop is set.
+    """
+
+    def __init__(self, path: str, batch_size: int = 50, loop: bool = True):
+        self.path = path
+        self.batch_size = batch_size
+        self.loop = loop
+        self.rows = self._load(path)
+        self.position = 0
+
+    @staticmethod
+    def _load(path: str) -> List[Dict]:
+        with open(path, newline='') as f:
+            if path.endswith('.csv'):
+                return list(csv.DictReader(f))
+            return [json.loads(line) for line in f if line.strip()]
+
+    def fetch(self) -> List[Tick]:
+        if self.position >= len(self.rows):
+            if not self.loop:
+                return []
+            self.position = 0
+
+        batch = self.rows[self.position:self.position + self.batch_size]
+        self.position += len(batch)
+        return [tick_from_quote(row, source='replay') for row in batch]
+
+
+class HttpJsonSource:
+    """Polls a JSON endpoint returning {"data": [quotes]} or {"stocks": [quotes]}"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def fetch(self) -> List[Tick]:
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        payload = response.json()
+
+        if isinstance(payload, dict):
+            quotes = payload.get('data') or payload.get('stocks') or []
+        else:
+            quotes = payload
+        return [tick_from_quote(quote, source='http') for quote in quotes]
+
+
+class TradingViewScraperSource:
+    """
+    Scrapes TradingView quote pages through Firecrawl
+
+    Python port of the scrape-morocco-stocks edge function: symbols whose
+    page cannot be parsed fall back to simulated quotes.
+    """
+
+    FIRECRAWL_URL = 'https://api.firecrawl.dev/v1/scrape'
+
+    def __init__(self, api_key: str, stocks: List[Dict] = None, timeout: float = 30.0):
+        self.api_key = api_key
+        self.stocks = stocks or MOROCCO_STOCKS
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def fetch(self) -> List[Tick]:
+        ticks = []
+        for stock in self.stocks:
+            tick = None
+            try:
+                response = self.session.post(
+                    self.FIRECRAWL_URL,
+                    headers={'Authorization': f'Bearer {self.api_key}'},
+                    json={'url': stock['url'], 'formats': ['markdown'], 'onlyMainContent': True, 'waitFor': 3000},
+                    timeout=self.timeout
+                )
+                data = response.json()
+                if data.get('success') and data.get('data', {}).get('markdown'):
+                    tick = parse_tradingview_markdown(data['data']['markdown'], stock)
+            except Exception as e:
+                logger.error('Error fetching quote from TradingView', symbol=stock['symbol'], error=e)
+
+            if tick is None:
+                logger.warning('Could not extract quote from TradingView, using simulated data',
+                               symbol=stock['symbol'])
+                tick = simulated_tick(stock)
+            ticks.append(tick)
+        return ticks
+
+
+PRICE_PATTERNS = [
+    re.compile(r'(\d{1,4}[,.]\d{1,2})\s*D?MAD', re.IGNORECASE),
+    re.compile(r'(\d{3,4})\s*D?MAD', re.IGNORECASE),
+]
+CHANGE_PATTERNS = [
+    re.compile(r'([+−-]?\d+[,.]\d{1,2})[+−-]?(\d+[,.]\d{1,2})%'),
+    re.compile(r'([+−-]?\d+[,.]\d{1,2})\s*%'),
+]
+
+
+def parse_tradingview_markdown(markdown: str, stock: Dict) -> Optional[Tick]:
+    """Extract price and change from a TradingView page (French number format)"""
+    low, high = stock['price_range']
+    cleaned = re.sub(r'(\d)\s+(\d)', r'\1\2', markdown)
+
+    price = 0.0
+    for pattern in PRICE_PATTERNS:
+        for match in pattern.finditer(cleaned):
+            candidate = float(match.group(1).replace(',', '.'))
+            if low <= candidate <= high:
+                price = candidate
+                break
+        if price:
+            break
+
+    if not price:
+        return None
+
+    change = 0.0
+    change_percent = 0.0
+    for pattern in CHANGE_PATTERNS:
+        match = pattern.search(cleaned)
+        if not match:
+            continue
+
+        if match.lastindex == 2:
+            change = float(match.group(1).replace(',', '.').replace('−', '-'))
+            change_percent = float(match.group(2).replace(',', '.'))
+            if '−' in match.group(0) or match.group(0).startswith('-'):
+                change = -abs(change)
+                change_percent = -abs(change_percent)
+        else:
+            change_percent = float(match.group(1).replace(',', '.').replace('−', '-'))
+            change = price * change_percent / 100
+
+        if abs(change_percent) < 15:
+            break
+
+    return Tick(
+        symbol=stock['symbol'],
+        name=stock['name'],
+        price=price,
+        change=round(change, 2),
+        change_percent=round(change_percent, 2),
+        source='tradingview'
+    )
+
+
+def tick_from_quote(quote: Dict, source: str = None) -> Tick:
+    """Build a Tick from a quote dict (edge function, replay file or stub server format)"""
+    def number(key, default=None):
+        value = quote.get(key)
+        return float(value) if value not in (None, '') else default
+
+    return Tick(
+        symbol=quote['symbol'],
+        price=float(quote['price']),
+        name=quote.get('name'),
+        change=number('change', 0.0),
+        change_percent=number('changePercent', 0.0),
+        volume=number('volume'),
+        timestamp=number('timestamp'),
+        source=quote.get('source') or source
+    )
+
+
+def create_source_from_env():
+    """Build the market data source selected by MARKET_DATA_SOURCE"""
+    kind = os.getenv("MARKET_DATA_SOURCE", "simulated")
+
+    if kind == 'simulated':
+        return SimulatedSource()
+    if kind == 'replay':
+        return FileReplaySource(
+            os.getenv("MARKET_DATA_FILE", "market_data.csv"),
+            batch_size=int(os.getenv("MARKET_DATA_REPLAY_BATCH", "50"))
+        )
+    if kind == 'http':
+        return HttpJsonSource(os.getenv("MARKET_DATA_URL", "http://127.0.0.1:8001/quotes"))
+    if kind == 'scraper':
+        api_key = os.getenv("FIRECRAWL_API_KEY")
+        if not api_key:
+            raise ValueError("FIRECRAWL_API_KEY must be set for the scraper market data source")
+        return TradingViewScraperSource(api_key)
+
+    raise ValueError(f"Unknown market data source: {kind}")
+
+
+# Global hub instance
+market_data_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_market_data_hub() -> MarketDataHub:
+    """Get the singleton hub, starting its source on first use"""
+    global market_data_hub
+    if market_data_hub is None:
+        with _hub_lock:
+            if market_data_hub is None:
+                hub = MarketDataHub(buffer_size=int(os.getenv("MARKET_DATA_BUFFER_SIZE", "256")))
+                hub.start(create_source_from_env(), poll_interval=float(os.getenv("MARKET_DATA_POLL_INTERVAL", "15")))
+                market_data_hub = hub
+    return market_data_hub
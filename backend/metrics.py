@@ -0,0 +1,320 @@
+"""
+Prometheus Metrics
+
+Counters, gauges and histograms served by the /metrics endpoint of app.py
+and asgi_app.py in the Prometheus text exposition format (0.0.4):
+- http_request_duration_seconds{method,route,status} and
+  http_requests_in_flight: every request, labelled by its route template
+- database_requests_total / database_request_duration_seconds
+  {backend,table,operation}: every Supabase (or SQLite) call, recorded by
+  the pooled transport in supabase_client.py and by persistence.py
+- scheduler_sweep_duration_seconds{mode} and
+  scheduler_sweep_challenges_total{outcome}: evaluation sweeps
+- cache_hits_total / cache_misses_total / cache_hit_ratio / cache_entries
+  {cache}: read at scrape time from the caches registered with track_cache()
+
+Recording is lock-free on the hot path: every thread writes its own shard of
+a metric (one writer per shard, so plain increments are safe under the GIL)
+and a scrape sums the shards. A lock is only taken the first time a thread
+touches a metric, when that thread exits and while a scrape reads the
+shards. An exited thread's shard is folded into a shared one, so servers
+running a thread per request keep one shard per live thread.
+"""
+
+import bisect
+import itertools
+import math
+import threading
+import weakref
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; request and database latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds; background sweeps run for much longer than requests
+SWEEP_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class MetricsRegistry:
+    """Set of metrics rendered together by one scrape"""
+
+    def __init__(self):
+        self._metrics: Dict[str, 'Metric'] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: 'Metric') -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional['Metric']:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _ShardOwner:
+    """Held only by a thread's threading.local; collected when the thread exits"""
+
+    __slots__ = ('__weakref__',)
+
+
+class Metric:
+    """Base of the sharded metrics: each thread accumulates into its own {labels: cell} dict"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._local = threading.local()
+        self._shards: Dict[int, Dict[Tuple, list]] = {}
+        self._retired: Dict[Tuple, list] = {}
+        self._shard_keys = itertools.count()
+        self._shards_lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _shard(self) -> Dict[Tuple, list]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                key = next(self._shard_keys)
+                self._shards[key] = shard
+            weakref.finalize(owner, self._retire, key).atexit = False
+        return shard
+
+    def _retire(self, key: int) -> None:
+        """Fold an exited thread's shard into the shared one (cells are lists of numbers)"""
+        with self._shards_lock:
+            shard = self._shards.pop(key, None)
+            for labels, cell in (shard or {}).items():
+                retired = self._retired.get(labels)
+                if retired is None:
+                    self._retired[labels] = list(cell)
+                else:
+                    for i, value in enumerate(cell):
+                        retired[i] += value
+
+    def shard_count(self) -> int:
+        """Shards of live threads"""
+        with self._shards_lock:
+            return len(self._shards)
+
+    def _cells(self) -> Dict[Tuple, List[list]]:
+        """Copies of the cells of every shard grouped by label values"""
+        cells: Dict[Tuple, List[list]] = {}
+        # Under the lock, so a retiring shard is never counted twice or missed
+        with self._shards_lock:
+            for shard in (self._retired, *self._shards.values()):
+                # list() of a dict view runs without releasing the GIL, so a
+                # writer adding a label set cannot break the iteration
+                for labels, cell in list(shard.items()):
+                    cells.setdefault(labels, []).append(list(cell))
+        return cells
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+
+    kind = 'counter'
+
+    def inc(self, labels: Tuple = (), amount: float = 1.0) -> None:
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            cell = shard[labels] = [0.0]
+        cell[0] += amount
+
+    def value(self, labels: Tuple = ()) -> float:
+        return sum(cell[0] for cell in self._cells().get(labels, ()))
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_format_value(sum(c[0] for c in cells))}"
+                for labels, cells in sorted(self._cells().items())]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, sharded like a counter
+
+    Meant for inc()/dec() pairs on the same thread, e.g. requests in flight.
+    """
+
+    kind = 'gauge'
+
+    def dec(self, labels: Tuple = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative `le` buckets, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: MetricsRegistry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # One count per bucket, one for +Inf, then the sum
+            cell = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _summarize(self, cells: Sequence[list]) -> Dict:
+        counts = [sum(cell[i] for cell in cells) for i in range(len(self.buckets) + 1)]
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {'buckets': buckets, 'count': cumulative, 'sum': sum(cell[-1] for cell in cells)}
+
+    def snapshot(self, labels: Tuple = ()) -> Dict:
+        """{'buckets': {le: cumulative count}, 'count', 'sum'} for one label set"""
+        return self._summarize(self._cells().get(labels, ()))
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, cells in sorted(self._cells().items()):
+            snapshot = self._summarize(cells)
+            for bound, count in snapshot['buckets'].items():
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_format_value(snapshot['sum'])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {snapshot['count']}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Metric whose values are read at scrape time: callback() -> {label values: value}"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple, float]], kind: str = 'gauge',
+                 registry: MetricsRegistry = REGISTRY):
+        self.kind = kind
+        self.callback = callback
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in sorted(self.callback().items())]
+
+
+# ---------------------------------------------------------------------------
+# Metrics of the backend
+# ---------------------------------------------------------------------------
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests by route template',
+    ('method', 'route', 'status'))
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests being served')
+
+DATABASE_REQUESTS = Counter(
+    'database_requests_total', 'Database calls by backend, table, operation and status',
+    ('backend', 'table', 'operation', 'status'))
+DATABASE_REQUEST_DURATION = Histogram(
+    'database_request_duration_seconds', 'Latency of database calls by backend, table and operation',
+    ('backend', 'table', 'operation'))
+
+SCHEDULER_SWEEP_DURATION = Histogram(
+    'scheduler_sweep_duration_seconds', 'Duration of the scheduler evaluation sweeps',
+    ('mode',), buckets=SWEEP_BUCKETS)
+SCHEDULER_SWEEP_CHALLENGES = Counter(
+    'scheduler_sweep_challenges_total', 'Challenges evaluated by the scheduler sweeps, by outcome',
+    ('outcome',))
+
+
+def record_request(method: str, route: str, status: int, seconds: float) -> None:
+    HTTP_REQUEST_DURATION.observe(seconds, (method, route, str(status)))
+
+
+def record_database_call(backend: str, table: str, operation: str, status: str, seconds: float) -> None:
+    DATABASE_REQUESTS.inc((backend, table, operation, status))
+    DATABASE_REQUEST_DURATION.observe(seconds, (backend, table, operation))
+
+
+# Outcome label of every counter in the scheduler's sweep results
+SWEEP_OUTCOMES = {'successes': 'success', 'failures': 'failed', 'unchanged': 'unchanged', 'errors': 'error'}
+
+
+def record_sweep(mode: str, seconds: float, results: Dict) -> None:
+    """Record one sweep; results is the scheduler's evaluation_results dict"""
+    SCHEDULER_SWEEP_DURATION.observe(seconds, (mode,))
+    for key, outcome in SWEEP_OUTCOMES.items():
+        if results.get(key):
+            SCHEDULER_SWEEP_CHALLENGES.inc((outcome,), results[key])
+
+
+# {cache name: stats() callable returning TTLCache.stats()}
+_caches: Dict[str, Callable[[], Dict]] = {}
+
+
+def track_cache(name: str, stats: Callable[[], Dict]) -> None:
+    """Expose a cache's hit/miss counters; stats() returns TTLCache.stats()"""
+    _caches[name] = stats
+
+
+def _cache_values(key: str) -> Callable[[], Dict[Tuple, float]]:
+    def read():
+        return {(name,): stats()[key] for name, stats in list(_caches.items())}
+    return read
+
+
+CallbackMetric('cache_hits_total', 'Cache hits', ('cache',), _cache_values('hits'), kind='counter')
+CallbackMetric('cache_misses_total', 'Cache misses', ('cache',), _cache_values('misses'), kind='counter')
+CallbackMetric('cache_hit_ratio', 'Cache hits over lookups since start', ('cache',), _cache_values('hit_ratio'))
+CallbackMetric('cache_entries', 'Entries held by the cache', ('cache',), _cache_values('size'))
+
+
+def render() -> str:
+    """The /metrics response body"""
+    return REGISTRY.render()
@@ -0,0 +1,879 @@
+"""
+Pluggable Persistence Backends
+
+The services are written against one interface: the subset of the supabase
+client they use, i.e.
+- table(name) query builders: select / insert / upsert / update / delete,
+  filters eq / neq / in_ / gt / gte / lt / lte / is_, order, limit,
+  single and maybe_single, then execute() returning an object with .data
+- rpc(name, params).execute() for the Postgres functions in
+  tradesense-ai-main/supabase/migrations
+
+Two backends implement it, selected with DATABASE_BACKEND:
+- supabase (default): hosted Postgres through PostgREST (supabase_client.py)
+- sqlite: an embedded database file, SQLiteClient below
+
+The SQLite schema is translated at startup from database_dump.sql and the
+migrations (SQLITE_SCHEMA_SOURCES): tables, indexes and the updated_at
+triggers are kept, Postgres-only objects (views, policies, functions,
+grants) are skipped. Every query shape compiles to the same parameterized
+SQL, so sqlite3's statement cache serves repeated queries as prepared
+statements. Database files run in WAL mode with one connection per thread.
+The RPCs on the hot paths (settle_trade, apply_challenge_transitions,
+reset_daily_metrics, rebuild_trade_stats) run as native transactions; the
+others raise the PostgREST "function not found" error, so the services take
+their client-side fallbacks.
+
+Configuration:
+- SQLITE_PATH: database file (default tradesense.db; ':memory:' for a
+  process-local database)
+- SQLITE_SCHEMA_SOURCES: schema files and migration directories, separated
+  by os.pathsep (default: the repository's dump and migrations)
+- SQLITE_BUSY_TIMEOUT: seconds a writer waits for the database lock (default 5)
+"""
+
+import asyncio
+import datetime
+import decimal
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from postgrest.exceptions import APIError
+
+import metrics
+from structured_logging import get_logger
+import tracing
+
+logger = get_logger(__name__)
+
+DATABASE_BACKENDS = ('supabase', 'sqlite')
+
+_REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SCHEMA_SOURCES = (
+    _REPOSITORY_ROOT / 'database_dump.sql',
+    _REPOSITORY_ROOT / 'tradesense-ai-main' / 'supabase' / 'migrations',
+)
+
+# Timestamps are stored as ISO 8601 text in the format PostgREST returns
+NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now')"
+
+# Indexes for the services' access patterns on top of the translated schema
+SQLITE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_trades_challenge_open ON trades (challenge_id, is_open)',
+    'CREATE INDEX IF NOT EXISTS idx_trades_user_open ON trades (user_id, is_open)',
+)
+
+
+class QueryResponse:
+    """Shape of postgrest's APIResponse"""
+
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class QueryBuilder:
+    """
+    Query builder chain shared by the non-Supabase clients
+
+    Records the operation, filters and modifiers of one request; subclasses
+    implement execute().
+    """
+
+    def __init__(self, table: str):
+        self.table_name = table
+        self.operation = 'select'
+        self.columns: Optional[List[str]] = None
+        self.count_mode: Optional[str] = None
+        self.payload = None
+        self.on_conflict = 'id'
+        self.filters: List = []
+        self.order_by = None
+        self.descending = False
+        self.limit_count = None
+        self.single_mode = None
+
+    # Operations
+    def select(self, columns: str = '*', count: str = None):
+        self.operation = 'select'
+        names = [c.strip() for c in columns.split(',')]
+        self.columns = None if '*' in names else names
+        self.count_mode = count
+        return self
+
+    def insert(self, rows):
+        self.operation, self.payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = 'id'):
+        self.operation, self.payload, self.on_conflict = 'upsert', rows, on_conflict
+        return self
+
+    def update(self, values: Dict):
+        self.operation, self.payload = 'update', values
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    # Filters
+    def _filter(self, op: str, column: str, value):
+        self.filters.append((op, column, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter('eq', column, value)
+
+    def neq(self, column, value):
+        return self._filter('neq', column, value)
+
+    def in_(self, column, values):
+        return self._filter('in', column, list(values))
+
+    def gt(self, column, value):
+        return self._filter('gt', column, value)
+
+    def gte(self, column, value):
+        return self._filter('gte', column, value)
+
+    def lt(self, column, value):
+        return self._filter('lt', column, value)
+
+    def lte(self, column, value):
+        return self._filter('lte', column, value)
+
+    def is_(self, column, value):
+        return self._filter('is', column, None if value in (None, 'null') else value)
+
+    # Modifiers
+    def order(self, column: str, desc: bool = False):
+        self.order_by, self.descending = column, desc
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def single(self):
+        self.single_mode = 'single'
+        return self
+
+    def maybe_single(self):
+        self.single_mode = 'maybe_single'
+        return self
+
+    def _response(self, data: List[Dict], count: Optional[int] = None):
+        """Apply single / maybe_single to the rows of a finished request"""
+        if self.single_mode is None:
+            return QueryResponse(data, count)
+        if len(data) > 1 or (not data and self.single_mode == 'single'):
+            raise APIError({'code': 'PGRST116', 'message': 'JSON object requested, multiple (or no) rows returned'})
+        if not data:
+            # maybe_single() returns no response for zero rows
+            return None
+        return QueryResponse(data[0], count)
+
+
+def _timed(table: str, operation: str, run: Callable):
+    """Run one call and record it in the database_* metrics and the request trace; the status is 'ok' or the error code"""
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        response = run()
+        status = 'ok'
+        return response
+    except APIError as e:
+        status = e.code or 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.record_database_call('sqlite', table, operation, status, elapsed)
+        tracing.record(f'db.{table}.{operation}', elapsed)
+
+
+def missing_function_error(name: str) -> APIError:
+    """The error PostgREST returns for a function that is not deployed"""
+    return APIError({'code': 'PGRST202', 'message': f'Could not find the function public.{name}'})
+
+
+# ---------------------------------------------------------------------------
+# Schema translation (Postgres dump -> SQLite)
+# ---------------------------------------------------------------------------
+
+def split_statements(sql: str) -> List[str]:
+    """Split a SQL script into statements, dropping comments and keeping quoted bodies intact"""
+    statements, current = [], []
+    i, length = 0, len(sql)
+    while i < length:
+        char = sql[i]
+        if sql.startswith('--', i):
+            i = sql.find('\n', i)
+            i = length if i < 0 else i
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+            continue
+        if sql.startswith('$$', i):
+            end = sql.find('$$', i + 2)
+            end = length if end < 0 else end + 2
+            current.append(sql[i:end])
+            i = end
+            continue
+        if char == "'":
+            end = i + 1
+            while end < length:
+                if sql[end] == "'" and sql.startswith("''", end):
+                    end += 2
+                elif sql[end] == "'":
+                    break
+                else:
+                    end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def _split_top_level(body: str) -> List[str]:
+    """Split on commas outside parentheses and quotes"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(body):
+        if char == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(body[start:i].strip())
+            start = i + 1
+    parts.append(body[start:].strip())
+    return [part for part in parts if part]
+
+
+_COLUMN_TYPES = (
+    (r'TIMESTAMP(?:TZ|\s+WITH(?:OUT)?\s+TIME\s+ZONE)?', 'TEXT'),
+    (r'UUID', 'TEXT'),
+    (r'(?:DECIMAL|NUMERIC)(?:\s*\([^)]*\))?', 'REAL'),
+    (r'DOUBLE\s+PRECISION|REAL|FLOAT\d*', 'REAL'),
+    (r'(?:BIG|SMALL)?INT(?:EGER)?|(?:BIG)?SERIAL', 'INTEGER'),
+    (r'BOOL(?:EAN)?', 'BOOLEAN'),
+    (r'JSONB?|TEXT\s*\[\]|VARCHAR(?:\s*\(\d+\))?|TEXT', 'TEXT'),
+)
+
+_TABLE_CONSTRAINT = re.compile(r'^(?:UNIQUE|PRIMARY\s+KEY|CHECK|FOREIGN\s+KEY|CONSTRAINT)\b', re.I)
+_AUTH_REFERENCE = re.compile(r'\s*REFERENCES\s+auth\.\w+\s*\([^)]*\)(?:\s+ON\s+(?:DELETE|UPDATE)\s+'
+                             r'(?:CASCADE|RESTRICT|SET\s+NULL|SET\s+DEFAULT|NO\s+ACTION))*', re.I)
+
+
+def _translate_clause(clause: str) -> str:
+    """Rewrite the Postgres-specific parts of a column or constraint clause"""
+    clause = _AUTH_REFERENCE.sub('', clause)
+    clause = re.sub(r'\bpublic\.', '', clause)
+    clause = re.sub(r'\s*DEFAULT\s+gen_random_uuid\(\)', '', clause, flags=re.I)
+    clause = re.sub(r'DEFAULT\s+(?:now\(\)|CURRENT_TIMESTAMP)', f'DEFAULT ({NOW_SQL})', clause, flags=re.I)
+    clause = re.sub(r"::[\w.]+(?:\[\])?", '', clause)
+    return clause
+
+
+def _translate_column(definition: str, enums: Dict[str, List[str]]) -> str:
+    name, _, rest = definition.partition(' ')
+    rest = rest.strip()
+
+    enum = re.match(r'(?:public\.)?(\w+)\b', rest)
+    if enum and enum.group(1).lower() in enums:
+        values = ', '.join(f"'{value}'" for value in enums[enum.group(1).lower()])
+        rest = f"TEXT CHECK ({name} IN ({values})){rest[enum.end():]}"
+    else:
+        for pattern, sqlite_type in _COLUMN_TYPES:
+            match = re.match(pattern + r'(?![\w(])', rest, re.I)
+            if match:
+                rest = sqlite_type + rest[match.end():]
+                break
+
+    return f"{name} {_translate_clause(rest)}"
+
+
+def translate_schema(sql: str, enums: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """
+    Translate a Postgres schema script into SQLite statements
+
+    Tables, indexes, added columns and updated_at triggers are translated;
+    everything else is Postgres-specific and skipped. Enum types become TEXT
+    with a CHECK constraint. Every statement is idempotent (IF NOT EXISTS,
+    and ADD COLUMN is skipped by apply_schema when the column exists), so a
+    database can be migrated again at every start.
+
+    Args:
+        sql: Postgres script (a dump or a migration)
+        enums: Enum types seen in earlier scripts; updated in place
+    """
+    enums = {} if enums is None else enums
+    translated = []
+
+    for statement in split_statements(sql):
+        flat = ' '.join(statement.split())
+
+        match = re.match(r"CREATE TYPE (?:public\.)?(\w+) AS ENUM \((.*)\)$", flat, re.I)
+        if match:
+            enums[match.group(1).lower()] = re.findall(r"'([^']*)'", match.group(2))
+            continue
+
+        match = re.match(r'CREATE TABLE (?:IF NOT EXISTS )?(?:public\.)?(\w+) \((.*)\)$', flat, re.I)
+        if match:
+            elements = []
+            for element in _split_top_level(match.group(2)):
+                if _TABLE_CONSTRAINT.match(element):
+                    elements.append(_translate_clause(element))
+                else:
+                    elements.append(_translate_column(element, enums))
+            columns = ',\n  '.join(elements)
+            translated.append(f"CREATE TABLE IF NOT EXISTS {match.group(1)} (\n  {columns}\n)")
+            continue
+
+        match = re.match(r'ALTER TABLE (?:ONLY )?(?:public\.)?(\w+) (ADD COLUMN .*)$', flat, re.I)
+        if match:
+            for addition in _split_top_level(match.group(2)):
+                column = re.sub(r'^ADD COLUMN (?:IF NOT EXISTS )?', '', addition, flags=re.I)
+                translated.append(f"ALTER TABLE {match.group(1)} ADD COLUMN {_translate_column(column, enums)}")
+            continue
+
+        match = re.match(r'CREATE (UNIQUE )?INDEX (?:IF NOT EXISTS )?(\w+) ON (?:public\.)?(\w+)'
+                         r'(?: USING btree)? ?(\(.*)$', flat, re.I)
+        if match:
+            unique, name, table, rest = match.groups()
+            translated.append(f"CREATE {unique or ''}INDEX IF NOT EXISTS {name} ON {table} {_translate_clause(rest)}")
+            continue
+
+        match = re.match(r'CREATE TRIGGER (\w+) BEFORE UPDATE ON (?:public\.)?(\w+) FOR EACH ROW '
+                         r'EXECUTE (?:FUNCTION|PROCEDURE) (?:public\.)?update_updated_at_column\(\)$', flat, re.I)
+        if match:
+            name, table = match.groups()
+            # SQLite triggers cannot assign NEW; stamp the row after the update instead
+            translated.append(
+                f"CREATE TRIGGER IF NOT EXISTS {name} AFTER UPDATE ON {table} FOR EACH ROW "
+                f"WHEN NEW.updated_at IS OLD.updated_at BEGIN "
+                f"UPDATE {table} SET updated_at = {NOW_SQL} WHERE rowid = NEW.rowid; END"
+            )
+
+    return translated
+
+
+def schema_scripts(sources: Sequence) -> List[Path]:
+    """Schema files in apply order: files as given, directories by file name"""
+    scripts = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            scripts.extend(sorted(path.glob('*.sql')))
+        elif path.exists():
+            scripts.append(path)
+        else:
+            raise FileNotFoundError(f"Schema source not found: {path}")
+    return scripts
+
+
+# ---------------------------------------------------------------------------
+# SQLite client
+# ---------------------------------------------------------------------------
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _parameter(value):
+    """Python value -> SQLite parameter, following PostgREST's JSON encoding"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+_INTEGRITY_CODES = (
+    ('UNIQUE', '23505'),
+    ('FOREIGN KEY', '23503'),
+    ('NOT NULL', '23502'),
+    ('CHECK', '23514'),
+)
+
+
+def _api_error(error: sqlite3.Error) -> APIError:
+    """Map a sqlite3 error to the APIError PostgREST would raise"""
+    message = str(error)
+    code = 'XX000'
+    if isinstance(error, sqlite3.IntegrityError):
+        code = next((c for marker, c in _INTEGRITY_CODES if marker in message.upper()), '23000')
+    elif 'locked' in message or 'busy' in message:
+        code = '55P03'
+    return APIError({'code': code, 'message': message})
+
+
+class SQLiteQuery(QueryBuilder):
+    """Query builder compiling to one parameterized SQLite statement"""
+
+    def __init__(self, client: 'SQLiteClient', table: str):
+        super().__init__(table)
+        self.client = client
+
+    def _column(self, table_columns: Dict[str, str], column: str) -> str:
+        if column not in table_columns:
+            raise APIError({'code': '42703', 'message': f'column {self.table_name}.{column} does not exist'})
+        return _quote(column)
+
+    def _where(self, table_columns: Dict[str, str]) -> Tuple[str, List]:
+        clauses, parameters = [], []
+        for op, column, value in self.filters:
+            name = self._column(table_columns, column)
+            if op == 'in':
+                clauses.append(f"{name} IN (SELECT value FROM json_each(?))")
+                parameters.append(json.dumps([_parameter(v) for v in value]))
+            elif op == 'is':
+                clauses.append(f"{name} IS ?")
+                parameters.append(value)
+            else:
+                clauses.append(f"{name} {_OPERATORS[op]} ?")
+                parameters.append(_parameter(value))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', parameters
+
+    def _rows(self, table_columns: Dict[str, str]) -> List[Dict]:
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        rows = [dict(row) for row in rows]
+        if 'id' in table_columns:
+            for row in rows:
+                if row.get('id') is None:
+                    row['id'] = str(uuid.uuid4())
+        for row in rows:
+            for column in row:
+                self._column(table_columns, column)
+        return rows
+
+    def _write_rows(self, db: sqlite3.Connection, table_columns: Dict[str, str]) -> List[Dict]:
+        table = _quote(self.table_name)
+        data = []
+        for row in self._rows(table_columns):
+            columns = list(row)
+            sql = (f"INSERT INTO {table} ({', '.join(map(_quote, columns))}) "
+                   f"VALUES ({', '.join('?' * len(columns))})")
+            if self.operation == 'upsert':
+                conflict = [c.strip() for c in self.on_conflict.split(',')]
+                updates = [c for c in columns if c not in conflict] or conflict[:1]
+                sql += (f" ON CONFLICT ({', '.join(self._column(table_columns, c) for c in conflict)}) DO UPDATE SET "
+                        + ', '.join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates))
+            cursor = db.execute(sql + ' RETURNING *', [_parameter(row[c]) for c in columns])
+            data.extend(self.client._decode(self.table_name, cursor))
+        return data
+
+    def _run_statement(self):
+        table_columns = self.client.columns(self.table_name)
+        table = _quote(self.table_name)
+        where, parameters = self._where(table_columns)
+        count = None
+
+        try:
+            if self.operation in ('insert', 'upsert'):
+                # A bulk write is atomic, like one PostgREST request
+                with self.client.transaction() as db:
+                    data = self._write_rows(db, table_columns)
+            elif self.operation == 'update':
+                values = dict(self.payload)
+                assignments = ', '.join(f"{self._column(table_columns, c)} = ?" for c in values)
+                if 'updated_at' in table_columns and 'updated_at' not in values:
+                    # Stamped in the statement so RETURNING sees it, like the BEFORE trigger in Postgres
+                    assignments += f", updated_at = {NOW_SQL}"
+                with self.client.connection() as db:
+                    cursor = db.execute(f"UPDATE {table} SET {assignments}{where} RETURNING *",
+                                        [_parameter(v) for v in values.values()] + parameters)
+                    data = self.client._decode(self.table_name, cursor)
+            elif self.operation == 'delete':
+                with self.client.connection() as db:
+                    cursor = db.execute(f"DELETE FROM {table}{where} RETURNING *", parameters)
+                    data = self.client._decode(self.table_name, cursor)
+            else:
+                columns = '*' if self.columns is None else \
+                    ', '.join(self._column(table_columns, c) for c in self.columns)
+                sql = f"SELECT {columns} FROM {table}{where}"
+                if self.order_by is not None:
+                    # Postgres sorts NULLs as the largest value
+                    direction = 'DESC NULLS FIRST' if self.descending else 'ASC NULLS LAST'
+                    sql += f" ORDER BY {self._column(table_columns, self.order_by)} {direction}"
+                select_parameters = list(parameters)
+                if self.limit_count is not None:
+                    sql += ' LIMIT ?'
+                    select_parameters.append(self.limit_count)
+                with self.client.connection() as db:
+                    data = self.client._decode(self.table_name, db.execute(sql, select_parameters))
+                    if self.count_mode is not None:
+                        count = db.execute(f"SELECT count(*) FROM {table}{where}", parameters).fetchone()[0]
+        except sqlite3.Error as e:
+            raise _api_error(e) from e
+
+        return self._response(data, count)
+
+    def _run(self):
+        return _timed(self.table_name, self.operation, self._run_statement)
+
+    def execute(self):
+        return self._run()
+
+
+# Declared column type -> Python type of the decoded value
+_CONVERTERS = {'BOOLEAN': bool, 'REAL': float}
+
+_OPERATORS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+class _SQLiteRpcCall:
+    def __init__(self, client: 'SQLiteClient', name: str, params: Dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def _run(self):
+        return _timed('rpc', self.name, self._call)
+
+    def _call(self):
+        function = SQLITE_FUNCTIONS.get(self.name)
+        if function is None:
+            raise missing_function_error(self.name)
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front, like the row locks of the Postgres functions
+            with self.client.transaction() as db:
+                return QueryResponse(function(self.client, db, self.params))
+        except sqlite3.Error as e:
+            raise _api_error(e) from e
+
+    def execute(self):
+        return self._run()
+
+
+class SQLiteClient:
+    """
+    Embedded SQLite implementation of the client interface the services use
+
+    Args:
+        path: Database file, or ':memory:' for a database private to this client
+        schema_sources: Schema files and migration directories (see translate_schema)
+        busy_timeout: Seconds a writer waits for the database lock
+    """
+
+    def __init__(self, path: str = 'tradesense.db', schema_sources: Sequence = DEFAULT_SCHEMA_SOURCES,
+                 busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.in_memory = path == ':memory:'
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # An in-memory database lives in one connection, shared under a lock
+        self._shared_lock = threading.RLock() if self.in_memory else None
+        self._columns: Dict[str, Dict[str, str]] = {}
+        self._conversions: Dict[str, Tuple] = {}
+
+        self.apply_schema(schema_sources)
+
+    def _open(self) -> sqlite3.Connection:
+        # Each thread uses its own connection; close() may run on any thread
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                             check_same_thread=False, cached_statements=256)
+        if not self.in_memory:
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('PRAGMA foreign_keys = ON')
+        db.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        with self._connections_lock:
+            self._connections.append(db)
+        return db
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.in_memory:
+            if not self._connections:
+                with self._shared_lock:
+                    if not self._connections:
+                        self._open()
+            return self._connections[0]
+
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._open()
+        return db
+
+    @contextmanager
+    def connection(self):
+        """This thread's connection (the shared one, locked, for an in-memory database)"""
+        if self._shared_lock is None:
+            yield self._connection()
+            return
+        with self._shared_lock:
+            yield self._connection()
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in one write transaction"""
+        with self.connection() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    def apply_schema(self, sources: Sequence) -> None:
+        """Create the tables, indexes and triggers of the translated schema"""
+        enums: Dict[str, List[str]] = {}
+        with self.transaction() as db:
+            for script in schema_scripts(sources):
+                for statement in translate_schema(script.read_text(encoding='utf-8'), enums):
+                    added = re.match(r'ALTER TABLE (\w+) ADD COLUMN (\w+)', statement)
+                    if added and added.group(2) in self._table_info(db, added.group(1)):
+                        continue
+                    db.execute(statement)
+            for statement in SQLITE_INDEXES:
+                db.execute(statement)
+
+        self._columns.clear()
+        self._conversions.clear()
+
+    @staticmethod
+    def _table_info(db: sqlite3.Connection, table: str) -> Dict[str, str]:
+        return {row[1]: row[2].upper() for row in db.execute(f"PRAGMA table_info({_quote(table)})")}
+
+    def columns(self, table: str) -> Dict[str, str]:
+        """Column names and declared types of a table"""
+        columns = self._columns.get(table)
+        if columns is None:
+            with self.connection() as db:
+                columns = self._table_info(db, table)
+            if not columns:
+                raise APIError({'code': 'PGRST205', 'message': f"Could not find the table 'public.{table}'"})
+            self._conversions[table] = tuple((name, _CONVERTERS[kind]) for name, kind in columns.items()
+                                             if kind in _CONVERTERS)
+            self._columns[table] = columns
+        return columns
+
+    def _decode(self, table: str, cursor: sqlite3.Cursor) -> List[Dict]:
+        names = [column[0] for column in cursor.description]
+        if table not in self._conversions:
+            self.columns(table)
+        # RETURNING yields values before column affinity: REAL may come back as int
+        conversions = [(name, convert) for name, convert in self._conversions.get(table, ()) if name in names]
+        rows = [dict(zip(names, values)) for values in cursor.fetchall()]
+        if conversions:
+            for row in rows:
+                for name, convert in conversions:
+                    if row[name] is not None:
+                        row[name] = convert(row[name])
+        return rows
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def rpc(self, name: str, params: Dict = None) -> _SQLiteRpcCall:
+        return _SQLiteRpcCall(self, name, params or {})
+
+    def close(self) -> None:
+        """Close every connection opened by this client"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+
+class _AsyncSQLiteQuery(SQLiteQuery):
+    async def execute(self):
+        return await asyncio.to_thread(self._run)
+
+
+class _AsyncSQLiteRpcCall(_SQLiteRpcCall):
+    async def execute(self):
+        return await asyncio.to_thread(self._run)
+
+
+class AsyncSQLiteClient:
+    """Awaitable view of a SQLiteClient, for the ASGI serving mode; statements run in worker threads"""
+
+    def __init__(self, client: SQLiteClient):
+        self.client = client
+
+    def table(self, name: str) -> _AsyncSQLiteQuery:
+        return _AsyncSQLiteQuery(self.client, name)
+
+    def rpc(self, name: str, params: Dict = None) -> _AsyncSQLiteRpcCall:
+        return _AsyncSQLiteRpcCall(self.client, name, params or {})
+
+
+def create_sqlite_client_from_env() -> SQLiteClient:
+    """Build the SQLite client configured by SQLITE_PATH, SQLITE_SCHEMA_SOURCES and SQLITE_BUSY_TIMEOUT"""
+    sources = os.getenv("SQLITE_SCHEMA_SOURCES")
+    client = SQLiteClient(
+        os.getenv("SQLITE_PATH", "tradesense.db"),
+        schema_sources=sources.split(os.pathsep) if sources else DEFAULT_SCHEMA_SOURCES,
+        busy_timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+    )
+    logger.info('SQLite persistence backend', path=client.path)
+    return client
+
+
+# ---------------------------------------------------------------------------
+# Native versions of the Postgres functions
+# ---------------------------------------------------------------------------
+
+def _one(client: SQLiteClient, table: str, cursor: sqlite3.Cursor) -> Optional[Dict]:
+    rows = client._decode(table, cursor)
+    return rows[0] if rows else None
+
+
+def _apply_challenge_rules(client: SQLiteClient, db: sqlite3.Connection, challenge: Dict, rules: Dict) -> str:
+    """Same checks and precedence as public.apply_challenge_rules"""
+    status = challenge['status']
+    initial = challenge['initial_capital']
+    if status in ('success', 'failed') or not initial:
+        return status
+
+    profit_pct = (challenge['current_balance'] - initial) / initial * 100
+    daily_loss_pct = max(-(challenge['daily_pnl'] / initial * 100), 0)
+    total_loss_pct = max(-profit_pct, 0)
+
+    rule = None
+    if daily_loss_pct >= float(rules['daily_loss_limit']):
+        status, rule = 'failed', rules.get('daily_rule')
+    elif total_loss_pct >= float(rules['total_loss_limit']):
+        status, rule = 'failed', rules.get('total_rule')
+    elif profit_pct >= float(rules['profit_target']):
+        status, rule = 'success', rules.get('profit_rule')
+    else:
+        status = 'active'
+
+    if status != challenge['status']:
+        db.execute(
+            f"UPDATE user_challenges SET status = ?, "
+            f"ended_at = CASE WHEN ? IN ('success', 'failed') THEN {NOW_SQL} END, "
+            f"failure_reason = ?, success_reason = ? WHERE id = ?",
+            (status, status, rule if status == 'failed' else None,
+             rule if status == 'success' else None, challenge['id'])
+        )
+    return status
+
+
+def _settle_trade(client: SQLiteClient, db: sqlite3.Connection, params: Dict) -> Dict:
+    exit_price = float(params['p_exit_price'])
+    trade = _one(client, 'trades', db.execute(
+        f"UPDATE trades SET exit_price = ?, "
+        f"pnl = round((? - entry_price) / entry_price * amount * leverage "
+        f"* CASE WHEN trade_type = 'buy' THEN 1 ELSE -1 END, 2), "
+        f"is_open = 0, closed_at = {NOW_SQL} "
+        f"WHERE id = ? AND user_id = ? AND is_open = 1 RETURNING id, challenge_id, pnl",
+        (exit_price, exit_price, params['p_trade_id'], params['p_user_id'])
+    ))
+    if trade is None:
+        return {'error': 'Trade not found or already closed'}
+
+    pnl = trade['pnl']
+    challenge = _one(client, 'user_challenges', db.execute(
+        "UPDATE user_challenges SET current_balance = current_balance + :pnl, "
+        "total_pnl = total_pnl + :pnl, daily_pnl = daily_pnl + :pnl, "
+        "trade_count = trade_count + 1, winning_trades = winning_trades + (:pnl > 0), "
+        "losing_trades = losing_trades + (:pnl < 0), sum_wins = sum_wins + max(:pnl, 0), "
+        "sum_losses = sum_losses + min(:pnl, 0) WHERE id = :id RETURNING *",
+        {'pnl': pnl, 'id': trade['challenge_id']}
+    ))
+    if challenge is None:
+        # Rolls the trade back, like RAISE ... USING ERRCODE = 'P0002'
+        raise APIError({'code': 'P0002', 'message': 'Challenge not found'})
+
+    status = _apply_challenge_rules(client, db, challenge, params['p_rules'])
+    return {
+        'success': True,
+        'trade': {'id': trade['id'], 'pnl': pnl, 'exit_price': exit_price},
+        'challenge': {
+            'id': challenge['id'],
+            'new_balance': challenge['current_balance'],
+            'total_pnl': challenge['total_pnl'],
+            'status': status
+        }
+    }
+
+
+def _apply_challenge_transitions(client: SQLiteClient, db: sqlite3.Connection, params: Dict) -> List[Dict]:
+    cursor = db.execute(
+        "UPDATE user_challenges AS uc SET status = t.status, ended_at = t.ended_at, "
+        "failure_reason = t.failure_reason, success_reason = t.success_reason "
+        "FROM (SELECT json_extract(value, '$.id') AS id, json_extract(value, '$.status') AS status, "
+        "json_extract(value, '$.ended_at') AS ended_at, "
+        "json_extract(value, '$.failure_reason') AS failure_reason, "
+        "json_extract(value, '$.success_reason') AS success_reason FROM json_each(?)) AS t "
+        "WHERE uc.id = t.id AND uc.status = 'active' RETURNING id",
+        (json.dumps(params['transitions'], default=_parameter),)
+    )
+    return [{'id': row[0]} for row in cursor.fetchall()]
+
+
+def _reset_daily_metrics(client: SQLiteClient, db: sqlite3.Connection, params: Dict) -> List[Dict]:
+    challenge_id = params.get('p_challenge_id')
+    cursor = db.execute(
+        f"UPDATE user_challenges SET daily_pnl = 0, daily_reset_time = {NOW_SQL} "
+        f"WHERE (:challenge_id IS NULL OR id = :challenge_id) "
+        f"AND (:user_id IS NULL OR user_id = :user_id) "
+        f"AND (:challenge_id IS NOT NULL OR status IN (SELECT value FROM json_each(:statuses))) "
+        f"RETURNING id",
+        {'challenge_id': challenge_id, 'user_id': params.get('p_user_id'),
+         'statuses': json.dumps(params.get('p_statuses') or ['active'])}
+    )
+    return [{'id': row[0]} for row in cursor.fetchall()]
+
+
+def _rebuild_trade_stats(client: SQLiteClient, db: sqlite3.Connection, params: Dict) -> int:
+    cursor = db.execute(
+        "UPDATE user_challenges AS uc SET trade_count = s.trades, winning_trades = s.wins, "
+        "losing_trades = s.losses, sum_wins = s.win_sum, sum_losses = s.loss_sum "
+        "FROM (SELECT c.id, count(t.id) AS trades, "
+        "count(t.id) FILTER (WHERE t.pnl > 0) AS wins, count(t.id) FILTER (WHERE t.pnl < 0) AS losses, "
+        "coalesce(sum(t.pnl) FILTER (WHERE t.pnl > 0), 0) AS win_sum, "
+        "coalesce(sum(t.pnl) FILTER (WHERE t.pnl < 0), 0) AS loss_sum "
+        "FROM user_challenges AS c LEFT JOIN trades AS t "
+        "ON t.challenge_id = c.id AND t.is_open = 0 AND t.pnl IS NOT NULL "
+        "WHERE :challenge_id IS NULL OR c.id = :challenge_id GROUP BY c.id) AS s "
+        "WHERE uc.id = s.id",
+        {'challenge_id': params.get('p_challenge_id')}
+    )
+    return cursor.rowcount
+
+
+# RPCs with a native implementation: {name: function(client, connection, params) -> data}
+SQLITE_FUNCTIONS: Dict[str, Callable[[SQLiteClient, sqlite3.Connection, Dict], object]] = {
+    'settle_trade': _settle_trade,
+    'apply_challenge_transitions': _apply_challenge_transitions,
+    'reset_daily_metrics': _reset_daily_metrics,
+    'rebuild_trade_stats': _rebuild_trade_stats,
+}
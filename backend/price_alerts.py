@@ -0,0 +1,287 @@
+"""
+Price Alert Matching Engine
+
+Keeps every active `price_alerts` row in memory, indexed per symbol by two
+sorted threshold lists: one for "above" alerts and one for "below" alerts.
+On each price update the crossed alerts are found by bisecting between the
+previous and the new price, so a tick costs O(log n + k) for k triggered
+alerts instead of a scan of all alerts.
+
+Semantics match the frontend check: an "above" alert fires when the price is
+>= its target, a "below" alert when the price is <= its target. A triggered
+alert leaves the index (it fires once) and is marked `triggered_at` /
+`is_active = false` in one batched write per tick batch. Simulated quotes
+never trigger alerts.
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from supabase import Client
+
+from market_data import real_ticks
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class ThresholdIndex:
+    """Alert ids sorted by target price (parallel lists, so bisect works on floats)"""
+
+    __slots__ = ('prices', 'ids')
+
+    def __init__(self):
+        self.prices: List[float] = []
+        self.ids: List[str] = []
+
+    def insert(self, price: float, alert_id: str) -> None:
+        i = bisect_right(self.prices, price)
+        self.prices.insert(i, price)
+        self.ids.insert(i, alert_id)
+
+    def remove(self, price: float, alert_id: str) -> bool:
+        i = bisect_left(self.prices, price)
+        while i < len(self.prices) and self.prices[i] == price:
+            if self.ids[i] == alert_id:
+                del self.prices[i]
+                del self.ids[i]
+                return True
+            i += 1
+        return False
+
+    def pop_range(self, lo: int, hi: int) -> List[str]:
+        """Remove and return the ids in positions [lo, hi)"""
+        if lo >= hi:
+            return []
+        fired = self.ids[lo:hi]
+        del self.prices[lo:hi]
+        del self.ids[lo:hi]
+        return fired
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class PriceAlertEngine:
+    """Matches price ticks against active price alerts"""
+
+    def __init__(self, supabase_client: Client, page_size: int = 1000, write_chunk_size: int = 500):
+        self.supabase = supabase_client
+        self.page_size = page_size
+        self.write_chunk_size = write_chunk_size
+
+        self._above: Dict[str, ThresholdIndex] = {}
+        self._below: Dict[str, ThresholdIndex] = {}
+        self._alerts: Dict[str, tuple] = {}
+        self._last_price: Dict[str, float] = {}
+        self._pending: List[str] = []
+        self._lock = threading.RLock()
+
+        self._last_sync: Optional[str] = None
+        self.fired_total = 0
+
+    def add_alert(self, alert: Dict) -> bool:
+        """
+        Insert or update one alert from a price_alerts row
+
+        Inactive or already triggered alerts are removed from the index. An
+        alert already satisfied by the last known price fires immediately.
+
+        Returns:
+            True if the alert is indexed (waiting for a crossing)
+        """
+        with self._lock:
+            self.remove_alert(alert['id'])
+
+            if not alert.get('is_active', True) or alert.get('triggered_at'):
+                return False
+
+            symbol = alert['asset_symbol']
+            target = float(alert['target_price'])
+            condition = alert['condition']
+            last_price = self._last_price.get(symbol)
+
+            if last_price is not None and (
+                (condition == 'above' and last_price >= target) or
+                (condition == 'below' and last_price <= target)
+            ):
+                self._fire([alert['id']])
+                return False
+
+            sides = self._above if condition == 'above' else self._below
+            index = sides.get(symbol)
+            if index is None:
+                index = sides[symbol] = ThresholdIndex()
+
+            index.insert(target, alert['id'])
+            self._alerts[alert['id']] = (symbol, condition, target)
+            return True
+
+    def remove_alert(self, alert_id: str) -> bool:
+        """Drop an alert from the index (deleted or deactivated); returns True if it was indexed"""
+        with self._lock:
+            entry = self._alerts.pop(alert_id, None)
+            if entry is None:
+                return False
+
+            symbol, condition, target = entry
+            sides = self._above if condition == 'above' else self._below
+            return sides[symbol].remove(target, alert_id)
+
+    def on_price(self, symbol: str, price: float) -> List[str]:
+        """
+        Apply a price update and return the ids of the alerts it triggered
+
+        "above" targets in (previous, new] and "below" targets in [new, previous)
+        were crossed; on the first price of a symbol every satisfied alert fires.
+        """
+        with self._lock:
+            previous = self._last_price.get(symbol)
+            self._last_price[symbol] = price
+            fired = []
+
+            above = self._above.get(symbol)
+            if above and (previous is None or price > previous):
+                lo = 0 if previous is None else bisect_right(above.prices, previous)
+                fired.extend(above.pop_range(lo, bisect_right(above.prices, price)))
+
+            below = self._below.get(symbol)
+            if below and (previous is None or price < previous):
+                hi = len(below) if previous is None else bisect_left(below.prices, previous)
+                fired.extend(below.pop_range(bisect_left(below.prices, price), hi))
+
+            for alert_id in fired:
+                del self._alerts[alert_id]
+
+            self._fire(fired)
+            return fired
+
+    def on_ticks(self, ticks) -> List[str]:
+        """Market data hub listener: match a batch of ticks, then write the triggered alerts once"""
+        fired = []
+        for tick in real_ticks(ticks):
+            fired.extend(self.on_price(tick.symbol, tick.price))
+
+        if fired:
+            logger.info('Price alerts triggered', alerts=len(fired))
+            self.flush()
+        return fired
+
+    def _fire(self, alert_ids: List[str]) -> None:
+        self._pending.extend(alert_ids)
+        self.fired_total += len(alert_ids)
+
+    def flush(self) -> int:
+        """
+        Mark pending triggered alerts in one update per chunk
+
+        Rows that were already triggered are left untouched, so several
+        processes matching the same alerts still record each one once.
+        Failed chunks are kept for the next flush.
+
+        Returns:
+            Number of alerts written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        triggered_at = datetime.utcnow().isoformat()
+        written = 0
+
+        for start in range(0, len(pending), self.write_chunk_size):
+            chunk = pending[start:start + self.write_chunk_size]
+            try:
+                self.supabase.table('price_alerts') \
+                    .update({'triggered_at': triggered_at, 'is_active': False}) \
+                    .in_('id', chunk) \
+                    .is_('triggered_at', 'null') \
+                    .execute()
+                written += len(chunk)
+            except Exception as e:
+                logger.error('Failed to mark price alerts as triggered', alerts=len(chunk), error=e)
+                with self._lock:
+                    self._pending.extend(chunk)
+
+        return written
+
+    def load(self) -> int:
+        """Rebuild the index from all active, untriggered alerts (keyset pagination)"""
+        alerts = []
+        last_id = None
+
+        while True:
+            query = self.supabase.table('price_alerts') \
+                .select('id, asset_symbol, target_price, condition, is_active, triggered_at, updated_at') \
+                .eq('is_active', True) \
+                .is_('triggered_at', 'null') \
+                .order('id') \
+                .limit(self.page_size)
+
+            if last_id:
+                query = query.gt('id', last_id)
+
+            page = query.execute().data or []
+            alerts.extend(page)
+
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1]['id']
+
+        with self._lock:
+            self._above.clear()
+            self._below.clear()
+            self._alerts.clear()
+            for alert in alerts:
+                self.add_alert(alert)
+            self._last_sync = max((a['updated_at'] for a in alerts if a.get('updated_at')), default=self._last_sync)
+
+        logger.info('Loaded active price alerts', alerts=len(self._alerts))
+        return len(self._alerts)
+
+    def sync(self) -> int:
+        """
+        Apply alerts created or changed since the last load/sync
+
+        Uses updated_at, so it sees inserts and (de)activations; hard deletes
+        are only picked up by the next load().
+        """
+        query = self.supabase.table('price_alerts') \
+            .select('id, asset_symbol, target_price, condition, is_active, triggered_at, updated_at') \
+            .order('updated_at')
+
+        if self._last_sync:
+            query = query.gt('updated_at', self._last_sync)
+
+        changed = query.execute().data or []
+
+        for alert in changed:
+            self.add_alert(alert)
+            self._last_sync = alert['updated_at']
+
+        if self._pending:
+            self.flush()
+        return len(changed)
+
+    def stats(self) -> Dict:
+        """Return index sizes and trigger counters"""
+        with self._lock:
+            return {
+                'active_alerts': len(self._alerts),
+                'symbols': len(set(self._above) | set(self._below)),
+                'fired_total': self.fired_total,
+                'pending_writes': len(self._pending)
+            }
+
+
+# Global engine instance
+price_alert_engine = None
+
+
+def get_price_alert_engine(supabase_client: Client) -> PriceAlertEngine:
+    """Get singleton instance of the price alert engine"""
+    global price_alert_engine
+    if price_alert_engine is None:
+        price_alert_engine = PriceAlertEngine(supabase_client)
+    return price_alert_engine
@@ -0,0 +1,169 @@
+"""
+On-Demand Request Profiling
+
+Operator-enabled profiler for selected requests of app.py and asgi_app.py.
+Profiling is off unless PROFILE_DIR is set; a request is then profiled when
+- it carries `X-Profile: <PROFILE_HEADER_TOKEN>` (the header is ignored while
+  no token is configured), or
+- it is drawn by PROFILE_SAMPLE_RATE (fraction of requests, default 0)
+
+PROFILE_MODE selects the output written to PROFILE_DIR:
+- 'cprofile' (default): a pstats file (<name>.prof) of the request thread,
+  for `python -m pstats` or snakeviz
+- 'stacks': a sampling profiler reading the request thread's stack every
+  PROFILE_STACK_INTERVAL seconds, written in the collapsed-stack format of
+  flamegraph.pl / speedscope (<name>.collapsed)
+
+At most one request per process is profiled at a time; requests selected
+while another one is being profiled run unprofiled. Under asgi_app.py the
+event loop thread also runs the other in-flight requests, so their work shows
+up in the profile too.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+
+MODES = ('cprofile', 'stacks')
+
+
+class _CProfileSession:
+    suffix = '.prof'
+
+    def __init__(self, interval: float):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, path: str) -> None:
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+
+class _StackSampler:
+    """Samples the stack of the thread that created it from a helper thread"""
+
+    suffix = '.collapsed'
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self, path: str) -> None:
+        self._stop.set()
+        self._thread.join()
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Chooses the requests to profile and writes their profiles to a directory"""
+
+    def __init__(self, directory: Optional[str], sample_rate: float = 0.0, header_token: Optional[str] = None,
+                 mode: str = 'cprofile', stack_interval: float = 0.005,
+                 random_fn: Callable[[], float] = random.random):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.header_token = header_token
+        self.mode = mode
+        self.stack_interval = stack_interval
+        self.random_fn = random_fn
+        self.profiles_written = 0
+        self._busy = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and (self.sample_rate > 0 or bool(self.header_token))
+
+    def has_token(self, header_value: Optional[str]) -> bool:
+        """Whether an X-Profile header value is the operator token (even with profiling off)"""
+        return bool(self.header_token and header_value and hmac.compare_digest(header_value, self.header_token))
+
+    def should_profile(self, header_value: Optional[str]) -> bool:
+        """Whether a request carrying this X-Profile header value is selected"""
+        if not self.enabled:
+            return False
+        if self.has_token(header_value):
+            return True
+        return self.sample_rate > 0 and self.random_fn() < self.sample_rate
+
+    def start(self):
+        """Start profiling the calling thread; None if another request is being profiled"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            session_class = _CProfileSession if self.mode == 'cprofile' else _StackSampler
+            return session_class(self.stack_interval)
+        except ValueError as e:
+            # cProfile refuses to start while another profiler is active
+            self._busy.release()
+            logger.warning('Request profiler unavailable', error=e)
+            return None
+
+    def stop(self, session, label: str) -> Optional[str]:
+        """Stop a session returned by start() and write it; returns the file path"""
+        try:
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+            path = os.path.join(self.directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-"
+                                                f"{self.profiles_written}-{name}{session.suffix}")
+            session.stop(path)
+            self.profiles_written += 1
+            logger.info('Request profile written', path=path)
+            return path
+        except OSError as e:
+            logger.error('Error writing request profile', error=e)
+            return None
+        finally:
+            self._busy.release()
+
+
+# Global profiler instance
+request_profiler = None
+
+
+def get_request_profiler() -> RequestProfiler:
+    """Get the singleton request profiler configured from the PROFILE_* variables"""
+    global request_profiler
+    if request_profiler is None:
+        request_profiler = RequestProfiler(
+            os.getenv("PROFILE_DIR") or None,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            header_token=os.getenv("PROFILE_HEADER_TOKEN") or None,
+            mode=os.getenv("PROFILE_MODE", "cprofile").lower(),
+            stack_interval=float(os.getenv("PROFILE_STACK_INTERVAL", "0.005"))
+        )
+    return request_profiler
@@ -6,15 +6,58 @@ Implements the core Prop Firm rules:
 - Daily loss limit: 5% 
 - Total loss limit: 10%
 - Profit target: 10%
-- Background task evaluation after each trade
+- Background task evaluation after each trade (queued through evaluation_queue when enabled)
 """
 
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from supabase import Client
-import logging
+from postgrest.exceptions import APIError
+from supabase_client import get_supabase_client
+from ttl_cache import TTLCache
+from records import ChallengeBatch
+from trade_stats import add_trade_pnls, empty_trade_stats, has_trade_stats, trade_statistics
+from structured_logging import get_logger
+import tracing
+import os
+import threading
+import numpy as np
 
-logger = logging.getLogger(__name__)
+from rule_engine import (
+    evaluate_rules, evaluate_rules_batch, RuleBatchResult, STATUS_NAMES,
+    RULE_DAILY_LOSS, RULE_TOTAL_LOSS, RULE_PROFIT_TARGET
+)
+
+logger = get_logger(__name__)
+
+# PostgREST/Postgres error codes meaning an RPC function is not deployed
+MISSING_FUNCTION_ERROR_CODES = ('PGRST202', '42883')
+
+
+def trade_pnl_coef(trade: Dict) -> float:
+    """
+    Factor f such that closing a trade at price books (price - entry_price) * f
+    
+    Relative price move times notional times leverage, signed by direction.
+    """
+    direction = 1.0 if trade['trade_type'] == 'buy' else -1.0
+    return float(trade['amount']) * float(trade['leverage']) * direction / float(trade['entry_price'])
+
+
+def settlement_pnl(trade: Dict, exit_price: float) -> float:
+    """
+    PnL booked when a trade is closed
+    
+    The trade_pnl_coef formula in decimal arithmetic, rounded to cents half
+    away from zero like ROUND(numeric, 2) in the settle_trade(s) Postgres
+    functions, so the client-side fallbacks book the same amounts.
+    """
+    entry_price = Decimal(str(trade['entry_price']))
+    direction = 1 if trade['trade_type'] == 'buy' else -1
+    pnl = (Decimal(str(exit_price)) - entry_price) / entry_price \
+        * Decimal(str(trade['amount'])) * Decimal(str(trade['leverage'])) * direction
+    return float(pnl.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
 
 class PropFirmChallengeEvaluator:
     """Service to evaluate Prop Firm challenge rules"""
@@ -25,6 +68,22 @@ class PropFirmChallengeEvaluator:
         self.DAILY_LOSS_LIMIT_PERCENT = 5.0
         self.TOTAL_LOSS_LIMIT_PERCENT = 10.0
         self.PROFIT_TARGET_PERCENT = 10.0
+        
+        # Read-through cache of user_challenges rows; writes made through this
+        # service update or invalidate the cached row
+        self.CHALLENGE_CACHE_SIZE = int(os.getenv("CHALLENGE_CACHE_SIZE", "10000"))
+        self.CHALLENGE_CACHE_TTL = float(os.getenv("CHALLENGE_CACHE_TTL", "10"))
+        self.challenge_cache = TTLCache(max_size=self.CHALLENGE_CACHE_SIZE, default_ttl=self.CHALLENGE_CACHE_TTL)
+        
+        # Called with (user_id, [{'challenge_id', 'pnl'}, ...]) after trades settle
+        self.settlement_listeners: List[Callable[[str, List[Dict]], None]] = []
+        
+        # Called with the reset challenge ids after a daily reset
+        self.reset_listeners: List[Callable[[List[str]], None]] = []
+        
+        # Set by evaluation_queue.get_evaluation_queue; status changes caused by
+        # settlements are then persisted by the queue instead of inline
+        self.evaluation_queue = None
     
     def create_new_challenge(self, user_id: str, initial_balance: float = None) -> Dict:
         """
@@ -56,16 +115,86 @@ class PropFirmChallengeEvaluator:
         try:
             response = self.supabase.table('user_challenges').insert(challenge_data).execute()
             
-            if response.error:
-                logger.error(f"Failed to create challenge: {response.error}")
-                return {'error': str(response.error)}
+            if not response.data:
+                return {'error': 'No data returned'}
             
-            return response.data[0] if response.data else {'error': 'No data returned'}
+            self.cache_challenge(response.data[0])
+            return response.data[0]
             
         except Exception as e:
-            logger.error(f"Error creating challenge: {str(e)}")
+            logger.error('Error creating challenge', user_id=user_id, error=e)
             return {'error': str(e)}
     
+    def get_challenge(self, challenge_id: str, user_id: str = None, fresh: bool = False) -> Optional[Dict]:
+        """
+        Fetch a user_challenges row through the challenge cache
+        
+        Args:
+            challenge_id: Challenge UUID
+            user_id: When given, a challenge owned by another user is treated as not found
+            fresh: Read from the database even when cached (read-modify-write paths)
+            
+        Returns:
+            A copy of the challenge row, or None if not found
+        """
+        challenge = None if fresh else self.challenge_cache.get(challenge_id)
+        
+        if challenge is None:
+            response = self.supabase.table('user_challenges') \
+                .select('*') \
+                .eq('id', challenge_id) \
+                .maybe_single() \
+                .execute()
+            
+            if not response or not response.data:
+                return None
+            
+            challenge = response.data
+            self.cache_challenge(challenge)
+        
+        if user_id and challenge['user_id'] != user_id:
+            return None
+        
+        return dict(challenge)
+    
+    def cache_challenge(self, challenge: Dict) -> None:
+        """Store a freshly read or written challenge row in the cache"""
+        self.challenge_cache.set(challenge['id'], dict(challenge))
+    
+    def update_cached_challenge(self, challenge_id: str, changes: Dict) -> None:
+        """Write-through: apply the columns just written to the cached row, if cached"""
+        self.challenge_cache.update_entry(challenge_id, changes)
+    
+    def invalidate_challenge(self, challenge_id: str) -> None:
+        """Drop a challenge row whose new state is not fully known locally"""
+        self.challenge_cache.invalidate(challenge_id)
+    
+    def write_status_update(self, challenge: Dict, update_data: Dict) -> bool:
+        """
+        Write a status change computed from `challenge`, guarded by the status it was read with
+        
+        Returns:
+            False when another process changed the status first; the cached
+            row is then dropped so the next read sees the new state
+        """
+        response = self.supabase.table('user_challenges') \
+            .update(update_data) \
+            .eq('id', challenge['id']) \
+            .eq('status', challenge['status']) \
+            .execute()
+        return self._status_written(challenge['id'], update_data, response)
+    
+    def _status_written(self, challenge_id: str, update_data: Dict, response) -> bool:
+        if not response or not response.data:
+            self.invalidate_challenge(challenge_id)
+            return False
+        self.update_cached_challenge(challenge_id, update_data)
+        return True
+    
+    def challenge_cache_stats(self) -> Dict:
+        """Return hit/miss counters of the challenge cache"""
+        return self.challenge_cache.stats()
+    
     def evaluate_challenge_rules(self, challenge_id: str) -> Dict:
         """
         Evaluate all Prop Firm rules for a challenge
@@ -77,115 +206,252 @@ class PropFirmChallengeEvaluator:
             Dictionary with evaluation results and updated status
         """
         try:
-            # Get challenge data
-            challenge_response = self.supabase.table('user_challenges') \
-                .select('*') \
-                .eq('id', challenge_id) \
-                .single() \
-                .execute()
+            # Read-modify-write: never decide a transition on a cached row
+            challenge = self.get_challenge(challenge_id, fresh=True)
             
-            if challenge_response.error:
-                logger.error(f"Challenge not found: {challenge_response.error}")
+            if not challenge:
+                logger.error('Challenge not found', challenge_id=challenge_id)
                 return {'error': 'Challenge not found'}
             
-            challenge = challenge_response.data
+            evaluation = self.evaluate_challenge_data(challenge)
             
             # Skip if already completed
-            if challenge['status'] in ['success', 'failed']:
-                return {
-                    'status': challenge['status'],
-                    'message': f'Challenge already {challenge["status"]}',
-                    'challenge': challenge
-                }
-            
-            # Calculate key metrics
-            initial_capital = challenge['initial_capital']
-            current_balance = challenge['current_balance']
-            
-            # Profit/Loss calculations
-            absolute_pnl = current_balance - initial_capital
-            profit_percentage = (absolute_pnl / initial_capital) * 100
-            loss_percentage = abs(min(profit_percentage, 0))
-            
-            # Daily loss calculation
-            daily_pnl = challenge['daily_pnl']
-            daily_loss_percentage = abs(min((daily_pnl / initial_capital) * 100, 0))
-            
-            # Total loss calculation
-            total_loss_percentage = abs(min(profit_percentage, 0))
-            
-            logger.info(f"Challenge {challenge_id} evaluation:")
-            logger.info(f"  Balance: ${current_balance:,.2f}")
-            logger.info(f"  PnL: ${absolute_pnl:,.2f} ({profit_percentage:+.2f}%)")
-            logger.info(f"  Daily Loss: {daily_loss_percentage:.2f}%")
-            logger.info(f"  Total Loss: {total_loss_percentage:.2f}%")
-            
-            # Apply Prop Firm rules
-            new_status = 'active'
-            rule_triggered = None
-            
-            # Rule 1: Daily loss limit (5%)
-            if daily_loss_percentage >= self.DAILY_LOSS_LIMIT_PERCENT:
-                new_status = 'failed'
-                rule_triggered = f"daily_loss_limit_exceeded_{self.DAILY_LOSS_LIMIT_PERCENT}percent"
-                logger.warning(f"Challenge {challenge_id} FAILED: Daily loss limit exceeded ({daily_loss_percentage:.2f}%)")
-            
-            # Rule 2: Total loss limit (10%)
-            elif total_loss_percentage >= self.TOTAL_LOSS_LIMIT_PERCENT:
-                new_status = 'failed'
-                rule_triggered = f"total_loss_limit_exceeded_{self.TOTAL_LOSS_LIMIT_PERCENT}percent"
-                logger.warning(f"Challenge {challenge_id} FAILED: Total loss limit exceeded ({total_loss_percentage:.2f}%)")
-            
-            # Rule 3: Profit target (10%)
-            elif profit_percentage >= self.PROFIT_TARGET_PERCENT:
-                new_status = 'success'
-                rule_triggered = f"profit_target_reached_{self.PROFIT_TARGET_PERCENT}percent"
-                logger.info(f"Challenge {challenge_id} SUCCESS: Profit target reached ({profit_percentage:.2f}%)")
+            if 'message' in evaluation:
+                return evaluation
+            
+            new_status = evaluation['status']
             
             # Update challenge if status changed
             if new_status != challenge['status']:
-                update_data = {
-                    'status': new_status,
-                    'ended_at': datetime.utcnow().isoformat() if new_status in ['success', 'failed'] else None
-                }
-                
-                if rule_triggered:
-                    update_data['failure_reason'] = rule_triggered if new_status == 'failed' else None
-                    update_data['success_reason'] = rule_triggered if new_status == 'success' else None
-                
-                update_response = self.supabase.table('user_challenges') \
-                    .update(update_data) \
-                    .eq('id', challenge_id) \
-                    .execute()
+                update_data = self.build_status_update(new_status, evaluation['rule_triggered'])
                 
-                if update_response.error:
-                    logger.error(f"Failed to update challenge status: {update_response.error}")
-                    return {'error': str(update_response.error)}
+                if not self.write_status_update(challenge, update_data):
+                    # Ended elsewhere since the read: report the status that won
+                    logger.info('Challenge status changed concurrently', challenge_id=challenge_id)
+                    challenge = self.get_challenge(challenge_id)
+                    return self.evaluate_challenge_data(challenge) if challenge else {'error': 'Challenge not found'}
                 
-                logger.info(f"Challenge {challenge_id} status updated to: {new_status}")
+                logger.info('Challenge status updated', challenge_id=challenge_id, status=new_status)
             
+            return evaluation
+            
+        except Exception as e:
+            logger.error('Error evaluating challenge rules', challenge_id=challenge_id, error=e)
+            return {'error': str(e)}
+    
+    def evaluate_challenge_data(self, challenge: Dict) -> Dict:
+        """
+        Apply the Prop Firm rules to an already fetched challenge row
+        
+        Pure in-memory evaluation, no database access. Used by
+        evaluate_challenge_rules and by bulk sweeps that fetch many rows at once.
+        
+        Args:
+            challenge: user_challenges row with at least id, status,
+                initial_capital, current_balance and daily_pnl
+            
+        Returns:
+            Dictionary with evaluation results and the computed status
+        """
+        challenge_id = challenge['id']
+        
+        # Skip if already completed
+        if challenge['status'] in ['success', 'failed']:
             return {
-                'status': new_status,
-                'rule_triggered': rule_triggered,
-                'metrics': {
-                    'current_balance': current_balance,
-                    'profit_percentage': profit_percentage,
-                    'loss_percentage': loss_percentage,
-                    'daily_loss_percentage': daily_loss_percentage,
-                    'total_loss_percentage': total_loss_percentage,
-                    'absolute_pnl': absolute_pnl
-                },
-                'limits': {
-                    'daily_loss_limit': self.DAILY_LOSS_LIMIT_PERCENT,
-                    'total_loss_limit': self.TOTAL_LOSS_LIMIT_PERCENT,
-                    'profit_target': self.PROFIT_TARGET_PERCENT
-                },
-                'challenge': challenge_response.data
+                'status': challenge['status'],
+                'message': f'Challenge already {challenge["status"]}',
+                'challenge': challenge
             }
+        
+        # Calculate key metrics
+        initial_capital = challenge['initial_capital']
+        current_balance = challenge['current_balance']
+        daily_pnl = challenge['daily_pnl']
+        
+        # Profit/Loss calculations and rule checks share the vectorized kernel
+        with tracing.span('rules'):
+            result = evaluate_rules(
+                initial_capital, current_balance, daily_pnl,
+                self.DAILY_LOSS_LIMIT_PERCENT, self.TOTAL_LOSS_LIMIT_PERCENT, self.PROFIT_TARGET_PERCENT
+            )
+        
+        absolute_pnl = current_balance - initial_capital
+        profit_percentage = result.profit_percentage
+        loss_percentage = result.total_loss_percentage
+        daily_loss_percentage = result.daily_loss_percentage
+        total_loss_percentage = result.total_loss_percentage
+        
+        # Runs for every challenge of a sweep: sampled, and free below DEBUG
+        logger.debug_sampled('Challenge evaluated', challenge_id=challenge_id, balance=current_balance,
+                             pnl=absolute_pnl, profit_percentage=profit_percentage,
+                             daily_loss_percentage=daily_loss_percentage,
+                             total_loss_percentage=total_loss_percentage)
+        
+        # Apply Prop Firm rules
+        new_status = STATUS_NAMES[result.status]
+        rule_triggered = self.rule_triggered_name(result.rule)
+        
+        if result.rule == RULE_DAILY_LOSS:
+            logger.warning('Challenge FAILED: daily loss limit exceeded', challenge_id=challenge_id,
+                           daily_loss_percentage=daily_loss_percentage)
+        elif result.rule == RULE_TOTAL_LOSS:
+            logger.warning('Challenge FAILED: total loss limit exceeded', challenge_id=challenge_id,
+                           total_loss_percentage=total_loss_percentage)
+        elif result.rule == RULE_PROFIT_TARGET:
+            logger.info('Challenge SUCCESS: profit target reached', challenge_id=challenge_id,
+                        profit_percentage=profit_percentage)
+        
+        return {
+            'status': new_status,
+            'rule_triggered': rule_triggered,
+            'metrics': {
+                'current_balance': current_balance,
+                'profit_percentage': profit_percentage,
+                'loss_percentage': loss_percentage,
+                'daily_loss_percentage': daily_loss_percentage,
+                'total_loss_percentage': total_loss_percentage,
+                'absolute_pnl': absolute_pnl
+            },
+            'limits': {
+                'daily_loss_limit': self.DAILY_LOSS_LIMIT_PERCENT,
+                'total_loss_limit': self.TOTAL_LOSS_LIMIT_PERCENT,
+                'profit_target': self.PROFIT_TARGET_PERCENT
+            },
+            'challenge': challenge
+        }
+    
+    def evaluate_challenges_batch(self, challenges: Union[List[Dict], ChallengeBatch]) -> RuleBatchResult:
+        """
+        Apply the Prop Firm rules to many challenge rows at once
+        
+        Columnar counterpart of evaluate_challenge_data; rows must be active
+        challenges with initial_capital, current_balance and daily_pnl.
+        
+        Args:
+            challenges: List of user_challenges rows, or a ChallengeBatch of them
+            
+        Returns:
+            RuleBatchResult aligned with the input rows
+        """
+        if isinstance(challenges, ChallengeBatch):
+            initial_capital = challenges.initial_capital
+            current_balance = challenges.current_balance
+            daily_pnl = challenges.daily_pnl
+        else:
+            count = len(challenges)
+            initial_capital = np.fromiter((c['initial_capital'] for c in challenges), dtype=np.float64, count=count)
+            current_balance = np.fromiter((c['current_balance'] for c in challenges), dtype=np.float64, count=count)
+            daily_pnl = np.fromiter((c['daily_pnl'] for c in challenges), dtype=np.float64, count=count)
+        
+        with tracing.span('rules'):
+            return evaluate_rules_batch(
+                initial_capital, current_balance, daily_pnl,
+                self.DAILY_LOSS_LIMIT_PERCENT, self.TOTAL_LOSS_LIMIT_PERCENT, self.PROFIT_TARGET_PERCENT
+            )
+    
+    def rule_triggered_name(self, rule_code: int) -> Optional[str]:
+        """Map a rule_engine rule code to the identifier stored on the challenge"""
+        if rule_code == RULE_DAILY_LOSS:
+            return f"daily_loss_limit_exceeded_{self.DAILY_LOSS_LIMIT_PERCENT}percent"
+        if rule_code == RULE_TOTAL_LOSS:
+            return f"total_loss_limit_exceeded_{self.TOTAL_LOSS_LIMIT_PERCENT}percent"
+        if rule_code == RULE_PROFIT_TARGET:
+            return f"profit_target_reached_{self.PROFIT_TARGET_PERCENT}percent"
+        return None
+    
+    def build_status_update(self, new_status: str, rule_triggered: Optional[str],
+                            ended_at: Optional[str] = None) -> Dict:
+        """
+        Build the user_challenges update payload for a status transition
+        
+        Args:
+            new_status: Status computed by the rules
+            rule_triggered: Rule identifier, if any rule fired
+            ended_at: ISO timestamp to record for completed challenges (defaults to now)
             
+        Returns:
+            Dictionary of columns to update
+        """
+        if new_status in ['success', 'failed']:
+            ended_at = ended_at or datetime.utcnow().isoformat()
+        else:
+            ended_at = None
+        
+        update_data = {
+            'status': new_status,
+            'ended_at': ended_at
+        }
+        
+        if rule_triggered:
+            update_data['failure_reason'] = rule_triggered if new_status == 'failed' else None
+            update_data['success_reason'] = rule_triggered if new_status == 'success' else None
+        
+        return update_data
+    
+    def apply_status_transitions(self, transitions: List[Dict]) -> Dict:
+        """
+        Persist many status transitions in one database call
+        
+        Uses the `apply_challenge_transitions` Postgres function. Only if it is
+        not deployed, falls back to one `update ... in (ids)` per distinct payload,
+        which is still a handful of calls per batch instead of one per row.
+        Only challenges that are still active are updated.
+        
+        Args:
+            transitions: List of update payloads from build_status_update, each with an 'id'
+            
+        Returns:
+            Dictionary with the updated challenge ids
+        """
+        if not transitions:
+            return {'success': True, 'updated_ids': []}
+        
+        try:
+            response = self.supabase.rpc('apply_challenge_transitions', {'transitions': transitions}).execute()
+            updated_ids = [row['id'] for row in (response.data or [])]
+            self._update_cached_transitions(transitions, updated_ids)
+            return {'success': True, 'updated_ids': updated_ids}
         except Exception as e:
-            logger.error(f"Error evaluating challenge rules: {str(e)}")
-            return {'error': str(e)}
+            if not (isinstance(e, APIError) and e.code in MISSING_FUNCTION_ERROR_CODES):
+                logger.error('Failed to apply status transitions', challenges=len(transitions), error=e)
+                return {'success': False, 'error': str(e), 'updated_ids': [],
+                        'failed_ids': [transition['id'] for transition in transitions]}
+            
+            logger.warning('apply_challenge_transitions unavailable, using grouped updates')
+        
+        # Group rows that share an identical payload so each group is one statement
+        groups = {}
+        for transition in transitions:
+            payload = {k: v for k, v in transition.items() if k != 'id'}
+            key = tuple(sorted(payload.items()))
+            groups.setdefault(key, (payload, []))[1].append(transition['id'])
+        
+        updated_ids = []
+        failed_ids = []
+        
+        for payload, ids in groups.values():
+            try:
+                self.supabase.table('user_challenges') \
+                    .update(payload) \
+                    .in_('id', ids) \
+                    .eq('status', 'active') \
+                    .execute()
+                updated_ids.extend(ids)
+            except Exception as e:
+                logger.error('Failed to apply status transition', challenges=len(ids), error=e)
+                failed_ids.extend(ids)
+        
+        # The grouped updates do not report which rows were still active
+        for challenge_id in updated_ids:
+            self.invalidate_challenge(challenge_id)
+        
+        return {'success': not failed_ids, 'updated_ids': updated_ids, 'failed_ids': failed_ids}
+    
+    def _update_cached_transitions(self, transitions: List[Dict], updated_ids: List[str]) -> None:
+        updated = set(updated_ids)
+        for transition in transitions:
+            if transition['id'] in updated:
+                self.update_cached_challenge(transition['id'], transition)
     
     def process_trade_completion(self, trade_id: str, user_id: str) -> Dict:
         """
@@ -203,21 +469,21 @@ class PropFirmChallengeEvaluator:
         try:
             # Get the completed trade
             trade_response = self.supabase.table('trades') \
-                .select('*, challenge_id') \
+                .select('id, challenge_id, pnl') \
                 .eq('id', trade_id) \
                 .eq('user_id', user_id) \
                 .eq('is_open', False) \
-                .single() \
+                .maybe_single() \
                 .execute()
             
-            if trade_response.error:
-                logger.error(f"Trade not found or still open: {trade_response.error}")
+            if not trade_response or not trade_response.data:
+                logger.error('Trade not found or still open', trade_id=trade_id)
                 return {'error': 'Trade not found or still open'}
             
             trade = trade_response.data
             challenge_id = trade['challenge_id']
             
-            logger.info(f"Processing completed trade {trade_id} for challenge {challenge_id}")
+            logger.debug_sampled('Processing completed trade', trade_id=trade_id, challenge_id=challenge_id)
             
             # Evaluate challenge rules
             evaluation_result = self.evaluate_challenge_rules(challenge_id)
@@ -226,7 +492,7 @@ class PropFirmChallengeEvaluator:
                 return evaluation_result
             
             # Log the trade impact
-            logger.info(f"Trade {trade_id} impact: PnL ${trade['pnl']:,.2f}")
+            logger.debug_sampled('Completed trade impact', trade_id=trade_id, pnl=trade['pnl'])
             
             return {
                 'success': True,
@@ -236,69 +502,424 @@ class PropFirmChallengeEvaluator:
                 'trade_pnl': trade['pnl']
             }
             
+        except APIError as e:
+            logger.error('Error reading completed trade', trade_id=trade_id, error=e.message or str(e))
+            return {'error': e.message or str(e)}
         except Exception as e:
-            logger.error(f"Error processing trade completion: {str(e)}")
+            logger.error('Error processing trade completion', trade_id=trade_id, error=e)
             return {'error': str(e)}
     
-    def reset_daily_metrics(self, challenge_id: str = None) -> Dict:
+    def rule_parameters(self) -> Dict:
+        """Limits and rule identifiers passed to the database-side rule checks"""
+        return {
+            'daily_loss_limit': self.DAILY_LOSS_LIMIT_PERCENT,
+            'total_loss_limit': self.TOTAL_LOSS_LIMIT_PERCENT,
+            'profit_target': self.PROFIT_TARGET_PERCENT,
+            'daily_rule': self.rule_triggered_name(RULE_DAILY_LOSS),
+            'total_rule': self.rule_triggered_name(RULE_TOTAL_LOSS),
+            'profit_rule': self.rule_triggered_name(RULE_PROFIT_TARGET)
+        }
+    
+    def add_settlement_listener(self, listener: Callable[[str, List[Dict]], None]) -> None:
+        """Call listener(user_id, trades) after every successful settlement"""
+        self.settlement_listeners.append(listener)
+    
+    def notify_settled(self, user_id: str, trades: List[Dict]) -> None:
+        """Pass settled trades ({'id', 'challenge_id', 'pnl'} each) to the settlement listeners"""
+        if not trades:
+            return
+        for listener in self.settlement_listeners:
+            try:
+                listener(user_id, trades)
+            except Exception as e:
+                logger.error('Settlement listener failed', user_id=user_id, error=e)
+    
+    def add_reset_listener(self, listener: Callable[[List[str]], None]) -> None:
+        """Call listener(challenge_ids) after every daily reset"""
+        self.reset_listeners.append(listener)
+    
+    def notify_reset(self, challenge_ids: List[str]) -> None:
+        """Pass the ids of reset challenges to the reset listeners"""
+        if not challenge_ids:
+            return
+        for listener in self.reset_listeners:
+            try:
+                listener(challenge_ids)
+            except Exception as e:
+                logger.error('Reset listener failed', challenges=len(challenge_ids), error=e)
+    
+    def settle_trade(self, trade_id: str, user_id: str, exit_price: float) -> Dict:
+        """
+        Close a trade, update the challenge balances and apply the Prop Firm rules
+        
+        Runs as one database transaction through the `settle_trade` Postgres
+        function, which also serializes concurrent settlements on the same
+        challenge. Falls back to the sequential read/update chain when the
+        function is not deployed.
+        
+        Args:
+            trade_id: Trade UUID
+            user_id: Owner of the trade
+            exit_price: Price at which the trade is closed
+            
+        Returns:
+            Dictionary shaped like the /evaluate-trade response, or
+            {'error', 'status_code'} on failure
+        """
+        try:
+            response = self.supabase.rpc('settle_trade', {
+                'p_trade_id': trade_id,
+                'p_user_id': user_id,
+                'p_exit_price': exit_price,
+                'p_rules': self.rule_parameters()
+            }).execute()
+        except APIError as e:
+            if e.code not in MISSING_FUNCTION_ERROR_CODES:
+                logger.error('Error settling trade', trade_id=trade_id, error=e.message)
+                status_code = 404 if e.code == 'P0002' else 500
+                return {'error': e.message or str(e), 'status_code': status_code}
+            
+            logger.warning("settle_trade function unavailable, settling trade sequentially")
+            result = self._settle_trade_sequential(trade_id, user_id, exit_price)
+            if 'error' not in result:
+                self.notify_settled(user_id, [{'id': trade_id, 'challenge_id': result['challenge']['id'], 'pnl': result['trade']['pnl']}])
+            return result
+        
+        result = response.data
+        
+        if 'error' in result:
+            return {'error': result['error'], 'status_code': 404}
+        
+        self.invalidate_challenge(result['challenge']['id'])
+        self.notify_settled(user_id, [{'id': trade_id, 'challenge_id': result['challenge']['id'], 'pnl': result['trade']['pnl']}])
+        logger.info('Trade settled', trade_id=trade_id, pnl=result['trade']['pnl'],
+                    challenge_id=result['challenge']['id'], status=result['challenge']['status'])
+        return result
+    
+    def _settle_trade_sequential(self, trade_id: str, user_id: str, exit_price: float) -> Dict:
+        """Fallback settlement issuing one request per step (not atomic)"""
+        # Get the trade
+        trade_response = self.supabase.table('trades') \
+            .select('*') \
+            .eq('id', trade_id) \
+            .eq('user_id', user_id) \
+            .eq('is_open', True) \
+            .maybe_single() \
+            .execute()
+        
+        if not trade_response or not trade_response.data:
+            logger.error('Trade not found or already closed', trade_id=trade_id)
+            return {'error': 'Trade not found or already closed', 'status_code': 404}
+        
+        trade = trade_response.data
+        with tracing.span('pnl'):
+            pnl = settlement_pnl(trade, exit_price)
+        
+        # Update trade with exit price and PnL
+        self.supabase.table('trades') \
+            .update({
+                'exit_price': exit_price,
+                'pnl': pnl,
+                'is_open': False,
+                'closed_at': datetime.utcnow().isoformat(),
+            }) \
+            .eq('id', trade_id) \
+            .execute()
+        
+        # Get the challenge
+        challenge_response = self.supabase.table('user_challenges') \
+            .select('*') \
+            .eq('id', trade['challenge_id']) \
+            .maybe_single() \
+            .execute()
+        
+        if not challenge_response or not challenge_response.data:
+            logger.error('Challenge not found', challenge_id=trade['challenge_id'])
+            return {'error': 'Challenge not found', 'status_code': 404}
+        
+        challenge = challenge_response.data
+        
+        # Update challenge balances
+        new_balance = challenge['current_balance'] + pnl
+        new_total_pnl = challenge['total_pnl'] + pnl
+        new_daily_pnl = challenge['daily_pnl'] + pnl
+        
+        challenge_update = {
+            'current_balance': new_balance,
+            'total_pnl': new_total_pnl,
+            'daily_pnl': new_daily_pnl,
+        }
+        if has_trade_stats(challenge):
+            challenge_update.update(add_trade_pnls(challenge, [pnl]))
+        
+        self.supabase.table('user_challenges') \
+            .update(challenge_update) \
+            .eq('id', trade['challenge_id']) \
+            .execute()
+        
+        self.invalidate_challenge(trade['challenge_id'])
+        
+        # Check challenge status using Prop Firm rules
+        if self.evaluation_queue is not None:
+            # The status is computed from the row just written; settle_trade's
+            # notify_settled enqueues the challenge and the queue persists it
+            status = self.evaluate_challenge_data({**challenge, **challenge_update})['status']
+        else:
+            check_response = self.process_trade_completion(trade_id, user_id)
+            if 'error' in check_response:
+                logger.error('Rule check after settlement failed', trade_id=trade_id, error=check_response['error'])
+            status = check_response.get('evaluation', {}).get('status', challenge['status'])
+        
+        return {
+            'success': True,
+            'trade': {
+                'id': trade_id,
+                'pnl': pnl,
+                'exit_price': exit_price,
+            },
+            'challenge': {
+                'id': trade['challenge_id'],
+                'new_balance': new_balance,
+                'total_pnl': new_total_pnl,
+                'status': status,
+            },
+        }
+    
+    def settle_trades(self, user_id: str, closes: List[Dict]) -> Dict:
+        """
+        Close many trades of one user in a single request
+        
+        Uses the `settle_trades` Postgres function: trades are closed with the
+        same PnL formula as settle_trade, each affected challenge receives one
+        aggregated balance delta, and the rules run once per challenge, all in
+        one transaction. Falls back to a grouped client-side settlement when
+        the function is not deployed.
+        
+        Args:
+            user_id: Owner of the trades
+            closes: List of {'trade_id', 'exit_price'}
+            
+        Returns:
+            Dictionary with the settled 'trades', the affected 'challenges' and
+            the requested trade ids that were 'not_found', or {'error', 'status_code'}
+        """
+        # Last exit price wins for duplicated trade ids
+        exit_prices = {close['trade_id']: close['exit_price'] for close in closes}
+        
+        try:
+            response = self.supabase.rpc('settle_trades', {
+                'p_user_id': user_id,
+                'p_closes': [{'trade_id': t, 'exit_price': p} for t, p in exit_prices.items()],
+                'p_rules': self.rule_parameters()
+            }).execute()
+            result = response.data
+        except APIError as e:
+            if e.code not in MISSING_FUNCTION_ERROR_CODES:
+                logger.error('Error settling trades', trades=len(exit_prices), error=e.message)
+                return {'error': e.message or str(e), 'status_code': 500}
+            
+            logger.warning("settle_trades function unavailable, settling trades client-side")
+            result = self._settle_trades_grouped(user_id, exit_prices)
+            
+            if 'error' in result:
+                return result
+        
+        for challenge in result['challenges']:
+            self.invalidate_challenge(challenge['id'])
+        self.notify_settled(user_id, result['trades'])
+        
+        settled_ids = {trade['id'] for trade in result['trades']}
+        result['not_found'] = [trade_id for trade_id in exit_prices if trade_id not in settled_ids]
+        
+        logger.info('Trades settled', trades=len(settled_ids), challenges=len(result['challenges']),
+                    user_id=user_id)
+        return result
+    
+    def _settle_trades_grouped(self, user_id: str, exit_prices: Dict[str, float]) -> Dict:
+        """Fallback batch settlement: a constant number of requests plus one update per challenge"""
+        trades_response = self.supabase.table('trades') \
+            .select('*') \
+            .in_('id', list(exit_prices)) \
+            .eq('user_id', user_id) \
+            .eq('is_open', True) \
+            .execute()
+        
+        trades = trades_response.data or []
+        if not trades:
+            return {'success': True, 'trades': [], 'challenges': []}
+        
+        closed_at = datetime.utcnow().isoformat()
+        deltas = {}
+        pnls = {}
+        settled = []
+        
+        with tracing.span('pnl'):
+            for trade in trades:
+                exit_price = exit_prices[trade['id']]
+                pnl = settlement_pnl(trade, exit_price)
+                trade.update({'exit_price': exit_price, 'pnl': pnl, 'is_open': False, 'closed_at': closed_at})
+                deltas[trade['challenge_id']] = deltas.get(trade['challenge_id'], 0.0) + pnl
+                pnls.setdefault(trade['challenge_id'], []).append(pnl)
+                settled.append({'id': trade['id'], 'challenge_id': trade['challenge_id'],
+                                'pnl': pnl, 'exit_price': exit_price})
+        
+        # Full rows, so the upsert only ever takes the update path
+        self.supabase.table('trades').upsert(trades).execute()
+        
+        challenges_response = self.supabase.table('user_challenges') \
+            .select('*') \
+            .in_('id', list(deltas)) \
+            .execute()
+        
+        challenges = []
+        transitions = []
+        ended_at = datetime.utcnow().isoformat()
+        
+        for challenge in challenges_response.data or []:
+            delta = deltas[challenge['id']]
+            challenge['current_balance'] += delta
+            challenge['total_pnl'] += delta
+            challenge['daily_pnl'] += delta
+            
+            challenge_update = {
+                'current_balance': challenge['current_balance'],
+                'total_pnl': challenge['total_pnl'],
+                'daily_pnl': challenge['daily_pnl'],
+            }
+            if has_trade_stats(challenge):
+                challenge_update.update(add_trade_pnls(challenge, pnls[challenge['id']]))
+            
+            self.supabase.table('user_challenges') \
+                .update(challenge_update) \
+                .eq('id', challenge['id']) \
+                .execute()
+            
+            # Rules run once per challenge on the row we just wrote
+            evaluation = self.evaluate_challenge_data(challenge)
+            status = evaluation['status']
+            if status != challenge['status']:
+                transitions.append({
+                    'id': challenge['id'],
+                    **self.build_status_update(status, evaluation.get('rule_triggered'), ended_at)
+                })
+            
+            challenges.append({
+                'id': challenge['id'],
+                'new_balance': challenge['current_balance'],
+                'total_pnl': challenge['total_pnl'],
+                'status': status,
+            })
+        
+        self.apply_status_transitions(transitions)
+        
+        return {'success': True, 'trades': settled, 'challenges': challenges}
+    
+    def reset_daily_metrics(self, challenge_id: str = None, user_id: str = None,
+                            statuses: List[str] = None) -> Dict:
         """
         Reset daily PnL for challenges (typically called at midnight)
         
+        All matching challenges are reset by one server-side statement (the
+        `reset_daily_metrics` Postgres function), so every row gets the same
+        reset timestamp. The per-row loop is only used when that function is
+        not deployed.
+        
         Args:
-            challenge_id: Specific challenge to reset (None for all active)
+            challenge_id: Specific challenge to reset (None for all matching)
+            user_id: Restrict the reset to one user's challenges
+            statuses: Statuses to reset when no challenge_id is given (defaults to active)
             
         Returns:
             Dictionary with reset results
         """
+        statuses = statuses or ['active']
+        
+        try:
+            response = self.supabase.rpc('reset_daily_metrics', {
+                'p_challenge_id': challenge_id,
+                'p_user_id': user_id,
+                'p_statuses': statuses
+            }).execute()
+        except Exception as e:
+            if not (isinstance(e, APIError) and e.code in MISSING_FUNCTION_ERROR_CODES):
+                logger.error('Error resetting daily metrics', error=e)
+                return {'error': str(e)}
+            
+            logger.warning('reset_daily_metrics function unavailable, resetting row by row')
+            return self._reset_daily_metrics_per_row(challenge_id, user_id, statuses)
+        
+        reset_ids = [row['id'] for row in (response.data or [])]
+        for reset_id in reset_ids:
+            self.invalidate_challenge(reset_id)
+        self.notify_reset(reset_ids)
+        logger.info('Daily PnL reset', challenges=len(reset_ids))
+        
+        return {
+            'success': True,
+            'reset_count': len(reset_ids),
+            'reset_ids': reset_ids,
+            'failed_resets': [],
+            'total_processed': len(reset_ids)
+        }
+    
+    def _reset_daily_metrics_per_row(self, challenge_id: Optional[str], user_id: Optional[str],
+                                     statuses: List[str]) -> Dict:
+        """Fallback daily reset issuing one update per challenge"""
         try:
             # Build query
-            query = self.supabase.table('user_challenges').select('*')
+            query = self.supabase.table('user_challenges').select('id')
             
             if challenge_id:
                 query = query.eq('id', challenge_id)
             else:
-                query = query.in_('status', ['active'])
+                query = query.in_('status', statuses)
             
-            response = query.execute()
+            if user_id:
+                query = query.eq('user_id', user_id)
             
-            if response.error:
-                logger.error(f"Error fetching challenges for daily reset: {response.error}")
-                return {'error': str(response.error)}
+            response = query.execute()
             
-            reset_count = 0
+            reset_ids = []
             failed_resets = []
+            reset_time = datetime.utcnow().isoformat()
             
             for challenge in response.data:
-                update_response = self.supabase.table('user_challenges') \
-                    .update({
-                        'daily_pnl': 0.0,
-                        'daily_reset_time': datetime.utcnow().isoformat()
-                    }) \
-                    .eq('id', challenge['id']) \
-                    .execute()
-                
-                if update_response.error:
-                    logger.error(f"Failed to reset daily PnL for challenge {challenge['id']}: {update_response.error}")
+                try:
+                    self.supabase.table('user_challenges') \
+                        .update({
+                            'daily_pnl': 0.0,
+                            'daily_reset_time': reset_time
+                        }) \
+                        .eq('id', challenge['id']) \
+                        .execute()
+                    self.update_cached_challenge(challenge['id'], {'daily_pnl': 0.0, 'daily_reset_time': reset_time})
+                    reset_ids.append(challenge['id'])
+                except Exception as e:
+                    logger.error('Failed to reset daily PnL', challenge_id=challenge['id'], error=e)
                     failed_resets.append(challenge['id'])
-                else:
-                    reset_count += 1
-                    logger.info(f"Daily PnL reset for challenge {challenge['id']}")
+            
+            self.notify_reset(reset_ids)
+            logger.info('Daily PnL reset', challenges=len(reset_ids))
             
             return {
                 'success': True,
-                'reset_count': reset_count,
+                'reset_count': len(reset_ids),
+                'reset_ids': reset_ids,
                 'failed_resets': failed_resets,
                 'total_processed': len(response.data)
             }
             
         except Exception as e:
-            logger.error(f"Error resetting daily metrics: {str(e)}")
+            logger.error('Error resetting daily metrics', error=e)
             return {'error': str(e)}
     
     def get_challenge_summary(self, challenge_id: str) -> Dict:
         """
         Get comprehensive challenge summary with all metrics
         
+        Trade statistics come from the running aggregates on the challenge
+        row; the trades are only scanned if the row does not carry them yet.
+        
         Args:
             challenge_id: Challenge UUID
             
@@ -306,53 +927,84 @@ class PropFirmChallengeEvaluator:
             Dictionary with challenge summary
         """
         try:
-            challenge_response = self.supabase.table('user_challenges') \
-                .select('*, trades(*)') \
-                .eq('id', challenge_id) \
-                .single() \
-                .execute()
+            challenge = self.get_challenge(challenge_id)
             
-            if challenge_response.error:
+            if not challenge:
                 return {'error': 'Challenge not found'}
             
-            challenge = challenge_response.data
-            trades = challenge.pop('trades', [])
-            
-            # Calculate additional metrics
-            winning_trades = [t for t in trades if t.get('pnl', 0) > 0]
-            losing_trades = [t for t in trades if t.get('pnl', 0) < 0]
-            
-            summary = {
-                'challenge': challenge,
-                'trade_statistics': {
-                    'total_trades': len(trades),
-                    'winning_trades': len(winning_trades),
-                    'losing_trades': len(losing_trades),
-                    'win_rate': len(winning_trades) / len(trades) * 100 if trades else 0,
-                    'total_pnl': sum(t.get('pnl', 0) for t in trades),
-                    'average_win': sum(t.get('pnl', 0) for t in winning_trades) / len(winning_trades) if winning_trades else 0,
-                    'average_loss': sum(t.get('pnl', 0) for t in losing_trades) / len(losing_trades) if losing_trades else 0
-                },
-                'current_status': {
-                    'balance': challenge['current_balance'],
-                    'remaining_to_profit_target': max(0, (challenge['initial_capital'] * (1 + self.PROFIT_TARGET_PERCENT/100)) - challenge['current_balance']),
-                    'remaining_before_daily_failure': max(0, challenge['initial_capital'] * (1 - self.DAILY_LOSS_LIMIT_PERCENT/100) - challenge['current_balance']),
-                    'remaining_before_total_failure': max(0, challenge['initial_capital'] * (1 - self.TOTAL_LOSS_LIMIT_PERCENT/100) - challenge['current_balance'])
-                }
-            }
+            if has_trade_stats(challenge):
+                return self.build_challenge_summary(challenge)
             
-            return summary
+            trades_response = self.supabase.table('trades') \
+                .select('pnl') \
+                .eq('challenge_id', challenge_id) \
+                .eq('is_open', False) \
+                .execute()
+            
+            return self.build_challenge_summary(challenge, trades_response.data or [])
             
         except Exception as e:
-            logger.error(f"Error getting challenge summary: {str(e)}")
+            logger.error('Error getting challenge summary', challenge_id=challenge_id, error=e)
             return {'error': str(e)}
+    
+    def build_challenge_summary(self, challenge: Dict, trades: Optional[List[Dict]] = None) -> Dict:
+        """
+        Build the challenge summary from a challenge row
+        
+        Args:
+            challenge: user_challenges row
+            trades: Closed trades of the challenge, only needed when the row
+                has no running trade statistics
+            
+        Returns:
+            Dictionary with challenge summary
+        """
+        if trades is None:
+            stats = challenge
+        else:
+            stats = add_trade_pnls(empty_trade_stats(), [t['pnl'] for t in trades if t.get('pnl') is not None])
+        
+        summary = {
+            'challenge': challenge,
+            'trade_statistics': trade_statistics(stats),
+            'current_status': {
+                'balance': challenge['current_balance'],
+                'remaining_to_profit_target': max(0, (challenge['initial_capital'] * (1 + self.PROFIT_TARGET_PERCENT/100)) - challenge['current_balance']),
+                'remaining_before_daily_failure': max(0, challenge['initial_capital'] * (1 - self.DAILY_LOSS_LIMIT_PERCENT/100) - challenge['current_balance']),
+                'remaining_before_total_failure': max(0, challenge['initial_capital'] * (1 - self.TOTAL_LOSS_LIMIT_PERCENT/100) - challenge['current_balance'])
+            }
+        }
+        
+        return summary
 
 # Initialize the service
 prop_firm_evaluator = None
 
-def get_prop_firm_evaluator(supabase_client):
-    """Get singleton instance of Prop Firm evaluator"""
+# Evaluators of clients other than the shared one, by id() of the client
+# (each evaluator holds its client, so ids are not reused while registered)
+_client_evaluators: Dict[int, PropFirmChallengeEvaluator] = {}
+_evaluator_lock = threading.Lock()
+
+def get_prop_firm_evaluator(supabase_client: Client = None):
+    """
+    Get the Prop Firm evaluator of a Supabase client
+
+    Defaults to the shared client from supabase_client. Every caller passing
+    the same client gets the same evaluator, so they share its challenge
+    cache and its settlement and reset listeners (evaluation queue,
+    leaderboard, mark-to-market).
+    """
     global prop_firm_evaluator
-    if prop_firm_evaluator is None:
-        prop_firm_evaluator = PropFirmChallengeEvaluator(supabase_client)
-    return prop_firm_evaluator
\ No newline at end of file
+    if supabase_client is None:
+        supabase_client = get_supabase_client()
+
+    with _evaluator_lock:
+        if prop_firm_evaluator is None:
+            prop_firm_evaluator = PropFirmChallengeEvaluator(supabase_client)
+        if prop_firm_evaluator.supabase is supabase_client:
+            return prop_firm_evaluator
+
+        evaluator = _client_evaluators.get(id(supabase_client))
+        if evaluator is None:
+            evaluator = _client_evaluators[id(supabase_client)] = PropFirmChallengeEvaluator(supabase_client)
+        return evaluator
@@ -0,0 +1,64 @@
+"""
+Columnar Records for user_challenges Rows
+
+ChallengeBatch is the struct-of-arrays form of challenge rows for the bulk
+paths (scheduler sweeps, the evaluation queue). Ids and statuses are lists,
+and the money columns are float64 arrays ready for
+rule_engine.evaluate_rules_batch; DECIMAL columns are converted to float
+once, when the rows are parsed.
+
+Per 100k challenge rows of the sweep columns, row dicts take about 60 MB and
+a ChallengeBatch about 28 MB, most of what remains being the id and user_id
+strings (bench_records.py).
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Columns of user_challenges read by the rules (the scheduler sweep's select)
+CHALLENGE_COLUMNS = ('id', 'user_id', 'status', 'initial_capital', 'current_balance', 'daily_pnl', 'total_pnl')
+
+
+def select_list(columns: Sequence[str]) -> str:
+    """PostgREST select() argument for a column tuple"""
+    return ', '.join(columns)
+
+
+class ChallengeBatch:
+    """Challenge rows as parallel columns: lists for the strings, float64 arrays for the money"""
+
+    __slots__ = ('ids', 'user_ids', 'statuses', 'initial_capital', 'current_balance', 'daily_pnl', 'total_pnl')
+
+    def __init__(self, ids: List[str], user_ids: List[Optional[str]], statuses: List[str],
+                 initial_capital: np.ndarray, current_balance: np.ndarray, daily_pnl: np.ndarray,
+                 total_pnl: np.ndarray):
+        self.ids = ids
+        self.user_ids = user_ids
+        self.statuses = statuses
+        self.initial_capital = initial_capital
+        self.current_balance = current_balance
+        self.daily_pnl = daily_pnl
+        self.total_pnl = total_pnl
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict]) -> 'ChallengeBatch':
+        """Columns of PostgREST rows; no per-row object is kept"""
+        count = len(rows)
+
+        def column(name, default=None):
+            if default is None:
+                return np.fromiter((row[name] for row in rows), dtype=np.float64, count=count)
+            return np.fromiter((row.get(name) or default for row in rows), dtype=np.float64, count=count)
+
+        return cls(
+            [row['id'] for row in rows],
+            [row.get('user_id') for row in rows],
+            [row['status'] for row in rows],
+            column('initial_capital'), column('current_balance'), column('daily_pnl'),
+            column('total_pnl', 0.0)
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
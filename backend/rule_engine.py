@@ -0,0 +1,114 @@
+"""
+Vectorized Prop Firm Rule Engine
+
+Columnar implementation of the challenge rules used by
+PropFirmChallengeEvaluator. All inputs are NumPy arrays (or scalars that
+broadcast against them), so a whole batch of challenges is evaluated in a
+handful of array operations. The scalar evaluate_rules helper is a thin
+wrapper over the same kernel so single-challenge and bulk evaluations
+always agree.
+
+Rule precedence (first match wins):
+1. Daily loss limit  -> failed
+2. Total loss limit  -> failed
+3. Profit target     -> success
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+# Status codes
+STATUS_ACTIVE = 0
+STATUS_SUCCESS = 1
+STATUS_FAILED = 2
+STATUS_NAMES = ('active', 'success', 'failed')
+
+# Triggered-rule codes
+RULE_NONE = 0
+RULE_DAILY_LOSS = 1
+RULE_TOTAL_LOSS = 2
+RULE_PROFIT_TARGET = 3
+
+# Status implied by each rule code, indexed by rule code
+_RULE_STATUS = np.array([STATUS_ACTIVE, STATUS_FAILED, STATUS_FAILED, STATUS_SUCCESS], dtype=np.int8)
+
+
+class RuleBatchResult(NamedTuple):
+    """Per-row output of evaluate_rules_batch"""
+    status: np.ndarray
+    rule: np.ndarray
+    profit_percentage: np.ndarray
+    daily_loss_percentage: np.ndarray
+    total_loss_percentage: np.ndarray
+
+
+class RuleResult(NamedTuple):
+    """Output of evaluate_rules for a single challenge"""
+    status: int
+    rule: int
+    profit_percentage: float
+    daily_loss_percentage: float
+    total_loss_percentage: float
+
+
+def evaluate_rules_batch(initial_capital, current_balance, daily_pnl,
+                         daily_loss_limit, total_loss_limit, profit_target) -> RuleBatchResult:
+    """
+    Evaluate the Prop Firm rules for a batch of challenges
+
+    Args:
+        initial_capital: Starting balance per challenge
+        current_balance: Realized (or marked-to-market) balance per challenge
+        daily_pnl: PnL since the last daily reset per challenge
+        daily_loss_limit: Daily loss limit in percent (scalar or per challenge)
+        total_loss_limit: Total loss limit in percent (scalar or per challenge)
+        profit_target: Profit target in percent (scalar or per challenge)
+
+    Returns:
+        RuleBatchResult with int8 status and rule codes plus the percentages used
+    """
+    initial_capital = np.asarray(initial_capital, dtype=np.float64)
+    current_balance = np.asarray(current_balance, dtype=np.float64)
+    daily_pnl = np.asarray(daily_pnl, dtype=np.float64)
+
+    # A zero initial capital yields inf/nan percentages, which never trigger a rule
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_percentage = (current_balance - initial_capital) / initial_capital * 100
+        daily_loss_percentage = np.maximum(-(daily_pnl / initial_capital * 100), 0.0)
+    total_loss_percentage = np.maximum(-profit_percentage, 0.0)
+
+    daily_hit = daily_loss_percentage >= daily_loss_limit
+    total_hit = total_loss_percentage >= total_loss_limit
+    profit_hit = profit_percentage >= profit_target
+
+    # Apply precedence from lowest to highest so the first rule in order wins
+    rule = np.zeros(np.broadcast(daily_hit, total_hit, profit_hit).shape, dtype=np.int8)
+    rule[profit_hit] = RULE_PROFIT_TARGET
+    rule[total_hit] = RULE_TOTAL_LOSS
+    rule[daily_hit] = RULE_DAILY_LOSS
+
+    return RuleBatchResult(
+        status=_RULE_STATUS[rule],
+        rule=rule,
+        profit_percentage=profit_percentage,
+        daily_loss_percentage=daily_loss_percentage,
+        total_loss_percentage=total_loss_percentage
+    )
+
+
+def evaluate_rules(initial_capital: float, current_balance: float, daily_pnl: float,
+                   daily_loss_limit: float, total_loss_limit: float, profit_target: float) -> RuleResult:
+    """Evaluate the Prop Firm rules for one challenge using the batch kernel"""
+    result = evaluate_rules_batch(
+        [initial_capital], [current_balance], [daily_pnl],
+        daily_loss_limit, total_loss_limit, profit_target
+    )
+
+    return RuleResult(
+        status=int(result.status[0]),
+        rule=int(result.rule[0]),
+        profit_percentage=float(result.profit_percentage[0]),
+        daily_loss_percentage=float(result.daily_loss_percentage[0]),
+        total_loss_percentage=float(result.total_loss_percentage[0])
+    )
@@ -8,49 +8,293 @@ This can be run as a separate process or integrated into the main Flask app.
 import schedule
 import time
 import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from supabase import create_client, Client
+from supabase import Client
+from postgrest.exceptions import APIError
 import os
 from dotenv import load_dotenv
 from prop_firm_service import get_prop_firm_evaluator
-import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from supabase_client import get_supabase_client, pool_stats
+from rule_engine import STATUS_NAMES
+from records import CHALLENGE_COLUMNS, ChallengeBatch, select_list
+from market_data import get_market_data_hub
+from price_alerts import get_price_alert_engine
+from mark_to_market import get_mark_to_market_engine
+from leaderboard import get_leaderboard_service
+from evaluation_queue import get_evaluation_queue
+from worker_pool import JobPool, RateLimiter
+from coordination import create_coordinator_from_env
+import metrics
+from structured_logging import configure_logging, get_logger
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging (LOG_LEVEL, LOG_FORMAT, LOG_ASYNC) unless the host app already did
+configure_logging()
+logger = get_logger(__name__)
+
+
+def id_partitions(count: int, shard: int = 0, shards: int = 1):
+    """
+    Split a shard's slice of the UUID key space into count contiguous (lower, upper) ranges
+
+    Shard i of n covers the i-th of n equal slices (see coordination.shard_of).
+    Bounds are canonical UUID strings, compared by Postgres in the same order
+    as the id column; None means unbounded. Random (v4) ids spread evenly.
+    """
+    total = count * shards
+    bounds = [
+        str(uuid.UUID(int=(i << 128) // total)) if 0 < i < total else None
+        for i in range(shard * count, (shard + 1) * count + 1)
+    ]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
 class PropFirmBackgroundScheduler:
     """Scheduler for background Prop Firm challenge evaluations"""
     
-    def __init__(self):
-        # Initialize Supabase client
-        self.SUPABASE_URL = os.getenv("SUPABASE_URL")
-        self.SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-        
-        if not self.SUPABASE_URL or not self.SUPABASE_SERVICE_ROLE_KEY:
-            raise ValueError("Supabase credentials not found in environment variables")
-        
-        self.supabase: Client = create_client(self.SUPABASE_URL, self.SUPABASE_SERVICE_ROLE_KEY)
+    def __init__(self, supabase_client: Client = None):
+        # Shared Supabase client (same connection pool as the web routes)
+        self.supabase: Client = supabase_client or get_supabase_client()
         self.prop_firm_evaluator = get_prop_firm_evaluator(self.supabase)
         
+        # Event-driven evaluation: settlements, daily resets and equity breaches
+        # enqueue their challenges; the full sweep is then only a safety net
+        self.EVALUATION_QUEUE_ENABLED = os.getenv("EVALUATION_QUEUE_ENABLED", "true").lower() == "true"
+        self.EVALUATION_QUEUE_WINDOW = float(os.getenv("EVALUATION_QUEUE_WINDOW", "0.25"))         # seconds
+        self.EVALUATION_QUEUE_BATCH_SIZE = int(os.getenv("EVALUATION_QUEUE_BATCH_SIZE", "500"))
+        self.SAFETY_SWEEP_INTERVAL = int(os.getenv("SCHEDULER_SAFETY_SWEEP_INTERVAL", "60"))     # minutes
+        self.evaluation_queue = None
+        
         # Scheduling intervals (in minutes)
-        self.EVALUATION_INTERVAL = 5  # Check active challenges every 5 minutes
+        self.EVALUATION_INTERVAL = self.SAFETY_SWEEP_INTERVAL if self.EVALUATION_QUEUE_ENABLED else 5
         self.DAILY_RESET_HOUR = 0     # Reset daily metrics at midnight UTC
         self.HEARTBEAT_INTERVAL = 30  # Log heartbeat every 30 minutes
         
+        # Bulk sweep: page through active challenges with the rule columns and
+        # write each page's status transitions in one batched call
+        self.BULK_SWEEP = os.getenv("SCHEDULER_BULK_SWEEP", "true").lower() == "true"
+        self.SWEEP_CHUNK_SIZE = int(os.getenv("SCHEDULER_SWEEP_CHUNK_SIZE", "1000"))
+        self.SWEEP_COLUMNS = select_list(CHALLENGE_COLUMNS)
+        
+        # Worker pools: scheduled jobs run side by side, so a slow sweep does not
+        # delay the daily reset, and sweeps fan out over id ranges (bulk) or
+        # challenges (individual). Sweep requests to Supabase are rate limited.
+        self.JOB_WORKERS = int(os.getenv("SCHEDULER_JOB_WORKERS", "4"))
+        self.EVALUATION_WORKERS = int(os.getenv("SCHEDULER_EVALUATION_WORKERS", "8"))
+        self.SUPABASE_RATE_LIMIT = float(os.getenv("SCHEDULER_SUPABASE_RATE_LIMIT", "50"))  # requests/s, 0 = unlimited
+        self.job_pool = JobPool(max_workers=self.JOB_WORKERS)
+        self.evaluation_pool = ThreadPoolExecutor(max_workers=self.EVALUATION_WORKERS,
+                                                  thread_name_prefix="SchedulerEvaluation")
+        self.rate_limiter = RateLimiter(self.SUPABASE_RATE_LIMIT)
+        
+        # Coordination with the scheduler instances of other workers/hosts:
+        # sweeps cover this instance's shard, singleton jobs run on the leader
+        self.coordinator = create_coordinator_from_env(self.supabase)
+        self.COORDINATION_HEARTBEAT_INTERVAL = max(1, int(float(os.getenv("SCHEDULER_LEASE_TTL", "30")) / 3))  # seconds
+        
+        # Price alerts: matched on every market data tick, re-synced periodically
+        self.PRICE_ALERTS_ENABLED = os.getenv("PRICE_ALERTS_ENABLED", "true").lower() == "true"
+        self.PRICE_ALERT_SYNC_INTERVAL = int(os.getenv("PRICE_ALERT_SYNC_INTERVAL", "30"))      # seconds
+        self.PRICE_ALERT_RELOAD_INTERVAL = int(os.getenv("PRICE_ALERT_RELOAD_INTERVAL", "10"))  # minutes
+        self.price_alert_engine = None
+        
+        # Mark-to-market: open positions re-marked on every tick, failing
+        # challenges whose equity breaches a loss limit; reloaded periodically to
+        # pick up trades opened and closed by other processes
+        self.MARK_TO_MARKET_ENABLED = os.getenv("MARK_TO_MARKET_ENABLED", "true").lower() == "true"
+        self.MARK_TO_MARKET_RELOAD_INTERVAL = int(os.getenv("MARK_TO_MARKET_RELOAD_INTERVAL", "60"))  # seconds
+        self.mark_to_market_engine = None
+        
+        # Leaderboard: ranks flushed to the leaderboard table in batched upserts;
+        # the reload folds in trades settled by other processes
+        self.LEADERBOARD_ENABLED = os.getenv("LEADERBOARD_ENABLED", "true").lower() == "true"
+        self.LEADERBOARD_FLUSH_INTERVAL = int(os.getenv("LEADERBOARD_FLUSH_INTERVAL", "60"))    # seconds
+        self.LEADERBOARD_RELOAD_INTERVAL = int(os.getenv("LEADERBOARD_RELOAD_INTERVAL", "5"))  # minutes
+        self.leaderboard_service = None
+        
         self.running = False
         self.scheduler_thread = None
     
     def evaluate_active_challenges(self):
         """Evaluate all active Prop Firm challenges"""
+        started = time.monotonic()
+        if self.BULK_SWEEP:
+            results = self.evaluate_active_challenges_bulk()
+        else:
+            results = self.evaluate_active_challenges_individually()
+        metrics.record_sweep('bulk' if self.BULK_SWEEP else 'individual', time.monotonic() - started, results)
+        return results
+    
+    def evaluate_active_challenges_bulk(self):
+        """
+        Evaluate all active challenges in pages, in memory
+        
+        Each page of SWEEP_CHUNK_SIZE rows costs one read and one batched
+        write, instead of a read and a write per challenge. The id space is
+        split into EVALUATION_WORKERS ranges that are paged concurrently.
+        With coordination, only this instance's shard of the id space is swept.
+        """
+        evaluation_results = self._empty_results()
+        
+        try:
+            logger.info('Starting bulk evaluation of active challenges')
+            
+            shard, shards = self.coordinator.shard() if self.coordinator else (0, 1)
+            futures = [
+                self.evaluation_pool.submit(self._sweep_partition, lower, upper)
+                for lower, upper in id_partitions(self.EVALUATION_WORKERS, shard, shards)
+            ]
+            for future in futures:
+                for key, value in future.result().items():
+                    evaluation_results[key] += value
+            
+            logger.info('Bulk evaluation complete', evaluated=evaluation_results['total_evaluated'],
+                        successes=evaluation_results['successes'], failures=evaluation_results['failures'],
+                        errors=evaluation_results['errors'])
+            
+        except Exception as e:
+            logger.error('Error in evaluate_active_challenges_bulk', error=e)
+            evaluation_results['errors'] += 1
+        
+        return evaluation_results
+    
+    @staticmethod
+    def _empty_results():
+        return {
+            'total_evaluated': 0,
+            'successes': 0,
+            'failures': 0,
+            'unchanged': 0,
+            'errors': 0
+        }
+    
+    def _sweep_partition(self, lower, upper):
+        """Page through the active challenges with lower <= id < upper"""
+        evaluation_results = self._empty_results()
+        last_id = None
+        
         try:
-            logger.info("Starting evaluation of active challenges...")
+            while True:
+                # Keyset pagination on id: stable even when rows leave the active set mid-sweep
+                query = self.supabase.table('user_challenges') \
+                    .select(self.SWEEP_COLUMNS) \
+                    .in_('status', ['active']) \
+                    .order('id') \
+                    .limit(self.SWEEP_CHUNK_SIZE)
+                
+                if last_id is not None:
+                    query = query.gt('id', last_id)
+                elif lower is not None:
+                    query = query.gte('id', lower)
+                if upper is not None:
+                    query = query.lt('id', upper)
+                
+                self.rate_limiter.acquire()
+                response = query.execute()
+                chunk = response.data or []
+                if not chunk:
+                    break
+                
+                self._evaluate_chunk(chunk, evaluation_results)
+                last_id = chunk[-1]['id']
+                
+                if len(chunk) < self.SWEEP_CHUNK_SIZE:
+                    break
+                
+        except Exception as e:
+            logger.error('Error sweeping challenges', lower=lower, upper=upper, error=e)
+            evaluation_results['errors'] += 1
+        
+        return evaluation_results
+    
+    def _evaluate_chunk(self, chunk, evaluation_results):
+        """Evaluate one page of challenges and write its transitions in one call"""
+        evaluator = self.prop_firm_evaluator
+        ended_at = datetime.utcnow().isoformat()
+        transitions = []
+        new_statuses = {}
+        
+        evaluation_results['total_evaluated'] += len(chunk)
+        
+        try:
+            outcomes = self._evaluate_chunk_vectorized(chunk)
+        except Exception as e:
+            # A malformed row poisons the columnar batch; isolate it row by row
+            logger.warning('Vectorized evaluation failed, evaluating chunk row by row', challenges=len(chunk),
+                           error=e)
+            outcomes = self._evaluate_chunk_rows(chunk)
+        
+        for challenge_id, old_status, status, rule_triggered in outcomes:
+            if status is None:
+                evaluation_results['errors'] += 1
+                continue
+            
+            if status != old_status:
+                transitions.append({
+                    'id': challenge_id,
+                    **evaluator.build_status_update(status, rule_triggered, ended_at)
+                })
+                new_statuses[challenge_id] = status
+            
+            if status == 'success':
+                evaluation_results['successes'] += 1
+            elif status == 'failed':
+                evaluation_results['failures'] += 1
+            else:
+                evaluation_results['unchanged'] += 1
+        
+        if transitions:
+            self.rate_limiter.acquire()
+        write_result = evaluator.apply_status_transitions(transitions)
+        
+        # Transitions that could not be written count as errors, not as outcomes
+        for challenge_id in write_result.get('failed_ids', []):
+            status = new_statuses[challenge_id]
+            evaluation_results['successes' if status == 'success' else 'failures'] -= 1
+            evaluation_results['errors'] += 1
+        
+        for challenge_id in write_result.get('updated_ids', []):
+            logger.info('Challenge status changed', challenge_id=challenge_id, status=new_statuses.get(challenge_id))
+    
+    def _evaluate_chunk_vectorized(self, chunk):
+        """Return (id, old status, status, rule_triggered) tuples using the columnar rule kernel"""
+        evaluator = self.prop_firm_evaluator
+        batch = ChallengeBatch.from_rows(chunk)
+        result = evaluator.evaluate_challenges_batch(batch)
+        
+        statuses = result.status.tolist()
+        rules = result.rule.tolist()
+        
+        return [
+            (challenge_id, old_status, STATUS_NAMES[status], evaluator.rule_triggered_name(rule))
+            for challenge_id, old_status, status, rule in zip(batch.ids, batch.statuses, statuses, rules)
+        ]
+    
+    def _evaluate_chunk_rows(self, chunk):
+        """Return (id, old status, status, rule_triggered) tuples row by row; status is None on error"""
+        outcomes = []
+        
+        for challenge in chunk:
+            try:
+                result = self.prop_firm_evaluator.evaluate_challenge_data(challenge)
+                outcomes.append((challenge['id'], challenge['status'],
+                                 result.get('status', 'unknown'), result.get('rule_triggered')))
+            except Exception as e:
+                logger.error('Exception evaluating challenge', challenge_id=challenge.get('id'), error=e)
+                outcomes.append((challenge.get('id'), challenge.get('status'), None, None))
+        
+        return outcomes
+    
+    def evaluate_active_challenges_individually(self):
+        """Evaluate all active Prop Firm challenges one request at a time"""
+        evaluation_results = self._empty_results()
+        
+        try:
+            logger.info('Starting evaluation of active challenges')
             
             # Get all active challenges
             response = self.supabase.table('user_challenges') \
@@ -58,86 +302,233 @@ class PropFirmBackgroundScheduler:
                 .in_('status', ['active']) \
                 .execute()
             
-            if response.error:
-                logger.error(f"Failed to fetch active challenges: {response.error}")
-                return
+            active_challenges = response.data or []
+            if self.coordinator:
+                active_challenges = [c for c in active_challenges if self.coordinator.owns(c['id'])]
+            logger.info('Active challenges to evaluate', challenges=len(active_challenges))
             
-            active_challenges = response.data
-            logger.info(f"Found {len(active_challenges)} active challenges to evaluate")
-            
-            evaluation_results = {
-                'total_evaluated': len(active_challenges),
-                'successes': 0,
-                'failures': 0,
-                'unchanged': 0,
-                'errors': 0
-            }
-            
-            # Evaluate each challenge
-            for challenge in active_challenges:
-                try:
-                    result = self.prop_firm_evaluator.evaluate_challenge_rules(challenge['id'])
-                    
-                    if 'error' in result:
-                        logger.error(f"Error evaluating challenge {challenge['id']}: {result['error']}")
-                        evaluation_results['errors'] += 1
-                    else:
-                        status = result.get('status', 'unknown')
-                        if status in ['success', 'failed']:
-                            logger.info(f"Challenge {challenge['id']} status changed to: {status}")
-                            if status == 'success':
-                                evaluation_results['successes'] += 1
-                            else:
-                                evaluation_results['failures'] += 1
-                        else:
-                            evaluation_results['unchanged'] += 1
-                            
-                except Exception as e:
-                    logger.error(f"Exception evaluating challenge {challenge['id']}: {str(e)}")
+            evaluation_results['total_evaluated'] = len(active_challenges)
+            
+            # Evaluate the challenges on the evaluation pool
+            statuses = self.evaluation_pool.map(
+                self._evaluate_one, [challenge['id'] for challenge in active_challenges]
+            )
+            
+            for status in statuses:
+                if status is None:
                     evaluation_results['errors'] += 1
+                elif status == 'success':
+                    evaluation_results['successes'] += 1
+                elif status == 'failed':
+                    evaluation_results['failures'] += 1
+                else:
+                    evaluation_results['unchanged'] += 1
+            
+            logger.info('Evaluation complete', evaluated=evaluation_results['total_evaluated'],
+                        successes=evaluation_results['successes'], failures=evaluation_results['failures'],
+                        errors=evaluation_results['errors'])
+            
+        except APIError as e:
+            logger.error('Failed to fetch active challenges', error=e.message or str(e))
+            evaluation_results['errors'] += 1
+        except Exception as e:
+            logger.error('Error in evaluate_active_challenges', error=e)
+            evaluation_results['errors'] += 1
+        
+        return evaluation_results
+    
+    def _evaluate_one(self, challenge_id):
+        """Evaluate one challenge with its own requests; returns its status, or None on error"""
+        try:
+            self.rate_limiter.acquire()
+            result = self.prop_firm_evaluator.evaluate_challenge_rules(challenge_id)
+            
+            if 'error' in result:
+                logger.error('Error evaluating challenge', challenge_id=challenge_id, error=result['error'])
+                return None
             
-            logger.info(f"Evaluation complete - "
-                       f"Successes: {evaluation_results['successes']}, "
-                       f"Failures: {evaluation_results['failures']}, "
-                       f"Errors: {evaluation_results['errors']}")
+            status = result.get('status', 'unknown')
+            if status in ['success', 'failed']:
+                logger.info('Challenge status changed', challenge_id=challenge_id, status=status)
+            return status
             
         except Exception as e:
-            logger.error(f"Error in evaluate_active_challenges: {str(e)}")
+            logger.error('Exception evaluating challenge', challenge_id=challenge_id, error=e)
+            return None
+    
+    def run_as_leader(self, func):
+        """Run a singleton job only on the instance holding the leader lease"""
+        if self.coordinator and not self.coordinator.is_leader():
+            logger.debug('Skipping job: not the scheduler leader', job=func.__name__)
+            return None
+        return func()
+    
+    def leader_tick_listener(self, engine):
+        """
+        Market data listener passing ticks to engine.on_ticks on the leader only
+
+        Leadership is read from the last coordination heartbeat, not confirmed
+        per tick; an instance that has just become the leader loads the
+        engine before marking its first ticks.
+        """
+        loaded = threading.Event()
+        if self.run_as_leader(engine.load) is not None:
+            loaded.set()
+
+        def on_ticks(ticks):
+            if self.coordinator and not self.coordinator.leads():
+                loaded.clear()
+                return None
+            if not loaded.is_set():
+                engine.load()
+                loaded.set()
+            return engine.on_ticks(ticks)
+
+        return on_ticks
     
     def daily_reset_job(self):
         """Perform daily reset of metrics"""
         try:
-            logger.info("Performing daily metrics reset...")
+            logger.info('Performing daily metrics reset')
             result = self.prop_firm_evaluator.reset_daily_metrics()
             
             if 'error' in result:
-                logger.error(f"Daily reset failed: {result['error']}")
+                logger.error('Daily reset failed', error=result['error'])
             else:
-                logger.info(f"Daily reset completed: {result['reset_count']} challenges reset")
+                logger.info('Daily reset completed', challenges=result['reset_count'])
+                
+                # Equity checks use daily_pnl, so pick up the reset values now
+                if self.mark_to_market_engine:
+                    self.mark_to_market_engine.load()
                 
         except Exception as e:
-            logger.error(f"Error in daily_reset_job: {str(e)}")
+            logger.error('Error in daily_reset_job', error=e)
+    
+    def start_evaluation_queue(self):
+        """Evaluate challenges as settlements, resets and equity breaches enqueue them"""
+        try:
+            self.evaluation_queue = get_evaluation_queue(
+                self.prop_firm_evaluator,
+                window=self.EVALUATION_QUEUE_WINDOW,
+                batch_size=self.EVALUATION_QUEUE_BATCH_SIZE
+            )
+            
+        except Exception as e:
+            logger.error('Error starting challenge evaluation queue', error=e)
+    
+    def start_price_alerts(self):
+        """Load active price alerts and match them against the market data hub's ticks"""
+        try:
+            if not get_market_data_hub().has_real_source():
+                logger.warning('Price alerts disabled: MARKET_DATA_SOURCE is simulated')
+                return
+            
+            # Only the leader matches ticks, so each alert triggers once across instances
+            self.price_alert_engine = get_price_alert_engine(self.supabase)
+            get_market_data_hub().subscribe(self.leader_tick_listener(self.price_alert_engine))
+            
+            # New and toggled alerts are picked up incrementally; the full
+            # reload also drops alerts deleted by users
+            schedule.every(self.PRICE_ALERT_SYNC_INTERVAL).seconds.do(
+                self.job_pool.submit, 'price_alert_sync', self.run_as_leader, self.price_alert_engine.sync)
+            schedule.every(self.PRICE_ALERT_RELOAD_INTERVAL).minutes.do(
+                self.job_pool.submit, 'price_alert_load', self.run_as_leader, self.price_alert_engine.load)
+            
+        except Exception as e:
+            logger.error('Error starting price alert engine', error=e)
+    
+    def start_mark_to_market(self):
+        """Load open positions and re-mark them on every market data tick"""
+        try:
+            if not get_market_data_hub().has_real_source():
+                logger.warning('Mark-to-market disabled: MARKET_DATA_SOURCE is simulated')
+                return
+            
+            self.mark_to_market_engine = get_mark_to_market_engine(self.prop_firm_evaluator)
+            if self.evaluation_queue:
+                self.evaluation_queue.attach_mark_to_market(self.mark_to_market_engine)
+            else:
+                self.prop_firm_evaluator.add_settlement_listener(self.mark_to_market_engine.on_settled)
+            get_market_data_hub().subscribe(self.leader_tick_listener(self.mark_to_market_engine))
+            
+            schedule.every(self.MARK_TO_MARKET_RELOAD_INTERVAL).seconds.do(
+                self.job_pool.submit, 'mark_to_market_load', self.run_as_leader, self.mark_to_market_engine.load)
+            
+        except Exception as e:
+            logger.error('Error starting mark-to-market engine', error=e)
+    
+    def start_leaderboard(self):
+        """Load the leaderboard rankings and flush their ranks periodically"""
+        try:
+            self.leaderboard_service = get_leaderboard_service(self.prop_firm_evaluator)
+            self.leaderboard_service.load()
+            
+            schedule.every(self.LEADERBOARD_FLUSH_INTERVAL).seconds.do(
+                self.job_pool.submit, 'leaderboard_flush', self.run_as_leader, self.leaderboard_service.flush)
+            schedule.every(self.LEADERBOARD_RELOAD_INTERVAL).minutes.do(
+                self.job_pool.submit, 'leaderboard_load', self.leaderboard_service.load)
+            
+        except Exception as e:
+            logger.error('Error starting leaderboard service', error=e)
     
     def heartbeat(self):
         """Log system heartbeat"""
-        logger.info(f"Prop Firm Background Scheduler is running - "
-                   f"Active challenges monitoring every {self.EVALUATION_INTERVAL} minutes")
+        logger.info('Prop Firm Background Scheduler is running', evaluation_interval_minutes=self.EVALUATION_INTERVAL)
+        
+        if self.evaluation_queue:
+            stats = self.evaluation_queue.stats()
+            logger.info('Evaluation queue', pending=stats['pending'], evaluated=stats['evaluated_total'],
+                        coalesced=stats['coalesced_total'], transitions=stats['transitions_total'])
+        
+        jobs = self.job_pool.stats()
+        logger.info('Scheduler jobs', running=len(jobs['running']), max_workers=jobs['max_workers'],
+                    skipped=jobs['skipped_total'], failed=jobs['failed_total'],
+                    rate_limit_wait_s=round(self.rate_limiter.waited_seconds, 1))
+        
+        if self.coordinator:
+            coordination = self.coordinator.stats()
+            logger.info('Scheduler instance', instance_id=coordination['instance_id'],
+                        shard=coordination['shard'] + 1, shards=coordination['shards'],
+                        role='leader' if coordination['leader'] else 'follower')
+        
+        for name, stats in pool_stats().items():
+            logger.info('Supabase pool', pool=name, in_flight=stats['in_flight'],
+                        max_connections=stats['max_connections'], peak_utilization=stats['peak_utilization'],
+                        avg_wait_ms=round(stats['avg_wait_ms'], 1), max_wait_ms=round(stats['max_wait_ms'], 1),
+                        pool_timeouts=stats['pool_timeouts'])
     
     def start_scheduler(self):
         """Start the background scheduler"""
         if self.running:
-            logger.warning("Scheduler is already running")
+            logger.warning('Scheduler is already running')
             return
         
-        logger.info("Starting Prop Firm Background Scheduler...")
+        logger.info('Starting Prop Firm Background Scheduler')
         
-        # Schedule jobs
-        schedule.every(self.EVALUATION_INTERVAL).minutes.do(self.evaluate_active_challenges)
-        schedule.every().day.at(f"{self.DAILY_RESET_HOUR:02d}:00").do(self.daily_reset_job)
-        schedule.every(self.HEARTBEAT_INTERVAL).minutes.do(self.heartbeat)
+        # Schedule jobs; they run on the job pool, never overlapping with their own previous run
+        schedule.every(self.EVALUATION_INTERVAL).minutes.do(
+            self.job_pool.submit, 'evaluate_active_challenges', self.evaluate_active_challenges)
+        schedule.every().day.at(f"{self.DAILY_RESET_HOUR:02d}:00").do(
+            self.job_pool.submit, 'daily_reset', self.run_as_leader, self.daily_reset_job)
+        schedule.every(self.HEARTBEAT_INTERVAL).minutes.do(
+            self.job_pool.submit, 'heartbeat', self.heartbeat)
+        
+        if self.coordinator:
+            self.coordinator.heartbeat()
+            schedule.every(self.COORDINATION_HEARTBEAT_INTERVAL).seconds.do(
+                self.job_pool.submit, 'coordination_heartbeat', self.coordinator.heartbeat)
+        
+        if self.EVALUATION_QUEUE_ENABLED:
+            self.start_evaluation_queue()
+        if self.PRICE_ALERTS_ENABLED:
+            self.start_price_alerts()
+        if self.MARK_TO_MARKET_ENABLED:
+            self.start_mark_to_market()
+        if self.LEADERBOARD_ENABLED:
+            self.start_leaderboard()
         
         # Run initial evaluation
-        self.evaluate_active_challenges()
+        self.job_pool.submit('evaluate_active_challenges', self.evaluate_active_challenges)
         self.heartbeat()
         
         self.running = True
@@ -147,20 +538,24 @@ class PropFirmBackgroundScheduler:
             schedule.run_pending()
             time.sleep(1)
         
-        logger.info("Prop Firm Background Scheduler stopped")
+        logger.info('Prop Firm Background Scheduler stopped')
     
     def stop_scheduler(self):
         """Stop the background scheduler"""
-        logger.info("Stopping Prop Firm Background Scheduler...")
+        logger.info('Stopping Prop Firm Background Scheduler')
         self.running = False
         
         # Clear all scheduled jobs
         schedule.clear()
+        
+        # Hand this instance's shard and any leadership to the other instances
+        if self.coordinator:
+            self.coordinator.leave()
     
     def run_in_background(self):
         """Run scheduler in a background thread"""
         if self.scheduler_thread and self.scheduler_thread.is_alive():
-            logger.warning("Background scheduler thread is already running")
+            logger.warning('Background scheduler thread is already running')
             return
         
         self.scheduler_thread = threading.Thread(
@@ -169,7 +564,7 @@ class PropFirmBackgroundScheduler:
             name="PropFirmScheduler"
         )
         self.scheduler_thread.start()
-        logger.info("Background scheduler thread started")
+        logger.info('Background scheduler thread started')
 
 # Global scheduler instance
 scheduler_instance = None
@@ -189,14 +584,12 @@ def start_background_scheduler():
 
 # For standalone execution
 if __name__ == "__main__":
-    print("Starting Prop Firm Background Scheduler...")
-    print("Press Ctrl+C to stop")
+    logger.info('Press Ctrl+C to stop')
     
     try:
         scheduler = get_scheduler()
         scheduler.start_scheduler()
     except KeyboardInterrupt:
-        print("\nReceived interrupt signal, shutting down...")
+        logger.info('Received interrupt signal, shutting down')
         if scheduler_instance:
-            scheduler_instance.stop_scheduler()
-        print("Scheduler stopped")
\ No newline at end of file
+            scheduler_instance.stop_scheduler()
\ No newline at end of file
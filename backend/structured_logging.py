@@ -0,0 +1,218 @@
+"""
+Structured, Non-Blocking Logging
+
+configure_logging() sets up the root logger once per process, from
+LOG_LEVEL, LOG_FORMAT and LOG_ASYNC:
+- LOG_ASYNC=true (default): records are put on an in-memory queue by a
+  QueueHandler and a QueueListener thread formats and writes them, so the
+  request and sweep threads never wait on formatting or stream I/O
+- LOG_FORMAT: 'text' (the previous `time - logger - LEVEL - message` lines,
+  with the fields appended as key=value), 'logfmt' or 'json'
+
+get_logger() returns a StructuredLogger: a constant message plus key/value
+fields, both stored on the record as-is and formatted only when a handler
+emits it. Calls below the logger's level cost one isEnabledFor() check.
+
+    logger.info('Trade settled', trade_id=trade_id, pnl=pnl)
+
+Lines logged for every challenge of a sweep use debug_sampled(), which only
+emits one record in LOG_SAMPLE_EVERY per message (with a sample_every field
+to scale counts back up).
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Dict, Optional
+
+LOG_FORMATS = ('text', 'logfmt', 'json')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _logfmt_value(value) -> str:
+    text = str(value)
+    if not text or any(c in text for c in ' ="\n'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return text
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record's message and its key/value fields as text, logfmt or JSON"""
+
+    def __init__(self, style: str = 'text'):
+        if style not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format: {style}")
+        super().__init__(TEXT_FORMAT if style == 'text' else None)
+        self.output = style
+
+    @staticmethod
+    def fields(record: logging.LogRecord) -> Dict:
+        fields = dict(getattr(record, 'fields', None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'fields':
+                fields.setdefault(key, value)
+        return fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = self.fields(record)
+
+        if self.output == 'text':
+            line = super().format(record)
+            if fields:
+                pairs = ' '.join(f'{key}={_logfmt_value(value)}' for key, value in fields.items())
+                # Keep a traceback below the fields
+                head, sep, tail = line.partition('\n')
+                line = f'{head} {pairs}{sep}{tail}'
+            return line
+
+        entry = {'time': self.formatTime(record), 'level': record.levelname.lower(),
+                 'logger': record.name, 'msg': record.getMessage()}
+        entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        if self.output == 'json':
+            return json.dumps(entry, default=str)
+        return ' '.join(f'{key}={_logfmt_value(value)}' for key, value in entry.items())
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record untouched
+
+    The stock prepare() formats the message in the logging thread to make
+    the record picklable; the queue here never leaves the process, so the
+    formatting is left to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class Sampler:
+    """True for one call in `every`"""
+
+    def __init__(self, every: int):
+        self.every = max(1, int(every))
+        self._calls = itertools.count()
+
+    def __call__(self) -> bool:
+        # next() on itertools.count is atomic under the GIL
+        return next(self._calls) % self.every == 0
+
+
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "1000"))
+
+
+class StructuredLogger:
+    """logging.Logger front end taking a constant message and key/value fields"""
+
+    def __init__(self, logger: logging.Logger, sample_every: int = None):
+        self.logger = logger
+        self.sample_every = LOG_SAMPLE_EVERY if sample_every is None else sample_every
+        self._samplers: Dict[str, Sampler] = {}
+        self._samplers_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.logger, name)
+
+    def _log(self, level: int, msg: str, args, exc_info, fields: Dict) -> None:
+        if self.logger.isEnabledFor(level):
+            # stacklevel 3: the caller of debug()/info()/..., not this method
+            self.logger.log(level, msg, *args, exc_info=exc_info,
+                            extra={'fields': fields} if fields else None, stacklevel=3)
+
+    def debug(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.DEBUG, msg, args, exc_info, fields)
+
+    def info(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.INFO, msg, args, exc_info, fields)
+
+    def warning(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.WARNING, msg, args, exc_info, fields)
+
+    def error(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.ERROR, msg, args, exc_info, fields)
+
+    def exception(self, msg: str, *args, exc_info=True, **fields) -> None:
+        self._log(logging.ERROR, msg, args, exc_info, fields)
+
+    def debug_sampled(self, msg: str, **fields) -> None:
+        """DEBUG record emitted for one call in sample_every with this message"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        sampler = self._samplers.get(msg)
+        if sampler is None:
+            with self._samplers_lock:
+                sampler = self._samplers.setdefault(msg, Sampler(self.sample_every))
+        if sampler():
+            fields['sample_every'] = sampler.every
+            self._log(logging.DEBUG, msg, (), None, fields)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(name))
+
+
+# QueueListener of the async mode, once configured
+log_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(level: str = None, output: str = None, asynchronous: bool = None,
+                      stream=None, force: bool = False) -> bool:
+    """
+    Configure the root logger from LOG_LEVEL, LOG_FORMAT and LOG_ASYNC
+
+    Like logging.basicConfig, does nothing when the root logger already has
+    handlers, unless force is set. Returns whether it configured logging.
+    """
+    global log_listener
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    output = (output or os.getenv("LOG_FORMAT", "text")).lower()
+    if asynchronous is None:
+        asynchronous = os.getenv("LOG_ASYNC", "true").lower() == "true"
+
+    with _configure_lock:
+        root = logging.getLogger()
+        if root.handlers and not force:
+            return False
+
+        shutdown_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(StructuredFormatter(output))
+
+        if asynchronous:
+            records = queue.SimpleQueue()
+            log_listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+            log_listener.start()
+            root.addHandler(DeferredQueueHandler(records))
+        else:
+            root.addHandler(handler)
+        root.setLevel(level)
+        return True
+
+
+def shutdown_logging() -> None:
+    """Write the records still queued and stop the listener thread"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,397 @@
+"""
+Shared Supabase Client Factory
+
+Owns the HTTP connection pool used to talk to Supabase. The web routes, the
+Prop Firm evaluator and the background scheduler all get the same client
+from get_supabase_client(), so they share one set of keep-alive connections
+instead of each building its own.
+
+The pool is configured from the environment:
+- SUPABASE_POOL_MAX_CONNECTIONS: total concurrent requests (default 50)
+- SUPABASE_POOL_MAX_PER_HOST: concurrent requests per host (default: the total)
+- SUPABASE_POOL_MAX_KEEPALIVE: idle connections kept open (default 20)
+- SUPABASE_POOL_KEEPALIVE_EXPIRY: seconds an idle connection is kept (default 30)
+- SUPABASE_HTTP2: use HTTP/2 when the `h2` package is installed (default true)
+- SUPABASE_CONNECT_TIMEOUT / SUPABASE_READ_TIMEOUT / SUPABASE_POOL_TIMEOUT: seconds
+
+Every request holds a slot of the pool while it is in flight; the time spent
+waiting for a slot and the pool utilization are reported by pool_stats().
+Each request is also recorded in the database_* metrics (metrics.py) by the
+table or function it called, from the wait for a slot to the end of its body.
+
+DATABASE_BACKEND=sqlite swaps Supabase for the embedded SQLite backend of
+persistence.py behind the same getters; the services run unchanged.
+"""
+
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from supabase import create_client, acreate_client, Client, AsyncClient, ClientOptions, AsyncClientOptions
+
+import metrics
+from persistence import DATABASE_BACKENDS, AsyncSQLiteClient, create_sqlite_client_from_env
+from structured_logging import get_logger
+import tracing
+
+logger = get_logger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase").lower()
+if DATABASE_BACKEND not in DATABASE_BACKENDS:
+    raise ValueError(f"Unknown database backend: {DATABASE_BACKEND}")
+
+SUPABASE_POOL_MAX_CONNECTIONS = int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "50"))
+SUPABASE_POOL_MAX_PER_HOST = int(os.getenv("SUPABASE_POOL_MAX_PER_HOST", str(SUPABASE_POOL_MAX_CONNECTIONS)))
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "20"))
+SUPABASE_POOL_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "30"))
+SUPABASE_POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "10"))
+
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PoolMonitor:
+    """Counts in-flight requests and slot wait time for one connection pool"""
+
+    def __init__(self, max_connections: int, max_per_host: int):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._in_flight_by_host: Dict[str, int] = {}
+        self._requests = 0
+        self._waited = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+
+    def acquired(self, host: str, wait: float) -> None:
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            self._in_flight_by_host[host] = self._in_flight_by_host.get(host, 0) + 1
+
+            # Sub-millisecond acquisitions did not actually queue
+            if wait >= 0.001:
+                self._waited += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+    def released(self, host: str) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._in_flight_by_host[host] -= 1
+
+    def timed_out(self) -> None:
+        with self._lock:
+            self._timeouts += 1
+
+    def stats(self) -> Dict:
+        """Return pool utilization and wait time counters"""
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'max_per_host': self.max_per_host,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'utilization': self._in_flight / self.max_connections,
+                'peak_utilization': self._peak_in_flight / self.max_connections,
+                'in_flight_by_host': {host: n for host, n in self._in_flight_by_host.items() if n},
+                'requests': self._requests,
+                'waited_requests': self._waited,
+                'pool_timeouts': self._timeouts,
+                'avg_wait_ms': self._total_wait / self._requests * 1000 if self._requests else 0.0,
+                'max_wait_ms': self._max_wait * 1000
+            }
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that gives the pool slot back once it is closed"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """Async response body that gives the pool slot back once it is closed"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+# PostgREST method -> query builder operation (POST is insert or upsert)
+_OPERATIONS = {'GET': 'select', 'HEAD': 'select', 'PATCH': 'update', 'DELETE': 'delete'}
+
+
+def call_labels(request: httpx.Request):
+    """(table, operation) of a Supabase HTTP request, for the database_* metrics"""
+    parts = request.url.path.strip('/').split('/')
+    if parts[:2] == ['rest', 'v1'] and len(parts) > 2:
+        if parts[2] == 'rpc' and len(parts) > 3:
+            return 'rpc', parts[3]
+        method = request.method
+        if method == 'POST':
+            upsert = 'merge-duplicates' in request.headers.get('prefer', '')
+            return parts[2], 'upsert' if upsert else 'insert'
+        return parts[2], _OPERATIONS.get(method, method.lower())
+    if parts[:2] == ['auth', 'v1']:
+        return 'auth', '/'.join(parts[2:]) or 'root'
+    return 'other', request.method.lower()
+
+
+def _record(request: httpx.Request, started: float, status: str) -> None:
+    table, operation = call_labels(request)
+    elapsed = time.monotonic() - started
+    metrics.record_database_call('supabase', table, operation, status, elapsed)
+    tracing.record(f'db.{table}.{operation}', elapsed)
+
+
+class PooledTransport(httpx.BaseTransport):
+    """httpx transport enforcing total and per-host request limits with wait-time accounting"""
+
+    def __init__(self, monitor: PoolMonitor, pool_timeout: float, **transport_options):
+        self.monitor = monitor
+        self.pool_timeout = pool_timeout
+        self._transport = httpx.HTTPTransport(**transport_options)
+        self._slots = threading.BoundedSemaphore(monitor.max_connections)
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_lock = threading.Lock()
+
+    def _host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.monitor.max_per_host)
+            return self._host_slots[host]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        host_slots = self._host_semaphore(host)
+
+        started = time.monotonic()
+        if not host_slots.acquire(timeout=self.pool_timeout):
+            self.monitor.timed_out()
+            raise httpx.PoolTimeout(f"No connection slot for {host} within {self.pool_timeout}s", request=request)
+
+        remaining = max(self.pool_timeout - (time.monotonic() - started), 0)
+        if not self._slots.acquire(timeout=remaining):
+            host_slots.release()
+            self.monitor.timed_out()
+            raise httpx.PoolTimeout(f"No connection slot within {self.pool_timeout}s", request=request)
+
+        self.monitor.acquired(host, time.monotonic() - started)
+        status = 'error'
+
+        def release():
+            self._slots.release()
+            host_slots.release()
+            self.monitor.released(host)
+            _record(request, started, status)
+
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        status = str(response.status_code)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of PooledTransport, for the ASGI serving mode"""
+
+    def __init__(self, monitor: PoolMonitor, pool_timeout: float, **transport_options):
+        self.monitor = monitor
+        self.pool_timeout = pool_timeout
+        self._transport = httpx.AsyncHTTPTransport(**transport_options)
+        self._slots = asyncio.BoundedSemaphore(monitor.max_connections)
+        self._host_slots: Dict[str, asyncio.BoundedSemaphore] = {}
+
+    async def _acquire(self, host: str, host_slots: asyncio.BoundedSemaphore) -> None:
+        await host_slots.acquire()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            host_slots.release()
+            raise
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        host_slots = self._host_slots.setdefault(host, asyncio.BoundedSemaphore(self.monitor.max_per_host))
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._acquire(host, host_slots), timeout=self.pool_timeout)
+        except asyncio.TimeoutError:
+            self.monitor.timed_out()
+            raise httpx.PoolTimeout(f"No connection slot for {host} within {self.pool_timeout}s", request=request)
+
+        self.monitor.acquired(host, time.monotonic() - started)
+        status = 'error'
+
+        def release():
+            self._slots.release()
+            host_slots.release()
+            self.monitor.released(host)
+            _record(request, started, status)
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        status = str(response.status_code)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_AsyncReleasingStream(response.stream, release),
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _transport_options() -> Dict:
+    return {
+        'http2': SUPABASE_HTTP2 and HTTP2_AVAILABLE,
+        'limits': httpx.Limits(
+            max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_POOL_KEEPALIVE_EXPIRY
+        )
+    }
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        SUPABASE_READ_TIMEOUT,
+        connect=SUPABASE_CONNECT_TIMEOUT,
+        pool=SUPABASE_POOL_TIMEOUT
+    )
+
+
+def _credentials():
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+    if not url or not key:
+        raise ValueError("Supabase URL and Service Role Key must be set in environment variables")
+
+    return url, key
+
+
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+_monitors: Dict[str, PoolMonitor] = {}
+
+
+def get_supabase_client() -> Client:
+    """Get the process-wide Supabase client backed by the shared connection pool"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None and DATABASE_BACKEND == 'sqlite':
+                _client = create_sqlite_client_from_env()
+            elif _client is None:
+                url, key = _credentials()
+                monitor = PoolMonitor(SUPABASE_POOL_MAX_CONNECTIONS, SUPABASE_POOL_MAX_PER_HOST)
+                http_client = httpx.Client(
+                    transport=PooledTransport(monitor, SUPABASE_POOL_TIMEOUT, **_transport_options()),
+                    timeout=_timeout(),
+                    follow_redirects=True
+                )
+
+                _client = create_client(url, key, options=ClientOptions(
+                    httpx_client=http_client,
+                    postgrest_client_timeout=_timeout()
+                ))
+                _monitors['sync'] = monitor
+
+                logger.info('Supabase connection pool', max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+                            max_per_host=SUPABASE_POOL_MAX_PER_HOST, http2=_transport_options()['http2'])
+    return _client
+
+
+async def create_async_supabase_client() -> AsyncClient:
+    """
+    Create an async Supabase client on the shared pool configuration
+
+    Must be called from the event loop that will use the client. With the
+    sqlite backend, returns an awaitable view of the shared sync client.
+    """
+    if DATABASE_BACKEND == 'sqlite':
+        return AsyncSQLiteClient(get_supabase_client())
+
+    url, key = _credentials()
+    monitor = PoolMonitor(SUPABASE_POOL_MAX_CONNECTIONS, SUPABASE_POOL_MAX_PER_HOST)
+    http_client = httpx.AsyncClient(
+        transport=AsyncPooledTransport(monitor, SUPABASE_POOL_TIMEOUT, **_transport_options()),
+        timeout=_timeout(),
+        follow_redirects=True
+    )
+
+    client = await acreate_client(url, key, options=AsyncClientOptions(
+        httpx_client=http_client,
+        postgrest_client_timeout=_timeout()
+    ))
+    _monitors['async'] = monitor
+    return client
+
+
+def pool_stats() -> Dict:
+    """Return utilization and wait time of every pool created in this process"""
+    return {name: monitor.stats() for name, monitor in _monitors.items()}
+
+
+metrics.CallbackMetric(
+    'database_pool_in_flight', 'Supabase requests holding a connection pool slot', ('pool',),
+    lambda: {(name,): stats['in_flight'] for name, stats in pool_stats().items()})
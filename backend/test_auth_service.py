@@ -0,0 +1,145 @@
+"""
+Tests for local JWT verification and the token cache
+"""
+
+import time
+from types import SimpleNamespace
+
+import httpx
+import jwt
+import pytest
+from supabase_auth.errors import AuthApiError
+
+from auth_service import TokenVerifier, AuthenticationError
+
+SECRET = "test-jwt-secret-with-enough-length-for-hs256"
+
+
+class FakeAuth:
+    def __init__(self, revoked=False):
+        self.calls = 0
+        self.revoked = revoked
+        self.down = False
+
+    def get_user(self, token):
+        self.calls += 1
+        if self.down:
+            raise httpx.ConnectError("Connection refused")
+        if self.revoked:
+            raise AuthApiError("Session not found", 403, 'session_not_found')
+        claims = jwt.decode(token, options={'verify_signature': False})
+        return SimpleNamespace(user=SimpleNamespace(id=claims['sub']))
+
+
+def make_token(sub="user-1", expires_in=3600, secret=SECRET):
+    return jwt.encode(
+        {'sub': sub, 'aud': 'authenticated', 'role': 'authenticated', 'exp': int(time.time()) + expires_in},
+        secret,
+        algorithm='HS256'
+    )
+
+
+def make_verifier(auth, **kwargs):
+    return TokenVerifier(SimpleNamespace(auth=auth), None, mode='local', jwt_secret=SECRET, **kwargs)
+
+
+def test_local_verification_skips_auth_server():
+    auth = FakeAuth()
+    verifier = make_verifier(auth)
+    token = make_token()
+
+    assert verifier.verify(token).id == "user-1"
+    assert verifier.verify(token).id == "user-1"
+    assert auth.calls == 0
+    assert verifier.cache.hits == 1
+
+
+def test_invalid_signature_and_expired_tokens_are_rejected():
+    verifier = make_verifier(FakeAuth())
+
+    with pytest.raises(AuthenticationError):
+        verifier.verify(make_token(secret="another-secret-with-enough-length-for-hs256"))
+
+    with pytest.raises(AuthenticationError):
+        verifier.verify(make_token(expires_in=-10))
+
+
+def test_cache_entry_never_outlives_token_expiry():
+    verifier = make_verifier(FakeAuth(), cache_ttl=300)
+    token = make_token(expires_in=1)
+
+    verifier.verify(token)
+    time.sleep(1.1)
+
+    with pytest.raises(AuthenticationError):
+        verifier.verify(token)
+
+
+def test_revocation_check_evicts_revoked_tokens():
+    auth = FakeAuth()
+    verifier = make_verifier(auth, revocation_check_interval=0.01)
+    token = make_token()
+
+    verifier.verify(token)
+    time.sleep(0.02)
+    auth.revoked = True
+
+    with pytest.raises(AuthenticationError):
+        verifier.verify(token)
+    assert len(verifier.cache) == 0
+
+
+def test_auth_server_outage_is_not_an_authentication_error():
+    auth = FakeAuth()
+    verifier = make_verifier(auth, revocation_check_interval=0.01)
+    token = make_token()
+    verifier.verify(token)
+    time.sleep(0.02)
+    auth.down = True
+
+    # A cached token survives a failed revocation check
+    assert verifier.verify(token).id == "user-1"
+    assert len(verifier.cache) == 1
+    assert auth.calls == 1
+
+    remote = TokenVerifier(SimpleNamespace(auth=auth), None, mode='remote')
+    with pytest.raises(httpx.ConnectError):
+        remote.verify(token)
+
+
+def test_remote_mode_calls_auth_server_every_time():
+    auth = FakeAuth()
+    verifier = TokenVerifier(SimpleNamespace(auth=auth), None, mode='remote')
+    token = make_token()
+
+    verifier.verify(token)
+    verifier.verify(token)
+    assert auth.calls == 2
+
+
+def test_asymmetric_tokens_fall_back_to_auth_server_in_secret_mode():
+    auth = FakeAuth()
+    verifier = make_verifier(auth)
+    # Only the header is read locally; the auth server vouches for the signature
+    header = jwt.utils.base64url_encode(b'{"alg":"ES256","typ":"JWT"}').decode()
+    payload = make_token(sub="user-2").split('.')[1]
+    token = f"{header}.{payload}.c2lnbmF0dXJl"
+
+    assert verifier.verify(token).id == "user-2"
+    assert verifier.verify(token).id == "user-2"
+    assert auth.calls == 1
+    assert verifier.stats()['remote_verifications'] == 1
+
+
+def test_scheduler_start_requires_an_admin(sqlite_app, monkeypatch):
+    monkeypatch.setattr(sqlite_app, 'get_scheduler', lambda: SimpleNamespace(running=True))
+    client = sqlite_app.app.test_client()
+
+    def start(**claims):
+        token = jwt.encode({'sub': 'user-1', 'aud': 'authenticated', 'role': 'authenticated',
+                            'exp': int(time.time()) + 60, **claims}, 'secret', algorithm='HS256')
+        return client.post('/prop-firm/scheduler/start', headers={'Authorization': f'Bearer {token}'})
+
+    assert client.post('/prop-firm/scheduler/start').status_code == 401
+    assert start().status_code == 403
+    assert start(app_metadata={'role': 'admin'}).status_code == 200
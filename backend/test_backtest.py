@@ -0,0 +1,162 @@
+"""
+Tests for the historical replay of the Prop Firm rules
+"""
+
+import csv
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import backtest
+from backtest import RuleSet, history_from_rows, load_history, replay
+from prop_firm_service import PropFirmChallengeEvaluator
+from rule_engine import STATUS_NAMES
+
+DAY = 86400
+START = datetime(2026, 3, 2, tzinfo=timezone.utc).timestamp()
+
+
+def iso(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+
+
+def trade(challenge_id, pnl, at):
+    return {'challenge_id': challenge_id, 'pnl': pnl, 'closed_at': iso(START + at), 'is_open': False}
+
+
+def sequential_replay(challenges, trades, evaluator):
+    """Settle trades one by one and evaluate each challenge row with the live evaluator"""
+    rows = {c['id']: {'id': c['id'], 'status': 'active', 'initial_capital': c['initial_capital'],
+                      'current_balance': c['initial_capital'], 'daily_pnl': 0.0, 'day': None}
+            for c in challenges}
+    for t in sorted(trades, key=lambda t: t['closed_at']):
+        row = rows[t['challenge_id']]
+        if row['status'] != 'active':
+            continue
+        day = t['closed_at'][:10]
+        if day != row['day']:
+            row['daily_pnl'], row['day'] = 0.0, day
+        row['current_balance'] += t['pnl']
+        row['daily_pnl'] += t['pnl']
+        row['status'] = evaluator.evaluate_challenge_data(row)['status']
+    return {challenge_id: row['status'] for challenge_id, row in rows.items()}
+
+
+def random_history(seed, challenges=60, trades=3000):
+    rng = np.random.default_rng(seed)
+    challenge_rows = [{'id': f'c{i:03d}', 'initial_capital': float(rng.choice([5000, 15000])), 'status': 'active'}
+                      for i in range(challenges)]
+    trade_rows = []
+    for _ in range(trades):
+        c = challenge_rows[rng.integers(challenges)]
+        trade_rows.append(trade(c['id'], float(c['initial_capital'] * rng.normal(0, 0.012)),
+                                float(rng.uniform(0, 20 * DAY))))
+    return challenge_rows, trade_rows
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_replay_matches_sequential_evaluation(monkeypatch, workers):
+    monkeypatch.setattr(backtest, 'PARALLEL_MIN_TRADES', 0)
+    monkeypatch.setattr(backtest, 'CHUNK_TRADES', 500)
+    challenges, trades = random_history(seed=workers)
+    strict = RuleSet('strict', daily_loss_limit=3.0, total_loss_limit=6.0, profit_target=8.0)
+
+    result = replay(history_from_rows(challenges, trades), [RuleSet('current'), strict], workers=workers)
+
+    for rule_set in (RuleSet('current'), strict):
+        evaluator = PropFirmChallengeEvaluator(None)
+        evaluator.DAILY_LOSS_LIMIT_PERCENT = rule_set.daily_loss_limit
+        evaluator.TOTAL_LOSS_LIMIT_PERCENT = rule_set.total_loss_limit
+        evaluator.PROFIT_TARGET_PERCENT = rule_set.profit_target
+        expected = sequential_replay(challenges, trades, evaluator)
+
+        statuses = result.outcomes[rule_set.name].status
+        assert {c['id']: STATUS_NAMES[s] for c, s in zip(challenges, statuses)} == expected
+
+
+def test_daily_pnl_restarts_at_midnight():
+    challenges = [{'id': 'a', 'initial_capital': 5000.0}, {'id': 'b', 'initial_capital': 5000.0}]
+    trades = [
+        # a: -3% in the evening, -3% the next morning; b: -6% within one day
+        trade('a', -150.0, 20 * 3600), trade('a', -150.0, 29 * 3600),
+        trade('b', -150.0, 1 * 3600), trade('b', -150.0, 23 * 3600),
+    ]
+
+    outcomes = replay(history_from_rows(challenges, trades), [RuleSet('current')], workers=1).outcomes['current']
+
+    assert [STATUS_NAMES[s] for s in outcomes.status] == ['active', 'failed']
+    assert outcomes.rule[1] == backtest.RULE_DAILY_LOSS
+    assert outcomes.ended_at[1] == START + 23 * 3600
+    assert np.isnan(outcomes.ended_at[0])
+    assert list(outcomes.trades) == [2, 2]
+
+    # With the reset at 06:00 UTC both of a's trades fall in the same day
+    outcomes = replay(history_from_rows(challenges, trades), [RuleSet('current')],
+                      workers=1, reset_hour=6).outcomes['current']
+    assert STATUS_NAMES[outcomes.status[0]] == 'failed'
+
+
+def test_trailing_drawdown_and_report():
+    challenges = [{'id': 'a', 'initial_capital': 5000.0, 'status': 'active'},
+                  {'id': 'b', 'initial_capital': 5000.0, 'status': 'success'}]
+    trades = [
+        # a: +8% then -7% over three days; b reaches the target, the later loss is ignored
+        trade('a', 400.0, 0), trade('a', -200.0, DAY), trade('a', -150.0, 2 * DAY),
+        trade('b', 550.0, 0), trade('b', -1000.0, DAY),
+    ]
+
+    result = replay(history_from_rows(challenges, trades),
+                    [RuleSet('current'), RuleSet.parse('trailing:trailing=6')], workers=1)
+
+    assert list(result.changed('trailing')) == ['a']
+    assert result.outcomes['trailing'].rule[0] == backtest.RULE_TRAILING_DRAWDOWN
+    assert result.outcomes['trailing'].trades[1] == 1
+
+    report = result.report()
+    assert report['rule_sets']['current']['outcomes'] == {'active': 1, 'success': 1, 'failed': 0}
+    assert report['rule_sets']['trailing']['rules']['trailing_drawdown'] == 1
+    assert report['rule_sets']['trailing']['transitions'] == {'active->failed': 1}
+    assert 'changed vs baseline: 1' in backtest.format_report(report)
+
+
+def test_replay_without_challenges_or_trades():
+    rule_sets = [RuleSet('current'), RuleSet.parse('strict:daily=3')]
+
+    empty = replay(history_from_rows([], []), rule_sets, workers=1)
+    assert all(len(outcome.status) == 0 for outcome in empty.outcomes.values())
+    assert empty.report()['rule_sets']['current']['outcomes'] == {'active': 0, 'success': 0, 'failed': 0}
+
+    idle = replay(history_from_rows([{'id': 'a', 'initial_capital': 5000.0, 'status': 'active'}], []),
+                  rule_sets, workers=1)
+    assert [STATUS_NAMES[status] for status in idle.outcomes['strict'].status] == ['active']
+    assert idle.outcomes['strict'].trades.tolist() == [0]
+
+
+def test_load_history_from_csv_exports(tmp_path):
+    challenges_path = tmp_path / 'challenges.csv'
+    trades_path = tmp_path / 'trades.csv'
+    with open(challenges_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'initial_capital', 'status'])
+        writer.writerow(['c1', '5000.00', 'failed'])
+    with open(trades_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['challenge_id', 'pnl', 'is_open', 'closed_at'])
+        writer.writerow(['c1', '-300.00', 'f', '2026-03-02 10:00:00+00'])
+        writer.writerow(['c1', '-300.00', 'f', '2026-03-02 11:30:00.25+00'])
+        writer.writerow(['c1', '', 't', ''])
+        writer.writerow(['gone', '10.00', 'f', '2026-03-02 12:00:00+00'])
+
+    history = load_history(str(challenges_path), str(trades_path))
+
+    assert history.skipped_trades == 2
+    assert list(history.trade_closed_at) == [START + 10 * 3600, START + 11.5 * 3600 + 0.25]
+    outcomes = replay(history, [RuleSet('current')], workers=1).outcomes['current']
+    assert STATUS_NAMES[outcomes.status[0]] == history.recorded_status[0] == 'failed'
+
+
+def test_rule_set_parse():
+    assert RuleSet.parse('strict:daily=4,total=8') == RuleSet('strict', 4.0, 8.0, 10.0, None)
+    with pytest.raises(ValueError):
+        RuleSet.parse('bad:weekly=3')
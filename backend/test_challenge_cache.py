@@ -0,0 +1,154 @@
+"""
+Tests for the read-through challenge cache of PropFirmChallengeEvaluator
+"""
+
+from postgrest.exceptions import APIError
+
+import prop_firm_service
+from fake_supabase import FakeSupabase
+from prop_firm_service import PropFirmChallengeEvaluator
+
+
+def make_db(*challenges):
+    db = FakeSupabase()
+    db.load('user_challenges', challenges)
+    return db
+
+
+def make_challenge(**overrides):
+    challenge = {
+        'id': 'c1', 'user_id': 'u1', 'status': 'active',
+        'initial_capital': 5000.0, 'current_balance': 5000.0,
+        'daily_pnl': 0.0, 'total_pnl': 0.0
+    }
+    challenge.update(overrides)
+    return challenge
+
+
+def test_repeated_reads_hit_the_cache():
+    db = make_db(make_challenge())
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    for _ in range(5):
+        assert evaluator.get_challenge('c1', 'u1')['status'] == 'active'
+
+    stats = evaluator.challenge_cache_stats()
+    assert db.round_trips['user_challenges.select'] == 1
+    assert stats['hits'] == 4
+    assert stats['misses'] == 1
+
+
+def test_ownership_checked_against_cached_row():
+    db = make_db(make_challenge())
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    assert evaluator.get_challenge('c1', 'u1') is not None
+    assert evaluator.get_challenge('c1', 'someone-else') is None
+    assert evaluator.get_challenge('missing') is None
+
+
+def test_status_change_is_written_through():
+    db = make_db(make_challenge(current_balance=4400.0, total_pnl=-600.0))
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    result = evaluator.evaluate_challenge_rules('c1')
+
+    assert result['status'] == 'failed'
+    assert db.round_trips['user_challenges.update'] == 1
+    cached = evaluator.get_challenge('c1')
+    assert cached['status'] == 'failed'
+    assert cached['failure_reason'] == result['rule_triggered']
+    assert db.round_trips['user_challenges.select'] == 1
+
+
+def test_invalidation_forces_a_fresh_read():
+    db = make_db(make_challenge())
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    evaluator.get_challenge('c1')
+    db.load('user_challenges', [make_challenge(current_balance=5100.0)])
+    evaluator.invalidate_challenge('c1')
+
+    assert evaluator.get_challenge('c1')['current_balance'] == 5100.0
+    assert db.round_trips['user_challenges.select'] == 2
+
+
+def test_stale_cached_row_cannot_reopen_an_ended_challenge():
+    db = make_db(make_challenge())
+    evaluator = PropFirmChallengeEvaluator(db)
+    evaluator.get_challenge('c1')
+    # Another process ends the challenge after this one cached it as active
+    db.load('user_challenges', [make_challenge(status='failed', current_balance=4400.0, total_pnl=-600.0)])
+
+    result = evaluator.evaluate_challenge_rules('c1')
+
+    assert result['status'] == 'failed'
+    assert db.rows('user_challenges')[0]['status'] == 'failed'
+    assert evaluator.get_challenge('c1')['status'] == 'failed'
+
+
+def test_lost_status_write_drops_the_cached_row():
+    db = make_db(make_challenge(current_balance=4400.0, total_pnl=-600.0))
+    evaluator = PropFirmChallengeEvaluator(db)
+    challenge = evaluator.get_challenge('c1')
+    db.load('user_challenges', [make_challenge(status='success', current_balance=5600.0)])
+
+    written = evaluator.write_status_update(challenge, evaluator.build_status_update('failed', 'total_loss'))
+
+    assert written is False
+    assert db.rows('user_challenges')[0]['status'] == 'success'
+    assert evaluator.get_challenge('c1')['status'] == 'success'
+
+
+def failing_rpc(client, params):
+    raise APIError({'code': '57014', 'message': 'canceling statement due to statement timeout'})
+
+
+def test_daily_reset_falls_back_only_when_the_function_is_missing():
+    db = make_db(make_challenge(daily_pnl=-120.0))
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    assert evaluator.reset_daily_metrics()['reset_ids'] == ['c1']
+    assert db.rows('user_challenges')[0]['daily_pnl'] == 0.0
+
+    db.load('user_challenges', [make_challenge(daily_pnl=-120.0)])
+    db.rpc_handlers['reset_daily_metrics'] = failing_rpc
+    result = evaluator.reset_daily_metrics()
+
+    assert 'statement timeout' in result['error']
+    assert db.rows('user_challenges')[0]['daily_pnl'] == -120.0
+
+
+def test_transitions_fall_back_only_when_the_function_is_missing():
+    db = make_db(make_challenge(), make_challenge(id='c2'))
+    evaluator = PropFirmChallengeEvaluator(db)
+    transitions = [{'id': 'c1', **evaluator.build_status_update('failed', 'daily_loss')}]
+
+    assert evaluator.apply_status_transitions(transitions)['updated_ids'] == ['c1']
+
+    db.rpc_handlers['apply_challenge_transitions'] = failing_rpc
+    result = evaluator.apply_status_transitions([{'id': 'c2', **evaluator.build_status_update('failed', 'daily_loss')}])
+
+    assert result['success'] is False
+    assert result['failed_ids'] == ['c2']
+    assert db.round_trips['user_challenges.update'] == 1
+    assert db.rows('user_challenges')[1]['status'] == 'active'
+
+
+def test_one_evaluator_per_client(monkeypatch):
+    shared, other = FakeSupabase(), FakeSupabase()
+    monkeypatch.setattr(prop_firm_service, 'prop_firm_evaluator', None)
+    monkeypatch.setattr(prop_firm_service, '_client_evaluators', {})
+    monkeypatch.setattr(prop_firm_service, 'get_supabase_client', lambda: shared)
+
+    default = prop_firm_service.get_prop_firm_evaluator()
+    assert prop_firm_service.get_prop_firm_evaluator(shared) is default
+
+    # Listeners registered on another client's evaluator reach its later callers
+    evaluator = prop_firm_service.get_prop_firm_evaluator(other)
+    settled = []
+    evaluator.add_settlement_listener(lambda user_id, trades: settled.extend(trades))
+    prop_firm_service.get_prop_firm_evaluator(other).notify_settled('u1', [{'challenge_id': 'c1', 'pnl': 1.0}])
+
+    assert evaluator is not default
+    assert settled == [{'challenge_id': 'c1', 'pnl': 1.0}]
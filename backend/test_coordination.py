@@ -0,0 +1,83 @@
+"""
+Tests for scheduler coordination (file backend)
+"""
+
+import multiprocessing
+import time
+import uuid
+
+from coordination import FileCoordinationBackend, SchedulerCoordinator, shard_of
+from scheduler import id_partitions
+
+
+def test_single_leader_and_takeover_after_expiry(tmp_path):
+    backend = FileCoordinationBackend(str(tmp_path))
+    a = SchedulerCoordinator(backend, 'a', lease_ttl=0.2)
+    b = SchedulerCoordinator(backend, 'b', lease_ttl=0.2)
+
+    assert a.is_leader()
+    assert not b.is_leader()
+    assert a.is_leader()
+
+    # a stops renewing; b takes over once the lease expires
+    time.sleep(0.3)
+    assert b.is_leader()
+    assert not a.is_leader()
+
+
+def test_leave_hands_over_shard_and_leadership(tmp_path):
+    backend = FileCoordinationBackend(str(tmp_path))
+    coordinators = [SchedulerCoordinator(backend, name) for name in ('a', 'b', 'c')]
+    for coordinator in coordinators:
+        coordinator.heartbeat()
+    for coordinator in coordinators:
+        coordinator.heartbeat()
+
+    assert [c.shard() for c in coordinators] == [(0, 3), (1, 3), (2, 3)]
+    assert [c.stats()['leader'] for c in coordinators] == [True, False, False]
+
+    coordinators[0].leave()
+    assert coordinators[1].heartbeat() == ['b', 'c']
+    assert coordinators[1].shard() == (0, 2)
+    assert coordinators[1].is_leader()
+
+
+def test_expired_instances_leave_the_membership(tmp_path):
+    backend = FileCoordinationBackend(str(tmp_path))
+    SchedulerCoordinator(backend, 'gone', lease_ttl=0.1).heartbeat()
+    live = SchedulerCoordinator(backend, 'live', lease_ttl=10)
+
+    assert live.heartbeat() == ['gone', 'live']
+    time.sleep(0.2)
+    assert live.heartbeat() == ['live']
+
+
+def test_shard_of_matches_sweep_ranges():
+    ids = [str(uuid.uuid4()) for _ in range(500)]
+    for shards in (1, 2, 3, 7):
+        for shard in range(shards):
+            ranges = id_partitions(4, shard, shards)
+            in_ranges = {
+                challenge_id for challenge_id in ids
+                if any((lower is None or challenge_id >= lower) and (upper is None or challenge_id < upper)
+                       for lower, upper in ranges)
+            }
+            assert in_ranges == {challenge_id for challenge_id in ids if shard_of(challenge_id, shards) == shard}
+
+
+def _contend(directory, name, results):
+    coordinator = SchedulerCoordinator(FileCoordinationBackend(directory), name, lease_ttl=5)
+    results.put((name, coordinator.is_leader()))
+
+
+def test_one_leader_across_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=_contend, args=(str(tmp_path), f'p{i}', results)) for i in range(6)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=10)
+
+    outcomes = [results.get(timeout=5) for _ in processes]
+    assert sum(leader for _, leader in outcomes) == 1
@@ -0,0 +1,152 @@
+"""
+Tests for the event-driven challenge evaluation queue
+"""
+
+from evaluation_queue import ChallengeEvaluationQueue
+from fake_supabase import FakeSupabase
+from mark_to_market import MarkToMarketEngine
+from market_data import Tick
+from prop_firm_service import PropFirmChallengeEvaluator
+
+
+class FakeEvaluator(PropFirmChallengeEvaluator):
+    def __init__(self, supabase_client):
+        super().__init__(supabase_client)
+        self.applied = []
+
+    def apply_status_transitions(self, transitions):
+        if transitions:
+            self.applied.append(transitions)
+        return {'success': True, 'updated_ids': [t['id'] for t in transitions]}
+
+
+def challenge(challenge_id, balance=5000.0, daily_pnl=0.0):
+    return {'id': challenge_id, 'user_id': 'u1', 'status': 'active', 'initial_capital': 5000.0,
+            'current_balance': balance, 'daily_pnl': daily_pnl, 'total_pnl': balance - 5000.0}
+
+
+def position(trade_id, challenge_id, entry_price=100.0):
+    return {'id': trade_id, 'user_id': 'u1', 'challenge_id': challenge_id, 'asset_symbol': 'IAM',
+            'trade_type': 'buy', 'amount': 1000.0, 'entry_price': entry_price, 'leverage': 1.0, 'is_open': True}
+
+
+def make_queue(challenges, trades=(), window=1.0):
+    db = FakeSupabase()
+    db.load('user_challenges', challenges)
+    db.load('trades', trades)
+    evaluator = FakeEvaluator(db)
+    queue = ChallengeEvaluationQueue(evaluator, window=window)
+    evaluator.add_settlement_listener(queue.on_settled)
+    evaluator.add_reset_listener(queue.on_reset)
+    return evaluator, queue
+
+
+def test_repeated_events_coalesce_into_one_evaluation():
+    evaluator, queue = make_queue([challenge('c1', balance=5600.0), challenge('c2')])
+
+    evaluator.notify_settled('u1', [{'challenge_id': 'c1', 'pnl': 100.0}, {'challenge_id': 'c1', 'pnl': 50.0}])
+    evaluator.notify_settled('u1', [{'challenge_id': 'c1', 'pnl': 10.0}])
+    evaluator.notify_reset(['c1', 'c2'])
+
+    stats = queue.stats()
+    assert stats['pending'] == 2
+    assert stats['coalesced_total'] == 2
+    assert stats['events_by_reason'] == {'settlement': 2, 'daily_reset': 2}
+
+    assert queue.pop_due() == []
+    assert queue.process_due(now=float('inf')) == 2
+    assert evaluator.supabase.round_trips['user_challenges.select'] == 1
+    assert [[t['id'] for t in batch] for batch in evaluator.applied] == [['c1']]
+    assert evaluator.applied[0][0]['status'] == 'success'
+    assert queue.stats()['pending'] == 0
+
+
+def test_event_after_evaluation_is_queued_again():
+    evaluator, queue = make_queue([challenge('c1')])
+
+    queue.enqueue(['c1'], 'settlement')
+    queue.process_due(now=float('inf'))
+    assert queue.enqueue(['c1'], 'settlement') == 1
+
+
+def test_completed_challenges_are_skipped():
+    evaluator, queue = make_queue([{**challenge('c1', balance=4000.0), 'status': 'failed'}])
+
+    queue.enqueue(['c1'])
+    assert queue.evaluate(queue.pop_due(now=float('inf'))) == {'evaluated': 0, 'updated_ids': []}
+    assert evaluator.applied == []
+
+
+def test_equity_breach_is_confirmed_against_the_current_row():
+    # The engine still holds the stale balance; c2 has since settled a profit
+    evaluator, queue = make_queue([challenge('c1'), challenge('c2', balance=5400.0)],
+                                  [position('t-c1', 'c1'), position('t-c2', 'c2')])
+    engine = MarkToMarketEngine(evaluator)
+    queue.attach_mark_to_market(engine)
+
+    for challenge_id in ('c1', 'c2'):
+        engine.add_challenge(challenge(challenge_id))
+        engine.add_position(position(f't-{challenge_id}', challenge_id))
+
+    # -30% on a 1000 notional: 300 unrealized loss, 6% daily loss on stale equity for both
+    flagged = engine.on_ticks([Tick('IAM', 70.0)])
+    assert {t['id'] for t in flagged} == {'c1', 'c2'}
+    assert evaluator.applied == []
+
+    queue.process_due(now=float('inf'))
+
+    # c2's fresh balance only absorbs the total loss; its daily PnL of 0 still breaches
+    assert {t['id'] for t in evaluator.applied[0]} == {'c1', 'c2'}
+    assert engine.equity('c1') is None
+
+    evaluator.applied.clear()
+    evaluator.supabase.load('user_challenges', [challenge('c3', balance=5400.0, daily_pnl=400.0)])
+    evaluator.supabase.load('trades', [position('t-c3', 'c3', entry_price=70.0)])
+    engine.add_challenge(challenge('c3'))
+    engine.add_position(position('t-c3', 'c3', entry_price=70.0))
+    engine.on_ticks([Tick('IAM', 48.0)])
+
+    queue.process_due(now=float('inf'))
+
+    # With today's realized profit, equity is within both limits: c3 stays tracked and active
+    assert evaluator.applied == []
+    assert engine.equity('c3')['current_balance'] == 5400.0
+    assert engine.stats()['challenges'] == 1
+
+
+def test_closed_position_loss_is_not_counted_twice():
+    evaluator, queue = make_queue([challenge('c1')], [position('t1', 'c1')])
+    evaluator.evaluation_queue = queue
+    engine = MarkToMarketEngine(evaluator)
+    queue.attach_mark_to_market(engine)
+    engine.load()
+
+    # -20% on a 1000 notional: a 4% loss, within the 5% daily limit
+    engine.on_ticks([Tick('IAM', 80.0)])
+    result = evaluator.settle_trade('t1', 'u1', 80.0)
+    assert result['challenge']['new_balance'] == 4800.0
+
+    queue.process_due(now=float('inf'))
+
+    assert evaluator.applied == []
+    assert evaluator.supabase.rows('user_challenges')[0]['status'] == 'active'
+    assert engine.equity('c1') == {'current_balance': 4800.0, 'unrealized_pnl': 0.0, 'equity': 4800.0,
+                                   'open_positions': 0}
+
+
+def test_positions_closed_by_another_process_leave_the_books():
+    evaluator, queue = make_queue([challenge('c1')], [position('t1', 'c1')])
+    engine = MarkToMarketEngine(evaluator)
+    queue.attach_mark_to_market(engine)
+    engine.load()
+    engine.on_ticks([Tick('IAM', 80.0)])
+
+    # Settled elsewhere: the engine still holds t1 when the queue re-checks c1
+    db = evaluator.supabase
+    db.table('trades').update({'is_open': False, 'pnl': -200.0}).eq('id', 't1').execute()
+    db.table('user_challenges').update({'current_balance': 4800.0, 'daily_pnl': -200.0}).eq('id', 'c1').execute()
+    queue.enqueue(['c1'], 'price')
+    queue.process_due(now=float('inf'))
+
+    assert evaluator.applied == []
+    assert engine.equity('c1')['open_positions'] == 0
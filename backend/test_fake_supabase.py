@@ -0,0 +1,84 @@
+"""
+Tests for the in-memory Supabase stand-in
+"""
+
+import pytest
+from postgrest.exceptions import APIError
+
+from fake_supabase import FakeSupabase
+from prop_firm_service import PropFirmChallengeEvaluator
+
+
+def seeded():
+    db = FakeSupabase()
+    db.load('user_challenges', [
+        {'id': f'c{i}', 'user_id': 'u1' if i < 3 else 'u2', 'status': 'active' if i % 2 == 0 else 'failed',
+         'initial_capital': 5000.0, 'current_balance': 5000.0 + i, 'daily_pnl': 0.0, 'total_pnl': float(i)}
+        for i in range(6)
+    ])
+    return db
+
+
+def test_filters_order_limit_and_projection():
+    db = seeded()
+
+    rows = db.table('user_challenges').select('id, total_pnl').eq('user_id', 'u1').execute().data
+    assert rows == [{'id': 'c0', 'total_pnl': 0.0}, {'id': 'c1', 'total_pnl': 1.0}, {'id': 'c2', 'total_pnl': 2.0}]
+
+    rows = db.table('user_challenges').select('*').in_('status', ['active']) \
+        .order('total_pnl', desc=True).limit(2).execute().data
+    assert [row['id'] for row in rows] == ['c4', 'c2']
+
+    # Keyset page over the primary key
+    rows = db.table('user_challenges').select('id').order('id').gt('id', 'c1').lt('id', 'c5').limit(2).execute().data
+    assert rows == [{'id': 'c2'}, {'id': 'c3'}]
+
+    # Returned rows are copies
+    rows[0]['id'] = 'changed'
+    assert db.rows('user_challenges')[2]['id'] == 'c2'
+
+
+def test_writes_keep_indexes_current():
+    db = seeded()
+
+    updated = db.table('user_challenges').update({'user_id': 'u3'}).in_('id', ['c0', 'c1']).eq('status', 'active').execute()
+    assert [row['id'] for row in updated.data] == ['c0']
+    assert [r['id'] for r in db.table('user_challenges').select('id').eq('user_id', 'u3').execute().data] == ['c0']
+
+    inserted = db.table('trades').insert({'challenge_id': 'c0', 'pnl': 5.0}).execute().data[0]
+    assert inserted['id']
+    with pytest.raises(APIError):
+        db.table('trades').insert({'id': inserted['id'], 'challenge_id': 'c0'}).execute()
+
+    db.table('trades').delete().eq('challenge_id', 'c0').execute()
+    assert db.rows('trades') == []
+
+
+def test_single_modes_and_rpc():
+    db = seeded()
+
+    assert db.table('user_challenges').select('*').eq('id', 'c9').maybe_single().execute() is None
+    assert db.table('user_challenges').select('*').eq('id', 'c1').single().execute().data['id'] == 'c1'
+    with pytest.raises(APIError):
+        db.table('user_challenges').select('*').eq('user_id', 'u1').single().execute()
+
+    with pytest.raises(APIError) as missing:
+        db.rpc('settle_trade', {}).execute()
+    assert missing.value.code == 'PGRST202'
+
+    db.rpc_handlers['count_rows'] = lambda client, params: len(client.tables[params['table']].rows)
+    assert db.rpc('count_rows', {'table': 'user_challenges'}).execute().data == 6
+
+
+def test_round_trips_are_counted_per_operation():
+    db = seeded()
+    evaluator = PropFirmChallengeEvaluator(db)
+
+    # c4 is at +0.08%: still active, so one read and no write
+    assert evaluator.evaluate_challenge_rules('c4')['status'] == 'active'
+    db.table('user_challenges').update({'current_balance': 4000.0}).eq('id', 'c2').execute()
+    assert evaluator.evaluate_challenge_rules('c2')['status'] == 'failed'
+
+    assert db.total_round_trips() == 4
+    assert db.reset_stats() == {'user_challenges.select': 2, 'user_challenges.update': 2}
+    assert db.total_round_trips() == 0
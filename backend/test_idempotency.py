@@ -0,0 +1,155 @@
+"""
+Tests for the Idempotency-Key response store
+"""
+
+import asyncio
+import threading
+import time
+
+import jwt
+
+import metrics
+from idempotency import (AsyncIdempotencyStore, IdempotencyStore, StoredResponse,
+                         IN_PROGRESS, MISMATCH, OWNER, REPLAY)
+
+USER = '00000000-0000-4000-8000-000000000001'
+KEY = (USER, '/evaluate-trade', 'key-1')
+
+
+def stored(status=200, body=b'{"success": true}', fingerprint='a'):
+    return StoredResponse(status, body, 'application/json', fingerprint)
+
+
+def test_replay_and_mismatch():
+    store = IdempotencyStore()
+
+    assert store.begin(KEY, 'a') == (OWNER, None)
+    store.complete(KEY, stored())
+
+    assert store.begin(KEY, 'a') == (REPLAY, stored())
+    assert store.begin(KEY, 'b')[0] == MISMATCH
+    # Keys are scoped by user and path
+    assert store.begin((USER, '/capture-paypal-order', 'key-1'), 'a') == (OWNER, None)
+    assert store.stats()['replays'] == 1
+
+
+def test_server_errors_and_failures_are_not_stored():
+    store = IdempotencyStore()
+
+    store.begin(KEY, 'a')
+    store.complete(KEY, stored(status=503))
+    assert store.begin(KEY, 'a') == (OWNER, None)
+
+    store.abandon(KEY)
+    assert store.begin(KEY, 'a') == (OWNER, None)
+
+
+def test_concurrent_duplicates_wait_for_the_original():
+    store = IdempotencyStore()
+    runs = []
+    outcomes = []
+    lock = threading.Lock()
+
+    def handle():
+        outcome, response = store.begin(KEY, 'a')
+        if outcome == OWNER:
+            runs.append(1)
+            time.sleep(0.05)
+            response = stored()
+            store.complete(KEY, response)
+        with lock:
+            outcomes.append((outcome, response))
+
+    threads = [threading.Thread(target=handle) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert sorted(outcome for outcome, _ in outcomes) == [OWNER] + [REPLAY] * 7
+    assert {response for _, response in outcomes} == {stored()}
+    assert store.stats()['in_flight'] == 0
+
+
+def test_waiters_give_up_after_the_timeout():
+    store = IdempotencyStore(wait_timeout=0.01)
+    store.begin(KEY, 'a')
+
+    assert store.begin(KEY, 'a') == (IN_PROGRESS, None)
+
+
+def test_async_store():
+    store = AsyncIdempotencyStore(wait_timeout=1.0)
+
+    async def original():
+        assert await store.begin(KEY, 'a') == (OWNER, None)
+        await asyncio.sleep(0.01)
+        store.complete(KEY, stored())
+
+    async def run():
+        first = asyncio.create_task(original())
+        await asyncio.sleep(0)
+        duplicate = await store.begin(KEY, 'a')
+        await first
+        return duplicate
+
+    assert asyncio.run(run()) == (REPLAY, stored())
+
+
+def test_retried_settlement_is_replayed(sqlite_app):
+    app = sqlite_app
+    app.supabase.table('user_challenges').insert({'id': 'c-idem', 'user_id': USER, 'plan_name': 'Starter'}).execute()
+    app.supabase.table('trades').insert({'id': 't-idem', 'user_id': USER, 'challenge_id': 'c-idem',
+                                         'asset_symbol': 'BTC-USD', 'trade_type': 'buy',
+                                         'amount': 1000.0, 'entry_price': 100.0}).execute()
+    token = jwt.encode({'sub': USER, 'aud': 'authenticated', 'role': 'authenticated',
+                        'exp': int(time.time()) + 60}, 'secret', algorithm='HS256')
+    client = app.app.test_client()
+    settlements = ('sqlite', 'rpc', 'settle_trade', 'ok')
+    before = metrics.DATABASE_REQUESTS.value(settlements)
+
+    def settle(exit_price=101.0):
+        return client.post('/evaluate-trade', json={'trade_id': 't-idem', 'exit_price': exit_price},
+                           headers={'Authorization': f'Bearer {token}', 'Idempotency-Key': 'retry-1'})
+
+    first = settle()
+    retry = settle()
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert metrics.DATABASE_REQUESTS.value(settlements) == before + 1
+
+    assert settle(exit_price=105.0).status_code == 422
+
+
+def test_retried_paypal_capture_is_replayed(sqlite_app, monkeypatch):
+    app = sqlite_app
+    monkeypatch.setattr(app, 'PAYPAL_CLIENT_ID', 'client-id')
+    monkeypatch.setattr(app, 'PAYPAL_CLIENT_SECRET', 'client-secret')
+    token = jwt.encode({'sub': USER, 'aud': 'authenticated', 'role': 'authenticated',
+                        'exp': int(time.time()) + 60}, 'secret', algorithm='HS256')
+    headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'capture-1'}
+    client = app.app.test_client()
+    updates = ('sqlite', 'payments', 'update', 'ok')
+
+    created = client.post('/create-paypal-order', json={'planName': 'Starter', 'amount': 99},
+                          headers={'Authorization': f'Bearer {token}'})
+    assert created.status_code == 200
+    order_id = created.get_json()['orderId']
+    before = metrics.DATABASE_REQUESTS.value(updates)
+
+    first = client.post('/capture-paypal-order', json={'orderId': order_id}, headers=headers)
+    retry = client.post('/capture-paypal-order', json={'orderId': order_id}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert first.get_json()['payment']['status'] == 'completed'
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert metrics.DATABASE_REQUESTS.value(updates) == before + 1
+
+    unknown = client.post('/capture-paypal-order', json={'orderId': 'no-such-order'},
+                          headers={'Authorization': f'Bearer {token}', 'Idempotency-Key': 'capture-2'})
+    assert unknown.status_code == 404
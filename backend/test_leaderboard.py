@@ -0,0 +1,111 @@
+"""
+Tests for the incrementally ranked leaderboard
+"""
+
+import random
+
+from fake_supabase import FakeSupabase
+from leaderboard import PERIOD_ALL_TIME, PERIOD_MONTHLY, LeaderboardService
+from prop_firm_service import PropFirmChallengeEvaluator
+
+
+def make_service(capitals):
+    service = LeaderboardService(FakeSupabase(), write_chunk_size=3)
+    service._capitals.update(capitals)
+    return service
+
+
+def test_ranks_match_sorted_scan():
+    rng = random.Random(5)
+    capitals = {f'c{i}': rng.choice([5000.0, 15000.0]) for i in range(300)}
+    owners = {f'c{i}': f'u{i % 120}' for i in range(300)}
+    service = make_service(capitals)
+    pnl = {c: 0.0 for c in capitals}
+
+    for _ in range(2000):
+        challenge_id = rng.choice(list(capitals))
+        value = round(rng.uniform(-100, 120), 2)
+        pnl[challenge_id] += value
+        service.record_trades(owners[challenge_id], [{'challenge_id': challenge_id, 'pnl': value}])
+
+    scores = {c: round(pnl[c] / capitals[c] * 100, 2) for c in capitals}
+    top = service.top(PERIOD_MONTHLY, 25)
+    assert [row['profit_percent'] for row in top] == sorted(scores.values(), reverse=True)[:25]
+
+    for user_id in ['u0', 'u7', 'u119']:
+        best = max(scores[c] for c in capitals if owners[c] == user_id)
+        expected_rank = 1 + sum(1 for score in scores.values() if score > best)
+        entry = service.rank(PERIOD_ALL_TIME, user_id)
+        assert entry['profit_percent'] == best
+        assert entry['rank_position'] == expected_rank
+
+
+def test_ties_share_a_rank():
+    service = make_service({'a': 5000.0, 'b': 5000.0, 'c': 5000.0})
+    service.record_trades('u1', [{'challenge_id': 'a', 'pnl': 500.0}])
+    service.record_trades('u2', [{'challenge_id': 'b', 'pnl': 500.0}])
+    service.record_trades('u3', [{'challenge_id': 'c', 'pnl': 100.0}])
+
+    assert [row['rank_position'] for row in service.top(PERIOD_MONTHLY, 3)] == [1, 1, 3]
+    assert service.rank(PERIOD_MONTHLY, 'u3')['rank_position'] == 3
+    assert service.rank(PERIOD_MONTHLY, 'nobody') is None
+
+
+def test_settlements_reach_the_service_and_flush_only_changed_rows():
+    evaluator = PropFirmChallengeEvaluator(supabase_client=None)
+    service = make_service({'a': 5000.0, 'b': 5000.0})
+    evaluator.add_settlement_listener(service.record_trades)
+
+    evaluator.notify_settled('u1', [{'challenge_id': 'a', 'pnl': 250.0}, {'challenge_id': 'a', 'pnl': -50.0}])
+    evaluator.notify_settled('u2', [{'challenge_id': 'b', 'pnl': 100.0}])
+
+    db = service.supabase
+    assert service.flush() == 4
+    assert db.round_trips['leaderboard.upsert'] == 2
+    assert {'period', 'rank_position', 'updated_at'} <= db.rows('leaderboard')[0].keys()
+
+    # Nothing moved: nothing to write
+    assert service.flush() == 0
+
+    # b overtakes a: both rows change rank in both periods, updated in place
+    evaluator.notify_settled('u2', [{'challenge_id': 'b', 'pnl': 300.0}])
+    assert service.flush() == 4
+    ranks = {(row['challenge_id'], row['period']): row['rank_position'] for row in db.rows('leaderboard')}
+    assert len(db.rows('leaderboard')) == 4
+    assert ranks == {('a', PERIOD_MONTHLY): 2, ('a', PERIOD_ALL_TIME): 2,
+                     ('b', PERIOD_MONTHLY): 1, ('b', PERIOD_ALL_TIME): 1}
+    assert service.rank(PERIOD_MONTHLY, 'u2') == {
+        'user_id': 'u2', 'challenge_id': 'b', 'profit_percent': 8.0,
+        'total_trades': 2, 'win_rate': 100.0, 'rank_position': 1
+    }
+
+
+def test_stale_rankings_reload_in_the_background():
+    db = FakeSupabase()
+    db.load('user_challenges', [{'id': 'a', 'user_id': 'u1', 'initial_capital': 5000.0, 'total_pnl': 100.0,
+                                 'trade_count': 1, 'winning_trades': 1}])
+    service = LeaderboardService(db, max_age=60.0)
+    service.ensure_loaded()
+
+    # Settled by another worker: this process never sees the settlement
+    db.load('user_challenges', [{'id': 'b', 'user_id': 'u2', 'initial_capital': 5000.0, 'total_pnl': 400.0,
+                                 'trade_count': 2, 'winning_trades': 2}])
+    service.ensure_loaded()
+    assert [row['challenge_id'] for row in service.top(PERIOD_ALL_TIME)] == ['a']
+
+    service._loaded_at -= 61.0
+    service.ensure_loaded()
+    with service._load_lock:
+        assert [row['challenge_id'] for row in service.top(PERIOD_ALL_TIME)] == ['b', 'a']
+
+
+def test_unresolved_challenges_are_capped():
+    service = LeaderboardService(FakeSupabase(), max_unresolved=2)
+
+    for challenge_id in ('a', 'b', 'c'):
+        service.record_trades('u1', [{'challenge_id': challenge_id, 'pnl': 10.0}])
+
+    stats = service.stats()
+    assert stats['unresolved_challenges'] == 2
+    assert stats['unresolved_dropped'] == 1
+    assert list(service._unresolved) == ['b', 'c']
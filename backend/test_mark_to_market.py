@@ -0,0 +1,119 @@
+"""
+Tests for the mark-to-market engine
+"""
+
+import random
+
+import pytest
+
+from fake_supabase import FakeSupabase
+from market_data import SIMULATED, Tick
+from mark_to_market import MarkToMarketEngine
+from prop_firm_service import PropFirmChallengeEvaluator, settlement_pnl
+
+
+class FakeEvaluator(PropFirmChallengeEvaluator):
+    def __init__(self, supabase_client=None):
+        super().__init__(supabase_client)
+        self.applied = []
+
+    def apply_status_transitions(self, transitions):
+        self.applied.append(transitions)
+        return {'success': True, 'updated_ids': [t['id'] for t in transitions]}
+
+
+def challenge(challenge_id, balance=5000.0, daily_pnl=0.0):
+    return {'id': challenge_id, 'status': 'active', 'initial_capital': 5000.0, 'current_balance': balance,
+            'daily_pnl': daily_pnl}
+
+
+def trade(trade_id, challenge_id, symbol, trade_type, amount, entry_price, leverage=1):
+    return {'id': trade_id, 'challenge_id': challenge_id, 'asset_symbol': symbol, 'trade_type': trade_type,
+            'amount': amount, 'entry_price': entry_price, 'leverage': leverage, 'is_open': True}
+
+
+def make_engine(challenges, trades):
+    db = FakeSupabase()
+    db.load('user_challenges', challenges)
+    db.load('trades', trades)
+    evaluator = FakeEvaluator(db)
+    engine = MarkToMarketEngine(evaluator)
+    engine.load()
+    return evaluator, engine, db
+
+
+def test_unrealized_pnl_matches_trade_formula():
+    rng = random.Random(11)
+    engine = MarkToMarketEngine(FakeEvaluator())
+    trades = []
+    for c in range(20):
+        engine.add_challenge(challenge(f'c{c}', balance=1e9))
+    for t in range(300):
+        row = trade(f't{t}', f'c{rng.randrange(20)}', rng.choice(['IAM', 'ATW']), rng.choice(['buy', 'sell']),
+                    rng.uniform(10, 500), rng.uniform(90, 800), rng.choice([1, 5, 10]))
+        trades.append(row)
+        engine.add_position(row)
+
+    # Close a few positions so swap-removal is exercised
+    for row in trades[::7]:
+        engine.remove_position(row['id'])
+    open_trades = [row for i, row in enumerate(trades) if i % 7]
+
+    prices = {'IAM': 120.0, 'ATW': 700.0}
+    for symbol, price in prices.items():
+        engine.on_price(symbol, price)
+    engine.on_price('IAM', 118.5)
+    prices['IAM'] = 118.5
+
+    for c in range(20):
+        held = [row for row in open_trades if row['challenge_id'] == f'c{c}']
+        # Settlement rounds each trade to cents
+        expected = sum(settlement_pnl(row, prices[row['asset_symbol']]) for row in held)
+        assert engine.equity(f'c{c}')['unrealized_pnl'] == pytest.approx(expected, abs=0.005 * len(held) + 1e-9)
+
+
+def test_losing_open_position_fails_challenge_on_equity():
+    evaluator, engine, _ = make_engine(
+        [challenge('daily', daily_pnl=-100.0), challenge('total', balance=4700.0), challenge('safe')],
+        [trade('t1', 'daily', 'IAM', 'buy', 1000.0, 100.0, 10),
+         trade('t2', 'total', 'IAM', 'sell', 500.0, 100.0, 10),
+         trade('t3', 'safe', 'IAM', 'buy', 100.0, 100.0, 1)]
+    )
+
+    # 'daily' is long 10k notional: -1.4% keeps daily equity at -240, -1.6% takes it
+    # to -260, past 5% of 5000
+    assert engine.on_ticks([Tick('IAM', 98.6)]) == []
+    # Random quotes never move equity, however far off they are
+    assert engine.on_ticks([Tick('IAM', 50.0, source=SIMULATED)]) == []
+    failed = engine.on_ticks([Tick('IAM', 98.4)])
+    assert [t['id'] for t in failed] == ['daily']
+    assert failed[0]['failure_reason'] == 'daily_loss_limit_exceeded_5.0percent'
+
+    # 'total' is short: equity 4700 - 500*10*(4%) = 4500 hits the 10% total loss limit
+    failed = engine.on_ticks([Tick('IAM', 104.0)])
+    assert [t['id'] for t in failed] == ['total']
+    assert failed[0]['failure_reason'] == 'total_loss_limit_exceeded_10.0percent'
+
+    assert len(evaluator.applied) == 2
+    assert engine.stats()['challenges'] == 1
+    assert engine.stats()['open_positions'] == 1
+    assert engine.equity('safe')['unrealized_pnl'] == pytest.approx(4.0)
+
+
+def test_breach_is_confirmed_on_the_current_row_and_trades():
+    evaluator, engine, db = make_engine(
+        [challenge('c1'), challenge('ended')],
+        [trade('t1', 'c1', 'IAM', 'buy', 1000.0, 100.0, 10),
+         trade('t2', 'ended', 'IAM', 'buy', 1000.0, 100.0, 10)]
+    )
+    # Settled by another process at 98.5 (-150), and 'ended' failed there, after the engine loaded
+    db.load('user_challenges', [challenge('c1', balance=4850.0, daily_pnl=-150.0),
+                                dict(challenge('ended'), status='failed')])
+    db.load('trades', [dict(trade('t1', 'c1', 'IAM', 'buy', 1000.0, 100.0, 10), is_open=False)])
+
+    # The stale books see -260 on 't1'; the realized -150 alone is within the 250 daily limit
+    assert engine.on_ticks([Tick('IAM', 97.4)]) == []
+    assert evaluator.applied == []
+    assert engine.equity('c1') == {'current_balance': 4850.0, 'unrealized_pnl': 0.0,
+                                   'equity': 4850.0, 'open_positions': 0}
+    assert engine.equity('ended') is None
@@ -0,0 +1,80 @@
+"""
+Tests for the in-memory market data hub and its sources
+"""
+
+from market_data import (
+    MOROCCO_STOCKS, SIMULATED, FileReplaySource, HttpJsonSource, MarketDataHub, SimulatedSource, Tick,
+    parse_tradingview_markdown, real_ticks
+)
+
+
+def test_ring_buffer_keeps_most_recent_ticks():
+    hub = MarketDataHub(buffer_size=3)
+
+    for i in range(10):
+        hub.publish([Tick('IAM', 100.0 + i)])
+
+    assert [t.price for t in hub.history('IAM')] == [107.0, 108.0, 109.0]
+    assert hub.latest('IAM').price == 109.0
+    assert hub.latest('ATW') is None
+
+
+def test_snapshot_is_cached_until_next_publish():
+    hub = MarketDataHub()
+    hub.publish([Tick('IAM', 114.0, timestamp=1.0), Tick('ATW', 752.0, timestamp=1.0)])
+
+    first = hub.snapshot()
+    assert hub.snapshot() is first
+    assert {quote['symbol'] for quote in first[0]} == {'IAM', 'ATW'}
+
+    hub.publish([Tick('IAM', 115.0, timestamp=2.0)])
+    quotes, etag, _ = hub.snapshot()
+    assert etag != first[1]
+    assert next(q for q in quotes if q['symbol'] == 'IAM')['price'] == 115.0
+
+
+def test_listeners_receive_published_batches():
+    hub = MarketDataHub()
+    received = []
+    hub.subscribe(received.append)
+
+    batch = [Tick('IAM', 114.0)]
+    hub.publish(batch)
+
+    assert received == [batch]
+
+
+def test_simulated_quotes_are_not_real():
+    hub = MarketDataHub()
+    assert not hub.has_real_source()
+
+    hub._source = SimulatedSource(seed=1)
+    assert not hub.has_real_source()
+    assert real_ticks(hub._source.fetch()) == []
+
+    hub._source = HttpJsonSource('http://127.0.0.1:8001/quotes')
+    assert hub.has_real_source()
+    live = Tick('IAM', 101.0, source='http')
+    assert real_ticks([Tick('IAM', 100.0, source=SIMULATED), live]) == [live]
+
+
+def test_file_replay_source_loops(tmp_path):
+    path = tmp_path / "ticks.csv"
+    path.write_text("symbol,price,timestamp\nIAM,114.5,1\nATW,752,2\nIAM,115,3\n")
+    source = FileReplaySource(str(path), batch_size=2)
+
+    assert [(t.symbol, t.price) for t in source.fetch()] == [('IAM', 114.5), ('ATW', 752.0)]
+    assert [(t.symbol, t.price) for t in source.fetch()] == [('IAM', 115.0)]
+    assert [t.timestamp for t in source.fetch()] == [1.0, 2.0]
+
+
+def test_parse_tradingview_markdown():
+    stock = next(s for s in MOROCCO_STOCKS if s['symbol'] == 'MNG')
+    markdown = "Managem\n\n1 850,00DMAD\n\n+23,50+1,29%\n"
+
+    tick = parse_tradingview_markdown(markdown, stock)
+
+    assert tick.price == 1850.0
+    assert tick.change == 23.5
+    assert tick.change_percent == 1.29
+    assert parse_tradingview_markdown("no quote here", stock) is None
@@ -0,0 +1,124 @@
+"""
+Tests for the Prometheus metrics
+"""
+
+import threading
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsRegistry
+from persistence import SQLiteClient
+from supabase_client import call_labels
+
+
+def test_counters_sum_the_shards_of_every_thread():
+    registry = MetricsRegistry()
+    counter = Counter('jobs_total', 'Jobs', ('kind',), registry=registry)
+    gauge = Gauge('jobs_running', 'Running jobs', registry=registry)
+
+    def work():
+        for _ in range(1000):
+            counter.inc(('a',))
+            gauge.inc()
+            gauge.dec()
+        counter.inc(('b',), 2.5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value(('a',)) == 4000
+    assert counter.value(('b',)) == 10.0
+    assert gauge.value() == 0
+    with pytest.raises(ValueError):
+        Counter('jobs_total', 'Again', registry=registry)
+
+
+def test_exited_threads_fold_their_shards():
+    registry = MetricsRegistry()
+    histogram = Histogram('request_seconds', 'Requests', ('route',), buckets=(0.1, 1.0), registry=registry)
+
+    # A thread per request, like Flask's threaded development server
+    for i in range(500):
+        thread = threading.Thread(target=histogram.observe, args=(0.05 if i % 2 else 0.5, ('/a',)))
+        thread.start()
+        thread.join()
+    histogram.observe(2.0, ('/a',))
+
+    assert histogram.shard_count() == 1
+    snapshot = histogram.snapshot(('/a',))
+    assert snapshot['buckets'] == {0.1: 250, 1.0: 500, float('inf'): 501}
+    assert snapshot['sum'] == pytest.approx(2.0 + 250 * 0.05 + 250 * 0.5)
+
+
+def test_histogram_text_format():
+    registry = MetricsRegistry()
+    histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ('/a "b"',))
+
+    assert histogram.snapshot(('/a "b"',)) == {'buckets': {0.1: 2, 1.0: 3, float('inf'): 4}, 'count': 4, 'sum': 3.65}
+    assert registry.render().splitlines() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a \\"b\\"",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a \\"b\\"",le="1"} 3',
+        'latency_seconds_bucket{route="/a \\"b\\"",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a \\"b\\""} 3.65',
+        'latency_seconds_count{route="/a \\"b\\""} 4',
+    ]
+
+
+def test_supabase_call_labels():
+    base = 'https://project.supabase.co'
+    assert call_labels(httpx.Request('GET', f'{base}/rest/v1/trades?id=eq.1')) == ('trades', 'select')
+    assert call_labels(httpx.Request('PATCH', f'{base}/rest/v1/user_challenges')) == ('user_challenges', 'update')
+    assert call_labels(httpx.Request('POST', f'{base}/rest/v1/leaderboard',
+                                     headers={'Prefer': 'resolution=merge-duplicates'})) == ('leaderboard', 'upsert')
+    assert call_labels(httpx.Request('POST', f'{base}/rest/v1/rpc/settle_trade')) == ('rpc', 'settle_trade')
+    assert call_labels(httpx.Request('GET', f'{base}/auth/v1/user')) == ('auth', 'user')
+
+
+def test_sqlite_calls_and_sweeps_are_recorded():
+    client = SQLiteClient(':memory:')
+    ok = ('sqlite', 'user_challenges', 'select', 'ok')
+    missing = ('sqlite', 'rpc', 'no_such_function', 'PGRST202')
+    before = metrics.DATABASE_REQUESTS.value(ok), metrics.DATABASE_REQUESTS.value(missing)
+
+    client.table('user_challenges').select('id').execute()
+    with pytest.raises(APIError):
+        client.rpc('no_such_function', {}).execute()
+    client.close()
+
+    assert metrics.DATABASE_REQUESTS.value(ok) == before[0] + 1
+    assert metrics.DATABASE_REQUESTS.value(missing) == before[1] + 1
+
+    failed = metrics.SCHEDULER_SWEEP_CHALLENGES.value(('failed',))
+    metrics.record_sweep('bulk', 2.0, {'total_evaluated': 5, 'successes': 0, 'failures': 3, 'unchanged': 2, 'errors': 0})
+    assert metrics.SCHEDULER_SWEEP_CHALLENGES.value(('failed',)) == failed + 3
+    assert metrics.SCHEDULER_SWEEP_DURATION.snapshot(('bulk',))['count'] >= 1
+
+
+def test_flask_metrics_endpoint(sqlite_app):
+    app = sqlite_app
+    client = app.app.test_client()
+
+    assert client.get('/').status_code == 200
+    assert client.get('/prop-firm/challenge/c1/status').status_code == 401
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"}' in body
+    # Requests are labelled by their route template, not their path
+    assert 'route="/prop-firm/challenge/<challenge_id>/status",status="401"' in body
+    assert 'cache_hits_total{cache="challenge"}' in body
+    assert 'cache_entries{cache="auth_token"}' in body
+    # The scrape itself is still in flight
+    assert 'http_requests_in_flight 1' in body
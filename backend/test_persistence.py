@@ -0,0 +1,232 @@
+"""
+Tests for the SQLite persistence backend
+"""
+
+import asyncio
+import threading
+
+import pytest
+from postgrest.exceptions import APIError
+
+from fake_supabase import FakeSupabase
+from persistence import AsyncSQLiteClient, SQLiteClient, translate_schema
+from prop_firm_service import PropFirmChallengeEvaluator
+
+USER = '00000000-0000-4000-8000-000000000001'
+
+
+@pytest.fixture
+def client(tmp_path):
+    client = SQLiteClient(str(tmp_path / 'tradesense.db'))
+    yield client
+    client.close()
+
+
+def add_challenge(client, challenge_id, **values):
+    row = {'id': challenge_id, 'user_id': USER, 'plan_name': 'Starter', 'status': 'active',
+           'initial_capital': 5000.0, 'current_balance': 5000.0, **values}
+    return client.table('user_challenges').insert(row).execute().data[0]
+
+
+def add_trade(client, trade_id, challenge_id, trade_type='buy', amount=1000.0, entry_price=100.0):
+    return client.table('trades').insert({
+        'id': trade_id, 'user_id': USER, 'challenge_id': challenge_id, 'asset_symbol': 'BTC-USD',
+        'trade_type': trade_type, 'amount': amount, 'entry_price': entry_price
+    }).execute().data[0]
+
+
+def test_translate_schema():
+    enums = {}
+    statements = translate_schema("""
+        CREATE TYPE public.challenge_status AS ENUM ('active', 'failed');
+        -- a comment; with a semicolon
+        CREATE TABLE public.user_challenges (
+          id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+          user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE NOT NULL,
+          balance DECIMAL(12,2) NOT NULL DEFAULT 5000.00,
+          status challenge_status NOT NULL DEFAULT 'active',
+          created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        );
+        ALTER TABLE public.user_challenges
+          ADD COLUMN IF NOT EXISTS trade_count INTEGER NOT NULL DEFAULT 0,
+          ADD COLUMN IF NOT EXISTS ended_at TIMESTAMPTZ;
+        CREATE INDEX IF NOT EXISTS idx_status ON public.user_challenges(status);
+        CREATE OR REPLACE FUNCTION public.f() RETURNS void LANGUAGE sql AS $$ SELECT 1; $$;
+        ALTER TABLE public.user_challenges ENABLE ROW LEVEL SECURITY;
+    """, enums)
+
+    assert enums == {'challenge_status': ['active', 'failed']}
+    assert len(statements) == 4
+    table = statements[0]
+    assert 'id TEXT PRIMARY KEY,' in table
+    assert 'user_id TEXT NOT NULL' in table and 'auth' not in table
+    assert 'balance REAL NOT NULL DEFAULT 5000.00' in table
+    assert "status TEXT CHECK (status IN ('active', 'failed')) NOT NULL DEFAULT 'active'" in table
+    assert "created_at TEXT NOT NULL DEFAULT (strftime(" in table
+    assert statements[1:3] == ['ALTER TABLE user_challenges ADD COLUMN trade_count INTEGER NOT NULL DEFAULT 0',
+                               'ALTER TABLE user_challenges ADD COLUMN ended_at TEXT']
+    assert statements[3] == 'CREATE INDEX IF NOT EXISTS idx_status ON user_challenges (status)'
+
+
+def test_repository_schema_in_wal_mode(client, tmp_path):
+    with client.connection() as db:
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        names = {row[0] for row in db.execute("SELECT name FROM sqlite_master")}
+    assert {'user_challenges', 'trades', 'payments', 'price_alerts', 'leaderboard'} <= names
+    assert {'idx_trades_challenge_id', 'idx_price_alerts_pending', 'update_user_challenges_updated_at'} <= names
+    assert {'trade_count', 'failure_reason', 'daily_reset_time'} <= set(client.columns('user_challenges'))
+
+    # Migrating an existing database again is a no-op
+    SQLiteClient(str(tmp_path / 'tradesense.db')).close()
+
+
+def test_query_builder(client):
+    add_challenge(client, 'c1', total_pnl=10.0)
+    add_challenge(client, 'c2', total_pnl=-5.0, status='failed')
+    add_challenge(client, 'c3')
+
+    row = client.table('user_challenges').select('*').eq('id', 'c3').single().execute().data
+    assert row['total_pnl'] == 0.0 and row['created_at'].endswith('+00:00')
+    assert add_trade(client, 't1', 'c1')['is_open'] is True
+
+    rows = client.table('user_challenges').select('id, total_pnl') \
+        .in_('status', ['active', 'failed']).order('total_pnl', desc=True).limit(2).execute().data
+    assert rows == [{'id': 'c1', 'total_pnl': 10.0}, {'id': 'c3', 'total_pnl': 0.0}]
+    assert [r['id'] for r in client.table('user_challenges').select('id').order('id').gt('id', 'c1')
+            .is_('ended_at', 'null').execute().data] == ['c2', 'c3']
+    assert client.table('user_challenges').select('id', count='exact').eq('status', 'active').execute().count == 2
+
+    updated = client.table('user_challenges').update({'status': 'failed'}).eq('id', 'c3').execute().data
+    assert updated[0]['status'] == 'failed'
+    assert updated[0]['updated_at'] == client.table('user_challenges').select('updated_at') \
+        .eq('id', 'c3').single().execute().data['updated_at']
+
+    client.table('leaderboard').upsert([{'user_id': USER, 'challenge_id': 'c1', 'period': 'monthly', 'rank_position': 1}],
+                                       on_conflict='user_id,challenge_id,period').execute()
+    client.table('leaderboard').upsert([{'user_id': USER, 'challenge_id': 'c1', 'period': 'monthly', 'rank_position': 2}],
+                                       on_conflict='user_id,challenge_id,period').execute()
+    assert [r['rank_position'] for r in client.table('leaderboard').select('*').execute().data] == [2]
+
+    assert client.table('trades').select('*').eq('id', 'missing').maybe_single().execute() is None
+    deleted = client.table('trades').delete().eq('challenge_id', 'c1').execute().data
+    assert [r['id'] for r in deleted] == ['t1']
+
+
+def test_errors_match_postgrest(client):
+    add_challenge(client, 'c1')
+
+    with pytest.raises(APIError) as duplicate:
+        add_challenge(client, 'c1')
+    assert duplicate.value.code == '23505'
+
+    with pytest.raises(APIError) as bad_status:
+        add_challenge(client, 'c2', status='unknown')
+    assert bad_status.value.code == '23514'
+
+    with pytest.raises(APIError) as bad_column:
+        client.table('user_challenges').select('*').eq('nope', 1).execute()
+    assert bad_column.value.code == '42703'
+
+    with pytest.raises(APIError) as missing:
+        client.rpc('settle_trades', {}).execute()
+    assert missing.value.code == 'PGRST202'
+
+    # A failed bulk insert writes nothing
+    with pytest.raises(APIError):
+        client.table('user_challenges').insert([
+            {'id': 'c3', 'user_id': USER, 'plan_name': 'Starter'},
+            {'id': 'c1', 'user_id': USER, 'plan_name': 'Starter'},
+        ]).execute()
+    assert client.table('user_challenges').select('id').eq('id', 'c3').execute().data == []
+
+
+def test_settle_trade_function(client):
+    add_challenge(client, 'c1')
+    add_trade(client, 't1', 'c1', trade_type='sell', amount=3000.0)
+    evaluator = PropFirmChallengeEvaluator(client)
+
+    # Short position, price up 10%: -300 puts the challenge at the 5% daily loss limit
+    result = evaluator.settle_trade('t1', USER, 110.0)
+    assert result['success'] is True
+    assert result['trade'] == {'id': 't1', 'pnl': -300.0, 'exit_price': 110.0}
+    assert result['challenge'] == {'id': 'c1', 'new_balance': 4700.0, 'total_pnl': -300.0, 'status': 'failed'}
+
+    challenge = client.table('user_challenges').select('*').eq('id', 'c1').single().execute().data
+    assert challenge['failure_reason'] == evaluator.rule_parameters()['daily_rule']
+    assert challenge['ended_at'] is not None
+    assert (challenge['trade_count'], challenge['losing_trades'], challenge['sum_losses']) == (1, 1, -300.0)
+    trade = client.table('trades').select('*').eq('id', 't1').single().execute().data
+    assert trade['is_open'] is False and trade['pnl'] == -300.0
+
+    assert evaluator.settle_trade('t1', USER, 110.0)['error'] == 'Trade not found or already closed'
+
+
+def test_client_side_fallback_books_the_same_pnl(client):
+    db = FakeSupabase()
+    db.load('user_challenges', [{'id': 'c1', 'user_id': USER, 'status': 'active', 'initial_capital': 5000.0,
+                                 'current_balance': 5000.0, 'daily_pnl': 0.0, 'total_pnl': 0.0}])
+    db.load('trades', [{'id': 't1', 'user_id': USER, 'challenge_id': 'c1', 'trade_type': 'sell',
+                        'amount': 3333.33, 'entry_price': 97.0, 'leverage': 1.0, 'is_open': True}])
+    add_challenge(client, 'c1')
+    add_trade(client, 't1', 'c1', trade_type='sell', amount=3333.33, entry_price=97.0)
+
+    # No settle_trade function on the fake: the sequential fallback runs, with the rules
+    # applied by process_trade_completion since no evaluation queue is attached
+    fallback = PropFirmChallengeEvaluator(db).settle_trade('t1', USER, 106.0)
+    database = PropFirmChallengeEvaluator(client).settle_trade('t1', USER, 106.0)
+
+    assert fallback['trade']['pnl'] == database['trade']['pnl'] == -309.28
+    assert fallback['challenge']['status'] == database['challenge']['status'] == 'failed'
+    assert db.rows('user_challenges')[0]['status'] == 'failed'
+
+
+def test_services_run_unchanged(client):
+    for i in range(4):
+        add_challenge(client, f'c{i}', current_balance=5000.0 + 200 * i, daily_pnl=-300.0 if i == 0 else 0.0)
+    evaluator = PropFirmChallengeEvaluator(client)
+
+    assert evaluator.evaluate_challenge_rules('c1')['status'] == 'active'
+    assert evaluator.evaluate_challenge_rules('c3')['status'] == 'success'
+
+    transitions = [{'id': 'c0', **evaluator.build_status_update('failed', 'daily')},
+                   {'id': 'c3', **evaluator.build_status_update('success', 'profit')}]
+    # c3 was already moved to success: only still-active rows change
+    assert evaluator.apply_status_transitions(transitions)['updated_ids'] == ['c0']
+
+    reset = evaluator.reset_daily_metrics()
+    assert sorted(reset['reset_ids']) == ['c1', 'c2']
+
+
+def test_concurrent_settlements_do_not_lose_updates(client):
+    add_challenge(client, 'c1', initial_capital=100000.0, current_balance=100000.0)
+    for i in range(40):
+        add_trade(client, f't{i:02d}', 'c1')
+    evaluator = PropFirmChallengeEvaluator(client)
+
+    def settle(ids):
+        for trade_id in ids:
+            evaluator.settle_trade(trade_id, USER, 101.0)
+
+    threads = [threading.Thread(target=settle, args=([f't{i:02d}' for i in range(k, 40, 4)],)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    challenge = client.table('user_challenges').select('*').eq('id', 'c1').single().execute().data
+    assert challenge['current_balance'] == pytest.approx(100000.0 + 40 * 10.0)
+    assert challenge['trade_count'] == 40
+
+
+def test_async_view_and_in_memory_database():
+    client = SQLiteClient(':memory:')
+    add_challenge(client, 'c1')
+    async_client = AsyncSQLiteClient(client)
+
+    async def run():
+        response = await async_client.table('user_challenges').select('id').eq('status', 'active').execute()
+        reset = await async_client.rpc('reset_daily_metrics', {'p_challenge_id': 'c1'}).execute()
+        return response.data, reset.data
+
+    assert asyncio.run(run()) == ([{'id': 'c1'}], [{'id': 'c1'}])
+    client.close()
@@ -0,0 +1,108 @@
+"""
+Tests for the price alert matching engine
+"""
+
+import random
+
+from fake_supabase import FakeSupabase
+from market_data import SIMULATED, Tick
+from price_alerts import PriceAlertEngine
+
+
+def alert(alert_id, symbol, target, condition):
+    return {'id': alert_id, 'asset_symbol': symbol, 'target_price': target,
+            'condition': condition, 'is_active': True, 'triggered_at': None}
+
+
+def test_crossings_fire_once():
+    engine = PriceAlertEngine(FakeSupabase())
+    engine.on_price('IAM', 100.0)
+    engine.add_alert(alert('a1', 'IAM', 105.0, 'above'))
+    engine.add_alert(alert('a2', 'IAM', 110.0, 'above'))
+    engine.add_alert(alert('b1', 'IAM', 95.0, 'below'))
+
+    assert engine.on_price('IAM', 104.0) == []
+    assert engine.on_price('IAM', 105.0) == ['a1']
+    assert engine.on_price('IAM', 94.0) == ['b1']
+    assert engine.on_price('IAM', 120.0) == ['a2']
+    assert engine.on_price('IAM', 80.0) == []
+    assert engine.on_price('IAM', 130.0) == []
+    assert engine.stats()['active_alerts'] == 0
+
+
+def test_already_satisfied_alert_fires_on_insert():
+    engine = PriceAlertEngine(FakeSupabase())
+    engine.on_price('ATW', 750.0)
+
+    assert engine.add_alert(alert('a1', 'ATW', 700.0, 'above')) is False
+    assert engine.stats()['fired_total'] == 1
+
+
+def test_removed_and_deactivated_alerts_do_not_fire():
+    engine = PriceAlertEngine(FakeSupabase())
+    engine.on_price('IAM', 100.0)
+    engine.add_alert(alert('a1', 'IAM', 105.0, 'above'))
+    engine.add_alert(alert('a2', 'IAM', 105.0, 'above'))
+
+    engine.remove_alert('a1')
+    engine.add_alert({**alert('a2', 'IAM', 105.0, 'above'), 'is_active': False})
+
+    assert engine.on_price('IAM', 110.0) == []
+
+
+def test_triggered_alerts_written_in_one_batch():
+    db = FakeSupabase()
+    alerts = [alert(f'a{i}', 'IAM', 101.0 + i, 'above') for i in range(5)]
+    # a4 was already triggered by another instance; its trigger time is kept
+    db.load('price_alerts', alerts[:4] + [{**alerts[4], 'is_active': False, 'triggered_at': 'earlier'}])
+    engine = PriceAlertEngine(db)
+    engine.on_price('IAM', 100.0)
+    for row in alerts:
+        engine.add_alert(row)
+
+    fired = engine.on_ticks([Tick('IAM', 110.0, source='http')])
+
+    assert len(fired) == 5
+    assert db.round_trips['price_alerts.update'] == 1
+    rows = db.rows('price_alerts')
+    assert not any(row['is_active'] for row in rows)
+    assert rows[4]['triggered_at'] == 'earlier'
+    assert len({row['triggered_at'] for row in rows[:4]}) == 1
+
+
+def test_simulated_ticks_never_fire():
+    db = FakeSupabase()
+    engine = PriceAlertEngine(db)
+    engine.on_price('IAM', 100.0)
+    engine.add_alert(alert('a1', 'IAM', 105.0, 'above'))
+
+    # The scraper falls back to simulated quotes for pages it cannot parse
+    assert engine.on_ticks([Tick('IAM', 150.0, source=SIMULATED)]) == []
+    assert db.round_trips['price_alerts.update'] == 0
+    assert engine.on_ticks([Tick('IAM', 106.0, source='tradingview')]) == ['a1']
+
+
+def test_matches_brute_force_scan():
+    rng = random.Random(3)
+    engine = PriceAlertEngine(FakeSupabase())
+    engine.on_price('MNG', 1850.0)
+
+    alerts = {}
+    for i in range(2000):
+        condition = rng.choice(['above', 'below'])
+        target = round(1850.0 + rng.uniform(0, 200) * (1 if condition == 'above' else -1), 2)
+        alerts[f'a{i}'] = (target, condition)
+        engine.add_alert(alert(f'a{i}', 'MNG', target, condition))
+
+    price = 1850.0
+    for _ in range(300):
+        price = round(price + rng.uniform(-15, 15), 2)
+        expected = {
+            alert_id for alert_id, (target, condition) in alerts.items()
+            if (condition == 'above' and price >= target) or (condition == 'below' and price <= target)
+        }
+        fired = engine.on_price('MNG', price)
+
+        assert set(fired) == expected
+        for alert_id in fired:
+            del alerts[alert_id]
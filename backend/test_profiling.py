@@ -0,0 +1,65 @@
+"""
+Tests for the on-demand request profiler
+"""
+
+import pstats
+import time
+
+import pytest
+
+from profiling import RequestProfiler
+
+
+def busy_work(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+
+def test_requests_are_selected_by_header_token_or_sample_rate(tmp_path):
+    assert not RequestProfiler(None, sample_rate=1.0).should_profile(None)
+    assert not RequestProfiler(str(tmp_path)).enabled
+
+    by_header = RequestProfiler(str(tmp_path), header_token='let-me-in')
+    assert by_header.should_profile('let-me-in')
+    assert not by_header.should_profile('guess')
+    assert not by_header.should_profile(None)
+
+    draws = iter([0.05, 0.5])
+    sampled = RequestProfiler(str(tmp_path), sample_rate=0.1, random_fn=lambda: next(draws))
+    assert sampled.should_profile(None)
+    assert not sampled.should_profile(None)
+
+    with pytest.raises(ValueError):
+        RequestProfiler(str(tmp_path), mode='perf')
+
+
+def test_cprofile_output(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), header_token='t')
+    session = profiler.start()
+    # One request at a time
+    assert profiler.start() is None
+    busy_work(0.01)
+    path = profiler.stop(session, 'POST /evaluate-trade')
+
+    assert path.endswith('-POST_evaluate-trade.prof')
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert 'busy_work' in functions
+    assert profiler.start() is not None
+
+
+def test_collapsed_stack_output(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), header_token='t', mode='stacks', stack_interval=0.001)
+    session = profiler.start()
+    busy_work(0.1)
+    path = profiler.stop(session, 'GET /leaderboard')
+
+    assert path.endswith('.collapsed')
+    with open(path) as collapsed:
+        lines = collapsed.read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any('test_profiling.py:busy_work' in line for line in lines)
+    assert stack.split(';')[-1].count(':') == 1
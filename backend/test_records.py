@@ -0,0 +1,44 @@
+"""
+Tests for the columnar challenge records
+"""
+
+import numpy as np
+
+from prop_firm_service import PropFirmChallengeEvaluator
+from records import CHALLENGE_COLUMNS, ChallengeBatch, select_list
+
+
+def challenge_row(challenge_id, balance='5000.00', daily='0.00', status='active'):
+    # PostgREST may return DECIMAL columns as strings
+    return {'id': challenge_id, 'user_id': 'u1', 'status': status, 'initial_capital': '5000.00',
+            'current_balance': balance, 'daily_pnl': daily, 'total_pnl': None, 'plan_name': 'Starter'}
+
+
+def test_batch_round_trips_rows():
+    rows = [challenge_row('c1'), challenge_row('c2', balance='4400'), challenge_row('c3', balance='5600')]
+    batch = ChallengeBatch.from_rows(rows)
+
+    assert len(batch) == 3
+    assert batch.ids == ['c1', 'c2', 'c3']
+    assert batch.statuses == ['active'] * 3
+    # DECIMAL columns arrive as strings and a NULL total_pnl counts as 0
+    assert batch.current_balance.dtype == np.float64
+    assert batch.current_balance.tolist() == [5000.0, 4400.0, 5600.0]
+    assert batch.total_pnl.tolist() == [0.0, 0.0, 0.0]
+    assert select_list(CHALLENGE_COLUMNS).startswith('id, user_id, status')
+
+
+def test_batch_and_rows_evaluate_alike():
+    evaluator = PropFirmChallengeEvaluator.__new__(PropFirmChallengeEvaluator)
+    evaluator.DAILY_LOSS_LIMIT_PERCENT = 5.0
+    evaluator.TOTAL_LOSS_LIMIT_PERCENT = 10.0
+    evaluator.PROFIT_TARGET_PERCENT = 10.0
+    rows = [{**challenge_row(f'c{i}', balance=balance), 'initial_capital': 5000.0,
+             'current_balance': float(balance), 'daily_pnl': 0.0}
+            for i, balance in enumerate(['5000', '4400', '5600'])]
+
+    from_rows = evaluator.evaluate_challenges_batch(rows)
+    from_batch = evaluator.evaluate_challenges_batch(ChallengeBatch.from_rows(rows))
+
+    assert from_batch.status.tolist() == from_rows.status.tolist()
+    assert from_batch.rule.tolist() == from_rows.rule.tolist()
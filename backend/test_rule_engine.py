@@ -0,0 +1,61 @@
+"""
+Tests for the vectorized Prop Firm rule engine
+"""
+
+import numpy as np
+
+from rule_engine import (
+    evaluate_rules, evaluate_rules_batch, STATUS_NAMES,
+    RULE_NONE, RULE_DAILY_LOSS, RULE_TOTAL_LOSS, RULE_PROFIT_TARGET
+)
+
+DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET = 5.0, 10.0, 10.0
+
+
+def reference_rules(initial_capital, current_balance, daily_pnl):
+    """Original scalar rule logic from PropFirmChallengeEvaluator"""
+    profit_percentage = ((current_balance - initial_capital) / initial_capital) * 100
+    daily_loss_percentage = abs(min((daily_pnl / initial_capital) * 100, 0))
+    total_loss_percentage = abs(min(profit_percentage, 0))
+
+    if daily_loss_percentage >= DAILY_LIMIT:
+        return 'failed', RULE_DAILY_LOSS
+    elif total_loss_percentage >= TOTAL_LIMIT:
+        return 'failed', RULE_TOTAL_LOSS
+    elif profit_percentage >= PROFIT_TARGET:
+        return 'success', RULE_PROFIT_TARGET
+    return 'active', RULE_NONE
+
+
+def test_batch_matches_reference_scalar_logic():
+    rng = np.random.default_rng(42)
+    initial = rng.choice([5000.0, 15000.0, 30000.0], size=5000)
+    balance = initial * rng.uniform(0.8, 1.2, size=5000)
+    daily = initial * rng.uniform(-0.08, 0.08, size=5000)
+
+    result = evaluate_rules_batch(initial, balance, daily, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET)
+
+    for i in range(len(initial)):
+        expected = reference_rules(initial[i], balance[i], daily[i])
+        assert (STATUS_NAMES[result.status[i]], result.rule[i]) == expected
+
+
+def test_rule_precedence_and_boundaries():
+    # daily loss wins over total loss; limits are inclusive
+    assert evaluate_rules(5000, 4000, -250, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET).rule == RULE_DAILY_LOSS
+    assert evaluate_rules(5000, 4500, -249, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET).rule == RULE_TOTAL_LOSS
+    assert evaluate_rules(5000, 5500, 0, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET).rule == RULE_PROFIT_TARGET
+    assert evaluate_rules(5000, 5499, 0, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET).rule == RULE_NONE
+
+
+def test_per_challenge_limits_broadcast():
+    result = evaluate_rules_batch(
+        [5000.0, 5000.0], [5300.0, 5300.0], [0.0, 0.0],
+        DAILY_LIMIT, TOTAL_LIMIT, np.array([5.0, 10.0])
+    )
+    assert [STATUS_NAMES[s] for s in result.status] == ['success', 'active']
+
+
+def test_zero_capital_never_triggers():
+    result = evaluate_rules(0, 0, 0, DAILY_LIMIT, TOTAL_LIMIT, PROFIT_TARGET)
+    assert result.status == 0 and result.rule == RULE_NONE
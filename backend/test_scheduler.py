@@ -0,0 +1,149 @@
+"""
+Tests for the scheduler's partitioned bulk sweep
+"""
+
+import random
+import uuid
+
+import pytest
+from postgrest.exceptions import APIError
+
+from coordination import shard_of
+from fake_supabase import FakeSupabase
+from scheduler import PropFirmBackgroundScheduler, id_partitions
+
+
+def make_db(challenges):
+    """FakeSupabase holding the challenges; returns it and the transitions applied through the rpc"""
+    transitions = []
+
+    def apply_challenge_transitions(db, params):
+        transitions.extend(params['transitions'])
+        return [{'id': t['id']} for t in params['transitions']]
+
+    db = FakeSupabase(rpc_handlers={'apply_challenge_transitions': apply_challenge_transitions})
+    db.load('user_challenges', challenges)
+    return db, transitions
+
+
+def rows(count, seed=9):
+    rng = random.Random(seed)
+    return [{'id': str(uuid.UUID(int=rng.getrandbits(128))), 'user_id': 'u', 'status': 'active',
+             'initial_capital': 5000.0, 'current_balance': rng.choice([4400.0, 5000.0, 5600.0]),
+             'daily_pnl': 0.0, 'total_pnl': 0.0} for _ in range(count)]
+
+
+def test_id_partitions_cover_the_key_space_in_order():
+    assert id_partitions(1) == [(None, None)]
+
+    partitions = id_partitions(4)
+    assert partitions[0][0] is None and partitions[-1][1] is None
+    assert partitions[1][0] == '40000000-0000-0000-0000-000000000000'
+    for (_, upper), (lower, _) in zip(partitions, partitions[1:]):
+        assert upper == lower
+
+
+@pytest.mark.parametrize('workers', [1, 3, 8])
+def test_partitioned_sweep_evaluates_each_challenge_once(monkeypatch, workers):
+    monkeypatch.setenv('SCHEDULER_EVALUATION_WORKERS', str(workers))
+    monkeypatch.setenv('SCHEDULER_SWEEP_CHUNK_SIZE', '7')
+    monkeypatch.setenv('SCHEDULER_SUPABASE_RATE_LIMIT', '0')
+    monkeypatch.setenv('SCHEDULER_COORDINATION', 'none')
+    monkeypatch.setattr('prop_firm_service.prop_firm_evaluator', None)
+
+    challenges = rows(200)
+    db, transitions = make_db(challenges)
+    results = PropFirmBackgroundScheduler(db).evaluate_active_challenges_bulk()
+
+    assert results['total_evaluated'] == 200
+    assert results['errors'] == 0
+    assert results['successes'] == sum(c['current_balance'] == 5600.0 for c in challenges)
+    assert results['failures'] == sum(c['current_balance'] == 4400.0 for c in challenges)
+    assert sorted(t['id'] for t in transitions) == sorted(c['id'] for c in challenges
+                                                          if c['current_balance'] != 5000.0)
+
+
+def test_instances_sweep_disjoint_shards(monkeypatch, tmp_path):
+    monkeypatch.setenv('SCHEDULER_EVALUATION_WORKERS', '2')
+    monkeypatch.setenv('SCHEDULER_SWEEP_CHUNK_SIZE', '10')
+    monkeypatch.setenv('SCHEDULER_SUPABASE_RATE_LIMIT', '0')
+    monkeypatch.setenv('SCHEDULER_COORDINATION', 'file')
+    monkeypatch.setenv('SCHEDULER_COORDINATION_DIR', str(tmp_path))
+    monkeypatch.setattr('prop_firm_service.prop_firm_evaluator', None)
+
+    challenges = rows(300)
+    db, transitions = make_db(challenges)
+    schedulers = [PropFirmBackgroundScheduler(db) for _ in range(3)]
+    # Two rounds: the first instance only sees its peers on its next heartbeat
+    for _ in range(2):
+        for scheduler in schedulers:
+            scheduler.coordinator.heartbeat()
+
+    evaluated = 0
+    for scheduler in schedulers:
+        transitions.clear()
+        evaluated += scheduler.evaluate_active_challenges_bulk()['total_evaluated']
+        index, count = scheduler.coordinator.shard()
+        assert count == 3
+        assert transitions and all(shard_of(t['id'], 3) == index for t in transitions)
+
+    assert evaluated == 300
+    assert sum(scheduler.coordinator.is_leader() for scheduler in schedulers) == 1
+
+
+def test_individual_sweep_reports_failed_reads(monkeypatch):
+    monkeypatch.setenv('SCHEDULER_SUPABASE_RATE_LIMIT', '0')
+    monkeypatch.setenv('SCHEDULER_COORDINATION', 'none')
+    monkeypatch.setattr('prop_firm_service.prop_firm_evaluator', None)
+
+    challenges = rows(20)
+    db, _ = make_db(challenges)
+    scheduler = PropFirmBackgroundScheduler(db)
+
+    results = scheduler.evaluate_active_challenges_individually()
+    assert results['total_evaluated'] == 20
+    assert results['errors'] == 0
+    assert results['successes'] == sum(c['current_balance'] == 5600.0 for c in challenges)
+
+    def unavailable(name):
+        raise APIError({'code': 'PGRST301', 'message': 'JWT expired'})
+
+    monkeypatch.setattr(db, 'table', unavailable)
+    assert scheduler.evaluate_active_challenges_individually() == {
+        'total_evaluated': 0, 'successes': 0, 'failures': 0, 'unchanged': 0, 'errors': 1
+    }
+
+
+def test_tick_engines_run_on_the_leader_only(monkeypatch, tmp_path):
+    monkeypatch.setenv('SCHEDULER_COORDINATION', 'file')
+    monkeypatch.setenv('SCHEDULER_COORDINATION_DIR', str(tmp_path))
+    monkeypatch.setattr('prop_firm_service.prop_firm_evaluator', None)
+
+    class Engine:
+        def __init__(self):
+            self.loads = 0
+            self.ticks = []
+
+        def load(self):
+            self.loads += 1
+            return 0
+
+        def on_ticks(self, ticks):
+            self.ticks.extend(ticks)
+
+    schedulers = [PropFirmBackgroundScheduler(FakeSupabase()) for _ in range(2)]
+    for scheduler in schedulers:
+        scheduler.coordinator.heartbeat()
+    engines = [Engine(), Engine()]
+    listeners = [s.leader_tick_listener(e) for s, e in zip(schedulers, engines)]
+
+    for listener in listeners:
+        listener(['tick-1'])
+    assert [(e.loads, e.ticks) for e in engines] == [(1, ['tick-1']), (0, [])]
+
+    # The second instance takes over on its next heartbeat and loads before marking
+    schedulers[0].coordinator.leave()
+    schedulers[1].coordinator.heartbeat()
+    for listener in listeners:
+        listener(['tick-2'])
+    assert [(e.loads, e.ticks) for e in engines] == [(1, ['tick-1']), (1, ['tick-2'])]
@@ -0,0 +1,128 @@
+"""
+Tests for the structured, non-blocking logging
+"""
+
+import contextlib
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+import structured_logging
+from structured_logging import Sampler, StructuredFormatter, StructuredLogger, configure_logging
+
+
+class Recorder:
+    """Value remembering the threads that turned it into a string"""
+
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.current_thread().name)
+        return 'recorded'
+
+
+@contextlib.contextmanager
+def configured(**options):
+    """configure_logging(force=True) for the block, restoring the root logger afterwards"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        assert configure_logging(force=True, **options)
+        yield
+    finally:
+        structured_logging.shutdown_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+
+def make_record(msg, fields=None, level=logging.INFO):
+    record = logging.LogRecord('prop_firm_service', level, __file__, 1, msg, (), None)
+    if fields:
+        record.fields = fields
+    return record
+
+
+def test_formats():
+    record = make_record('Trade settled', {'trade_id': 't1', 'pnl': -12.5, 'status': 'failed hard'})
+
+    text = StructuredFormatter('text').format(record)
+    assert text.endswith(' - prop_firm_service - INFO - Trade settled trade_id=t1 pnl=-12.5 status="failed hard"')
+
+    logfmt = StructuredFormatter('logfmt').format(record)
+    assert logfmt.startswith('time=')
+    assert logfmt.endswith(' level=info logger=prop_firm_service msg="Trade settled" trade_id=t1 pnl=-12.5 '
+                           'status="failed hard"')
+
+    entry = json.loads(StructuredFormatter('json').format(record))
+    assert entry['msg'] == 'Trade settled'
+    assert (entry['trade_id'], entry['pnl'], entry['level']) == ('t1', -12.5, 'info')
+
+    with pytest.raises(ValueError):
+        StructuredFormatter('xml')
+
+
+def test_fields_are_only_formatted_when_emitted():
+    logger = StructuredLogger(logging.getLogger('test_structured_logging.lazy'))
+    logger.setLevel(logging.WARNING)
+    value = Recorder()
+
+    logger.info('Below the level', value=value)
+    logger.debug_sampled('Below the level', value=value)
+
+    assert value.threads == []
+
+
+def test_records_are_formatted_by_the_listener_thread():
+    stream = io.StringIO()
+    logger = structured_logging.get_logger('test_structured_logging.async')
+    value = Recorder()
+
+    with configured(level='DEBUG', output='logfmt', asynchronous=True, stream=stream):
+        # Already configured: a second call is a no-op
+        assert not configure_logging()
+        logger.info('Challenge evaluated', challenge_id='c1', value=value)
+        logger.error('Old style %s message', 'positional')
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0].endswith('msg="Challenge evaluated" challenge_id=c1 value=recorded')
+    assert 'msg="Old style positional message"' in lines[1]
+    assert value.threads and threading.current_thread().name not in value.threads
+
+
+def test_per_challenge_lines_are_sampled():
+    stream = io.StringIO()
+    logger = StructuredLogger(logging.getLogger('test_structured_logging.sampled'), sample_every=100)
+
+    with configured(level='DEBUG', output='json', asynchronous=False, stream=stream):
+        for i in range(1000):
+            logger.debug_sampled('Challenge evaluated', challenge_id=f'c{i}')
+        logger.debug_sampled('Trade priced', trade_id='t1')
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry['challenge_id'] for entry in entries[:-1]] == [f'c{i}' for i in range(0, 1000, 100)]
+    assert entries[0]['sample_every'] == 100
+    # Every message has its own sampler
+    assert entries[-1]['trade_id'] == 't1'
+
+
+def test_sampler_across_threads():
+    sampler = Sampler(10)
+    hits = []
+
+    def draw():
+        hits.append(sum(sampler() for _ in range(1000)))
+
+    threads = [threading.Thread(target=draw) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(hits) == 400
@@ -0,0 +1,69 @@
+"""
+Tests for the shared connection pool accounting
+"""
+
+import threading
+import time
+
+import httpx
+import pytest
+
+from supabase_client import PoolMonitor, PooledTransport
+
+
+def make_client(max_connections, handler, pool_timeout=5.0):
+    monitor = PoolMonitor(max_connections, max_connections)
+    transport = PooledTransport(monitor, pool_timeout)
+    transport._transport = httpx.MockTransport(handler)
+    return httpx.Client(transport=transport, base_url="http://supabase.test"), monitor
+
+
+def test_pool_caps_concurrency_and_records_wait():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def handler(request):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return httpx.Response(200, json={'ok': True})
+
+    client, monitor = make_client(2, handler)
+    threads = [threading.Thread(target=client.get, args=("/rest/v1/trades",)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = monitor.stats()
+    assert max(peak) <= 2
+    assert stats['requests'] == 6
+    assert stats['peak_in_flight'] == 2
+    assert stats['in_flight'] == 0
+    assert stats['waited_requests'] >= 3
+    assert stats['max_wait_ms'] > 0
+
+
+def test_pool_timeout_when_no_slot_frees_up():
+    release = threading.Event()
+
+    def handler(request):
+        release.wait(5)
+        return httpx.Response(200)
+
+    client, monitor = make_client(1, handler, pool_timeout=0.05)
+    holder = threading.Thread(target=client.get, args=("/rest/v1/trades",))
+    holder.start()
+    time.sleep(0.02)
+
+    with pytest.raises(httpx.PoolTimeout):
+        client.get("/rest/v1/trades")
+
+    release.set()
+    holder.join()
+    assert monitor.stats()['pool_timeouts'] == 1
+    assert monitor.stats()['in_flight'] == 0
@@ -0,0 +1,103 @@
+"""
+Tests for the per-request span tracing
+"""
+
+import asyncio
+import time
+
+import jwt
+
+import tracing
+from persistence import AsyncSQLiteClient, SQLiteClient
+from prop_firm_service import PropFirmChallengeEvaluator
+
+USER = '00000000-0000-4000-8000-000000000001'
+
+
+def test_spans_outside_a_trace_are_ignored():
+    assert tracing.current_trace() is None
+    with tracing.span('rules'):
+        pass
+    tracing.record('db.trades.select', 0.5)
+    assert tracing.current_trace() is None
+
+
+def test_breakdown_and_server_timing():
+    token = tracing.start_trace()
+    tracing.record('db.trades.select', 0.002)
+    with tracing.span('pnl'):
+        time.sleep(0.001)
+    tracing.record('db.trades.select', 0.003)
+    trace = tracing.finish_trace(token)
+
+    assert tracing.current_trace() is None
+    breakdown = trace.breakdown()
+    assert list(breakdown) == ['db.trades.select', 'pnl']
+    assert breakdown['db.trades.select'] == {'count': 2, 'ms': 5.0}
+    assert breakdown['pnl']['ms'] >= 1.0
+
+    header = trace.server_timing(0.01)
+    assert header.startswith('db.trades.select;dur=5.00;desc="2 calls", pnl;dur=')
+    assert header.endswith(', total;dur=10.00')
+    assert trace.summary().startswith('db.trades.select=5.0msx2 pnl=')
+
+
+def test_sequential_settlement_spans():
+    client = SQLiteClient(':memory:')
+    client.table('user_challenges').insert({'id': 'c1', 'user_id': USER, 'plan_name': 'Starter'}).execute()
+    client.table('trades').insert({'id': 't1', 'user_id': USER, 'challenge_id': 'c1', 'asset_symbol': 'BTC-USD',
+                                   'trade_type': 'buy', 'amount': 1000.0, 'entry_price': 100.0}).execute()
+    evaluator = PropFirmChallengeEvaluator(client)
+    # As with the evaluation queue attached: the status is computed from the written row
+    evaluator.evaluation_queue = object()
+
+    token = tracing.start_trace()
+    evaluator._settle_trade_sequential('t1', USER, 101.0)
+    trace = tracing.finish_trace(token)
+    client.close()
+
+    assert list(trace.breakdown()) == ['db.trades.select', 'pnl', 'db.trades.update', 'db.user_challenges.select',
+                                       'db.user_challenges.update', 'rules']
+
+
+def test_async_tasks_and_worker_threads_share_the_request_trace():
+    client = SQLiteClient(':memory:')
+    async_client = AsyncSQLiteClient(client)
+
+    async def request(name):
+        token = tracing.start_trace()
+        await async_client.table('user_challenges').select('id').execute()
+        with tracing.span(name):
+            await asyncio.sleep(0)
+        return tracing.finish_trace(token)
+
+    async def run():
+        return await asyncio.gather(request('a'), request('b'))
+
+    first, second = asyncio.run(run())
+    client.close()
+
+    assert list(first.breakdown()) == ['db.user_challenges.select', 'a']
+    assert list(second.breakdown()) == ['db.user_challenges.select', 'b']
+
+
+def test_flask_server_timing_header(sqlite_app, monkeypatch):
+    app = sqlite_app
+    monkeypatch.setattr(app.request_profiler, 'header_token', 'profile-token')
+    app.supabase.table('user_challenges').insert({'id': 'c-trace', 'user_id': USER, 'plan_name': 'Starter'}).execute()
+    app.supabase.table('trades').insert({'id': 't-trace', 'user_id': USER, 'challenge_id': 'c-trace',
+                                         'asset_symbol': 'BTC-USD', 'trade_type': 'buy',
+                                         'amount': 1000.0, 'entry_price': 100.0}).execute()
+    token = jwt.encode({'sub': USER, 'aud': 'authenticated', 'role': 'authenticated',
+                        'exp': int(time.time()) + 60}, 'secret', algorithm='HS256')
+
+    client = app.app.test_client()
+    plain = client.get('/metrics', headers={'X-Profile': 'wrong-token'})
+    response = client.post('/evaluate-trade', json={'trade_id': 't-trace', 'exit_price': 101.0},
+                           headers={'Authorization': f'Bearer {token}', 'X-Profile': 'profile-token'})
+
+    assert 'Server-Timing' not in plain.headers
+    assert response.status_code == 200
+    names = [metric.split(';')[0] for metric in response.headers['Server-Timing'].split(', ')]
+    assert names == ['auth', 'db.rpc.settle_trade', 'total']
+    assert tracing.current_trace() is None
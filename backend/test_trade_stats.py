@@ -0,0 +1,73 @@
+"""
+Tests for the running trade statistics
+"""
+
+import random
+
+import pytest
+
+from fake_supabase import FakeSupabase
+from trade_stats import add_trade_pnls, empty_trade_stats, rebuild_trade_stats, trade_statistics
+
+
+def scan_statistics(pnls):
+    """Reference: the full-scan computation the aggregates replace"""
+    wins = [p for p in pnls if p > 0]
+    losses = [p for p in pnls if p < 0]
+    return {
+        'total_trades': len(pnls),
+        'winning_trades': len(wins),
+        'losing_trades': len(losses),
+        'win_rate': len(wins) / len(pnls) * 100 if pnls else 0,
+        'total_pnl': sum(pnls),
+        'average_win': sum(wins) / len(wins) if wins else 0,
+        'average_loss': sum(losses) / len(losses) if losses else 0
+    }
+
+
+def test_incremental_updates_match_full_scan():
+    rng = random.Random(7)
+    pnls = [round(rng.uniform(-50, 50), 2) for _ in range(500)] + [0.0, 0.0]
+
+    stats = empty_trade_stats()
+    for pnl in pnls:
+        stats = add_trade_pnls(stats, [pnl])
+
+    incremental = trade_statistics(stats)
+    expected = scan_statistics(pnls)
+
+    assert incremental.keys() == expected.keys()
+    for key, value in expected.items():
+        assert incremental[key] == pytest.approx(value)
+
+
+def test_empty_challenge_statistics():
+    assert trade_statistics(empty_trade_stats()) == scan_statistics([])
+
+
+def test_client_side_rebuild_pages_through_closed_trades(monkeypatch):
+    monkeypatch.setattr('trade_stats.REBUILD_PAGE_SIZE', 3)
+    challenges = [{'id': 'c1'}, {'id': 'c2'}]
+    trades = [
+        {'id': f't{i:02d}', 'challenge_id': 'c1', 'pnl': pnl, 'is_open': False}
+        for i, pnl in enumerate([10.0, -5.0, 20.0, -1.0, 3.0])
+    ] + [
+        {'id': 't90', 'challenge_id': 'c1', 'pnl': None, 'is_open': True},
+        {'id': 't91', 'challenge_id': 'c2', 'pnl': -7.0, 'is_open': False},
+    ]
+
+    db = FakeSupabase()
+    db.load('user_challenges', challenges)
+    db.load('trades', trades)
+
+    result = rebuild_trade_stats(db)
+
+    c1, c2 = db.rows('user_challenges')
+    assert result['rebuilt'] == 2
+    assert c1['trade_count'] == 5
+    assert c1['winning_trades'] == 3
+    assert c1['sum_wins'] == pytest.approx(33.0)
+    assert c1['sum_losses'] == pytest.approx(-6.0)
+    assert c2['losing_trades'] == 1
+    # Six closed trades in pages of 3, then the empty page that ends the scan
+    assert db.round_trips['trades.select'] == 3
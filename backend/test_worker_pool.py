@@ -0,0 +1,68 @@
+"""
+Tests for the scheduler's job pool and rate limiter
+"""
+
+import threading
+import time
+
+from worker_pool import JobPool, RateLimiter
+
+
+def test_job_is_skipped_while_previous_run_is_in_flight():
+    pool = JobPool(max_workers=2)
+    release = threading.Event()
+
+    first = pool.submit('sweep', release.wait)
+    assert pool.submit('sweep', release.wait) is None
+    assert pool.is_running('sweep')
+
+    release.set()
+    first.result(timeout=5)
+    assert not pool.is_running('sweep')
+    assert pool.submit('sweep', lambda: 'done').result(timeout=5) == 'done'
+
+    stats = pool.stats()
+    assert stats['submitted_total'] == 2
+    assert stats['skipped_total'] == 1
+    pool.shutdown(wait=True)
+
+
+def test_slow_job_does_not_delay_other_jobs():
+    pool = JobPool(max_workers=2)
+    release = threading.Event()
+
+    pool.submit('sweep', release.wait)
+    reset = pool.submit('daily_reset', lambda: 'reset')
+
+    assert reset.result(timeout=1) == 'reset'
+    release.set()
+    pool.shutdown(wait=True)
+
+
+def test_failing_job_is_counted_and_can_run_again():
+    pool = JobPool(max_workers=1)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    pool.submit('flush', fail).result(timeout=5)
+    assert pool.stats()['failed_total'] == 1
+    assert pool.submit('flush', lambda: 1).result(timeout=5) == 1
+    pool.shutdown(wait=True)
+
+
+def test_rate_limiter_spaces_calls_after_the_burst():
+    limiter = RateLimiter(rate=100, burst=5)
+
+    start = time.monotonic()
+    for _ in range(15):
+        limiter.acquire()
+    elapsed = time.monotonic() - start
+
+    # 5 calls from the burst, 10 more at 100/s
+    assert 0.08 <= elapsed < 0.5
+
+
+def test_zero_rate_disables_limiting():
+    limiter = RateLimiter(rate=0)
+    assert all(limiter.acquire() == 0.0 for _ in range(1000))
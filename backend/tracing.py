@@ -0,0 +1,125 @@
+"""
+Request Tracing
+
+Per-request timing breakdown: app.py and asgi_app.py start a Trace for every
+request, and the code it runs adds spans to it:
+- db.<table>.<operation> for every Supabase call (supabase_client.py) or
+  SQLite statement (persistence.py); RPCs are db.rpc.<function>
+- pnl and rules for the PnL computation and the rule evaluation in
+  prop_firm_service.py (inside the settle_trade functions when they are
+  deployed, so those requests show a single db.rpc.settle_trade span)
+- auth for the token verification
+
+The breakdown is returned in the Server-Timing header (to operator requests
+only, see app.py) and logged for slow requests. The current trace lives in
+a ContextVar, so it follows the request through its thread, its asyncio
+task and asyncio.to_thread; outside a request span() costs one ContextVar
+lookup.
+"""
+
+import time
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+
+_current: ContextVar[Optional['Trace']] = ContextVar('trace', default=None)
+
+
+class Trace:
+    """Spans of one request: (name, seconds) in completion order"""
+
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans.append((name, seconds))
+
+    def breakdown(self) -> Dict[str, Dict]:
+        """{name: {'count', 'ms'}} with repeated spans summed, in first-seen order"""
+        totals: Dict[str, Dict] = {}
+        for name, seconds in self.spans:
+            entry = totals.get(name)
+            if entry is None:
+                entry = totals[name] = {'count': 0, 'ms': 0.0}
+            entry['count'] += 1
+            entry['ms'] += seconds * 1000.0
+        return totals
+
+    def server_timing(self, total_seconds: Optional[float] = None) -> str:
+        """Server-Timing header value, e.g. `db.trades.select;dur=1.2;desc="2 calls", total;dur=4.0`"""
+        parts = []
+        for name, entry in self.breakdown().items():
+            part = f"{name};dur={entry['ms']:.2f}"
+            if entry['count'] > 1:
+                part += f';desc="{entry["count"]} calls"'
+            parts.append(part)
+        if total_seconds is not None:
+            parts.append(f"total;dur={total_seconds * 1000.0:.2f}")
+        return ', '.join(parts)
+
+    def summary(self) -> str:
+        """One-line breakdown for the logs, slowest span first"""
+        entries = sorted(self.breakdown().items(), key=lambda item: item[1]['ms'], reverse=True)
+        return ' '.join(f"{name}={entry['ms']:.1f}ms" + (f"x{entry['count']}" if entry['count'] > 1 else '')
+                        for name, entry in entries)
+
+
+def start_trace() -> Token:
+    """Make a new Trace current; pass the returned token to finish_trace()"""
+    return _current.set(Trace())
+
+
+def finish_trace(token: Token) -> Trace:
+    """Detach the trace started with token and return it"""
+    trace = _current.get()
+    _current.reset(token)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add an already measured span to the current trace, if any"""
+    trace = _current.get()
+    if trace is not None:
+        trace.spans.append((name, seconds))
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.spans.append((self.name, time.perf_counter() - self.started))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    """Context manager timing its block into the current trace; a no-op outside a request"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
@@ -0,0 +1,165 @@
+"""
+Running Trade Statistics
+
+Each user_challenges row carries running aggregates of its closed trades:
+trade_count, winning_trades, losing_trades, sum_wins and sum_losses
+(sum_losses is the negative sum of losing PnL). Settlement increments them in
+O(1) per trade, and the challenge summary reads them instead of scanning the
+trades table.
+
+Run as a script to rebuild the aggregates from trade history:
+    python trade_stats.py rebuild [--challenge-id <uuid>]
+"""
+
+import argparse
+from typing import Dict, Iterable, Optional
+
+from supabase import Client
+
+from structured_logging import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+TRADE_STATS_COLUMNS = ('trade_count', 'winning_trades', 'losing_trades', 'sum_wins', 'sum_losses')
+
+# Page size of the client-side rebuild
+REBUILD_PAGE_SIZE = 1000
+
+
+def empty_trade_stats() -> Dict:
+    """Aggregates of a challenge without closed trades"""
+    return {'trade_count': 0, 'winning_trades': 0, 'losing_trades': 0, 'sum_wins': 0.0, 'sum_losses': 0.0}
+
+
+def add_trade_pnls(stats: Dict, pnls: Iterable[float]) -> Dict:
+    """
+    Return the aggregates after settling trades with the given PnLs
+
+    Args:
+        stats: Current aggregates (a challenge row works; missing columns count as zero)
+        pnls: PnL of each newly closed trade
+
+    Returns:
+        Dictionary with the updated TRADE_STATS_COLUMNS
+    """
+    updated = {column: stats.get(column) or 0 for column in TRADE_STATS_COLUMNS}
+
+    for pnl in pnls:
+        updated['trade_count'] += 1
+        if pnl > 0:
+            updated['winning_trades'] += 1
+            updated['sum_wins'] += pnl
+        elif pnl < 0:
+            updated['losing_trades'] += 1
+            updated['sum_losses'] += pnl
+
+    return updated
+
+
+def trade_statistics(stats: Dict) -> Dict:
+    """
+    Build the summary's trade_statistics block from the aggregates
+
+    Args:
+        stats: Challenge row (or dict) with the TRADE_STATS_COLUMNS
+
+    Returns:
+        Dictionary with counts, win rate, total PnL and average win/loss
+    """
+    count = stats.get('trade_count') or 0
+    wins = stats.get('winning_trades') or 0
+    losses = stats.get('losing_trades') or 0
+    sum_wins = stats.get('sum_wins') or 0
+    sum_losses = stats.get('sum_losses') or 0
+
+    return {
+        'total_trades': count,
+        'winning_trades': wins,
+        'losing_trades': losses,
+        'win_rate': wins / count * 100 if count else 0,
+        'total_pnl': sum_wins + sum_losses,
+        'average_win': sum_wins / wins if wins else 0,
+        'average_loss': sum_losses / losses if losses else 0
+    }
+
+
+def has_trade_stats(challenge: Dict) -> bool:
+    """True if the row carries the aggregates (the trade_stats migration is applied)"""
+    return all(column in challenge for column in TRADE_STATS_COLUMNS)
+
+
+def rebuild_trade_stats(supabase: Client, challenge_id: Optional[str] = None) -> Dict:
+    """
+    Recompute the aggregates from trade history
+
+    Uses the `rebuild_trade_stats` Postgres function (one statement); falls
+    back to paging through closed trades client-side when it is not deployed.
+
+    Args:
+        supabase: Supabase client
+        challenge_id: Rebuild one challenge (None for all)
+
+    Returns:
+        Dictionary with the number of challenges rebuilt
+    """
+    try:
+        response = supabase.rpc('rebuild_trade_stats', {'p_challenge_id': challenge_id}).execute()
+        logger.info('Rebuilt trade statistics', challenges=response.data)
+        return {'success': True, 'rebuilt': response.data}
+    except Exception as e:
+        logger.warning('rebuild_trade_stats function unavailable, rebuilding client-side', error=e)
+
+    challenges_query = supabase.table('user_challenges').select('id')
+    if challenge_id:
+        challenges_query = challenges_query.eq('id', challenge_id)
+    stats = {row['id']: empty_trade_stats() for row in (challenges_query.execute().data or [])}
+
+    # Keyset pagination over closed trades
+    last_id = None
+    while True:
+        query = supabase.table('trades') \
+            .select('id, challenge_id, pnl') \
+            .eq('is_open', False) \
+            .order('id') \
+            .limit(REBUILD_PAGE_SIZE)
+
+        if challenge_id:
+            query = query.eq('challenge_id', challenge_id)
+        if last_id:
+            query = query.gt('id', last_id)
+
+        trades = query.execute().data or []
+
+        for trade in trades:
+            if trade['pnl'] is not None and trade['challenge_id'] in stats:
+                stats[trade['challenge_id']] = add_trade_pnls(stats[trade['challenge_id']], [trade['pnl']])
+
+        if len(trades) < REBUILD_PAGE_SIZE:
+            break
+        last_id = trades[-1]['id']
+
+    for rebuilt_id, challenge_stats in stats.items():
+        supabase.table('user_challenges') \
+            .update(challenge_stats) \
+            .eq('id', rebuilt_id) \
+            .execute()
+
+    logger.info('Rebuilt trade statistics', challenges=len(stats))
+    return {'success': True, 'rebuilt': len(stats)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain running trade statistics')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild: recompute from trade history')
+    parser.add_argument('--challenge-id', help='Rebuild a single challenge')
+    args = parser.parse_args()
+
+    configure_logging()
+
+    from supabase_client import get_supabase_client
+    result = rebuild_trade_stats(get_supabase_client(), args.challenge_id)
+    print(f"Rebuilt trade statistics for {result['rebuilt']} challenges")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Bounded LRU cache with per-entry time-to-live
+
+Small thread-safe building block shared by the backend services that keep
+hot data in process memory (verified auth tokens, challenge rows, ...).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Thread-safe LRU cache where every entry also expires after a TTL"""
+
+    def __init__(self, max_size: int = 10000, default_ttl: float = 300.0):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value for key, refreshing its LRU position
+
+        Expired entries are dropped on access and count as a miss.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store value under key for ttl seconds (defaults to default_ttl)
+
+        A non-positive ttl removes the key instead of storing it.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+
+        with self._lock:
+            if ttl <= 0:
+                self._entries.pop(key, None)
+                return
+
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def update_entry(self, key: Hashable, changes: Dict) -> bool:
+        """
+        Merge changes into a cached dict value, keeping its expiry
+
+        Used for write-through updates; does not count as a hit or miss.
+        Returns False if the key is not cached (nothing to update).
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[1] <= now:
+                return False
+
+            value, expires_at = entry
+            self._entries[key] = ({**value, **changes}, expires_at)
+            return True
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Remove key from the cache, returning True if it was present"""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
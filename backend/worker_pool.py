@@ -0,0 +1,130 @@
+"""
+Bounded Worker Pool for Scheduler Jobs
+
+Small building blocks used by the background scheduler:
+- RateLimiter: thread-safe token bucket capping calls per second toward Supabase
+- JobPool: runs named jobs on a bounded thread pool and never starts a job
+  while its previous run is still in flight, so a slow sweep neither delays
+  other jobs (the daily reset) nor piles up behind itself
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second, bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.waited_seconds = 0.0
+
+    def acquire(self) -> float:
+        """
+        Take one token, sleeping until one is available
+
+        A rate of 0 or less disables limiting.
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Reserve the token now; a negative balance is the queue of waiting callers
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += wait
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict:
+        return {'rate': self.rate, 'burst': self.burst, 'waited_seconds': round(self.waited_seconds, 3)}
+
+
+class JobPool:
+    """Named jobs on a bounded thread pool, with overlap protection per job name"""
+
+    def __init__(self, max_workers: int = 4, thread_name_prefix: str = "SchedulerJob"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._running: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self.submitted_total = 0
+        self.skipped_total = 0
+        self.failed_total = 0
+
+    def submit(self, name: str, func: Callable, *args, **kwargs) -> Optional[Future]:
+        """
+        Run func on the pool unless a job with the same name is still running
+
+        Returns:
+            The job's Future, or None if it was skipped because the previous run is in flight
+        """
+        with self._lock:
+            started = self._running.get(name)
+            if started is not None:
+                self.skipped_total += 1
+                logger.warning('Skipping job: previous run still in progress', job=name,
+                               running_s=round(time.monotonic() - started, 1))
+                return None
+            self._running[name] = time.monotonic()
+            self.submitted_total += 1
+
+        try:
+            return self._executor.submit(self._run, name, func, *args, **kwargs)
+        except RuntimeError:
+            # Pool already shut down
+            with self._lock:
+                self._running.pop(name, None)
+            raise
+
+    def _run(self, name: str, func: Callable, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            self.failed_total += 1
+            logger.error('Job failed', job=name, error=e)
+        finally:
+            with self._lock:
+                started = self._running.pop(name)
+            logger.debug('Job finished', job=name, duration_s=round(time.monotonic() - started, 2))
+
+    def is_running(self, name: str) -> bool:
+        with self._lock:
+            return name in self._running
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict:
+        """Return the jobs in flight and counters"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'max_workers': self.max_workers,
+                'running': {name: round(now - started, 1) for name, started in self._running.items()},
+                'submitted_total': self.submitted_total,
+                'skipped_total': self.skipped_total,
+                'failed_total': self.failed_total
+            }
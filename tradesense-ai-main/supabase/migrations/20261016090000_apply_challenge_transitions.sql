@@ -0,0 +1,34 @@
+-- Columns written by the Flask prop firm service when a challenge ends
+ALTER TABLE public.user_challenges
+  ADD COLUMN IF NOT EXISTS failure_reason TEXT,
+  ADD COLUMN IF NOT EXISTS success_reason TEXT,
+  ADD COLUMN IF NOT EXISTS daily_reset_time TIMESTAMPTZ;
+
+-- Apply a batch of challenge status transitions in one statement.
+-- Used by the scheduler's bulk sweep; only rows that are still active are
+-- touched so a concurrent settlement or manual update is never overwritten.
+CREATE OR REPLACE FUNCTION public.apply_challenge_transitions(transitions JSONB)
+RETURNS TABLE (id UUID)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.user_challenges AS uc
+  SET status = t.status::challenge_status,
+      ended_at = t.ended_at,
+      failure_reason = t.failure_reason,
+      success_reason = t.success_reason
+  FROM jsonb_to_recordset(transitions) AS t(
+    id UUID,
+    status TEXT,
+    ended_at TIMESTAMPTZ,
+    failure_reason TEXT,
+    success_reason TEXT
+  )
+  WHERE uc.id = t.id
+    AND uc.status = 'active'
+  RETURNING uc.id
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_challenge_transitions(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_challenge_transitions(JSONB) TO service_role;
@@ -0,0 +1,27 @@
+-- Reset daily PnL for all matching challenges in a single statement.
+-- Every row gets the same reset timestamp, so a trade settling during the
+-- midnight job never observes a half-reset set of challenges.
+--   p_challenge_id: reset only this challenge (status filter ignored)
+--   p_user_id:      restrict the reset to one user's challenges
+--   p_statuses:     statuses to reset when no challenge id is given
+CREATE OR REPLACE FUNCTION public.reset_daily_metrics(
+  p_challenge_id UUID DEFAULT NULL,
+  p_user_id UUID DEFAULT NULL,
+  p_statuses TEXT[] DEFAULT ARRAY['active']
+)
+RETURNS TABLE (id UUID)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.user_challenges AS uc
+  SET daily_pnl = 0,
+      daily_reset_time = now()
+  WHERE (p_challenge_id IS NULL OR uc.id = p_challenge_id)
+    AND (p_user_id IS NULL OR uc.user_id = p_user_id)
+    AND (p_challenge_id IS NOT NULL OR uc.status::text = ANY (p_statuses))
+  RETURNING uc.id
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.reset_daily_metrics(UUID, UUID, TEXT[]) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reset_daily_metrics(UUID, UUID, TEXT[]) TO service_role;
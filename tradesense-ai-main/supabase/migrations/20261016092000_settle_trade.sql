@@ -0,0 +1,119 @@
+-- Settle a trade in one transaction: compute the PnL, close the trade,
+-- increment the challenge balances and apply the Prop Firm rules.
+-- The trade and challenge rows are locked, so concurrent settlements on the
+-- same challenge are serialized instead of losing balance updates.
+--
+-- p_rules carries the evaluator's limits and rule identifiers:
+--   {"daily_loss_limit": 5, "total_loss_limit": 10, "profit_target": 10,
+--    "daily_rule": "...", "total_rule": "...", "profit_rule": "..."}
+--
+-- Returns the /evaluate-trade response body, or {"error": ...} when the
+-- trade does not exist, belongs to another user or is already closed.
+CREATE OR REPLACE FUNCTION public.settle_trade(
+  p_trade_id UUID,
+  p_user_id UUID,
+  p_exit_price NUMERIC,
+  p_rules JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_trade public.trades%ROWTYPE;
+  v_challenge public.user_challenges%ROWTYPE;
+  v_pnl NUMERIC;
+  v_profit_pct NUMERIC;
+  v_daily_loss_pct NUMERIC;
+  v_total_loss_pct NUMERIC;
+  v_status TEXT;
+  v_rule TEXT;
+BEGIN
+  SELECT * INTO v_trade
+  FROM public.trades
+  WHERE id = p_trade_id
+    AND user_id = p_user_id
+    AND is_open = true
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('error', 'Trade not found or already closed');
+  END IF;
+
+  -- Same formula as evaluate_trade: relative price move * notional * leverage * direction
+  v_pnl := ROUND(
+    (p_exit_price - v_trade.entry_price) / v_trade.entry_price
+      * v_trade.amount * v_trade.leverage
+      * CASE WHEN v_trade.trade_type = 'buy' THEN 1 ELSE -1 END,
+    2
+  );
+
+  UPDATE public.trades
+  SET exit_price = p_exit_price,
+      pnl = v_pnl,
+      is_open = false,
+      closed_at = now()
+  WHERE id = p_trade_id;
+
+  UPDATE public.user_challenges
+  SET current_balance = current_balance + v_pnl,
+      total_pnl = total_pnl + v_pnl,
+      daily_pnl = daily_pnl + v_pnl
+  WHERE id = v_trade.challenge_id
+  RETURNING * INTO v_challenge;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Challenge not found' USING ERRCODE = 'P0002';
+  END IF;
+
+  v_status := v_challenge.status::text;
+
+  IF v_status NOT IN ('success', 'failed') AND v_challenge.initial_capital <> 0 THEN
+    v_profit_pct := (v_challenge.current_balance - v_challenge.initial_capital) / v_challenge.initial_capital * 100;
+    v_daily_loss_pct := GREATEST(-(v_challenge.daily_pnl / v_challenge.initial_capital * 100), 0);
+    v_total_loss_pct := GREATEST(-v_profit_pct, 0);
+
+    -- Precedence matches rule_engine: daily loss, total loss, profit target
+    IF v_daily_loss_pct >= (p_rules ->> 'daily_loss_limit')::numeric THEN
+      v_status := 'failed';
+      v_rule := p_rules ->> 'daily_rule';
+    ELSIF v_total_loss_pct >= (p_rules ->> 'total_loss_limit')::numeric THEN
+      v_status := 'failed';
+      v_rule := p_rules ->> 'total_rule';
+    ELSIF v_profit_pct >= (p_rules ->> 'profit_target')::numeric THEN
+      v_status := 'success';
+      v_rule := p_rules ->> 'profit_rule';
+    ELSE
+      v_status := 'active';
+    END IF;
+
+    IF v_status <> v_challenge.status::text THEN
+      UPDATE public.user_challenges
+      SET status = v_status::challenge_status,
+          ended_at = CASE WHEN v_status IN ('success', 'failed') THEN now() END,
+          failure_reason = CASE WHEN v_status = 'failed' THEN v_rule END,
+          success_reason = CASE WHEN v_status = 'success' THEN v_rule END
+      WHERE id = v_challenge.id;
+    END IF;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'success', true,
+    'trade', jsonb_build_object(
+      'id', v_trade.id,
+      'pnl', v_pnl,
+      'exit_price', p_exit_price
+    ),
+    'challenge', jsonb_build_object(
+      'id', v_challenge.id,
+      'new_balance', v_challenge.current_balance,
+      'total_pnl', v_challenge.total_pnl,
+      'status', v_status
+    )
+  );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.settle_trade(UUID, UUID, NUMERIC, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.settle_trade(UUID, UUID, NUMERIC, JSONB) TO service_role;
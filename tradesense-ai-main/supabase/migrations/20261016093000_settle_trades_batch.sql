@@ -0,0 +1,152 @@
+-- Apply the Prop Firm rules to one challenge inside the caller's transaction.
+-- Precedence matches rule_engine: daily loss, total loss, profit target.
+-- Updates the status (and ended_at/reason) when it changes and returns it.
+CREATE OR REPLACE FUNCTION public.apply_challenge_rules(p_challenge_id UUID, p_rules JSONB)
+RETURNS TEXT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_challenge public.user_challenges%ROWTYPE;
+  v_profit_pct NUMERIC;
+  v_daily_loss_pct NUMERIC;
+  v_total_loss_pct NUMERIC;
+  v_status TEXT;
+  v_rule TEXT;
+BEGIN
+  SELECT * INTO v_challenge FROM public.user_challenges WHERE id = p_challenge_id;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Challenge not found' USING ERRCODE = 'P0002';
+  END IF;
+
+  v_status := v_challenge.status::text;
+
+  IF v_status IN ('success', 'failed') OR v_challenge.initial_capital = 0 THEN
+    RETURN v_status;
+  END IF;
+
+  v_profit_pct := (v_challenge.current_balance - v_challenge.initial_capital) / v_challenge.initial_capital * 100;
+  v_daily_loss_pct := GREATEST(-(v_challenge.daily_pnl / v_challenge.initial_capital * 100), 0);
+  v_total_loss_pct := GREATEST(-v_profit_pct, 0);
+
+  IF v_daily_loss_pct >= (p_rules ->> 'daily_loss_limit')::numeric THEN
+    v_status := 'failed';
+    v_rule := p_rules ->> 'daily_rule';
+  ELSIF v_total_loss_pct >= (p_rules ->> 'total_loss_limit')::numeric THEN
+    v_status := 'failed';
+    v_rule := p_rules ->> 'total_rule';
+  ELSIF v_profit_pct >= (p_rules ->> 'profit_target')::numeric THEN
+    v_status := 'success';
+    v_rule := p_rules ->> 'profit_rule';
+  ELSE
+    v_status := 'active';
+  END IF;
+
+  IF v_status <> v_challenge.status::text THEN
+    UPDATE public.user_challenges
+    SET status = v_status::challenge_status,
+        ended_at = CASE WHEN v_status IN ('success', 'failed') THEN now() END,
+        failure_reason = CASE WHEN v_status = 'failed' THEN v_rule END,
+        success_reason = CASE WHEN v_status = 'success' THEN v_rule END
+    WHERE id = p_challenge_id;
+  END IF;
+
+  RETURN v_status;
+END;
+$$;
+
+-- Settle many trades of one user in a single transaction.
+-- p_closes: [{"trade_id": "...", "exit_price": 123.45}, ...]
+-- Trades are closed in one UPDATE, each affected challenge receives one
+-- aggregated balance delta, and the rules run once per challenge.
+CREATE OR REPLACE FUNCTION public.settle_trades(
+  p_user_id UUID,
+  p_closes JSONB,
+  p_rules JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_trades JSONB;
+  v_challenges JSONB := '[]'::jsonb;
+  v_challenge RECORD;
+  v_status TEXT;
+BEGIN
+  CREATE TEMP TABLE IF NOT EXISTS _settled_trades (
+    id UUID,
+    challenge_id UUID,
+    pnl NUMERIC,
+    exit_price NUMERIC
+  ) ON COMMIT DROP;
+
+  WITH closes AS (
+    SELECT DISTINCT ON (c.trade_id) c.trade_id, c.exit_price
+    FROM jsonb_to_recordset(p_closes) AS c(trade_id UUID, exit_price NUMERIC)
+  ),
+  closed AS (
+    UPDATE public.trades AS t
+    SET exit_price = c.exit_price,
+        pnl = ROUND(
+          (c.exit_price - t.entry_price) / t.entry_price
+            * t.amount * t.leverage
+            * CASE WHEN t.trade_type = 'buy' THEN 1 ELSE -1 END,
+          2
+        ),
+        is_open = false,
+        closed_at = now()
+    FROM closes AS c
+    WHERE t.id = c.trade_id
+      AND t.user_id = p_user_id
+      AND t.is_open = true
+    RETURNING t.id, t.challenge_id, t.pnl, t.exit_price
+  )
+  INSERT INTO _settled_trades SELECT * FROM closed;
+
+  SELECT COALESCE(jsonb_agg(jsonb_build_object(
+           'id', id, 'challenge_id', challenge_id, 'pnl', pnl, 'exit_price', exit_price
+         )), '[]'::jsonb)
+  INTO v_trades
+  FROM _settled_trades;
+
+  FOR v_challenge IN
+    WITH deltas AS (
+      SELECT challenge_id, SUM(pnl) AS delta
+      FROM _settled_trades
+      GROUP BY challenge_id
+    )
+    UPDATE public.user_challenges AS uc
+    SET current_balance = uc.current_balance + d.delta,
+        total_pnl = uc.total_pnl + d.delta,
+        daily_pnl = uc.daily_pnl + d.delta
+    FROM deltas AS d
+    WHERE uc.id = d.challenge_id
+    RETURNING uc.id, uc.current_balance, uc.total_pnl
+  LOOP
+    v_status := public.apply_challenge_rules(v_challenge.id, p_rules);
+    v_challenges := v_challenges || jsonb_build_object(
+      'id', v_challenge.id,
+      'new_balance', v_challenge.current_balance,
+      'total_pnl', v_challenge.total_pnl,
+      'status', v_status
+    );
+  END LOOP;
+
+  DROP TABLE _settled_trades;
+
+  RETURN jsonb_build_object(
+    'success', true,
+    'trades', v_trades,
+    'challenges', v_challenges
+  );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_challenge_rules(UUID, JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.settle_trades(UUID, JSONB, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_challenge_rules(UUID, JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.settle_trades(UUID, JSONB, JSONB) TO service_role;
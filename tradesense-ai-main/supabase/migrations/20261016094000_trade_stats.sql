@@ -0,0 +1,252 @@
+-- Running trade statistics per challenge, maintained at settlement time so
+-- the challenge summary never has to scan the trades table.
+-- Only closed trades are counted; sum_losses is negative (sum of losing PnL).
+ALTER TABLE public.user_challenges
+  ADD COLUMN IF NOT EXISTS trade_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS winning_trades INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS losing_trades INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS sum_wins NUMERIC(14,2) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS sum_losses NUMERIC(14,2) NOT NULL DEFAULT 0;
+
+-- Book settled PnL on a challenge: the balances and the running trade
+-- statistics, incremented in place (O(1), no scan of the trades table).
+-- Shared by settle_trade (one trade) and settle_trades (one call per challenge
+-- with the aggregated counts). Returns the updated row, or no row when the
+-- challenge does not exist.
+CREATE OR REPLACE FUNCTION public.book_settled_pnl(
+  p_challenge_id UUID,
+  p_delta NUMERIC,
+  p_trades INTEGER,
+  p_wins INTEGER,
+  p_losses INTEGER,
+  p_win_sum NUMERIC,
+  p_loss_sum NUMERIC
+)
+RETURNS SETOF public.user_challenges
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.user_challenges
+  SET current_balance = current_balance + p_delta,
+      total_pnl = total_pnl + p_delta,
+      daily_pnl = daily_pnl + p_delta,
+      trade_count = trade_count + p_trades,
+      winning_trades = winning_trades + p_wins,
+      losing_trades = losing_trades + p_losses,
+      sum_wins = sum_wins + p_win_sum,
+      sum_losses = sum_losses + p_loss_sum
+  WHERE id = p_challenge_id
+  RETURNING *;
+$$;
+
+-- settle_trade books through book_settled_pnl and shares the rules with settle_trades
+CREATE OR REPLACE FUNCTION public.settle_trade(
+  p_trade_id UUID,
+  p_user_id UUID,
+  p_exit_price NUMERIC,
+  p_rules JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_trade public.trades%ROWTYPE;
+  v_challenge public.user_challenges%ROWTYPE;
+  v_pnl NUMERIC;
+  v_status TEXT;
+BEGIN
+  SELECT * INTO v_trade
+  FROM public.trades
+  WHERE id = p_trade_id
+    AND user_id = p_user_id
+    AND is_open = true
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('error', 'Trade not found or already closed');
+  END IF;
+
+  -- Same formula as evaluate_trade: relative price move * notional * leverage * direction
+  v_pnl := ROUND(
+    (p_exit_price - v_trade.entry_price) / v_trade.entry_price
+      * v_trade.amount * v_trade.leverage
+      * CASE WHEN v_trade.trade_type = 'buy' THEN 1 ELSE -1 END,
+    2
+  );
+
+  UPDATE public.trades
+  SET exit_price = p_exit_price,
+      pnl = v_pnl,
+      is_open = false,
+      closed_at = now()
+  WHERE id = p_trade_id;
+
+  SELECT * INTO v_challenge
+  FROM public.book_settled_pnl(
+    v_trade.challenge_id, v_pnl, 1, (v_pnl > 0)::int, (v_pnl < 0)::int, GREATEST(v_pnl, 0), LEAST(v_pnl, 0)
+  );
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Challenge not found' USING ERRCODE = 'P0002';
+  END IF;
+
+  v_status := public.apply_challenge_rules(v_challenge.id, p_rules);
+
+  RETURN jsonb_build_object(
+    'success', true,
+    'trade', jsonb_build_object(
+      'id', v_trade.id,
+      'pnl', v_pnl,
+      'exit_price', p_exit_price
+    ),
+    'challenge', jsonb_build_object(
+      'id', v_challenge.id,
+      'new_balance', v_challenge.current_balance,
+      'total_pnl', v_challenge.total_pnl,
+      'status', v_status
+    )
+  );
+END;
+$$;
+
+-- settle_trades books each challenge's aggregated counts through book_settled_pnl
+CREATE OR REPLACE FUNCTION public.settle_trades(
+  p_user_id UUID,
+  p_closes JSONB,
+  p_rules JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_trades JSONB;
+  v_challenges JSONB := '[]'::jsonb;
+  v_challenge RECORD;
+  v_status TEXT;
+BEGIN
+  CREATE TEMP TABLE IF NOT EXISTS _settled_trades (
+    id UUID,
+    challenge_id UUID,
+    pnl NUMERIC,
+    exit_price NUMERIC
+  ) ON COMMIT DROP;
+
+  WITH closes AS (
+    SELECT DISTINCT ON (c.trade_id) c.trade_id, c.exit_price
+    FROM jsonb_to_recordset(p_closes) AS c(trade_id UUID, exit_price NUMERIC)
+  ),
+  closed AS (
+    UPDATE public.trades AS t
+    SET exit_price = c.exit_price,
+        pnl = ROUND(
+          (c.exit_price - t.entry_price) / t.entry_price
+            * t.amount * t.leverage
+            * CASE WHEN t.trade_type = 'buy' THEN 1 ELSE -1 END,
+          2
+        ),
+        is_open = false,
+        closed_at = now()
+    FROM closes AS c
+    WHERE t.id = c.trade_id
+      AND t.user_id = p_user_id
+      AND t.is_open = true
+    RETURNING t.id, t.challenge_id, t.pnl, t.exit_price
+  )
+  INSERT INTO _settled_trades SELECT * FROM closed;
+
+  SELECT COALESCE(jsonb_agg(jsonb_build_object(
+           'id', id, 'challenge_id', challenge_id, 'pnl', pnl, 'exit_price', exit_price
+         )), '[]'::jsonb)
+  INTO v_trades
+  FROM _settled_trades;
+
+  FOR v_challenge IN
+    SELECT b.id, b.current_balance, b.total_pnl
+    FROM (
+      SELECT challenge_id,
+             SUM(pnl) AS delta,
+             COUNT(*) AS trades,
+             COUNT(*) FILTER (WHERE pnl > 0) AS wins,
+             COUNT(*) FILTER (WHERE pnl < 0) AS losses,
+             SUM(GREATEST(pnl, 0)) AS win_sum,
+             SUM(LEAST(pnl, 0)) AS loss_sum
+      FROM _settled_trades
+      GROUP BY challenge_id
+    ) AS d
+    CROSS JOIN LATERAL public.book_settled_pnl(
+      d.challenge_id, d.delta, d.trades::int, d.wins::int, d.losses::int, d.win_sum, d.loss_sum
+    ) AS b
+  LOOP
+    v_status := public.apply_challenge_rules(v_challenge.id, p_rules);
+    v_challenges := v_challenges || jsonb_build_object(
+      'id', v_challenge.id,
+      'new_balance', v_challenge.current_balance,
+      'total_pnl', v_challenge.total_pnl,
+      'status', v_status
+    );
+  END LOOP;
+
+  DROP TABLE _settled_trades;
+
+  RETURN jsonb_build_object(
+    'success', true,
+    'trades', v_trades,
+    'challenges', v_challenges
+  );
+END;
+$$;
+
+-- Recompute the statistics from trade history (all challenges, or one).
+-- Returns the number of challenges rebuilt.
+CREATE OR REPLACE FUNCTION public.rebuild_trade_stats(p_challenge_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_rebuilt INTEGER;
+BEGIN
+  WITH stats AS (
+    SELECT uc.id,
+           COUNT(t.id) AS trades,
+           COUNT(t.id) FILTER (WHERE t.pnl > 0) AS wins,
+           COUNT(t.id) FILTER (WHERE t.pnl < 0) AS losses,
+           COALESCE(SUM(t.pnl) FILTER (WHERE t.pnl > 0), 0) AS win_sum,
+           COALESCE(SUM(t.pnl) FILTER (WHERE t.pnl < 0), 0) AS loss_sum
+    FROM public.user_challenges AS uc
+    LEFT JOIN public.trades AS t
+      ON t.challenge_id = uc.id
+     AND t.is_open = false
+     AND t.pnl IS NOT NULL
+    WHERE p_challenge_id IS NULL OR uc.id = p_challenge_id
+    GROUP BY uc.id
+  )
+  UPDATE public.user_challenges AS uc
+  SET trade_count = s.trades,
+      winning_trades = s.wins,
+      losing_trades = s.losses,
+      sum_wins = s.win_sum,
+      sum_losses = s.loss_sum
+  FROM stats AS s
+  WHERE uc.id = s.id;
+
+  GET DIAGNOSTICS v_rebuilt = ROW_COUNT;
+  RETURN v_rebuilt;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.book_settled_pnl(UUID, NUMERIC, INTEGER, INTEGER, INTEGER, NUMERIC, NUMERIC)
+  FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.rebuild_trade_stats(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.book_settled_pnl(UUID, NUMERIC, INTEGER, INTEGER, INTEGER, NUMERIC, NUMERIC)
+  TO service_role;
+GRANT EXECUTE ON FUNCTION public.rebuild_trade_stats(UUID) TO service_role;
+
+-- Backfill existing challenges
+SELECT public.rebuild_trade_stats();
@@ -0,0 +1,9 @@
+-- Indexes for the backend price alert engine (price_alerts.py):
+-- the full load pages through active, untriggered alerts by id, and the
+-- periodic sync reads alerts changed since the last updated_at it saw.
+CREATE INDEX IF NOT EXISTS idx_price_alerts_pending
+  ON public.price_alerts (id)
+  WHERE is_active = true AND triggered_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_price_alerts_updated_at
+  ON public.price_alerts (updated_at);
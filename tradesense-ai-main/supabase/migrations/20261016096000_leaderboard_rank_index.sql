@@ -0,0 +1,5 @@
+-- Leaderboard reads by period in rank order; ranks are maintained by the
+-- backend leaderboard service (leaderboard.py), which upserts changed rows
+-- on (user_id, challenge_id, period). Periods: 'monthly' and 'all_time'.
+CREATE INDEX IF NOT EXISTS idx_leaderboard_period_rank
+  ON public.leaderboard (period, rank_position);
@@ -0,0 +1,99 @@
+-- Coordination of background scheduler instances (backend/coordination.py).
+-- Each instance heartbeats into scheduler_instances with a TTL; the live
+-- instances split the evaluation sweeps between them. Singleton jobs (daily
+-- reset, leaderboard flush) run on the holder of a lease in scheduler_leases.
+-- Changes are serialized with transaction-level advisory locks: PostgREST
+-- does not keep a session across requests, so session-level advisory locks
+-- cannot be held between calls.
+CREATE TABLE IF NOT EXISTS public.scheduler_instances (
+  instance_id TEXT PRIMARY KEY,
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS public.scheduler_leases (
+  name TEXT PRIMARY KEY,
+  holder TEXT NOT NULL,
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- No policies: only the service role (through the functions below) uses these tables
+ALTER TABLE public.scheduler_instances ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.scheduler_leases ENABLE ROW LEVEL SECURITY;
+
+-- Register or refresh an instance, drop expired ones, return the live ones
+CREATE OR REPLACE FUNCTION public.scheduler_heartbeat(
+  p_instance_id TEXT,
+  p_ttl_seconds DOUBLE PRECISION
+)
+RETURNS TABLE (member_id TEXT)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('scheduler_instances'));
+
+  DELETE FROM public.scheduler_instances AS si WHERE si.expires_at < now();
+
+  INSERT INTO public.scheduler_instances (instance_id, expires_at)
+  VALUES (p_instance_id, now() + make_interval(secs => p_ttl_seconds))
+  ON CONFLICT ON CONSTRAINT scheduler_instances_pkey
+  DO UPDATE SET expires_at = EXCLUDED.expires_at;
+
+  RETURN QUERY
+    SELECT si.instance_id FROM public.scheduler_instances AS si ORDER BY si.instance_id;
+END;
+$$;
+
+-- Take a lease if it is free or expired, or renew it for its current holder
+CREATE OR REPLACE FUNCTION public.acquire_scheduler_lease(
+  p_name TEXT,
+  p_holder TEXT,
+  p_ttl_seconds DOUBLE PRECISION
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('scheduler_lease:' || p_name));
+
+  INSERT INTO public.scheduler_leases AS sl (name, holder, expires_at)
+  VALUES (p_name, p_holder, now() + make_interval(secs => p_ttl_seconds))
+  ON CONFLICT ON CONSTRAINT scheduler_leases_pkey
+  DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+  WHERE sl.holder = EXCLUDED.holder OR sl.expires_at < now();
+
+  RETURN FOUND;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.release_scheduler_lease(p_name TEXT, p_holder TEXT)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  DELETE FROM public.scheduler_leases WHERE name = p_name AND holder = p_holder
+$$;
+
+-- Deregister an instance on shutdown, releasing its leases
+CREATE OR REPLACE FUNCTION public.leave_scheduler(p_instance_id TEXT)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  DELETE FROM public.scheduler_leases WHERE holder = p_instance_id;
+  DELETE FROM public.scheduler_instances WHERE instance_id = p_instance_id;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.scheduler_heartbeat(TEXT, DOUBLE PRECISION) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.acquire_scheduler_lease(TEXT, TEXT, DOUBLE PRECISION) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.release_scheduler_lease(TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.leave_scheduler(TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.scheduler_heartbeat(TEXT, DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION public.acquire_scheduler_lease(TEXT, TEXT, DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION public.release_scheduler_lease(TEXT, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.leave_scheduler(TEXT) TO service_role;